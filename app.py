@@ -1,7 +1,22 @@
 import streamlit as st
 import pandas as pd
-import altair as alt
-import os
+from tc_dados.agregacao import GRUPOS_PERIODO, cpu_por, tabela_cpu
+from tc_dados.busca import opcoes_com_busca, termos_busca
+from tc_dados.cache_resultados import exibir_estatisticas_cache
+from tc_dados.carregamento import carregar_dados, listar_anos_disponiveis
+from tc_dados.estado_url import (
+    fragmento_secao, indice_url, iniciar_estado_url, padrao_url, sincronizar_url, texto_url
+)
+from tc_dados.exportacao import botao_download, botao_exportacao
+from tc_dados.filtros import FiltroSpec
+from tc_dados.graficos import criar_grafico, montar_cubo
+from tc_dados.metadados import (
+    ORDEM_MESES, carregar_agregado, carregar_cubo_cpu, carregar_dimensoes, carregar_facetas, carregar_visao,
+    carregar_volume_visao, contar_linhas, opcoes_faceta, opcoes_visao, rotulo_faceta
+)
+from tc_dados.moeda import COLUNAS_MONETARIAS, somar, somar_linhas, tabela_soma
+from tc_dados.preaquecimento import exibir_status_preaquecimento, iniciar_preaquecimento
+from tc_dados.tabela import config_colunas_valor, exibir_tabela_paginada
 
 # Configuração da página
 st.set_page_config(
@@ -11,6 +26,9 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Pré-aquecer o cache compartilhado em segundo plano (uma vez por processo e versão dos dados)
+preaquecimento = iniciar_preaquecimento()
+
 # CSS para reduzir títulos em 20%
 st.markdown("""
     <style>
@@ -35,60 +53,8 @@ st.subheader("Análise de dados agrupados por Oficina e Período")
 
 st.markdown("---")
 
-# Função auxiliar para listar anos disponíveis
-def listar_anos_disponiveis():
-    """Lista todos os anos disponíveis nas pastas de dados"""
-    pasta_dados = "dados"
-    anos_disponiveis = []
-    
-    if os.path.exists(pasta_dados):
-        for item in os.listdir(pasta_dados):
-            caminho_item = os.path.join(pasta_dados, item)
-            if os.path.isdir(caminho_item) and item.isdigit():
-                anos_disponiveis.append(int(item))
-    
-    return sorted(anos_disponiveis, reverse=True)  # Mais recente primeiro
-
-# Função auxiliar para encontrar arquivo parquet na ordem de prioridade
-def encontrar_arquivo_parquet(nome_arquivo, ano_selecionado=None):
-    """
-    Busca arquivo parquet na seguinte ordem de prioridade:
-    1. Se ano_selecionado for None ou "Todos": Histórico consolidado (dados/historico_consolidado/)
-    2. Se ano_selecionado for especificado: Pasta do ano (dados/{ANO}/)
-    3. Pasta do ano mais recente (dados/{ANO}/)
-    4. Raiz do projeto (compatibilidade)
-    """
-    # Se ano específico foi selecionado, buscar na pasta do ano
-    if ano_selecionado is not None and ano_selecionado != "Todos":
-        caminho_ano = os.path.join("dados", str(ano_selecionado), nome_arquivo)
-        if os.path.exists(caminho_ano):
-            return caminho_ano
-    
-    # 1. Tentar histórico consolidado (para "Todos" ou quando não especificado)
-    caminho_historico = os.path.join("dados", "historico_consolidado", nome_arquivo.replace(".parquet", "_historico.parquet"))
-    if os.path.exists(caminho_historico):
-        return caminho_historico
-    
-    # 2. Tentar pasta do ano mais recente
-    pasta_dados = "dados"
-    if os.path.exists(pasta_dados):
-        anos_disponiveis = []
-        for item in os.listdir(pasta_dados):
-            caminho_item = os.path.join(pasta_dados, item)
-            if os.path.isdir(caminho_item) and item.isdigit():
-                anos_disponiveis.append(int(item))
-        
-        if anos_disponiveis:
-            ano_mais_recente = max(anos_disponiveis)
-            caminho_ano = os.path.join(pasta_dados, str(ano_mais_recente), nome_arquivo)
-            if os.path.exists(caminho_ano):
-                return caminho_ano
-    
-    # 3. Tentar raiz (compatibilidade)
-    if os.path.exists(nome_arquivo):
-        return nome_arquivo
-    
-    return None
+# Estado da visão na URL: um link compartilhado abre com os mesmos filtros
+iniciar_estado_url("app")
 
 # Filtros na sidebar - ANTES de carregar dados
 st.sidebar.markdown("---")
@@ -102,241 +68,122 @@ opcoes_ano = ["Todos"] + [str(ano) for ano in anos_disponiveis]
 ano_selecionado = st.sidebar.selectbox(
     "Selecione o ano:",
     options=opcoes_ano,
-    index=0,  # "Todos" por padrão
-    help="Selecione 'Todos' para ver dados consolidados ou um ano específico"
+    index=indice_url("ano", opcoes_ano),  # "Todos" por padrão
+    help="Selecione 'Todos' para ver dados consolidados ou um ano específico",
+    key="ano"
 )
 
 st.sidebar.markdown("---")
 st.sidebar.markdown("**🔍 Filtros**")
 
-# Função para carregar dados com cache
-@st.cache_data(
-    ttl=3600,
-    max_entries=10,  # Aumentar para cachear diferentes anos
-    show_spinner=True
-)
+# Função para carregar dados (cache compartilhado entre as páginas em tc_dados.carregamento)
 def load_data(ano_selecionado_param):
     """Carrega os dados do arquivo parquet"""
     try:
-        # Converter "Todos" para None
-        ano_para_busca = None if ano_selecionado_param == "Todos" else ano_selecionado_param
-        
-        # Buscar arquivo na ordem de prioridade
-        arquivo_parquet = encontrar_arquivo_parquet("df_ke5z_group.parquet", ano_para_busca)
-
-        if arquivo_parquet is None:
-            st.error(f"❌ Arquivo não encontrado: df_ke5z_group.parquet")
-            st.info("💡 Verifique se o arquivo existe em:")
-            st.info("   - dados/historico_consolidado/df_ke5z_historico.parquet")
-            st.info("   - dados/{ANO}/df_ke5z_group.parquet")
-            st.info("   - df_ke5z_group.parquet (raiz)")
-            st.stop()
-
-        # Carregar dados
-        df = pd.read_parquet(arquivo_parquet)
-
-        # Se carregou do histórico consolidado e um ano específico foi selecionado, filtrar
-        if ano_selecionado_param != "Todos" and "Ano" in df.columns:
-            df = df[df['Ano'] == int(ano_selecionado_param)].copy()
-
-        # Otimizar tipos de dados
-        for col in df.columns:
-            if df[col].dtype == 'object':
-                unique_ratio = df[col].nunique() / len(df)
-                if unique_ratio < 0.5:
-                    df[col] = df[col].astype('category')
-
-        # Converter floats para tipos menores
-        for col in df.select_dtypes(include=['float64']).columns:
-            df[col] = pd.to_numeric(df[col], downcast='float')
-
-        # Converter ints para tipos menores
-        for col in df.select_dtypes(include=['int64']).columns:
-            df[col] = pd.to_numeric(df[col], downcast='integer')
-
-        return df
+        df = carregar_dados(ano_selecionado_param, "df_ke5z_group")
     except Exception as e:
         st.error(f"❌ Erro ao carregar dados: {str(e)}")
         st.stop()
 
+    if df is None:
+        st.error(f"❌ Arquivo não encontrado: df_ke5z_group.parquet")
+        st.info("💡 Verifique se o arquivo existe em:")
+        st.info("   - dados/historico_consolidado/df_ke5z_historico.parquet")
+        st.info("   - dados/{ANO}/df_ke5z_group.parquet")
+        st.info("   - df_ke5z_group.parquet (raiz)")
+        st.stop()
 
-# Função para carregar dados de volume com cache
-@st.cache_data(
-    ttl=3600,
-    max_entries=10,  # Aumentar para cachear diferentes anos
-    show_spinner=True
-)
-def load_volume_data(ano_selecionado_param):
-    """Carrega os dados de volume do arquivo parquet"""
-    try:
-        # Converter "Todos" para None
-        ano_para_busca = None if ano_selecionado_param == "Todos" else ano_selecionado_param
-        
-        # Buscar arquivo na ordem de prioridade
-        arquivo_parquet = encontrar_arquivo_parquet("df_vol.parquet", ano_para_busca)
-
-        if arquivo_parquet is None:
-            return None
-
-        df = pd.read_parquet(arquivo_parquet)
-
-        # Se carregou do histórico consolidado e um ano específico foi selecionado, filtrar
-        if ano_selecionado_param != "Todos" and "Ano" in df.columns:
-            df = df[df['Ano'] == int(ano_selecionado_param)].copy()
-
-        # Otimizar tipos de dados
-        for col in df.columns:
-            if df[col].dtype == 'object':
-                unique_ratio = df[col].nunique() / len(df)
-                if unique_ratio < 0.5:
-                    df[col] = df[col].astype('category')
-
-        # Converter floats para tipos menores
-        for col in df.select_dtypes(include=['float64']).columns:
-            df[col] = pd.to_numeric(df[col], downcast='float')
-
-        # Converter ints para tipos menores
-        for col in df.select_dtypes(include=['int64']).columns:
-            df[col] = pd.to_numeric(df[col], downcast='integer')
-
-        return df
-    except Exception:
-        return None
+    return df
 
 
-# Carregar dados com o ano selecionado
+# Metadados das dimensões (poucos KB): a sidebar é montada sem ler a tabela completa
 try:
-    df_total = load_data(ano_selecionado)
-    st.sidebar.success("✅ Dados carregados com sucesso")
-    if ano_selecionado == "Todos":
-        st.sidebar.info(f"📊 {len(df_total):,} registros (Todos os anos)")
-    else:
-        st.sidebar.info(f"📊 {len(df_total):,} registros (Ano {ano_selecionado})")
+    df_dimensoes = carregar_dimensoes(ano_selecionado, "df_ke5z_group")
 except Exception as e:
-    st.error(f"❌ Erro: {str(e)}")
+    st.error(f"❌ Erro ao carregar dados: {str(e)}")
     st.stop()
 
-# Função auxiliar para obter opções de filtro
-
-
-@st.cache_data(ttl=1800, max_entries=5)
-def get_filter_options(df, column_name):
-    """Obtém opções de filtro com cache"""
-    if column_name in df.columns:
-        opcoes = sorted(
-            df[column_name].dropna().astype(str).unique().tolist()
-        )
-        return ["Todos"] + opcoes
-    return ["Todos"]
-
-
-# Ordem dos meses para ordenação cronológica
-ORDEM_MESES = [
-    'janeiro', 'fevereiro', 'março', 'abril', 'maio', 'junho',
-    'julho', 'agosto', 'setembro', 'outubro', 'novembro', 'dezembro'
-]
+if df_dimensoes is None:
+    load_data(ano_selecionado)  # Exibe o erro de arquivo não encontrado
 
+if ano_selecionado == "Todos":
+    st.sidebar.info(f"📊 {contar_linhas(df_dimensoes):,} registros (Todos os anos)")
+else:
+    st.sidebar.info(f"📊 {contar_linhas(df_dimensoes):,} registros (Ano {ano_selecionado})")
 
 # Seletor de tipo de visualização
 st.sidebar.markdown("**📊 Tipo de Visualização**")
+opcoes_visualizacao = ["Custo Total", "CPU (Custo por Unidade)"]
 tipo_visualizacao = st.sidebar.radio(
     "Selecione o tipo:",
-    ["Custo Total", "CPU (Custo por Unidade)"],
-    index=0
+    opcoes_visualizacao,
+    index=indice_url("tipo_visualizacao", opcoes_visualizacao),
+    key="tipo_visualizacao"
 )
 st.sidebar.markdown("---")
 
-# Filtro 1: Oficina (com cache otimizado)
-if 'Oficina' in df_total.columns:
-    oficina_opcoes = get_filter_options(df_total, 'Oficina')
+# Filtros em cascata: as opções de cada filtro (com linhas e total) vêm das
+# facetas das seleções anteriores; a tabela completa é filtrada depois, de uma vez
+selecoes = {}
+
+# Filtro 1: Oficina
+if 'Oficina' in df_dimensoes.columns:
+    facetas = carregar_facetas(ano_selecionado, "df_ke5z_group", selecoes)
+    opcoes = opcoes_faceta(facetas, 'Oficina')
     oficina_selecionadas = st.sidebar.multiselect(
-        "Selecione a Oficina:", oficina_opcoes, default=["Todos"]
+        "Selecione a Oficina:", opcoes,
+        default=padrao_url("filtro_Oficina", opcoes, ["Todos"]),
+        format_func=rotulo_faceta(facetas, 'Oficina'),
+        key="filtro_Oficina"
     )
+    selecoes['Oficina'] = oficina_selecionadas
 
-    # Filtrar o DataFrame com base na Oficina
-    if "Todos" in oficina_selecionadas or not oficina_selecionadas:
-        df_filtrado = df_total.copy()
-    else:
-        df_filtrado = df_total[
-            df_total['Oficina'].astype(str).isin(oficina_selecionadas)
-        ].copy()
-else:
-    df_filtrado = df_total.copy()
-
-# Filtro 2: USI (com cache otimizado)
-if 'USI' in df_filtrado.columns:
-    usi_opcoes = get_filter_options(df_filtrado, 'USI')
+# Filtro 2: USI
+if 'USI' in df_dimensoes.columns:
+    facetas = carregar_facetas(ano_selecionado, "df_ke5z_group", selecoes)
+    usi_opcoes = opcoes_faceta(facetas, 'USI')
     default_usi = ["TC Ext"] if "TC Ext" in usi_opcoes else ["Todos"]
     usi_selecionada = st.sidebar.multiselect(
-        "Selecione a USI:", usi_opcoes, default=default_usi
-    )
-
-    # Filtrar o DataFrame com base na USI
-    if "Todos" in usi_selecionada or not usi_selecionada:
-        pass  # Manter df_filtrado como está
-    else:
-        df_filtrado = df_filtrado[
-            df_filtrado['USI'].astype(str).isin(usi_selecionada)
-        ].copy()
-
-# Filtro 3: Período (com cache otimizado)
-if 'Período' in df_filtrado.columns:
-    periodo_opcoes_raw = get_filter_options(df_filtrado, 'Período')
-
-    # Ordenar meses cronologicamente
-    periodo_opcoes = ["Todos"]
-    meses_ordenados = []
-    outros_periodos = []
-
-    for periodo in periodo_opcoes_raw[1:]:  # Pular "Todos"
-        periodo_lower = str(periodo).lower()
-        if periodo_lower in ORDEM_MESES:
-            meses_ordenados.append(periodo)
-        else:
-            outros_periodos.append(periodo)
-
-    # Ordenar meses pela ordem cronológica
-    meses_ordenados.sort(
-        key=lambda x: ORDEM_MESES.index(str(x).lower())
-        if str(x).lower() in ORDEM_MESES else 999
+        "Selecione a USI:", usi_opcoes, default=padrao_url("filtro_USI", usi_opcoes, default_usi),
+        format_func=rotulo_faceta(facetas, 'USI'),
+        key="filtro_USI"
     )
+    selecoes['USI'] = usi_selecionada
 
-    # Combinar: Todos + meses ordenados + outros períodos
-    periodo_opcoes = periodo_opcoes + meses_ordenados + outros_periodos
-
+# Filtro 3: Período (meses em ordem cronológica)
+if 'Período' in df_dimensoes.columns:
+    facetas = carregar_facetas(ano_selecionado, "df_ke5z_group", selecoes)
+    opcoes = opcoes_faceta(facetas, 'Período')
     periodo_selecionado = st.sidebar.selectbox(
-        "Selecione o Período:", periodo_opcoes
+        "Selecione o Período:", opcoes, index=indice_url("filtro_Período", opcoes),
+        format_func=rotulo_faceta(facetas, 'Período'),
+        key="filtro_Período"
     )
-    if periodo_selecionado != "Todos":
-        df_filtrado = df_filtrado[
-            df_filtrado['Período'].astype(str) == str(periodo_selecionado)
-        ].copy()
-
-# Filtro 4: Centro cst (com cache otimizado)
-if 'Centrocst' in df_filtrado.columns:
-    centro_cst_opcoes = get_filter_options(df_filtrado, 'Centrocst')
+    selecoes['Período'] = periodo_selecionado
+
+# Filtro 4: Centro cst
+if 'Centrocst' in df_dimensoes.columns:
+    facetas = carregar_facetas(ano_selecionado, "df_ke5z_group", selecoes)
+    opcoes = opcoes_faceta(facetas, 'Centrocst')
     centro_cst_selecionado = st.sidebar.selectbox(
-        "Selecione o Centro cst:", centro_cst_opcoes
+        "Selecione o Centro cst:", opcoes, index=indice_url("filtro_Centrocst", opcoes),
+        format_func=rotulo_faceta(facetas, 'Centrocst'),
+        key="filtro_Centrocst"
     )
-    if centro_cst_selecionado != "Todos":
-        df_filtrado = df_filtrado[
-            df_filtrado['Centrocst'].astype(str) == str(centro_cst_selecionado)
-        ].copy()
-
-# Filtro 5: Conta contábil (com cache otimizado)
-if 'Nºconta' in df_filtrado.columns:
-    conta_contabil_opcoes = get_filter_options(df_filtrado, 'Nºconta')[1:]
+    selecoes['Centrocst'] = centro_cst_selecionado
+
+# Filtro 5: Conta contábil
+if 'Nºconta' in df_dimensoes.columns:
+    facetas = carregar_facetas(ano_selecionado, "df_ke5z_group", selecoes)
+    opcoes = opcoes_faceta(facetas, 'Nºconta')[1:]
     conta_contabil_selecionadas = st.sidebar.multiselect(
-        "Selecione a Conta contábil:", conta_contabil_opcoes
+        "Selecione a Conta contábil:", opcoes, default=padrao_url("filtro_Nºconta", opcoes, []),
+        format_func=rotulo_faceta(facetas, 'Nºconta'),
+        key="filtro_Nºconta"
     )
-    if conta_contabil_selecionadas:
-        df_filtrado = df_filtrado[
-            df_filtrado['Nºconta'].astype(str).isin(
-                conta_contabil_selecionadas
-            )
-        ].copy()
+    selecoes['Nºconta'] = conta_contabil_selecionadas
 
-# Filtros principais (com cache otimizado)
+# Filtros principais
 filtros_principais = [
     ("Type 05", "Type 05", "multiselect"),
     ("Type 06", "Type 06", "multiselect"),
@@ -346,18 +193,46 @@ filtros_principais = [
 ]
 
 for col_name, label, widget_type in filtros_principais:
-    if col_name in df_filtrado.columns:
-        opcoes = get_filter_options(df_filtrado, col_name)
+    if col_name in df_dimensoes.columns:
+        facetas = carregar_facetas(ano_selecionado, "df_ke5z_group", selecoes)
+        opcoes = opcoes_faceta(facetas, col_name)
         if widget_type == "multiselect":
             selecionadas = st.sidebar.multiselect(
-                f"Selecione o {label}:", opcoes, default=["Todos"]
+                f"Selecione o {label}:", opcoes,
+                default=padrao_url(f"filtro_{col_name}", opcoes, ["Todos"]),
+                format_func=rotulo_faceta(facetas, col_name),
+                key=f"filtro_{col_name}"
             )
-            if selecionadas and "Todos" not in selecionadas:
-                df_filtrado = df_filtrado[
-                    df_filtrado[col_name].astype(str).isin(selecionadas)
-                ].copy()
+            selecoes[col_name] = selecionadas
+
+# Busca textual em Texto breve / Fornecedor: entra no mesmo spec dos filtros
+consulta_texto = st.sidebar.text_input(
+    "🔎 Buscar na descrição / fornecedor:",
+    value=texto_url("busca_texto"),
+    key="busca_texto",
+    placeholder="Ex.: oxigenio white martins",
+    help="Busca em Texto breve e Fornecedor sem diferenciar acentos e maiúsculas; "
+         "todas as palavras precisam aparecer na linha"
+)
+termos_busca_texto = termos_busca(consulta_texto)
+
+# Carregar a tabela completa só agora (a sidebar principal já está na tela),
+# já filtrada: a visão padrão vem pronta do pré-aquecimento
+filtro_principal = FiltroSpec(selecoes).com_busca(termos_busca_texto)
+try:
+    df_filtrado = carregar_visao(ano_selecionado, "df_ke5z_group", filtro_principal)
+except Exception as e:
+    st.error(f"❌ Erro: {str(e)}")
+    st.stop()
+
+if df_filtrado is None:
+    load_data(ano_selecionado)  # Exibe o erro de arquivo não encontrado
+st.sidebar.success("✅ Dados carregados com sucesso")
+exibir_status_preaquecimento(preaquecimento)
+exibir_estatisticas_cache()
 
-# Filtros avançados (expansível)
+# Filtros avançados (expansível): entram no mesmo spec dos filtros principais
+filtro = filtro_principal
 with st.sidebar.expander("🔍 Filtros Avançados"):
     filtros_avancados = [
         ("Usuário", "Usuário", "multiselect"),
@@ -369,59 +244,35 @@ with st.sidebar.expander("🔍 Filtros Avançados"):
 
     for col_name, label, widget_type in filtros_avancados:
         if col_name in df_filtrado.columns:
-            opcoes = get_filter_options(df_filtrado, col_name)
-            # Limitar opções para melhor performance
-            if len(opcoes) > 101:  # 100 + "Todos"
-                opcoes = opcoes[:101]
-                st.caption(
-                    f"⚠️ {label}: Limitado a 100 opções para performance"
-                )
+            opcoes = opcoes_visao(ano_selecionado, "df_ke5z_group", filtro, col_name)
+            # Muitos valores (Material, Texto breve, ...): caixa de busca em vez da lista completa
+            opcoes = opcoes_com_busca(
+                ano_selecionado, "df_ke5z_group", col_name, label, opcoes, f"filtro_avancado_{col_name}"
+            )
 
             if widget_type == "multiselect":
                 selecionadas = st.multiselect(
-                    f"Selecione o {label}:", opcoes, default=["Todos"]
+                    f"Selecione o {label}:", opcoes,
+                    default=padrao_url(f"filtro_avancado_{col_name}", opcoes, ["Todos"]),
+                    key=f"filtro_avancado_{col_name}"
                 )
-                if selecionadas and "Todos" not in selecionadas:
-                    df_filtrado = df_filtrado[
-                        df_filtrado[col_name].astype(str).isin(selecionadas)
-                    ].copy()
+                filtro = filtro.com(col_name, selecionadas)
+
+# Todas as seleções numa única máscara: a tabela é recortada uma vez só
+if filtro != filtro_principal:
+    df_filtrado = carregar_visao(ano_selecionado, "df_ke5z_group", filtro)
 
 # Preparar dados para visualização
+cubo_cpu = None
 if tipo_visualizacao == "CPU (Custo por Unidade)":
-    # Carregar dados de volume
-    df_vol_calc = load_volume_data(ano_selecionado)
-
-    if df_vol_calc is not None and 'Volume' in df_vol_calc.columns:
-        # Agrupar df_filtrado por Oficina e Período para calcular Valor total
-        if ('Oficina' in df_filtrado.columns and
-                'Período' in df_filtrado.columns):
-            # Agrupar Valor por Oficina e Período
-            df_valor_agrupado = df_filtrado.groupby(
-                ['Oficina', 'Período'], as_index=False
-            )['Valor'].sum()
-
-            # Agrupar Volume por Oficina e Período do df_vol
-            df_vol_agrupado = df_vol_calc.groupby(
-                ['Oficina', 'Período'], as_index=False
-            )['Volume'].sum()
-
-            # Fazer merge
-            df_cpu = pd.merge(
-                df_valor_agrupado,
-                df_vol_agrupado,
-                on=['Oficina', 'Período'],
-                how='left'
-            )
+    # Cubo de CPU: Valor da visão e Volume somados no grão mais fino (memoizado por versão e filtros)
+    cubo_cpu = carregar_cubo_cpu(ano_selecionado, "df_ke5z_group", filtro, 'Valor')
 
-            # Calcular CPU (evitando divisão por zero)
-            df_cpu['CPU'] = df_cpu.apply(
-                lambda row: (
-                    row['Valor'] / row['Volume']
-                    if pd.notnull(row['Volume']) and row['Volume'] != 0
-                    else 0
-                ),
-                axis=1
-            )
+    if cubo_cpu is not None:
+        # CPU por Oficina e Período = soma do Valor / soma do Volume
+        if ('Oficina' in cubo_cpu.columns and
+                'Período' in cubo_cpu.columns):
+            df_cpu = cpu_por(cubo_cpu, ['Oficina', 'Período'], 'Valor')
 
             # Criar DataFrame para visualização com CPU
             df_visualizacao = df_cpu.copy()
@@ -455,10 +306,10 @@ st.sidebar.write(f"**Linhas:** {df_filtrado.shape[0]:,}")
 
 # Calcular totais se as colunas existirem
 if 'Valor' in df_filtrado.columns:
-    valor_total = df_filtrado['Valor'].sum()
+    valor_total = somar(df_filtrado['Valor'])
     st.sidebar.write(f"**Total Valor:** R$ {valor_total:,.2f}")
 if 'Total' in df_filtrado.columns:
-    total_sum = df_filtrado['Total'].sum()
+    total_sum = somar(df_filtrado['Total'])
     st.sidebar.write(f"**Total:** R$ {total_sum:,.2f}")
 if 'Volume' in df_filtrado.columns:
     volume_total = df_filtrado['Volume'].sum()
@@ -468,447 +319,160 @@ if 'Volume' in df_filtrado.columns:
 st.sidebar.info(f"📈 **Visualizando:** {tipo_visualizacao}")
 
 
-def ordenar_por_mes(df, coluna_periodo='Período'):
-    """Ordena DataFrame por ordem cronológica dos meses, considerando ano se disponível"""
-    df_copy = df.copy()
-    
-    # Se houver coluna "Ano" e múltiplos anos, ordenar por ano e mês
-    if 'Ano' in df_copy.columns and df_copy['Ano'].nunique() > 1:
-        # Criar coluna de ordenação: ano primeiro, depois mês
-        df_copy['_ordem_ano'] = df_copy['Ano']
-        df_copy['_ordem_mes'] = df_copy[coluna_periodo].str.lower().map(
-            {mes: idx for idx, mes in enumerate(ORDEM_MESES)}
-        ).fillna(999)
-        df_copy = df_copy.sort_values(['_ordem_ano', '_ordem_mes'])
-        df_copy = df_copy.drop(columns=['_ordem_ano', '_ordem_mes'])
-    else:
-        # Ordenação simples por mês (comportamento original)
-        df_copy['_ordem_mes'] = df_copy[coluna_periodo].str.lower().map(
-            {mes: idx for idx, mes in enumerate(ORDEM_MESES)}
-        ).fillna(999)
-        df_copy = df_copy.sort_values('_ordem_mes')
-        df_copy = df_copy.drop(columns=['_ordem_mes'])
-    
-    return df_copy
-
-
-# Gráfico 1: Soma do Valor por Período
-@st.cache_data(ttl=900, max_entries=2)
-def create_period_chart(df_data, coluna, tipo_viz):
-    """Cria gráfico de barras por Período"""
-    try:
-        if coluna not in df_data.columns:
-            return None
-
-        # Verificar se há múltiplos anos
-        tem_multiplos_anos = 'Ano' in df_data.columns and df_data['Ano'].nunique() > 1
-        
-        if tem_multiplos_anos:
-            # Agrupar por Ano e Período
-            chart_data = df_data.groupby(['Ano', 'Período'])[coluna].sum().reset_index()
-            
-            # Criar coluna combinada para o rótulo do gráfico
-            chart_data['Período_Completo'] = chart_data['Período'].astype(str) + ' ' + chart_data['Ano'].astype(str)
-            
-            # Ordenar por ano e mês
-            chart_data = ordenar_por_mes(chart_data, 'Período')
-            ordem_periodos = chart_data['Período_Completo'].tolist()
-            
-            # Usar Período_Completo no gráfico
-            coluna_periodo_grafico = 'Período_Completo'
-        else:
-            # Comportamento original: agrupar apenas por Período
-            chart_data = df_data.groupby('Período')[coluna].sum().reset_index()
-            chart_data = ordenar_por_mes(chart_data, 'Período')
-            ordem_periodos = chart_data['Período'].tolist()
-            coluna_periodo_grafico = 'Período'
-
-        # Definir título do eixo Y baseado no tipo
-        if tipo_viz == "CPU (Custo por Unidade)":
-            titulo_y = "CPU (R$/Unidade)"
-            titulo_grafico = "CPU por Período"
-        else:
-            titulo_y = "Soma do Valor (R$)"
-            titulo_grafico = "Soma do Valor por Período"
-
-        grafico_barras = alt.Chart(chart_data).mark_bar().encode(
-            x=alt.X(
-                f'{coluna_periodo_grafico}:N',
-                title='Período',
-                sort=ordem_periodos
-            ),
-            y=alt.Y(f'{coluna}:Q', title=titulo_y),
-            color=alt.Color(
-                f'{coluna}:Q',
-                title=coluna,
-                scale=alt.Scale(scheme='redyellowgreen', reverse=True)
-            ),
-            tooltip=[
-                alt.Tooltip(f'{coluna_periodo_grafico}:N', title='Período'),
-                alt.Tooltip(
-                    f'{coluna}:Q',
-                    title=coluna,
-                    format=',.4f' if tipo_viz == "CPU (Custo por Unidade)"
-                    else ',.2f'
-                )
-            ]
-        ).properties(
-            title=titulo_grafico,
-            height=400
-        )
+# Cubo dos gráficos (tc_dados.graficos): somas por Ano, Período e Oficina/Veículo
+# montadas uma vez; todos os gráficos da página saem dele
+if tipo_visualizacao == "CPU (Custo por Unidade)":
+    # Valor (como Total) e Volume por Oficina e Período: tabela pequena. Os
+    # gráficos ponderam (soma do Valor / soma do Volume de cada ponto), em vez
+    # de somar os CPUs de cada Oficina e Período
+    cubo_graficos = montar_cubo(
+        df_cpu.rename(columns={'Valor': 'Total'}), ['Oficina', 'Veículo'], ['Total', 'Volume']
+    )
+else:
+    # Somas da visão memoizadas pelo spec dos filtros
+    cubo_graficos = carregar_agregado(
+        ano_selecionado, "df_ke5z_group", filtro,
+        GRUPOS_PERIODO + ('Oficina',), (coluna_visualizacao, 'Total')
+    )
 
-        # Adicionar rótulos com valores nas barras
-        formato_rotulo = (
-            ',.4f' if tipo_viz == "CPU (Custo por Unidade)" else ',.2f'
-        )
-        rotulos = grafico_barras.mark_text(
-            align='center',
-            baseline='middle',
-            dy=-10,
-            color='black',
-            fontSize=12
-        ).encode(
-            text=alt.Text(f'{coluna}:Q', format=formato_rotulo)
-        )
+if tipo_visualizacao == "CPU (Custo por Unidade)":
+    titulo_y_valor = "CPU (R$/Unidade)"
+    formato_valor = ',.4f'
+else:
+    titulo_y_valor = "Soma do Valor (R$)"
+    formato_valor = ',.2f'
 
-        return grafico_barras + rotulos
-    except Exception as e:
-        st.error(f"Erro ao criar gráfico: {e}")
-        return None
 
+# Seções da página como fragmentos (tc_dados.estado_url.fragmento_secao):
+# os filtros locais de um gráfico e os widgets das tabelas reexecutam só a
+# própria seção, a partir do cubo e da visão já calculados nesta execução.
 
-# Exibir gráfico por Período
-if coluna_visualizacao in df_visualizacao.columns:
+@fragmento_secao
+def secao_grafico_periodo(cubo_graficos, coluna_visualizacao, tipo_visualizacao, titulo_y_valor, formato_valor):
+    """Gráfico por Período (em CPU, com filtros de Veículo e Oficina do próprio gráfico)"""
     if tipo_visualizacao == "CPU (Custo por Unidade)":
         st.subheader("📊 CPU por Período")
         
-        # Filtros específicos para este gráfico
-        df_grafico_periodo = df_visualizacao.copy()
+        # Filtros específicos para este gráfico (aplicados às linhas do cubo)
+        cubo_periodo = cubo_graficos
         
         # Criar colunas para os filtros
         col1, col2 = st.columns(2)
         
         # Filtro de Veículo
         with col1:
-            if 'Veículo' in df_grafico_periodo.columns:
+            if 'Veículo' in cubo_periodo.columns:
                 veiculo_opcoes_grafico = sorted(
-                    df_grafico_periodo['Veículo'].dropna().astype(str).unique().tolist()
+                    cubo_periodo['Veículo'].dropna().astype(str).unique().tolist()
                 )
                 veiculo_selecionado_grafico = st.selectbox(
                     "🚗 Filtrar por Veículo:",
                     ["Todos"] + veiculo_opcoes_grafico,
+                    index=indice_url("filtro_veiculo_grafico_periodo", ["Todos"] + veiculo_opcoes_grafico),
                     key="filtro_veiculo_grafico_periodo"
                 )
                 if veiculo_selecionado_grafico != "Todos":
-                    df_grafico_periodo = df_grafico_periodo[
-                        df_grafico_periodo['Veículo'].astype(str) == str(veiculo_selecionado_grafico)
-                    ].copy()
+                    cubo_periodo = cubo_periodo[
+                        cubo_periodo['Veículo'].astype(str) == str(veiculo_selecionado_grafico)
+                    ]
         
         # Filtro de Oficina
         with col2:
-            if 'Oficina' in df_grafico_periodo.columns:
+            if 'Oficina' in cubo_periodo.columns:
                 oficina_opcoes_grafico = sorted(
-                    df_grafico_periodo['Oficina'].dropna().astype(str).unique().tolist()
+                    cubo_periodo['Oficina'].dropna().astype(str).unique().tolist()
                 )
                 oficina_selecionada_grafico = st.selectbox(
                     "🏭 Filtrar por Oficina:",
                     ["Todos"] + oficina_opcoes_grafico,
+                    index=indice_url("filtro_oficina_grafico_periodo", ["Todos"] + oficina_opcoes_grafico),
                     key="filtro_oficina_grafico_periodo"
                 )
                 if oficina_selecionada_grafico != "Todos":
-                    df_grafico_periodo = df_grafico_periodo[
-                        df_grafico_periodo['Oficina'].astype(str) == str(oficina_selecionada_grafico)
-                    ].copy()
+                    cubo_periodo = cubo_periodo[
+                        cubo_periodo['Oficina'].astype(str) == str(oficina_selecionada_grafico)
+                    ]
         
-        # Criar gráfico com dados filtrados
-        grafico_periodo = create_period_chart(
-            df_grafico_periodo, coluna_visualizacao, tipo_visualizacao
+        grafico_periodo = criar_grafico(
+            cubo_periodo, coluna_visualizacao, "CPU por Período", titulo_y_valor, ponderado=True,
+            formato=formato_valor, esquema='redyellowgreen', inverter=True
         )
     else:
         st.subheader("📊 Soma do Valor por Período")
-        grafico_periodo = create_period_chart(
-            df_visualizacao, coluna_visualizacao, tipo_visualizacao
+        grafico_periodo = criar_grafico(
+            cubo_graficos, coluna_visualizacao, "Soma do Valor por Período", titulo_y_valor,
+            formato=formato_valor, esquema='redyellowgreen', inverter=True
         )
     
     if grafico_periodo:
         st.altair_chart(grafico_periodo, use_container_width=True)
 
 
-# Gráfico 2: Soma do Valor por Oficina
-@st.cache_data(ttl=900, max_entries=2)
-def create_oficina_chart(df_data, coluna, tipo_viz):
-    """Cria gráfico de barras por Oficina"""
-    try:
-        if (coluna not in df_data.columns or
-                'Oficina' not in df_data.columns):
-            return None
-
-        chart_data = df_data.groupby('Oficina')[coluna].sum().reset_index()
-        chart_data = chart_data.sort_values(coluna, ascending=False)
-
-        # Definir título do eixo Y baseado no tipo
-        if tipo_viz == "CPU (Custo por Unidade)":
-            titulo_y = "CPU (R$/Unidade)"
-            titulo_grafico = "CPU por Oficina"
-        else:
-            titulo_y = "Soma do Valor (R$)"
-            titulo_grafico = "Soma do Valor por Oficina"
-
-        grafico_barras = alt.Chart(chart_data).mark_bar().encode(
-            x=alt.X('Oficina:N', title='Oficina', sort='-y'),
-            y=alt.Y(f'{coluna}:Q', title=titulo_y),
-            color=alt.Color(
-                f'{coluna}:Q',
-                title=coluna,
-                scale=alt.Scale(scheme='redyellowgreen', reverse=True)
-            ),
-            tooltip=[
-                alt.Tooltip('Oficina:N', title='Oficina'),
-                alt.Tooltip(
-                    f'{coluna}:Q',
-                    title=coluna,
-                    format=',.4f' if tipo_viz == "CPU (Custo por Unidade)"
-                    else ',.2f'
-                )
-            ]
-        ).properties(
-            title=titulo_grafico,
-            height=400
-        )
-
-        # Adicionar rótulos com valores nas barras
-        formato_rotulo = (
-            ',.4f' if tipo_viz == "CPU (Custo por Unidade)" else ',.2f'
-        )
-        rotulos = grafico_barras.mark_text(
-            align='center',
-            baseline='middle',
-            dy=-10,
-            color='black',
-            fontSize=12
-        ).encode(
-            text=alt.Text(f'{coluna}:Q', format=formato_rotulo)
-        )
-
-        return grafico_barras + rotulos
-    except Exception as e:
-        st.error(f"Erro ao criar gráfico: {e}")
-        return None
-
-
-# Exibir gráfico por Oficina
-if ('Oficina' in df_visualizacao.columns and
-        coluna_visualizacao in df_visualizacao.columns):
+@fragmento_secao
+def secao_grafico_oficina(cubo_graficos, coluna_visualizacao, tipo_visualizacao, titulo_y_valor, formato_valor):
+    """Gráfico por Oficina"""
     if tipo_visualizacao == "CPU (Custo por Unidade)":
-        st.subheader("📊 CPU por Oficina")
+        titulo_oficina = "CPU por Oficina"
     else:
-        st.subheader("📊 Soma do Valor por Oficina")
-    grafico_oficina = create_oficina_chart(
-        df_visualizacao, coluna_visualizacao, tipo_visualizacao
+        titulo_oficina = "Soma do Valor por Oficina"
+    st.subheader(f"📊 {titulo_oficina}")
+    grafico_oficina = criar_grafico(
+        cubo_graficos, coluna_visualizacao, titulo_oficina, titulo_y_valor, dimensao='Oficina',
+        ponderado=tipo_visualizacao == "CPU (Custo por Unidade)",
+        formato=formato_valor, esquema='redyellowgreen', inverter=True
     )
     if grafico_oficina:
         st.altair_chart(grafico_oficina, use_container_width=True)
 
 
-# Gráfico 3: Volume por Período (se coluna Volume existir)
-@st.cache_data(ttl=900, max_entries=2)
-def create_volume_chart(df_data):
-    """Cria gráfico de barras de Volume por Período"""
-    try:
-        if 'Volume' not in df_data.columns or 'Período' not in df_data.columns:
-            return None
-
-        # Verificar se há múltiplos anos
-        tem_multiplos_anos = 'Ano' in df_data.columns and df_data['Ano'].nunique() > 1
-        
-        if tem_multiplos_anos:
-            # Agrupar por Ano e Período
-            chart_data = df_data.groupby(['Ano', 'Período'])['Volume'].sum().reset_index()
-            
-            # Criar coluna combinada para o rótulo do gráfico
-            chart_data['Período_Completo'] = chart_data['Período'].astype(str) + ' ' + chart_data['Ano'].astype(str)
-            
-            # Ordenar por ano e mês
-            chart_data = ordenar_por_mes(chart_data, 'Período')
-            ordem_periodos = chart_data['Período_Completo'].tolist()
-            
-            # Usar Período_Completo no gráfico
-            coluna_periodo_grafico = 'Período_Completo'
-        else:
-            # Comportamento original: agrupar apenas por Período
-            chart_data = df_data.groupby('Período')['Volume'].sum().reset_index()
-            chart_data = ordenar_por_mes(chart_data, 'Período')
-            ordem_periodos = chart_data['Período'].tolist()
-            coluna_periodo_grafico = 'Período'
-
-        grafico_barras = alt.Chart(chart_data).mark_bar().encode(
-            x=alt.X(
-                f'{coluna_periodo_grafico}:N',
-                title='Período',
-                sort=ordem_periodos
-            ),
-            y=alt.Y('Volume:Q', title='Volume Total'),
-            color=alt.Color(
-                'Volume:Q',
-                title='Volume',
-                scale=alt.Scale(scheme='blues')
-            ),
-            tooltip=[
-                alt.Tooltip(f'{coluna_periodo_grafico}:N', title='Período'),
-                alt.Tooltip('Volume:Q', title='Volume', format=',.2f')
-            ]
-        ).properties(
-            title='Volume Total por Período',
-            height=400
-        )
-
-        # Adicionar rótulos
-        rotulos = grafico_barras.mark_text(
-            align='center',
-            baseline='middle',
-            dy=-10,
-            color='black',
-            fontSize=12
-        ).encode(
-            text=alt.Text('Volume:Q', format=',.2f')
-        )
-
-        return grafico_barras + rotulos
-    except Exception as e:
-        st.error(f"Erro ao criar gráfico: {e}")
-        return None
-
-
-# Exibir gráfico de Volume
-st.subheader("📊 Volume Total por Período")
-
-# Carregar dados de volume do arquivo df_vol.parquet
-# Este gráfico não é afetado pelos filtros de Período
-df_vol = load_volume_data(ano_selecionado)
-
-if df_vol is not None:
-    # Verificar se tem as colunas necessárias
-    if 'Período' in df_vol.columns and 'Volume' in df_vol.columns:
-        # Aplicar filtros apenas para colunas que não são Período
-        # Identificar colunas comuns entre df_filtrado e df_vol
-        colunas_comuns = set(df_filtrado.columns) & set(df_vol.columns)
-        # Remover colunas que não devem ser usadas para filtro
-        # Excluir Período para não filtrar por mês
-        colunas_filtro = [
-            col for col in colunas_comuns
-            if col not in ['Volume', 'Total', 'Valor', 'CPU', 'Período']
-        ]
+@fragmento_secao
+def secao_grafico_volume(ano_selecionado, filtro):
+    """Gráfico de Volume (não é afetado pelos filtros de Período)"""
+    st.subheader("📊 Volume Total por Período")
 
-        # Aplicar filtros do df_filtrado ao df_vol usando colunas comuns
-        df_vol_filtrado = df_vol.copy()
-
-        for col in colunas_filtro:
-            if col in df_filtrado.columns:
-                # Obter valores únicos da coluna no df_filtrado
-                valores_filtrados = df_filtrado[col].dropna().unique()
-                if len(valores_filtrados) > 0:
-                    # Filtrar df_vol com os mesmos valores
-                    df_vol_filtrado = df_vol_filtrado[
-                        df_vol_filtrado[col].isin(valores_filtrados)
-                    ]
+    # Carregar dados de volume do arquivo df_vol.parquet, já restritos às
+    # dimensões da visão da sidebar (Oficina, Ano)
+    df_vol_filtrado = carregar_volume_visao(ano_selecionado, "df_ke5z_group", filtro)
 
-        # Criar gráfico (sempre mostrando todos os períodos)
-        grafico_volume = create_volume_chart(df_vol_filtrado)
-        if grafico_volume:
-            st.altair_chart(grafico_volume, use_container_width=True)
+    if df_vol_filtrado is not None:
+        # Verificar se tem as colunas necessárias
+        if 'Período' in df_vol_filtrado.columns and 'Volume' in df_vol_filtrado.columns:
+            # Criar gráfico (sempre mostrando todos os períodos)
+            grafico_volume = criar_grafico(
+                montar_cubo(df_vol_filtrado, [], ['Volume']), 'Volume',
+                'Volume Total por Período', 'Volume Total', esquema='blues'
+            )
+            if grafico_volume:
+                st.altair_chart(grafico_volume, use_container_width=True)
+            else:
+                st.info("Não foi possível criar o gráfico de volume.")
         else:
-            st.info("Não foi possível criar o gráfico de volume.")
+            st.warning(
+                "⚠️ O arquivo df_vol.parquet não contém as colunas "
+                "'Período' e 'Volume' necessárias."
+            )
     else:
-        st.warning(
-            "⚠️ O arquivo df_vol.parquet não contém as colunas "
-            "'Período' e 'Volume' necessárias."
-        )
-else:
-    st.info(
-        "ℹ️ Carregue o arquivo df_vol.parquet para visualizar "
-        "o gráfico de volume."
-    )
-
-
-# Gráfico 4: Total por Período (se coluna Total existir)
-@st.cache_data(ttl=900, max_entries=2)
-def create_total_chart(df_data):
-    """Cria gráfico de barras de Total por Período"""
-    try:
-        if 'Total' not in df_data.columns:
-            return None
-
-        # Verificar se há múltiplos anos
-        tem_multiplos_anos = 'Ano' in df_data.columns and df_data['Ano'].nunique() > 1
-        
-        if tem_multiplos_anos:
-            # Agrupar por Ano e Período
-            chart_data = df_data.groupby(['Ano', 'Período'])['Total'].sum().reset_index()
-            
-            # Criar coluna combinada para o rótulo do gráfico
-            chart_data['Período_Completo'] = chart_data['Período'].astype(str) + ' ' + chart_data['Ano'].astype(str)
-            
-            # Ordenar por ano e mês
-            chart_data = ordenar_por_mes(chart_data, 'Período')
-            ordem_periodos = chart_data['Período_Completo'].tolist()
-            
-            # Usar Período_Completo no gráfico
-            coluna_periodo_grafico = 'Período_Completo'
-        else:
-            # Comportamento original: agrupar apenas por Período
-            chart_data = df_data.groupby('Período')['Total'].sum().reset_index()
-            chart_data = ordenar_por_mes(chart_data, 'Período')
-            ordem_periodos = chart_data['Período'].tolist()
-            coluna_periodo_grafico = 'Período'
-
-        grafico_barras = alt.Chart(chart_data).mark_bar().encode(
-            x=alt.X(
-                f'{coluna_periodo_grafico}:N',
-                title='Período',
-                sort=ordem_periodos
-            ),
-            y=alt.Y('Total:Q', title='Total (R$)'),
-            color=alt.Color(
-                'Total:Q',
-                title='Total',
-                scale=alt.Scale(scheme='redyellowgreen', reverse=True)
-            ),
-            tooltip=[
-                alt.Tooltip(f'{coluna_periodo_grafico}:N', title='Período'),
-                alt.Tooltip('Total:Q', title='Total', format=',.2f')
-            ]
-        ).properties(
-            title='Total por Período',
-            height=400
+        st.info(
+            "ℹ️ Carregue o arquivo df_vol.parquet para visualizar "
+            "o gráfico de volume."
         )
 
-        # Adicionar rótulos
-        rotulos = grafico_barras.mark_text(
-            align='center',
-            baseline='middle',
-            dy=-10,
-            color='black',
-            fontSize=12
-        ).encode(
-            text=alt.Text('Total:Q', format=',.2f')
-        )
-
-        return grafico_barras + rotulos
-    except Exception as e:
-        st.error(f"Erro ao criar gráfico: {e}")
-        return None
 
-
-# Exibir gráfico de Total (apenas para Custo Total)
-if tipo_visualizacao == "Custo Total" and 'Total' in df_filtrado.columns:
+@fragmento_secao
+def secao_grafico_total(cubo_graficos):
+    """Gráfico de Total por Período (apenas para Custo Total)"""
     st.subheader("📊 Total por Período")
-    grafico_total = create_total_chart(df_filtrado)
+    grafico_total = criar_grafico(
+        cubo_graficos, 'Total', 'Total por Período', 'Total (R$)',
+        esquema='redyellowgreen', inverter=True
+    )
     if grafico_total:
         st.altair_chart(grafico_total, use_container_width=True)
 
-# Tabela dinâmica: Valor por Oficina e Período
-if ('Oficina' in df_visualizacao.columns and
-        'Período' in df_visualizacao.columns):
+
+@fragmento_secao
+def secao_tabela_dinamica(df_visualizacao, coluna_visualizacao, tipo_visualizacao, cubo_cpu):
+    """Tabela dinâmica: Valor (ou CPU) por Oficina e Período, com download"""
     st.markdown("---")
     if tipo_visualizacao == "CPU (Custo por Unidade)":
         st.subheader("📋 Tabela Dinâmica - CPU por Oficina e Período")
@@ -916,13 +480,23 @@ if ('Oficina' in df_visualizacao.columns and
         st.subheader("📋 Tabela Dinâmica - Valor por Oficina e Período")
 
     if coluna_visualizacao in df_visualizacao.columns:
-        df_pivot = df_visualizacao.pivot_table(
-            index='Oficina',
-            columns='Período',
-            values=coluna_visualizacao,
-            aggfunc='sum',
-            fill_value=0
-        )
+        if tipo_visualizacao == "CPU (Custo por Unidade)":
+            # Células e Total = soma do Valor / soma do Volume (o Total não soma os CPUs dos meses)
+            df_pivot = tabela_cpu(cubo_cpu, 'Oficina', 'Período', 'Valor')
+        elif coluna_visualizacao in COLUNAS_MONETARIAS:
+            # Soma exata em inteiros (evita diferenças de arredondamento no R$)
+            df_pivot = tabela_soma(
+                df_visualizacao, 'Oficina', 'Período', coluna_visualizacao
+            )
+        else:
+            df_pivot = df_visualizacao.pivot_table(
+                index='Oficina',
+                columns='Período',
+                values=coluna_visualizacao,
+                aggfunc='sum',
+                fill_value=0,
+                observed=True
+            )
 
         # Ordenar colunas por ordem cronológica dos meses
         colunas_existentes = [
@@ -933,103 +507,62 @@ if ('Oficina' in df_visualizacao.columns and
         ]
         df_pivot = df_pivot[colunas_existentes + colunas_restantes]
 
-        # Calcular total por linha
-        df_pivot['Total'] = df_pivot.sum(axis=1)
+        # Calcular total por linha (em CPU, tabela_cpu já traz o CPU da linha inteira)
+        if tipo_visualizacao != "CPU (Custo por Unidade)":
+            if coluna_visualizacao in COLUNAS_MONETARIAS:
+                df_pivot['Total'] = somar_linhas(df_pivot)
+            else:
+                df_pivot['Total'] = df_pivot.sum(axis=1)
         df_pivot = df_pivot.sort_values('Total', ascending=False)
 
-        # Formatar valores baseado no tipo de visualização
-        def formatar_valor(val, tipo):
-            if isinstance(val, (int, float)):
-                if tipo == "CPU (Custo por Unidade)":
-                    return f"{val:,.4f}"
-                else:
-                    return f"R$ {val:,.2f}"
-            return val
-
-        # Aplicar formatação
-        df_pivot_formatado = df_pivot.copy()
-        for col in df_pivot_formatado.columns:
-            df_pivot_formatado[col] = df_pivot_formatado[col].apply(
-                lambda x: formatar_valor(x, tipo_visualizacao)
-            )
+        # Valores continuam numéricos: R$ / CPU formatados na exibição
+        st.dataframe(
+            df_pivot, use_container_width=True,
+            column_config=config_colunas_valor(df_pivot.columns, tipo_visualizacao)
+        )
 
-        st.dataframe(df_pivot_formatado, use_container_width=True)
-
-        # Botão de download da Tabela Dinâmica
-        if st.button(
-            "📥 Baixar Tabela Dinâmica (Excel)",
-            use_container_width=True,
-            key="download_pivot"
-        ):
-            with st.spinner("Gerando arquivo da tabela dinâmica..."):
-                try:
-                    # Obter pasta Downloads do usuário
-                    downloads_path = os.path.join(
-                        os.path.expanduser("~"), "Downloads"
-                    )
-                    file_name = "TC_tabela_dinamica.xlsx"
-                    file_path = os.path.join(downloads_path, file_name)
-
-                    # Salvar arquivo diretamente na pasta Downloads
-                    with pd.ExcelWriter(
-                        file_path, engine='openpyxl'
-                    ) as writer:
-                        df_pivot.to_excel(
-                            writer, index=True, sheet_name='Tabela_Dinamica'
-                        )
-
-                    st.success(
-                        f"✅ Arquivo salvo com sucesso em: {file_path}"
-                    )
-                    st.info(
-                        f"📁 Verifique sua pasta Downloads: {downloads_path}"
-                    )
-                except Exception as e:
-                    st.error(f"❌ Erro ao salvar arquivo: {str(e)}")
-
-# Exibir tabela filtrada
-st.markdown("---")
-if tipo_visualizacao == "CPU (Custo por Unidade)":
-    st.subheader("📋 Tabela Filtrada - CPU")
-else:
-    st.subheader("📋 Tabela Filtrada")
-display_limit = 1000
-if len(df_visualizacao) > display_limit:
-    st.info(
-        f"📊 Mostrando {display_limit:,} de "
-        f"{len(df_visualizacao):,} registros"
-    )
-    df_display = df_visualizacao.head(display_limit)
-else:
-    df_display = df_visualizacao
-
-st.dataframe(df_display, use_container_width=True)
-
-# Botão de download da Tabela Filtrada
-if st.button(
-    "📥 Baixar Tabela Filtrada (Excel)",
-    use_container_width=True,
-    key="download_filtered"
-):
-    with st.spinner("Gerando arquivo da tabela filtrada..."):
-        try:
-            # Obter pasta Downloads do usuário
-            downloads_path = os.path.join(
-                os.path.expanduser("~"), "Downloads"
-            )
-            file_name = "TC_tabela_filtrada.xlsx"
-            file_path = os.path.join(downloads_path, file_name)
+        # Download da Tabela Dinâmica (gerado em memória no clique)
+        botao_download(df_pivot, "📥 Baixar Tabela Dinâmica", "TC_tabela_dinamica", "download_pivot",
+                       nome_planilha='Tabela_Dinamica', index=True)
 
-            # Salvar arquivo diretamente na pasta Downloads
-            with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
-                df_visualizacao.to_excel(
-                    writer, index=False, sheet_name='Dados_Filtrados'
-                )
 
-            st.success(f"✅ Arquivo salvo com sucesso em: {file_path}")
-            st.info(f"📁 Verifique sua pasta Downloads: {downloads_path}")
-        except Exception as e:
-            st.error(f"❌ Erro ao salvar arquivo: {str(e)}")
+@fragmento_secao
+def secao_tabela_filtrada(df_visualizacao, tipo_visualizacao, ano_selecionado, filtro):
+    """Tabela filtrada paginada, com exportação"""
+    st.markdown("---")
+    if tipo_visualizacao == "CPU (Custo por Unidade)":
+        st.subheader("📋 Tabela Filtrada - CPU")
+    else:
+        st.subheader("📋 Tabela Filtrada")
+    # Busca, ordenação e paginação no servidor: só a página visível vai para o navegador
+    exibir_tabela_paginada(df_visualizacao, "tabela_filtrada")
+
+    # Download da Tabela Filtrada (gerado na fila de exportação, com progresso)
+    botao_exportacao(df_visualizacao, "Tabela Filtrada", "TC_tabela_filtrada", "download_filtered",
+                     identidade=(ano_selecionado, filtro.chave, tipo_visualizacao),
+                     nome_planilha='Dados_Filtrados')
+
+
+if coluna_visualizacao in df_visualizacao.columns:
+    secao_grafico_periodo(cubo_graficos, coluna_visualizacao, tipo_visualizacao, titulo_y_valor, formato_valor)
+
+if ('Oficina' in df_visualizacao.columns and
+        coluna_visualizacao in df_visualizacao.columns):
+    secao_grafico_oficina(cubo_graficos, coluna_visualizacao, tipo_visualizacao, titulo_y_valor, formato_valor)
+
+secao_grafico_volume(ano_selecionado, filtro)
+
+if tipo_visualizacao == "Custo Total" and 'Total' in df_filtrado.columns:
+    secao_grafico_total(cubo_graficos)
+
+if ('Oficina' in df_visualizacao.columns and
+        'Período' in df_visualizacao.columns):
+    secao_tabela_dinamica(df_visualizacao, coluna_visualizacao, tipo_visualizacao, cubo_cpu)
+
+secao_tabela_filtrada(df_visualizacao, tipo_visualizacao, ano_selecionado, filtro)
+
+# Gravar o estado da visão na URL (link compartilhável)
+sincronizar_url()
 
 # Footer
 st.markdown("---")
@@ -1,8 +1,24 @@
 import streamlit as st
 import pandas as pd
-import altair as alt
-import os
+import functools
 import numpy as np
+from tc_dados.agregacao import GRAO_CPU, calcular_cpu, cpu_por, tabela_cpu
+from tc_dados.busca import opcoes_com_busca, termos_busca
+from tc_dados.carregamento import carregar_dados, listar_anos_disponiveis
+from tc_dados.estado_url import (
+    indice_url, iniciar_estado_url, padrao_url, sincronizar_url, texto_url
+)
+from tc_dados.exportacao import botao_download, botao_exportacao
+from tc_dados.filtros import FiltroSpec
+from tc_dados.graficos import GRAO_ANO_MES, criar_grafico, montar_cubo
+from tc_dados.metadados import (
+    ORDEM_MESES, carregar_cubo_cpu, carregar_dimensoes, carregar_facetas, carregar_visao,
+    carregar_volume_visao, contar_linhas, opcoes_faceta, opcoes_visao, rotulo_faceta
+)
+from tc_dados.moeda import COLUNAS_MONETARIAS, somar, somar_linhas, tabela_soma
+from tc_dados.preaquecimento import iniciar_preaquecimento
+from tc_dados.subtotais import NIVEL, NIVEL_SUBTOTAL, com_subtotais
+from tc_dados.tabela import config_colunas_valor, exibir_tabela_paginada, formatar_valor
 
 # Configuração da página
 st.set_page_config(
@@ -12,6 +28,9 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Pré-aquecer o cache compartilhado em segundo plano (uma vez por processo e versão dos dados)
+iniciar_preaquecimento()
+
 # CSS para reduzir títulos em 20%
 st.markdown("""
     <style>
@@ -36,60 +55,8 @@ st.subheader("Análise de dados agrupados por Oficina e Período")
 
 st.markdown("---")
 
-# Função auxiliar para listar anos disponíveis
-def listar_anos_disponiveis():
-    """Lista todos os anos disponíveis nas pastas de dados"""
-    pasta_dados = "dados"
-    anos_disponiveis = []
-    
-    if os.path.exists(pasta_dados):
-        for item in os.listdir(pasta_dados):
-            caminho_item = os.path.join(pasta_dados, item)
-            if os.path.isdir(caminho_item) and item.isdigit():
-                anos_disponiveis.append(int(item))
-    
-    return sorted(anos_disponiveis, reverse=True)  # Mais recente primeiro
-
-# Função auxiliar para encontrar arquivo parquet na ordem de prioridade
-def encontrar_arquivo_parquet(nome_arquivo, ano_selecionado=None):
-    """
-    Busca arquivo parquet na seguinte ordem de prioridade:
-    1. Se ano_selecionado for None ou "Todos": Histórico consolidado (dados/historico_consolidado/)
-    2. Se ano_selecionado for especificado: Pasta do ano (dados/{ANO}/)
-    3. Pasta do ano mais recente (dados/{ANO}/)
-    4. Raiz do projeto (compatibilidade)
-    """
-    # Se ano específico foi selecionado, buscar na pasta do ano
-    if ano_selecionado is not None and ano_selecionado != "Todos":
-        caminho_ano = os.path.join("dados", str(ano_selecionado), nome_arquivo)
-        if os.path.exists(caminho_ano):
-            return caminho_ano
-    
-    # 1. Tentar histórico consolidado (para "Todos" ou quando não especificado)
-    caminho_historico = os.path.join("dados", "historico_consolidado", nome_arquivo.replace(".parquet", "_historico.parquet"))
-    if os.path.exists(caminho_historico):
-        return caminho_historico
-    
-    # 2. Tentar pasta do ano mais recente
-    pasta_dados = "dados"
-    if os.path.exists(pasta_dados):
-        anos_disponiveis = []
-        for item in os.listdir(pasta_dados):
-            caminho_item = os.path.join(pasta_dados, item)
-            if os.path.isdir(caminho_item) and item.isdigit():
-                anos_disponiveis.append(int(item))
-        
-        if anos_disponiveis:
-            ano_mais_recente = max(anos_disponiveis)
-            caminho_ano = os.path.join(pasta_dados, str(ano_mais_recente), nome_arquivo)
-            if os.path.exists(caminho_ano):
-                return caminho_ano
-    
-    # 3. Tentar raiz (compatibilidade)
-    if os.path.exists(nome_arquivo):
-        return nome_arquivo
-    
-    return None
+# Estado da visão na URL: um link compartilhado abre com os mesmos filtros
+iniciar_estado_url("tc_ext")
 
 # Filtros na sidebar - ANTES de carregar dados
 st.sidebar.markdown("---")
@@ -103,333 +70,138 @@ opcoes_ano = ["Todos"] + [str(ano) for ano in anos_disponiveis]
 ano_selecionado = st.sidebar.selectbox(
     "Selecione o ano:",
     options=opcoes_ano,
-    index=0,  # "Todos" por padrão
-    help="Selecione 'Todos' para ver dados consolidados ou um ano específico"
+    index=indice_url("ano", opcoes_ano),  # "Todos" por padrão
+    help="Selecione 'Todos' para ver dados consolidados ou um ano específico",
+    key="ano"
 )
 
 st.sidebar.markdown("---")
 st.sidebar.markdown("**🔍 Filtros**")
 
-# Função para carregar dados com cache
-@st.cache_data(
-    ttl=3600,
-    max_entries=10,  # Aumentar para cachear diferentes anos
-    show_spinner=True
-)
+# Função para carregar dados (cache compartilhado entre as páginas em tc_dados.carregamento)
 def load_data(ano_selecionado_param):
     """Carrega os dados do arquivo parquet"""
     try:
-        # Quando "Todos" está selecionado, SEMPRE carregar do histórico consolidado
-        if ano_selecionado_param == "Todos":
-            caminho_historico = os.path.join("dados", "historico_consolidado", "df_final_historico.parquet")
-            caminho_absoluto = os.path.abspath(caminho_historico)
-            
-            if os.path.exists(caminho_historico):
-                df = pd.read_parquet(caminho_historico)
-                
-                # Debug: mostrar informações detalhadas sobre os dados carregados
-                st.sidebar.info(f"📁 Arquivo carregado: {caminho_absoluto}")
-                
-                if "Ano" in df.columns:
-                    anos_carregados = sorted(df['Ano'].unique())
-                    st.sidebar.info(f"📊 Anos disponíveis: {anos_carregados} | Total de registros: {len(df):,}")
-                    
-                    # Verificar se há coluna Total e se tem valores
-                    if 'Total' in df.columns:
-                        total_sum = df['Total'].sum() if pd.api.types.is_numeric_dtype(df['Total']) else 0
-                        st.sidebar.info(f"💰 Soma Total: R$ {total_sum:,.2f}")
-                else:
-                    st.sidebar.warning("⚠️ Coluna 'Ano' não encontrada nos dados")
-            else:
-                st.error(f"❌ Arquivo de histórico consolidado não encontrado: {caminho_absoluto}")
-                st.info("💡 Execute o dados.ipynb para gerar o histórico consolidado")
-                st.stop()
-                return None
-        else:
-            # Converter "Todos" para None
-            ano_para_busca = None if ano_selecionado_param == "Todos" else ano_selecionado_param
-            
-            # Buscar arquivo na ordem de prioridade
-            arquivo_parquet = encontrar_arquivo_parquet("df_final.parquet", ano_para_busca)
-
-            if arquivo_parquet is None:
-                st.error(f"❌ Arquivo não encontrado: df_final.parquet")
-                st.info("💡 Verifique se o arquivo existe em:")
-                st.info("   - dados/historico_consolidado/df_final_historico.parquet")
-                st.info("   - dados/{ANO}/df_final.parquet")
-                st.info("   - df_final.parquet (raiz)")
-                st.stop()
-                return None
-
-            # Carregar dados
-            df = pd.read_parquet(arquivo_parquet)
-
-        # Se carregou do histórico consolidado e um ano específico foi selecionado, filtrar
-        if ano_selecionado_param != "Todos" and "Ano" in df.columns:
-            df = df[df['Ano'] == int(ano_selecionado_param)].copy()
-
-        # Converter colunas numéricas conhecidas para numérico ANTES da otimização
-        # Isso evita que sejam convertidas para categorical
-        colunas_numericas = ['Valor', 'Total', 'Volume', 'CPU']
-        for col in colunas_numericas:
-            if col in df.columns and df[col].dtype == 'object':
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-
-        # Otimizar tipos de dados
-        for col in df.columns:
-            if df[col].dtype == 'object':
-                unique_ratio = df[col].nunique() / len(df)
-                if unique_ratio < 0.5:
-                    df[col] = df[col].astype('category')
-
-        # Converter floats para tipos menores
-        for col in df.select_dtypes(include=['float64']).columns:
-            df[col] = pd.to_numeric(df[col], downcast='float')
-
-        # Converter ints para tipos menores
-        for col in df.select_dtypes(include=['int64']).columns:
-            df[col] = pd.to_numeric(df[col], downcast='integer')
-
-        return df
+        df = carregar_dados(ano_selecionado_param, "df_final")
     except Exception as e:
         st.error(f"❌ Erro ao carregar dados: {str(e)}")
         st.stop()
 
+    if df is None:
+        st.error(f"❌ Arquivo não encontrado: df_final.parquet")
+        st.info("💡 Verifique se o arquivo existe em:")
+        st.info("   - dados/historico_consolidado/df_final_historico.parquet")
+        st.info("   - dados/{ANO}/df_final.parquet")
+        st.info("   - df_final.parquet (raiz)")
+        st.info("💡 Execute o dados.ipynb para gerar o histórico consolidado")
+        st.stop()
 
-# Função para carregar dados de volume com cache
-@st.cache_data(
-    ttl=3600,
-    max_entries=10,  # Aumentar para cachear diferentes anos
-    show_spinner=True
-)
-def load_volume_data(ano_selecionado_param):
-    """Carrega os dados de volume do arquivo parquet"""
-    try:
-        # Quando "Todos" está selecionado, SEMPRE carregar do histórico consolidado
-        if ano_selecionado_param == "Todos":
-            caminho_historico = os.path.join("dados", "historico_consolidado", "df_vol_historico.parquet")
-            if os.path.exists(caminho_historico):
-                df = pd.read_parquet(caminho_historico)
-            else:
-                return None
-        else:
-            # Converter "Todos" para None
-            ano_para_busca = None if ano_selecionado_param == "Todos" else ano_selecionado_param
-            
-            # Buscar arquivo na ordem de prioridade
-            arquivo_parquet = encontrar_arquivo_parquet("df_vol.parquet", ano_para_busca)
-
-            if arquivo_parquet is None:
-                return None
-
-            df = pd.read_parquet(arquivo_parquet)
-
-        # Se carregou do histórico consolidado e um ano específico foi selecionado, filtrar
-        if ano_selecionado_param != "Todos" and "Ano" in df.columns:
-            df = df[df['Ano'] == int(ano_selecionado_param)].copy()
-
-        # Converter colunas numéricas conhecidas para numérico ANTES da otimização
-        # Isso evita que sejam convertidas para categorical
-        colunas_numericas = ['Valor', 'Total', 'Volume', 'CPU']
-        for col in colunas_numericas:
-            if col in df.columns and df[col].dtype == 'object':
-                df[col] = pd.to_numeric(df[col], errors='coerce')
-
-        # Otimizar tipos de dados
-        for col in df.columns:
-            if df[col].dtype == 'object':
-                unique_ratio = df[col].nunique() / len(df)
-                if unique_ratio < 0.5:
-                    df[col] = df[col].astype('category')
-
-        # Converter floats para tipos menores
-        for col in df.select_dtypes(include=['float64']).columns:
-            df[col] = pd.to_numeric(df[col], downcast='float')
-
-        # Converter ints para tipos menores
-        for col in df.select_dtypes(include=['int64']).columns:
-            df[col] = pd.to_numeric(df[col], downcast='integer')
-
-        return df
-    except Exception:
-        return None
+    return df
 
 
-# Carregar dados com o ano selecionado
+# Metadados das dimensões (poucos KB): a sidebar é montada sem ler a tabela completa
 try:
-    df_total = load_data(ano_selecionado)
-    
-    # Verificar se df_total foi carregado corretamente
-    if df_total is None:
-        st.error("❌ Erro: Nenhum dado foi carregado (df_total é None)")
-        st.stop()
-    
-    if df_total.empty:
-        st.error("❌ Erro: DataFrame carregado está vazio")
-        st.stop()
-    
-    st.sidebar.success("✅ Dados carregados com sucesso")
-    
-    # Debug adicional: verificar colunas e valores
-    if ano_selecionado == "Todos":
-        st.sidebar.info(f"📊 {len(df_total):,} registros (Todos os anos)")
-        
-        # Verificar se há coluna Total e mostrar soma
-        if 'Total' in df_total.columns:
-            # Converter para numérico se necessário
-            if not pd.api.types.is_numeric_dtype(df_total['Total']):
-                df_total['Total'] = pd.to_numeric(df_total['Total'], errors='coerce')
-            
-            total_sum = df_total['Total'].sum()
-            st.sidebar.info(f"💰 Soma Total (df_total): R$ {total_sum:,.2f}")
-            
-            # Verificar anos disponíveis
-            if 'Ano' in df_total.columns:
-                anos_disponiveis = sorted(df_total['Ano'].unique())
-                st.sidebar.info(f"📅 Anos em df_total: {anos_disponiveis}")
-    else:
-        st.sidebar.info(f"📊 {len(df_total):,} registros (Ano {ano_selecionado})")
+    df_dimensoes = carregar_dimensoes(ano_selecionado, "df_final")
 except Exception as e:
-    st.error(f"❌ Erro: {str(e)}")
-    import traceback
-    st.error(f"Detalhes: {traceback.format_exc()}")
+    st.error(f"❌ Erro ao carregar dados: {str(e)}")
     st.stop()
 
-# Função auxiliar para obter opções de filtro
-
-
-@st.cache_data(ttl=1800, max_entries=5)
-def get_filter_options(df, column_name):
-    """Obtém opções de filtro com cache"""
-    if column_name in df.columns:
-        opcoes = sorted(
-            df[column_name].dropna().astype(str).unique().tolist()
-        )
-        return ["Todos"] + opcoes
-    return ["Todos"]
-
-
-# Ordem dos meses para ordenação cronológica
-ORDEM_MESES = [
-    'janeiro', 'fevereiro', 'março', 'abril', 'maio', 'junho',
-    'julho', 'agosto', 'setembro', 'outubro', 'novembro', 'dezembro'
-]
+if df_dimensoes is None:
+    load_data(ano_selecionado)  # Exibe o erro de arquivo não encontrado
 
+if ano_selecionado == "Todos":
+    st.sidebar.info(f"📊 {contar_linhas(df_dimensoes):,} registros (Todos os anos)")
+else:
+    st.sidebar.info(f"📊 {contar_linhas(df_dimensoes):,} registros (Ano {ano_selecionado})")
 
 # Seletor de tipo de visualização
 st.sidebar.markdown("**📊 Tipo de Visualização**")
+opcoes_visualizacao = ["Custo Total", "CPU (Custo por Unidade)"]
 tipo_visualizacao = st.sidebar.radio(
     "Selecione o tipo:",
-    ["Custo Total", "CPU (Custo por Unidade)"],
-    index=0
+    opcoes_visualizacao,
+    index=indice_url("tipo_visualizacao", opcoes_visualizacao),
+    key="tipo_visualizacao"
 )
 st.sidebar.markdown("---")
 
-# Filtro 1: Oficina (com cache otimizado)
-if 'Oficina' in df_total.columns:
-    oficina_opcoes = get_filter_options(df_total, 'Oficina')
+# Filtros em cascata: as opções de cada filtro (com linhas e total) vêm das
+# facetas das seleções anteriores; a tabela completa é filtrada depois, de uma vez
+selecoes = {}
+
+# Filtro 1: Oficina
+if 'Oficina' in df_dimensoes.columns:
+    facetas = carregar_facetas(ano_selecionado, "df_final", selecoes)
+    opcoes = opcoes_faceta(facetas, 'Oficina')
     oficina_selecionadas = st.sidebar.multiselect(
-        "Selecione a Oficina:", oficina_opcoes, default=["Todos"]
+        "Selecione a Oficina:", opcoes,
+        default=padrao_url("filtro_Oficina", opcoes, ["Todos"]),
+        format_func=rotulo_faceta(facetas, 'Oficina'),
+        key="filtro_Oficina"
     )
+    selecoes['Oficina'] = oficina_selecionadas
 
-    # Filtrar o DataFrame com base na Oficina
-    if "Todos" in oficina_selecionadas or not oficina_selecionadas:
-        df_filtrado = df_total.copy()
-    else:
-        df_filtrado = df_total[
-            df_total['Oficina'].astype(str).isin(oficina_selecionadas)
-        ].copy()
-else:
-    df_filtrado = df_total.copy()
-
-# Filtro 2: Veículo (com cache otimizado)
-if 'Veículo' in df_filtrado.columns:
-    veiculo_opcoes = get_filter_options(df_filtrado, 'Veículo')
+# Filtro 2: Veículo
+if 'Veículo' in df_dimensoes.columns:
+    facetas = carregar_facetas(ano_selecionado, "df_final", selecoes)
+    opcoes = opcoes_faceta(facetas, 'Veículo')
     veiculo_selecionados = st.sidebar.multiselect(
-        "Selecione o Veículo:", veiculo_opcoes, default=["Todos"]
+        "Selecione o Veículo:", opcoes,
+        default=padrao_url("filtro_Veículo", opcoes, ["Todos"]),
+        format_func=rotulo_faceta(facetas, 'Veículo'),
+        key="filtro_Veículo"
     )
-    if veiculo_selecionados and "Todos" not in veiculo_selecionados:
-        df_filtrado = df_filtrado[
-            df_filtrado['Veículo'].astype(str).isin(veiculo_selecionados)
-        ].copy()
-
-# Filtro 3: USI (com cache otimizado)
-if 'USI' in df_filtrado.columns:
-    usi_opcoes = get_filter_options(df_filtrado, 'USI')
+    selecoes['Veículo'] = veiculo_selecionados
+
+# Filtro 3: USI
+if 'USI' in df_dimensoes.columns:
+    facetas = carregar_facetas(ano_selecionado, "df_final", selecoes)
+    usi_opcoes = opcoes_faceta(facetas, 'USI')
     default_usi = ["TC Ext"] if "TC Ext" in usi_opcoes else ["Todos"]
     usi_selecionada = st.sidebar.multiselect(
-        "Selecione a USI:", usi_opcoes, default=default_usi
-    )
-
-    # Filtrar o DataFrame com base na USI
-    if "Todos" in usi_selecionada or not usi_selecionada:
-        pass  # Manter df_filtrado como está
-    else:
-        df_filtrado = df_filtrado[
-            df_filtrado['USI'].astype(str).isin(usi_selecionada)
-        ].copy()
-
-# Filtro 4: Período (com cache otimizado)
-# IMPORTANTE: Criar cópia ANTES do filtro de período para usar no gráfico
-df_para_grafico_periodo = df_filtrado.copy()
-
-if 'Período' in df_filtrado.columns:
-    periodo_opcoes_raw = get_filter_options(df_filtrado, 'Período')
-
-    # Ordenar meses cronologicamente
-    periodo_opcoes = ["Todos"]
-    meses_ordenados = []
-    outros_periodos = []
-
-    for periodo in periodo_opcoes_raw[1:]:  # Pular "Todos"
-        periodo_lower = str(periodo).lower()
-        if periodo_lower in ORDEM_MESES:
-            meses_ordenados.append(periodo)
-        else:
-            outros_periodos.append(periodo)
-
-    # Ordenar meses pela ordem cronológica
-    meses_ordenados.sort(
-        key=lambda x: ORDEM_MESES.index(str(x).lower())
-        if str(x).lower() in ORDEM_MESES else 999
+        "Selecione a USI:", usi_opcoes, default=padrao_url("filtro_USI", usi_opcoes, default_usi),
+        format_func=rotulo_faceta(facetas, 'USI'),
+        key="filtro_USI"
     )
+    selecoes['USI'] = usi_selecionada
 
-    # Combinar: Todos + meses ordenados + outros períodos
-    periodo_opcoes = periodo_opcoes + meses_ordenados + outros_periodos
+# IMPORTANTE: o gráfico por período usa os filtros ANTERIORES ao de período
+selecoes_grafico_periodo = dict(selecoes)
 
+# Filtro 4: Período (meses em ordem cronológica)
+if 'Período' in df_dimensoes.columns:
+    facetas = carregar_facetas(ano_selecionado, "df_final", selecoes)
+    opcoes = opcoes_faceta(facetas, 'Período')
     periodo_selecionado = st.sidebar.selectbox(
-        "Selecione o Período:", periodo_opcoes
+        "Selecione o Período:", opcoes, index=indice_url("filtro_Período", opcoes),
+        format_func=rotulo_faceta(facetas, 'Período'),
+        key="filtro_Período"
     )
-    if periodo_selecionado != "Todos":
-        df_filtrado = df_filtrado[
-            df_filtrado['Período'].astype(str) == str(periodo_selecionado)
-        ].copy()
-
-# Filtro 5: Centro cst (com cache otimizado)
-if 'Centrocst' in df_filtrado.columns:
-    centro_cst_opcoes = get_filter_options(df_filtrado, 'Centrocst')
+    selecoes['Período'] = periodo_selecionado
+
+# Filtro 5: Centro cst
+if 'Centrocst' in df_dimensoes.columns:
+    facetas = carregar_facetas(ano_selecionado, "df_final", selecoes)
+    opcoes = opcoes_faceta(facetas, 'Centrocst')
     centro_cst_selecionado = st.sidebar.selectbox(
-        "Selecione o Centro cst:", centro_cst_opcoes
+        "Selecione o Centro cst:", opcoes, index=indice_url("filtro_Centrocst", opcoes),
+        format_func=rotulo_faceta(facetas, 'Centrocst'),
+        key="filtro_Centrocst"
     )
-    if centro_cst_selecionado != "Todos":
-        df_filtrado = df_filtrado[
-            df_filtrado['Centrocst'].astype(str) == str(centro_cst_selecionado)
-        ].copy()
-
-# Filtro 6: Conta contábil (com cache otimizado)
-if 'Nºconta' in df_filtrado.columns:
-    conta_contabil_opcoes = get_filter_options(df_filtrado, 'Nºconta')[1:]
+    selecoes['Centrocst'] = centro_cst_selecionado
+
+# Filtro 6: Conta contábil
+if 'Nºconta' in df_dimensoes.columns:
+    facetas = carregar_facetas(ano_selecionado, "df_final", selecoes)
+    opcoes = opcoes_faceta(facetas, 'Nºconta')[1:]
     conta_contabil_selecionadas = st.sidebar.multiselect(
-        "Selecione a Conta contábil:", conta_contabil_opcoes
+        "Selecione a Conta contábil:", opcoes, default=padrao_url("filtro_Nºconta", opcoes, []),
+        format_func=rotulo_faceta(facetas, 'Nºconta'),
+        key="filtro_Nºconta"
     )
-    if conta_contabil_selecionadas:
-        df_filtrado = df_filtrado[
-            df_filtrado['Nºconta'].astype(str).isin(
-                conta_contabil_selecionadas
-            )
-        ].copy()
+    selecoes['Nºconta'] = conta_contabil_selecionadas
 
-# Filtros principais (com cache otimizado)
+# Filtros principais
 filtros_principais = [
     ("Type 05", "Type 05", "multiselect"),
     ("Type 06", "Type 06", "multiselect"),
@@ -439,18 +211,61 @@ filtros_principais = [
 ]
 
 for col_name, label, widget_type in filtros_principais:
-    if col_name in df_filtrado.columns:
-        opcoes = get_filter_options(df_filtrado, col_name)
+    if col_name in df_dimensoes.columns:
+        facetas = carregar_facetas(ano_selecionado, "df_final", selecoes)
+        opcoes = opcoes_faceta(facetas, col_name)
         if widget_type == "multiselect":
             selecionadas = st.sidebar.multiselect(
-                f"Selecione o {label}:", opcoes, default=["Todos"]
+                f"Selecione o {label}:", opcoes,
+                default=padrao_url(f"filtro_{col_name}", opcoes, ["Todos"]),
+                format_func=rotulo_faceta(facetas, col_name),
+                key=f"filtro_{col_name}"
             )
-            if selecionadas and "Todos" not in selecionadas:
-                df_filtrado = df_filtrado[
-                    df_filtrado[col_name].astype(str).isin(selecionadas)
-                ].copy()
+            selecoes[col_name] = selecionadas
+
+# Busca textual em Texto breve / Fornecedor: entra no mesmo spec dos filtros
+consulta_texto = st.sidebar.text_input(
+    "🔎 Buscar na descrição / fornecedor:",
+    value=texto_url("busca_texto"),
+    key="busca_texto",
+    placeholder="Ex.: oxigenio white martins",
+    help="Busca em Texto breve e Fornecedor sem diferenciar acentos e maiúsculas; "
+         "todas as palavras precisam aparecer na linha"
+)
+termos_busca_texto = termos_busca(consulta_texto)
+
+# Carregar a tabela completa só agora (a sidebar principal já está na tela)
+try:
+    df_total = load_data(ano_selecionado)
+
+    if df_total.empty:
+        st.error("❌ Erro: DataFrame carregado está vazio")
+        st.stop()
+
+    st.sidebar.success("✅ Dados carregados com sucesso")
+
+    # Debug adicional: soma Total e anos do histórico
+    if ano_selecionado == "Todos" and 'Total' in df_total.columns:
+        total_sum = somar(df_total['Total'])
+        st.sidebar.info(f"💰 Soma Total (df_total): R$ {total_sum:,.2f}")
+
+        if 'Ano' in df_total.columns:
+            anos_disponiveis = sorted(df_total['Ano'].unique())
+            st.sidebar.info(f"📅 Anos em df_total: {anos_disponiveis}")
+except Exception as e:
+    st.error(f"❌ Erro: {str(e)}")
+    import traceback
+    st.error(f"Detalhes: {traceback.format_exc()}")
+    st.stop()
+
+# Visões filtradas em cache (a padrão vem pronta do pré-aquecimento)
+filtro_grafico_periodo = FiltroSpec(selecoes_grafico_periodo).com_busca(termos_busca_texto)
+df_para_grafico_periodo = carregar_visao(ano_selecionado, "df_final", filtro_grafico_periodo)
+filtro_principal = FiltroSpec(selecoes).com_busca(termos_busca_texto)
+df_filtrado = carregar_visao(ano_selecionado, "df_final", filtro_principal)
 
-# Filtros avançados (expansível)
+# Filtros avançados (expansível): entram no mesmo spec dos filtros principais
+filtro = filtro_principal
 with st.sidebar.expander("🔍 Filtros Avançados"):
     filtros_avancados = [
         ("Usuário", "Usuário", "multiselect"),
@@ -462,202 +277,57 @@ with st.sidebar.expander("🔍 Filtros Avançados"):
 
     for col_name, label, widget_type in filtros_avancados:
         if col_name in df_filtrado.columns:
-            opcoes = get_filter_options(df_filtrado, col_name)
-            # Limitar opções para melhor performance
-            if len(opcoes) > 101:  # 100 + "Todos"
-                opcoes = opcoes[:101]
-                st.caption(
-                    f"⚠️ {label}: Limitado a 100 opções para performance"
-                )
+            opcoes = opcoes_visao(ano_selecionado, "df_final", filtro, col_name)
+            # Muitos valores (Material, Texto breve, ...): caixa de busca em vez da lista completa
+            opcoes = opcoes_com_busca(
+                ano_selecionado, "df_final", col_name, label, opcoes, f"filtro_avancado_{col_name}"
+            )
 
             if widget_type == "multiselect":
                 selecionadas = st.multiselect(
-                    f"Selecione o {label}:", opcoes, default=["Todos"]
+                    f"Selecione o {label}:", opcoes,
+                    default=padrao_url(f"filtro_avancado_{col_name}", opcoes, ["Todos"]),
+                    key=f"filtro_avancado_{col_name}"
                 )
-                if selecionadas and "Todos" not in selecionadas:
-                    df_filtrado = df_filtrado[
-                        df_filtrado[col_name].astype(str).isin(selecionadas)
-                    ].copy()
+                filtro = filtro.com(col_name, selecionadas)
+
+# Todas as seleções numa única máscara: a tabela é recortada uma vez só
+if filtro != filtro_principal:
+    df_filtrado = carregar_visao(ano_selecionado, "df_final", filtro)
 
 # Preparar dados para visualização
 if tipo_visualizacao == "CPU (Custo por Unidade)":
-    # Carregar dados de volume
-    df_vol_calc = load_volume_data(ano_selecionado)
-
-    if df_vol_calc is not None and 'Volume' in df_vol_calc.columns:
-        # Agrupar df_filtrado por Oficina e Período para calcular Total
-        if ('Oficina' in df_filtrado.columns and
-                'Período' in df_filtrado.columns):
-            # Agrupar Total por Oficina e Período
-            if 'Total' in df_filtrado.columns:
-                df_total_agrupado = df_filtrado.groupby(
-                    ['Oficina', 'Período'], as_index=False
-                )['Total'].sum()
-            elif 'Valor' in df_filtrado.columns:
-                df_total_agrupado = df_filtrado.groupby(
-                    ['Oficina', 'Período'], as_index=False
-                )['Valor'].sum()
-                df_total_agrupado.rename(
-                    columns={'Valor': 'Total'}, inplace=True
-                )
-            else:
-                st.warning(
-                    "⚠️ Colunas 'Total' ou 'Valor' necessárias para "
-                    "calcular CPU"
-                )
-                df_visualizacao = df_filtrado.copy()
-                coluna_visualizacao = (
-                    'Total' if 'Total' in df_filtrado.columns else 'Valor'
-                )
-                tipo_visualizacao = "Custo Total"
-                df_vol_calc = None
-
-            if df_vol_calc is not None:
-                # Verificar se df_filtrado tem Veículo e Ano
-                tem_veiculo = 'Veículo' in df_filtrado.columns
-                tem_ano = 'Ano' in df_filtrado.columns
-                
-                # IMPORTANTE: Filtrar df_vol_calc pelos mesmos filtros aplicados em df_filtrado
-                # Isso garante que quando filtra por um veículo, o volume também seja filtrado
-                df_vol_calc_filtrado = df_vol_calc.copy()
-                
-                # Aplicar filtros de Veículo se existir
-                if tem_veiculo and 'Veículo' in df_vol_calc_filtrado.columns:
-                    # Obter veículos únicos de df_filtrado (já filtrado pela sidebar)
-                    veiculos_filtrados = df_filtrado['Veículo'].dropna().unique()
-                    if len(veiculos_filtrados) > 0:
-                        df_vol_calc_filtrado = df_vol_calc_filtrado[
-                            df_vol_calc_filtrado['Veículo'].isin(veiculos_filtrados)
-                        ].copy()
-                
-                # Aplicar filtros de Oficina se existir
-                if 'Oficina' in df_filtrado.columns and 'Oficina' in df_vol_calc_filtrado.columns:
-                    oficinas_filtradas = df_filtrado['Oficina'].dropna().unique()
-                    if len(oficinas_filtradas) > 0:
-                        df_vol_calc_filtrado = df_vol_calc_filtrado[
-                            df_vol_calc_filtrado['Oficina'].isin(oficinas_filtradas)
-                        ].copy()
-                
-                # Usar df_vol_calc_filtrado em vez de df_vol_calc
-                df_vol_calc = df_vol_calc_filtrado
-
-                # 🔧 CORREÇÃO: Incluir 'Ano' no groupby se existir
-                colunas_agrupamento = ['Oficina', 'Período']
-                if tem_ano:
-                    colunas_agrupamento.append('Ano')
-                if tem_veiculo:
-                    colunas_agrupamento.append('Veículo')
-
-                # Agrupar Volume por Oficina, Período, Ano (se existir) e Veículo (se existir)
-                if tem_veiculo and 'Veículo' in df_vol_calc.columns:
-                    # Agrupar Total incluindo Veículo e Ano
-                    if 'Total' in df_filtrado.columns:
-                        df_total_agrupado = df_filtrado.groupby(
-                            colunas_agrupamento,
-                            as_index=False
-                        )['Total'].sum()
-                    else:
-                        df_total_agrupado = df_filtrado.groupby(
-                            colunas_agrupamento,
-                            as_index=False
-                        )['Valor'].sum()
-                        df_total_agrupado.rename(
-                            columns={'Valor': 'Total'}, inplace=True
-                        )
+    # Cubo de CPU: Total da visão e Volume somados por Ano, Período, Oficina e
+    # Veículo (memoizado por versão e filtros); o CPU de cada grupo sai das somas
+    coluna_custo = 'Total' if 'Total' in df_filtrado.columns else 'Valor'
+    cubo_cpu = carregar_cubo_cpu(ano_selecionado, "df_final", filtro, coluna_custo)
 
-                    # Agrupar Volume incluindo Veículo e Ano
-                    colunas_agrupamento_vol = ['Oficina', 'Período']
-                    if tem_ano and 'Ano' in df_vol_calc.columns:
-                        colunas_agrupamento_vol.append('Ano')
-                    if 'Veículo' in df_vol_calc.columns:
-                        colunas_agrupamento_vol.append('Veículo')
-                    
-                    df_vol_agrupado = df_vol_calc.groupby(
-                        colunas_agrupamento_vol, as_index=False
-                    )['Volume'].sum()
-
-                    # Fazer merge incluindo Veículo e Ano
-                    df_cpu = pd.merge(
-                        df_total_agrupado,
-                        df_vol_agrupado,
-                        on=colunas_agrupamento,
-                        how='left'
-                    )
-                else:
-                    # Agrupar Total por Oficina, Período e Ano (se existir)
-                    if 'Total' in df_filtrado.columns:
-                        df_total_agrupado = df_filtrado.groupby(
-                            colunas_agrupamento,
-                            as_index=False
-                        )['Total'].sum()
-                    else:
-                        df_total_agrupado = df_filtrado.groupby(
-                            colunas_agrupamento,
-                            as_index=False
-                        )['Valor'].sum()
-                        df_total_agrupado.rename(
-                            columns={'Valor': 'Total'}, inplace=True
-                        )
-                    
-                    # Agrupar Volume por Oficina, Período e Ano (se existir)
-                    colunas_agrupamento_vol = ['Oficina', 'Período']
-                    if tem_ano and 'Ano' in df_vol_calc.columns:
-                        colunas_agrupamento_vol.append('Ano')
-                    
-                    df_vol_agrupado = df_vol_calc.groupby(
-                        colunas_agrupamento_vol, as_index=False
-                    )['Volume'].sum()
-
-                    # Fazer merge
-                    df_cpu = pd.merge(
-                        df_total_agrupado,
-                        df_vol_agrupado,
-                        on=colunas_agrupamento,
-                        how='left'
-                    )
-
-                    # Se df_filtrado tem Veículo mas df_vol não, expandir
-                    if tem_veiculo:
-                        # Fazer merge com df_filtrado para obter Veículo e Ano
-                        colunas_merge_veiculo = ['Oficina', 'Período', 'Veículo']
-                        if tem_ano:
-                            colunas_merge_veiculo.append('Ano')
-                        
-                        df_filtrado_veiculo = (
-                            df_filtrado[colunas_merge_veiculo]
-                            .drop_duplicates()
-                        )
-                        df_cpu_expandido = pd.merge(
-                            df_filtrado_veiculo,
-                            df_cpu,
-                            on=colunas_agrupamento,
-                            how='right'
-                        )
-                        # Usar o mesmo Volume para todos os veículos
-                        df_cpu = df_cpu_expandido.copy()
-
-                # Calcular CPU (evitando divisão por zero)
-                df_cpu['CPU'] = df_cpu.apply(
-                    lambda row: (
-                        row['Total'] / row['Volume']
-                        if pd.notnull(row['Volume']) and row['Volume'] != 0
-                        else 0
-                    ),
-                    axis=1
-                )
-
-                # Criar DataFrame para visualização com CPU
-                df_visualizacao = df_cpu.copy()
-                coluna_visualizacao = 'CPU'
+    if coluna_custo not in df_filtrado.columns:
+        st.warning(
+            "⚠️ Colunas 'Total' ou 'Valor' necessárias para "
+            "calcular CPU"
+        )
+        df_visualizacao = df_filtrado.copy()
+        coluna_visualizacao = coluna_custo
+        tipo_visualizacao = "Custo Total"
+    elif cubo_cpu is not None:
+        if ('Oficina' in cubo_cpu.columns and
+                'Período' in cubo_cpu.columns):
+            # Mesmo grão da tabela e dos gráficos: Oficina, Período, Ano e Veículo (se existirem)
+            colunas_agrupamento = [g for g in ['Oficina', 'Período', 'Ano', 'Veículo'] if g in cubo_cpu.columns]
+            df_cpu = cpu_por(cubo_cpu, colunas_agrupamento, coluna_custo)
+            df_cpu = df_cpu.rename(columns={coluna_custo: 'Total'})
+
+            # Criar DataFrame para visualização com CPU
+            df_visualizacao = df_cpu.copy()
+            coluna_visualizacao = 'CPU'
         else:
             st.warning(
                 "⚠️ Colunas 'Oficina' e 'Período' necessárias para "
                 "calcular CPU"
             )
             df_visualizacao = df_filtrado.copy()
-            coluna_visualizacao = (
-                'Total' if 'Total' in df_filtrado.columns else 'Valor'
-            )
+            coluna_visualizacao = coluna_custo
             tipo_visualizacao = "Custo Total"
     else:
         st.warning(
@@ -665,86 +335,20 @@ if tipo_visualizacao == "CPU (Custo por Unidade)":
             "Mostrando Custo Total."
         )
         df_visualizacao = df_filtrado.copy()
-        coluna_visualizacao = (
-            'Total' if 'Total' in df_filtrado.columns else 'Valor'
-        )
+        coluna_visualizacao = coluna_custo
         tipo_visualizacao = "Custo Total"
 else:
     # Usar Total ou Valor diretamente
-    # IMPORTANTE: Adicionar Volume ao df_visualizacao para que o gráfico funcione igual ao modo CPU
-    if 'Total' in df_filtrado.columns:
-        df_visualizacao = df_filtrado.copy()
-        coluna_visualizacao = 'Total'
-    elif 'Valor' in df_filtrado.columns:
-        df_visualizacao = df_filtrado.copy()
-        coluna_visualizacao = 'Valor'
-    else:
-        df_visualizacao = df_filtrado.copy()
-        coluna_visualizacao = 'Total'
-    
-    # Adicionar Volume ao df_visualizacao usando a mesma lógica do modo CPU
-    # PROBLEMA IDENTIFICADO: df_visualizacao = df_filtrado.copy() pode ter múltiplas linhas
-    # para a mesma combinação de Oficina+Período+Veículo, causando duplicação no merge
-    # SOLUÇÃO: Agrupar df_visualizacao ANTES do merge, igual ao modo CPU faz com df_total_agrupado
+    coluna_visualizacao = 'Valor' if 'Total' not in df_filtrado.columns and 'Valor' in df_filtrado.columns else 'Total'
+    df_visualizacao = df_filtrado.copy()
+
+    # Volume junto do custo (para os gráficos funcionarem igual ao modo CPU): o
+    # cubo de CPU já traz custo e Volume somados por Oficina, Período, Ano e Veículo
     if 'Veículo' in df_visualizacao.columns and 'Oficina' in df_visualizacao.columns and 'Período' in df_visualizacao.columns:
-        df_vol_calc = load_volume_data(ano_selecionado)
-        if df_vol_calc is not None and 'Volume' in df_vol_calc.columns:
-            tem_veiculo = 'Veículo' in df_visualizacao.columns
-            tem_ano = 'Ano' in df_visualizacao.columns
-            
-            # Filtrar df_vol_calc pelos mesmos filtros (mesma lógica do modo CPU)
-            df_vol_calc_filtrado = df_vol_calc.copy()
-            
-            if tem_veiculo and 'Veículo' in df_vol_calc_filtrado.columns:
-                veiculos_filtrados = df_visualizacao['Veículo'].dropna().unique()
-                if len(veiculos_filtrados) > 0:
-                    df_vol_calc_filtrado = df_vol_calc_filtrado[
-                        df_vol_calc_filtrado['Veículo'].isin(veiculos_filtrados)
-                    ].copy()
-            
-            if 'Oficina' in df_visualizacao.columns and 'Oficina' in df_vol_calc_filtrado.columns:
-                oficinas_filtradas = df_visualizacao['Oficina'].dropna().unique()
-                if len(oficinas_filtradas) > 0:
-                    df_vol_calc_filtrado = df_vol_calc_filtrado[
-                        df_vol_calc_filtrado['Oficina'].isin(oficinas_filtradas)
-                    ].copy()
-            
-            df_vol_calc = df_vol_calc_filtrado
-            
-            # Agrupar Volume exatamente como no modo CPU
-            if tem_veiculo and 'Veículo' in df_vol_calc.columns:
-                colunas_agrupamento_vol = ['Oficina', 'Período']
-                if tem_ano and 'Ano' in df_vol_calc.columns:
-                    colunas_agrupamento_vol.append('Ano')
-                if 'Veículo' in df_vol_calc.columns:
-                    colunas_agrupamento_vol.append('Veículo')
-                
-                df_vol_agrupado = df_vol_calc.groupby(
-                    colunas_agrupamento_vol, as_index=False
-                )['Volume'].sum()
-                
-                # IMPORTANTE: Usar EXATAMENTE as mesmas colunas de agrupamento para o merge
-                # Garantir que colunas_agrupamento seja idêntica a colunas_agrupamento_vol
-                colunas_agrupamento = colunas_agrupamento_vol.copy()
-                
-                # Agrupar df_visualizacao mantendo apenas as colunas necessárias
-                if coluna_visualizacao in df_visualizacao.columns:
-                    # Se tiver coluna de visualização, somar ela também
-                    df_visualizacao_agrupado = df_visualizacao.groupby(
-                        colunas_agrupamento, as_index=False
-                    )[coluna_visualizacao].sum()
-                else:
-                    # Se não tiver, apenas agrupar para ter estrutura única
-                    df_visualizacao_agrupado = df_visualizacao[colunas_agrupamento].drop_duplicates()
-                
-                # Fazer merge com df_vol_agrupado usando as MESMAS colunas
-                # Isso garante que não há duplicação
-                df_visualizacao = pd.merge(
-                    df_visualizacao_agrupado,
-                    df_vol_agrupado[colunas_agrupamento_vol + ['Volume']],
-                    on=colunas_agrupamento_vol,
-                    how='left'
-                )
+        cubo_cpu = carregar_cubo_cpu(ano_selecionado, "df_final", filtro, coluna_visualizacao)
+        if cubo_cpu is not None and 'Veículo' in cubo_cpu.columns:
+            colunas_agrupamento = [g for g in ['Oficina', 'Período', 'Ano', 'Veículo'] if g in cubo_cpu.columns]
+            df_visualizacao = cpu_por(cubo_cpu, colunas_agrupamento, coluna_visualizacao).drop(columns=['CPU'])
 
 # Resumo na sidebar
 st.sidebar.markdown("---")
@@ -753,10 +357,10 @@ st.sidebar.write(f"**Linhas:** {df_filtrado.shape[0]:,}")
 
 # Calcular totais se as colunas existirem
 if 'Valor' in df_filtrado.columns:
-    valor_total = df_filtrado['Valor'].sum()
+    valor_total = somar(df_filtrado['Valor'])
     st.sidebar.write(f"**Total Valor:** R$ {valor_total:,.2f}")
 if 'Total' in df_filtrado.columns:
-    total_sum = df_filtrado['Total'].sum()
+    total_sum = somar(df_filtrado['Total'])
     st.sidebar.write(f"**Total:** R$ {total_sum:,.2f}")
 if 'Volume' in df_filtrado.columns:
     volume_total = df_filtrado['Volume'].sum()
@@ -773,240 +377,6 @@ if 'CPU' in df_filtrado.columns:
 st.sidebar.info(f"📈 **Visualizando:** {tipo_visualizacao}")
 
 
-def ordenar_por_mes(df, coluna_periodo='Período'):
-    """Ordena DataFrame por ordem cronológica dos meses, considerando ano se disponível"""
-    df_copy = df.copy()
-    
-    # Se houver coluna "Ano", sempre ordenar por ano e mês (mesmo que haja apenas um ano)
-    # Isso garante que quando "Todos" está selecionado, todos os períodos sejam mostrados ordenados
-    if 'Ano' in df_copy.columns:
-        # Criar coluna de ordenação: ano primeiro, depois mês
-        df_copy['_ordem_ano'] = df_copy['Ano']
-        df_copy['_ordem_mes'] = df_copy[coluna_periodo].str.lower().map(
-            {mes: idx for idx, mes in enumerate(ORDEM_MESES)}
-        ).fillna(999)
-        df_copy = df_copy.sort_values(['_ordem_ano', '_ordem_mes'])
-        df_copy = df_copy.drop(columns=['_ordem_ano', '_ordem_mes'])
-    else:
-        # Ordenação simples por mês (comportamento original quando não há coluna Ano)
-        df_copy['_ordem_mes'] = df_copy[coluna_periodo].str.lower().map(
-            {mes: idx for idx, mes in enumerate(ORDEM_MESES)}
-        ).fillna(999)
-        df_copy = df_copy.sort_values('_ordem_mes')
-        df_copy = df_copy.drop(columns=['_ordem_mes'])
-    
-    return df_copy
-
-
-# Gráfico 1: Soma do Valor por Período
-@st.cache_data(ttl=900, max_entries=2)
-def create_period_chart(df_data, coluna, tipo_viz):
-    """Cria gráfico de barras por Período"""
-    try:
-        if coluna not in df_data.columns or 'Período' not in df_data.columns:
-            st.warning(f"⚠️ Colunas necessárias não encontradas. Coluna: {coluna}, Período: {'Período' in df_data.columns}")
-            return None
-
-        # Debug: verificar dados recebidos
-        st.sidebar.write(f"🔍 Debug create_period_chart:")
-        st.sidebar.write(f"   - Total de registros recebidos: {len(df_data):,}")
-        st.sidebar.write(f"   - Coluna a ser usada: {coluna}")
-        st.sidebar.write(f"   - Tipo de visualização: {tipo_viz}")
-        
-        if coluna in df_data.columns:
-            # Verificar se a coluna tem valores
-            if pd.api.types.is_numeric_dtype(df_data[coluna]):
-                soma_coluna = df_data[coluna].sum()
-                st.sidebar.write(f"   - Soma da coluna {coluna}: {soma_coluna:,.2f}")
-            else:
-                st.sidebar.write(f"   - Coluna {coluna} não é numérica")
-
-        # Verificar se há coluna Ano - sempre mostrar ano junto com período quando existir
-        tem_ano = 'Ano' in df_data.columns
-        
-        if tem_ano:
-            # Agrupar por Ano e Período (sempre que houver coluna Ano)
-            # Para CPU, usar EXATAMENTE a mesma lógica da tabela (que está correta)
-            if tipo_viz == "CPU (Custo por Unidade)" and 'Total' in df_data.columns and 'Volume' in df_data.columns:
-                # MESMA LÓGICA DA TABELA: Agrupar por Ano e Período, somar Total e Volume, calcular CPU
-                chart_data = df_data.groupby(['Ano', 'Período']).agg({
-                    'Total': 'sum',
-                    'Volume': 'sum'
-                }).reset_index()
-                # Recalcular CPU (mesma lógica da tabela)
-                chart_data[coluna] = chart_data.apply(
-                    lambda row: (
-                        row['Total'] / row['Volume']
-                        if pd.notnull(row['Volume']) and row['Volume'] != 0
-                        else 0
-                    ),
-                    axis=1
-                )
-            else:
-                chart_data = df_data.groupby(['Ano', 'Período'])[coluna].sum().reset_index()
-            
-            # Debug: verificar dados agrupados
-            st.sidebar.write(f"   - Registros após agrupamento: {len(chart_data):,}")
-            if coluna in chart_data.columns and pd.api.types.is_numeric_dtype(chart_data[coluna]):
-                soma_agrupada = chart_data[coluna].sum()
-                st.sidebar.write(f"   - Soma após agrupamento: {soma_agrupada:,.2f}")
-            
-            # Criar coluna combinada para o rótulo do gráfico
-            chart_data['Período_Completo'] = chart_data['Período'].astype(str) + ' ' + chart_data['Ano'].astype(str)
-            
-            # Ordenar por ano e mês
-            chart_data = ordenar_por_mes(chart_data, 'Período')
-            ordem_periodos = chart_data['Período_Completo'].tolist()
-            
-            # Usar Período_Completo no gráfico
-            coluna_periodo_grafico = 'Período_Completo'
-        else:
-            # Comportamento original: agrupar apenas por Período (quando não há coluna Ano)
-            # Para CPU, usar EXATAMENTE a mesma lógica da tabela (que está correta)
-            if tipo_viz == "CPU (Custo por Unidade)" and 'Total' in df_data.columns and 'Volume' in df_data.columns:
-                # MESMA LÓGICA DA TABELA: Agrupar por Período, somar Total e Volume, calcular CPU
-                chart_data = df_data.groupby('Período').agg({
-                    'Total': 'sum',
-                    'Volume': 'sum'
-                }).reset_index()
-                # Recalcular CPU (mesma lógica da tabela)
-                chart_data[coluna] = chart_data.apply(
-                    lambda row: (
-                        row['Total'] / row['Volume']
-                        if pd.notnull(row['Volume']) and row['Volume'] != 0
-                        else 0
-                    ),
-                    axis=1
-                )
-            else:
-                chart_data = df_data.groupby('Período')[coluna].sum().reset_index()
-            chart_data = ordenar_por_mes(chart_data, 'Período')
-            ordem_periodos = chart_data['Período'].tolist()
-            coluna_periodo_grafico = 'Período'
-
-        # Definir título do eixo Y baseado no tipo
-        if tipo_viz == "CPU (Custo por Unidade)":
-            titulo_y = "CPU (R$/Unidade)"
-            titulo_grafico = "CPU por Período"
-        else:
-            titulo_y = "Soma do Valor (R$)"
-            titulo_grafico = "Soma do Valor por Período"
-
-        grafico_barras = alt.Chart(chart_data).mark_bar().encode(
-            x=alt.X(
-                f'{coluna_periodo_grafico}:N',
-                title='Período',
-                sort=ordem_periodos
-            ),
-            y=alt.Y(f'{coluna}:Q', title=titulo_y),
-            color=alt.Color(
-                f'{coluna}:Q',
-                title=coluna,
-                scale=alt.Scale(scheme='blues')
-            ),
-            tooltip=[
-                alt.Tooltip(f'{coluna_periodo_grafico}:N', title='Período'),
-                alt.Tooltip(
-                    f'{coluna}:Q',
-                    title=coluna,
-                    format=',.4f' if tipo_viz == "CPU (Custo por Unidade)"
-                    else ',.2f'
-                )
-            ]
-        ).properties(
-            title=titulo_grafico,
-            height=400
-        )
-
-        # Adicionar rótulos com valores nas barras
-        formato_rotulo = (
-            ',.4f' if tipo_viz == "CPU (Custo por Unidade)" else ',.2f'
-        )
-        rotulos = grafico_barras.mark_text(
-            align='center',
-            baseline='middle',
-            dy=-10,
-            color='black',
-            fontSize=12
-        ).encode(
-            text=alt.Text(f'{coluna}:Q', format=formato_rotulo)
-        )
-
-        return grafico_barras + rotulos
-    except Exception as e:
-        st.error(f"Erro ao criar gráfico: {e}")
-        return None
-
-
-# Gráfico 2: Volume por Período
-@st.cache_data(ttl=900, max_entries=2)
-def create_volume_chart(df_data):
-    """Cria gráfico de barras de Volume por Período"""
-    try:
-        if 'Volume' not in df_data.columns or 'Período' not in df_data.columns:
-            return None
-
-        # Verificar se há coluna Ano - sempre mostrar ano junto com período quando existir
-        tem_ano = 'Ano' in df_data.columns
-        
-        if tem_ano:
-            # Agrupar por Ano e Período (sempre que houver coluna Ano)
-            chart_data = df_data.groupby(['Ano', 'Período'])['Volume'].sum().reset_index()
-            
-            # Criar coluna combinada para o rótulo do gráfico
-            chart_data['Período_Completo'] = chart_data['Período'].astype(str) + ' ' + chart_data['Ano'].astype(str)
-            
-            # Ordenar por ano e mês
-            chart_data = ordenar_por_mes(chart_data, 'Período')
-            ordem_periodos = chart_data['Período_Completo'].tolist()
-            
-            # Usar Período_Completo no gráfico
-            coluna_periodo_grafico = 'Período_Completo'
-        else:
-            # Comportamento original: agrupar apenas por Período (quando não há coluna Ano)
-            chart_data = df_data.groupby('Período')['Volume'].sum().reset_index()
-            chart_data = ordenar_por_mes(chart_data, 'Período')
-            ordem_periodos = chart_data['Período'].tolist()
-            coluna_periodo_grafico = 'Período'
-
-        grafico_barras = alt.Chart(chart_data).mark_bar().encode(
-            x=alt.X(
-                f'{coluna_periodo_grafico}:N',
-                title='Período',
-                sort=ordem_periodos
-            ),
-            y=alt.Y('Volume:Q', title='Volume Total'),
-            color=alt.Color(
-                'Volume:Q',
-                title='Volume',
-                scale=alt.Scale(scheme='blues')
-            ),
-            tooltip=[
-                alt.Tooltip(f'{coluna_periodo_grafico}:N', title='Período'),
-                alt.Tooltip('Volume:Q', title='Volume', format=',.2f')
-            ]
-        ).properties(
-            title='Volume Total por Período',
-            height=400
-        )
-
-        # Adicionar rótulos
-        rotulos = grafico_barras.mark_text(
-            align='center',
-            baseline='middle',
-            dy=-10,
-            color='black',
-            fontSize=12
-        ).encode(
-            text=alt.Text('Volume:Q', format=',.2f')
-        )
-
-        return grafico_barras + rotulos
-    except Exception as e:
-        st.error(f"Erro ao criar gráfico: {e}")
-        return None
-
-
 # Exibir gráfico por Período
 if (coluna_visualizacao in df_visualizacao.columns and
         'Período' in df_visualizacao.columns):
@@ -1019,91 +389,33 @@ if (coluna_visualizacao in df_visualizacao.columns and
     # (dados ANTES do filtro de período) para mostrar TODOS os períodos no gráfico
     # Aplicar a mesma lógica de preparação de dados, mas usando df_para_grafico_periodo
     if tipo_visualizacao == "CPU (Custo por Unidade)":
-        df_vol_calc_grafico = load_volume_data(ano_selecionado)
-        if df_vol_calc_grafico is not None and 'Volume' in df_vol_calc_grafico.columns:
-            if ('Oficina' in df_para_grafico_periodo.columns and
-                    'Período' in df_para_grafico_periodo.columns):
-                tem_veiculo = 'Veículo' in df_para_grafico_periodo.columns
-                tem_ano = 'Ano' in df_para_grafico_periodo.columns
-                
-                # Aplicar mesmos filtros de Veículo e Oficina ao volume
-                df_vol_calc_filtrado_grafico = df_vol_calc_grafico.copy()
-                if tem_veiculo and 'Veículo' in df_vol_calc_filtrado_grafico.columns:
-                    veiculos_filtrados = df_para_grafico_periodo['Veículo'].dropna().unique()
-                    if len(veiculos_filtrados) > 0:
-                        df_vol_calc_filtrado_grafico = df_vol_calc_filtrado_grafico[
-                            df_vol_calc_filtrado_grafico['Veículo'].isin(veiculos_filtrados)
-                        ].copy()
-                if 'Oficina' in df_para_grafico_periodo.columns and 'Oficina' in df_vol_calc_filtrado_grafico.columns:
-                    oficinas_filtradas = df_para_grafico_periodo['Oficina'].dropna().unique()
-                    if len(oficinas_filtradas) > 0:
-                        df_vol_calc_filtrado_grafico = df_vol_calc_filtrado_grafico[
-                            df_vol_calc_filtrado_grafico['Oficina'].isin(oficinas_filtradas)
-                        ].copy()
-                
-                colunas_agrupamento_grafico = ['Oficina', 'Período']
-                if tem_ano:
-                    colunas_agrupamento_grafico.append('Ano')
-                if tem_veiculo:
-                    colunas_agrupamento_grafico.append('Veículo')
-                
-                if 'Total' in df_para_grafico_periodo.columns:
-                    df_total_agrupado_grafico = df_para_grafico_periodo.groupby(
-                        colunas_agrupamento_grafico, as_index=False
-                    )['Total'].sum()
-                else:
-                    df_total_agrupado_grafico = df_para_grafico_periodo.groupby(
-                        colunas_agrupamento_grafico, as_index=False
-                    )['Valor'].sum()
-                    df_total_agrupado_grafico.rename(columns={'Valor': 'Total'}, inplace=True)
-                
-                colunas_agrupamento_vol_grafico = ['Oficina', 'Período']
-                if tem_ano:
-                    colunas_agrupamento_vol_grafico.append('Ano')
-                if tem_veiculo:
-                    colunas_agrupamento_vol_grafico.append('Veículo')
-                
-                df_vol_agrupado_grafico = df_vol_calc_filtrado_grafico.groupby(
-                    colunas_agrupamento_vol_grafico, as_index=False
-                )['Volume'].sum()
+        coluna_custo_grafico = 'Total' if 'Total' in df_para_grafico_periodo.columns else 'Valor'
+        cubo_cpu_grafico = carregar_cubo_cpu(ano_selecionado, "df_final", filtro_grafico_periodo, coluna_custo_grafico)
+        if cubo_cpu_grafico is not None:
+            if ('Oficina' in cubo_cpu_grafico.columns and
+                    'Período' in cubo_cpu_grafico.columns):
+                colunas_agrupamento_grafico = [
+                    g for g in ['Oficina', 'Período', 'Ano', 'Veículo'] if g in cubo_cpu_grafico.columns
+                ]
                 
-                # Fazer merge preservando todos os períodos de todos os anos
-                # Usar 'outer' quando "Todos" está selecionado para garantir que todos os períodos sejam mostrados
-                if ano_selecionado == "Todos" and tem_ano:
-                    df_cpu_grafico = pd.merge(
-                        df_total_agrupado_grafico,
-                        df_vol_agrupado_grafico,
-                        on=colunas_agrupamento_grafico,
-                        how='outer'
-                    )
-                    # Preencher valores faltantes com 0 após merge outer
-                    df_cpu_grafico['Total'] = df_cpu_grafico['Total'].fillna(0)
-                    df_cpu_grafico['Volume'] = df_cpu_grafico['Volume'].fillna(0)
+                # Com "Todos" os anos, manter todos os períodos com volume (mesmo sem custo)
+                # das Oficinas e Veículos da visão; nos demais casos, só os meses da visão
+                if ano_selecionado == "Todos" and 'Ano' in cubo_cpu_grafico.columns:
+                    dimensoes_visao = ('Oficina', 'Veículo')
                 else:
-                    df_cpu_grafico = pd.merge(
-                        df_total_agrupado_grafico,
-                        df_vol_agrupado_grafico,
-                        on=colunas_agrupamento_grafico,
-                        how='left'
-                    )
-                
-                df_cpu_grafico['CPU'] = df_cpu_grafico.apply(
-                    lambda row: (
-                        row['Total'] / row['Volume']
-                        if pd.notnull(row['Volume']) and row['Volume'] != 0
-                        else 0
-                    ),
-                    axis=1
-                )
+                    dimensoes_visao = GRAO_CPU
+                df_cpu_grafico = cpu_por(
+                    cubo_cpu_grafico, colunas_agrupamento_grafico, coluna_custo_grafico, dimensoes_visao
+                ).rename(columns={coluna_custo_grafico: 'Total'})
                 
                 df_visualizacao_para_grafico = df_cpu_grafico.copy()
                 coluna_visualizacao_grafico = 'CPU'
             else:
                 df_visualizacao_para_grafico = df_para_grafico_periodo.copy()
-                coluna_visualizacao_grafico = 'Total' if 'Total' in df_para_grafico_periodo.columns else 'Valor'
+                coluna_visualizacao_grafico = coluna_custo_grafico
         else:
             df_visualizacao_para_grafico = df_para_grafico_periodo.copy()
-            coluna_visualizacao_grafico = 'Total' if 'Total' in df_para_grafico_periodo.columns else 'Valor'
+            coluna_visualizacao_grafico = coluna_custo_grafico
     else:
         df_visualizacao_para_grafico = df_para_grafico_periodo.copy()
         coluna_visualizacao_grafico = 'Total' if 'Total' in df_para_grafico_periodo.columns else 'Valor'
@@ -1121,11 +433,13 @@ if (coluna_visualizacao in df_visualizacao.columns and
     # Filtro de Oficina
     with col1:
         if 'Oficina' in df_grafico_periodo.columns:
-            oficina_opcoes_grafico = get_filter_options(df_grafico_periodo, 'Oficina')
+            # Opções das facetas do spec do gráfico (memoizadas pela chave, sem hashear a tabela)
+            facetas_grafico = carregar_facetas(ano_selecionado, "df_final", filtro_grafico_periodo)
+            oficina_opcoes_grafico = opcoes_faceta(facetas_grafico, 'Oficina')
             oficina_selecionadas_grafico = st.multiselect(
                 "🏭 Filtrar por Oficina:",
                 oficina_opcoes_grafico,
-                default=["Todos"],
+                default=padrao_url("filtro_oficina_grafico_periodo", oficina_opcoes_grafico, ["Todos"]),
                 key="filtro_oficina_grafico_periodo"
             )
             if oficina_selecionadas_grafico and "Todos" not in oficina_selecionadas_grafico:
@@ -1136,11 +450,14 @@ if (coluna_visualizacao in df_visualizacao.columns and
     # Filtro de Veículo
     with col2:
         if 'Veículo' in df_grafico_periodo.columns:
-            veiculo_opcoes_grafico = get_filter_options(df_grafico_periodo, 'Veículo')
+            facetas_grafico = carregar_facetas(
+                ano_selecionado, "df_final", filtro_grafico_periodo.com('Oficina', oficina_selecionadas_grafico)
+            )
+            veiculo_opcoes_grafico = opcoes_faceta(facetas_grafico, 'Veículo')
             veiculo_selecionados_grafico = st.multiselect(
                 "🚗 Filtrar por Veículo:",
                 veiculo_opcoes_grafico,
-                default=["Todos"],
+                default=padrao_url("filtro_veiculo_grafico_periodo", veiculo_opcoes_grafico, ["Todos"]),
                 key="filtro_veiculo_grafico_periodo"
             )
             if veiculo_selecionados_grafico and "Todos" not in veiculo_selecionados_grafico:
@@ -1148,13 +465,30 @@ if (coluna_visualizacao in df_visualizacao.columns and
                     df_grafico_periodo['Veículo'].astype(str).isin(veiculo_selecionados_grafico)
                 ].copy()
     
-    # IMPORTANTE: Quando "Todos" está selecionado, garantir que todos os períodos de todos os anos sejam mostrados
-    # O create_period_chart já faz o agrupamento correto por Ano e Período quando há coluna Ano
-    
-    # Criar gráfico com dados filtrados (usar coluna_visualizacao_grafico que foi criada acima)
-    # O create_period_chart já faz o agrupamento correto por Ano e Período quando há coluna Ano
-    grafico_periodo = create_period_chart(
-        df_grafico_periodo, coluna_visualizacao_grafico, tipo_visualizacao
+    # Cubo do gráfico por período: todos os períodos, com os filtros do gráfico aplicados
+    if tipo_visualizacao == "CPU (Custo por Unidade)":
+        medidas_periodo = [coluna_visualizacao_grafico, 'Total', 'Volume']
+        titulo_periodo, titulo_y_periodo, formato_periodo = "CPU por Período", "CPU (R$/Unidade)", ',.4f'
+    else:
+        medidas_periodo = [coluna_visualizacao_grafico]
+        titulo_periodo, titulo_y_periodo, formato_periodo = "Soma do Valor por Período", "Soma do Valor (R$)", ',.2f'
+    cubo_periodo = montar_cubo(df_grafico_periodo, [], medidas_periodo)
+
+    # Debug: dados do gráfico por período
+    st.sidebar.write("🔍 Debug gráfico por período:")
+    st.sidebar.write(f"   - Total de registros recebidos: {len(df_grafico_periodo):,}")
+    st.sidebar.write(f"   - Coluna a ser usada: {coluna_visualizacao_grafico}")
+    st.sidebar.write(f"   - Tipo de visualização: {tipo_visualizacao}")
+    if coluna_visualizacao_grafico in cubo_periodo.columns:
+        st.sidebar.write(f"   - Soma da coluna {coluna_visualizacao_grafico}: "
+                         f"{cubo_periodo[coluna_visualizacao_grafico].sum():,.2f}")
+    st.sidebar.write(f"   - Registros no cubo: {len(cubo_periodo):,}")
+
+    # Período sempre como "mês ano" quando houver coluna Ano
+    grafico_periodo = criar_grafico(
+        cubo_periodo, coluna_visualizacao_grafico, titulo_periodo, titulo_y_periodo,
+        grao=GRAO_ANO_MES, ponderado=tipo_visualizacao == "CPU (Custo por Unidade)",
+        formato=formato_periodo
     )
     if grafico_periodo:
         st.altair_chart(grafico_periodo, use_container_width=True)
@@ -1163,51 +497,26 @@ if (coluna_visualizacao in df_visualizacao.columns and
     st.subheader("📊 Volume Total por Período")
     
     # IMPORTANTE: Usar a mesma lógica de filtragem em ambos os modos
-    # para garantir que os volumes sejam consistentes
-    df_vol = load_volume_data(ano_selecionado)
+    # para garantir que os volumes sejam consistentes: df_vol já vem restrito
+    # às dimensões da visão da sidebar (Ano, Oficina, Veículo), sem filtrar
+    # por Período (mostrar todos os períodos)
+    df_vol_filtrado = carregar_volume_visao(ano_selecionado, "df_final", filtro)
     
-    if df_vol is not None:
+    if df_vol_filtrado is not None:
         # Verificar se tem as colunas necessárias
-        if 'Período' in df_vol.columns and 'Volume' in df_vol.columns:
-            # Aplicar TODOS os filtros da sidebar ao df_vol (mesma lógica para ambos os modos)
-            # Identificar colunas comuns entre df_filtrado e df_vol
-            colunas_comuns = set(df_filtrado.columns) & set(df_vol.columns)
-            # Remover colunas que não devem ser usadas para filtro
-            # Excluir Período para não filtrar por mês (mostrar todos os períodos)
-            colunas_filtro = [
-                col for col in colunas_comuns
-                if col not in ['Volume', 'Total', 'Valor', 'CPU', 'Período']
-            ]
-            
-            # Aplicar filtros do df_filtrado ao df_vol usando colunas comuns
-            df_vol_filtrado = df_vol.copy()
-            
-            for col in colunas_filtro:
-                if col in df_filtrado.columns:
-                    # Obter valores únicos da coluna no df_filtrado
-                    valores_filtrados = df_filtrado[col].dropna().unique()
-                    if len(valores_filtrados) > 0:
-                        # Filtrar df_vol com os mesmos valores
-                        df_vol_filtrado = df_vol_filtrado[
-                            df_vol_filtrado[col].isin(valores_filtrados)
-                        ].copy()
-            
+        if 'Período' in df_vol_filtrado.columns and 'Volume' in df_vol_filtrado.columns:
             # Aplicar também os filtros específicos do gráfico (Oficina e Veículo) se foram selecionados
             # Isso permite que o gráfico de volume responda aos filtros do gráfico também
-            if 'Oficina' in df_vol_filtrado.columns:
-                if oficina_selecionadas_grafico and "Todos" not in oficina_selecionadas_grafico:
-                    df_vol_filtrado = df_vol_filtrado[
-                        df_vol_filtrado['Oficina'].astype(str).isin(oficina_selecionadas_grafico)
-                    ].copy()
-            
-            if 'Veículo' in df_vol_filtrado.columns:
-                if veiculo_selecionados_grafico and "Todos" not in veiculo_selecionados_grafico:
-                    df_vol_filtrado = df_vol_filtrado[
-                        df_vol_filtrado['Veículo'].astype(str).isin(veiculo_selecionados_grafico)
-                    ].copy()
+            df_vol_filtrado = FiltroSpec({
+                'Oficina': oficina_selecionadas_grafico,
+                'Veículo': veiculo_selecionados_grafico
+            }).aplicar(df_vol_filtrado)
             
             # Criar gráfico com dados filtrados (sempre mostrando todos os períodos)
-            grafico_volume = create_volume_chart(df_vol_filtrado)
+            grafico_volume = criar_grafico(
+                montar_cubo(df_vol_filtrado, [], ['Volume']), 'Volume',
+                'Volume Total por Período', 'Volume Total', grao=GRAO_ANO_MES
+            )
             if grafico_volume:
                 st.altair_chart(grafico_volume, use_container_width=True)
             else:
@@ -1255,7 +564,8 @@ if (coluna_visualizacao in df_visualizacao.columns and
                 columns=coluna_periodo_pivot,
                 values=coluna_visualizacao,
                 aggfunc='sum',
-                fill_value=0
+                fill_value=0,
+                observed=True
             )
         else:
             df_tabela_ref = df_visualizacao_pivot.pivot_table(
@@ -1263,7 +573,8 @@ if (coluna_visualizacao in df_visualizacao.columns and
                 columns=coluna_periodo_pivot,
                 values=coluna_visualizacao,
                 aggfunc='sum',
-                fill_value=0
+                fill_value=0,
+                observed=True
             )
         
         # Ordenar colunas de períodos (mesma lógica para ambas tabelas)
@@ -1354,7 +665,8 @@ if (coluna_visualizacao in df_visualizacao.columns and
                     columns=coluna_periodo_pivot,
                     values=coluna_visualizacao,
                     aggfunc='sum',
-                    fill_value=0
+                    fill_value=0,
+                    observed=True
                 )
                 
                 if tem_multiplos_anos:
@@ -1396,31 +708,26 @@ if (coluna_visualizacao in df_visualizacao.columns and
             
             # Usar as mesmas colunas de períodos já determinadas
             # Para CPU, recalcular a partir de Total e Volume agregados
+            razao_cpu = None
             if tipo_visualizacao == "CPU (Custo por Unidade)" and 'Total' in df_visualizacao_pivot.columns and 'Volume' in df_visualizacao_pivot.columns:
-                # Agrupar por Oficina, Veículo e Período, somar Total e Volume
-                df_agrupado = df_visualizacao_pivot.groupby(['Oficina', 'Veículo', coluna_periodo_pivot]).agg({
-                    'Total': 'sum',
-                    'Volume': 'sum'
-                }).reset_index()
-                
-                # Recalcular CPU
-                df_agrupado['CPU'] = df_agrupado.apply(
-                    lambda row: (
-                        row['Total'] / row['Volume']
-                        if pd.notnull(row['Volume']) and row['Volume'] != 0
-                        else 0
-                    ),
-                    axis=1
-                )
-                
-                # Criar tabela pivot com CPU recalculado
-                df_tabela = df_agrupado.pivot_table(
+                # Total e Volume por Oficina, Veículo e Período (e no total da linha)
+                df_total_pivot = tabela_soma(df_visualizacao_pivot, ['Oficina', 'Veículo'], coluna_periodo_pivot, 'Total')
+                df_volume_pivot = df_visualizacao_pivot.pivot_table(
                     index=['Oficina', 'Veículo'],
                     columns=coluna_periodo_pivot,
-                    values='CPU',
-                    aggfunc='first',
-                    fill_value=0
+                    values='Volume',
+                    aggfunc='sum',
+                    fill_value=0,
+                    observed=True
                 )
+                df_total_pivot = df_total_pivot.reindex(columns=colunas_periodos, fill_value=0)
+                df_volume_pivot = df_volume_pivot.reindex(index=df_total_pivot.index, columns=colunas_periodos, fill_value=0)
+                df_total_pivot['Total'] = somar_linhas(df_total_pivot)
+                df_volume_pivot['Total'] = df_volume_pivot.sum(axis=1)
+                razao_cpu = (df_total_pivot, df_volume_pivot)
+
+                # CPU de cada célula e da coluna Total = Total / Volume
+                df_tabela = df_total_pivot.div(df_volume_pivot.where(df_volume_pivot != 0)).fillna(0)
             else:
                 # Para Custo Total, usar soma normalmente
                 df_tabela = df_visualizacao_pivot.pivot_table(
@@ -1428,44 +735,11 @@ if (coluna_visualizacao in df_visualizacao.columns and
                     columns=coluna_periodo_pivot,
                     values=coluna_visualizacao,
                     aggfunc='sum',
-                    fill_value=0
-                )
-            
-            # Garantir que tenha as mesmas colunas (adicionar colunas faltantes com 0)
-            for col in colunas_periodos:
-                if col not in df_tabela.columns:
-                    df_tabela[col] = 0
-            
-            # Reordenar para usar exatamente as mesmas colunas
-            df_tabela = df_tabela[colunas_periodos]
-            
-            # Calcular total por linha
-            # Para CPU, recalcular a partir de Total e Volume agregados por Oficina e Veículo
-            if tipo_visualizacao == "CPU (Custo por Unidade)" and 'Total' in df_visualizacao_pivot.columns and 'Volume' in df_visualizacao_pivot.columns:
-                # Agrupar por Oficina e Veículo, somar Total e Volume, e recalcular CPU
-                df_total_oficina_veiculo = df_visualizacao_pivot.groupby(['Oficina', 'Veículo']).agg({
-                    'Total': 'sum',
-                    'Volume': 'sum'
-                }).reset_index()
-                df_total_oficina_veiculo['CPU'] = df_total_oficina_veiculo.apply(
-                    lambda row: (
-                        row['Total'] / row['Volume']
-                        if pd.notnull(row['Volume']) and row['Volume'] != 0
-                        else 0
-                    ),
-                    axis=1
-                )
-                # Fazer merge com df_tabela para adicionar coluna Total
-                df_tabela = df_tabela.reset_index()
-                df_tabela = pd.merge(
-                    df_tabela,
-                    df_total_oficina_veiculo[['Oficina', 'Veículo', 'CPU']],
-                    on=['Oficina', 'Veículo'],
-                    how='left'
+                    fill_value=0,
+                    observed=True
                 )
-                df_tabela.rename(columns={'CPU': 'Total'}, inplace=True)
-                df_tabela = df_tabela.set_index(['Oficina', 'Veículo'])
-            else:
+                # Mesmas colunas de períodos (faltantes com 0) e total por linha
+                df_tabela = df_tabela.reindex(columns=colunas_periodos, fill_value=0)
                 df_tabela['Total'] = df_tabela.sum(axis=1)
             df_tabela = df_tabela.sort_values(['Oficina', 'Veículo'])
             
@@ -1483,7 +757,7 @@ if (coluna_visualizacao in df_visualizacao.columns and
                 if colunas_adicionais_validas:
                     # Agrupar por Oficina e Veículo e pegar o primeiro valor não nulo de cada coluna adicional
                     # Usar df_visualizacao original para ter todas as colunas
-                    df_colunas_adicionais = df_visualizacao.groupby(['Oficina', 'Veículo'])[colunas_adicionais_validas].first().reset_index()
+                    df_colunas_adicionais = df_visualizacao.groupby(['Oficina', 'Veículo'], observed=True)[colunas_adicionais_validas].first().reset_index()
                     # Fazer merge com a tabela
                     df_tabela = pd.merge(
                         df_tabela,
@@ -1507,201 +781,47 @@ if (coluna_visualizacao in df_visualizacao.columns and
                                                               if col not in ['Oficina', 'Veículo']]
                 df_tabela = df_tabela[colunas_ordenadas]
             
-            # Formatar valores baseado no tipo de visualização
-            def formatar_valor(val, tipo):
-                if isinstance(val, (int, float)):
-                    if tipo == "CPU (Custo por Unidade)":
-                        return f"{val:,.4f}"
-                    else:
-                        return f"R$ {val:,.2f}"
-                return val
+            # Valores continuam numéricos: R$ / CPU formatados na exibição (períodos e Total)
+            config_valores = config_colunas_valor(colunas_periodos + ['Total'], tipo_visualizacao)
             
-            # Aplicar formatação apenas nas colunas numéricas (exceto Veículo, Oficina e colunas adicionais)
-            df_tabela_formatado = df_tabela.copy()
-            # Obter colunas adicionais que foram realmente adicionadas à tabela
+            # Linha TOTAL de cada oficina (CPU: Total / Volume da oficina), para a tela e o download
+            df_tabela = com_subtotais(df_tabela, 'Oficina', 'Veículo', colunas_periodos + ['Total'], razao_cpu)
             colunas_adicionais_na_tabela = [
-                col for col in df_tabela_formatado.columns 
-                if col not in ['Oficina', 'Veículo'] + colunas_periodos + ['Total']
+                col for col in df_tabela.columns
+                if col not in ['Oficina', 'Veículo', NIVEL] + colunas_periodos + ['Total']
             ]
-            colunas_formatar = [
-                col for col in df_tabela_formatado.columns 
-                if col not in ['Veículo', 'Oficina'] + colunas_adicionais_na_tabela and
-                df_tabela_formatado[col].dtype in ['float64', 'float32', 'int64', 'int32']
-            ]
-            for col in colunas_formatar:
-                df_tabela_formatado[col] = df_tabela_formatado[col].apply(
-                    lambda x: formatar_valor(x, tipo_visualizacao)
-                )
-            
-            # Agrupar por Oficina e criar expanders (abertos por padrão)
-            oficinas = df_tabela_formatado['Oficina'].unique()
+            # Remover colunas 'mes', 'Mes', 'QTD', 'soma_percentuais' e 'Soma_Percentuais' da exibição
+            colunas_para_remover = ['mes', 'Mes', 'QTD', 'soma_percentuais', 'Soma_Percentuais']
+            df_tabela_display = df_tabela.drop(columns=[col for col in colunas_para_remover if col in df_tabela.columns])
+            subtotal = df_tabela_display[NIVEL] == NIVEL_SUBTOTAL
+            df_tabela_display.loc[subtotal, 'Veículo'] = '**TOTAL**'
+            for col in colunas_adicionais_na_tabela:
+                if col in df_tabela_display.columns:
+                    df_tabela_display[col] = df_tabela_display[col].astype(object)
+                    df_tabela_display.loc[subtotal, col] = ''
             
-            for oficina in sorted(oficinas):
-                # Filtrar dados da oficina
-                df_oficina = df_tabela_formatado[df_tabela_formatado['Oficina'] == oficina].copy()
-                
-                # Calcular total da oficina
-                if 'Total' in df_oficina.columns:
-                    # Converter Total de string formatada para número para calcular
-                    df_oficina_numerico = df_tabela[df_tabela['Oficina'] == oficina].copy()
-                    total_oficina = df_oficina_numerico['Total'].sum()
-                    total_formatado = formatar_valor(total_oficina, tipo_visualizacao)
-                else:
-                    total_formatado = "N/A"
+            # Uma tabela por Oficina (já em ordem, com a linha TOTAL no fim)
+            for oficina, df_oficina in df_tabela_display.groupby('Oficina', observed=True, sort=False):
+                linha_total = df_oficina[NIVEL] == NIVEL_SUBTOTAL
+                total_formatado = formatar_valor(df_oficina.loc[linha_total, 'Total'].iloc[0], tipo_visualizacao)
+                qtd_veiculos = int((~linha_total).sum())
                 
                 # Criar container para cada oficina (substituindo expander para evitar aninhamento)
                 st.markdown("---")
                 with st.container():
-                    st.markdown(f"### 🏭 **{oficina}** - Total: {total_formatado} ({len(df_oficina)} veículo{'s' if len(df_oficina) > 1 else ''})")
+                    st.markdown(f"### 🏭 **{oficina}** - Total: {total_formatado} ({qtd_veiculos} veículo{'s' if qtd_veiculos > 1 else ''})")
                     # Remover coluna Oficina da tabela (já está no título)
-                    df_oficina_display = df_oficina.drop(columns=['Oficina'])
-                    
-                    # Remover colunas 'mes', 'Mes', 'QTD', 'soma_percentuais' e 'Soma_Percentuais' se existirem
-                    colunas_para_remover = ['mes', 'Mes', 'QTD', 'soma_percentuais', 'Soma_Percentuais']
-                    for col in colunas_para_remover:
-                        if col in df_oficina_display.columns:
-                            df_oficina_display = df_oficina_display.drop(columns=[col])
-                    
-                    # Calcular totais por coluna (meses) usando dados numéricos
-                    df_oficina_numerico = df_tabela[df_tabela['Oficina'] == oficina].copy()
-                    df_oficina_numerico = df_oficina_numerico.drop(columns=['Oficina'])
-                    
-                    # Criar linha de total
-                    linha_total = {'Veículo': '**TOTAL**'}
-                    
-                    # Obter colunas adicionais que foram realmente adicionadas à tabela
-                    colunas_adicionais_na_tabela = [
-                        col for col in df_oficina_numerico.columns 
-                        if col not in ['Veículo'] + colunas_periodos + ['Total']
-                    ]
-                    
-                    # Adicionar valores vazios para colunas adicionais na linha de total
-                    for col in colunas_adicionais_na_tabela:
-                        if col in df_oficina_numerico.columns:
-                            linha_total[col] = ''
-                    
-                    # Adicionar totais por coluna (meses e Total)
-                    for col in df_oficina_numerico.columns:
-                        if col not in ['Veículo'] + colunas_adicionais_na_tabela:
-                            if col in colunas_periodos:
-                                # Para colunas de período, se for CPU, calcular Total/Volume do período
-                                if tipo_visualizacao == "CPU (Custo por Unidade)" and 'Total' in df_visualizacao.columns and 'Volume' in df_visualizacao.columns:
-                                    # Filtrar dados da oficina e do período específico
-                                    df_oficina_filtrado = df_visualizacao[df_visualizacao['Oficina'] == oficina].copy()
-                                    
-                                    # Verificar se há múltiplos anos
-                                    tem_multiplos_anos = 'Ano' in df_visualizacao.columns and df_visualizacao['Ano'].nunique() > 1
-                                    
-                                    if tem_multiplos_anos:
-                                        # Filtrar pelo período específico (formato: "mês ano")
-                                        df_temp = df_oficina_filtrado.copy()
-                                        df_temp['Período_Ano_temp'] = df_temp['Período'].astype(str) + ' ' + df_temp['Ano'].astype(str)
-                                        df_periodo_filtrado = df_temp[df_temp['Período_Ano_temp'] == col].copy()
-                                    else:
-                                        # Filtrar apenas por Período
-                                        df_periodo_filtrado = df_oficina_filtrado[df_oficina_filtrado['Período'] == col].copy()
-                                    
-                                    if len(df_periodo_filtrado) > 0:
-                                        # Agrupar e calcular Total e Volume do período
-                                        total_periodo = df_periodo_filtrado['Total'].sum()
-                                        volume_periodo = df_periodo_filtrado['Volume'].sum()
-                                        if pd.notnull(volume_periodo) and volume_periodo != 0:
-                                            cpu_periodo = total_periodo / volume_periodo
-                                        else:
-                                            cpu_periodo = 0
-                                        linha_total[col] = formatar_valor(cpu_periodo, tipo_visualizacao)
-                                    else:
-                                        linha_total[col] = formatar_valor(0, tipo_visualizacao)
-                                else:
-                                    # Para Custo Total, somar normalmente
-                                    if df_oficina_numerico[col].dtype in ['float64', 'float32', 'int64', 'int32']:
-                                        total_col = df_oficina_numerico[col].sum()
-                                        linha_total[col] = formatar_valor(total_col, tipo_visualizacao)
-                            elif col == 'Total':
-                                # Para a coluna Total, se for CPU, calcular Total/Volume geral da oficina
-                                if tipo_visualizacao == "CPU (Custo por Unidade)" and 'Total' in df_visualizacao.columns and 'Volume' in df_visualizacao.columns:
-                                    # Filtrar dados da oficina
-                                    df_oficina_filtrado = df_visualizacao[df_visualizacao['Oficina'] == oficina].copy()
-                                    total_geral = df_oficina_filtrado['Total'].sum()
-                                    volume_geral = df_oficina_filtrado['Volume'].sum()
-                                    if pd.notnull(volume_geral) and volume_geral != 0:
-                                        cpu_geral = total_geral / volume_geral
-                                    else:
-                                        cpu_geral = 0
-                                    linha_total[col] = formatar_valor(cpu_geral, tipo_visualizacao)
-                                else:
-                                    # Para Custo Total, somar normalmente
-                                    if df_oficina_numerico[col].dtype in ['float64', 'float32', 'int64', 'int32']:
-                                        total_col = df_oficina_numerico[col].sum()
-                                        linha_total[col] = formatar_valor(total_col, tipo_visualizacao)
-                    
-                    # Adicionar linha de total ao DataFrame
-                    df_oficina_display = pd.concat([
-                        df_oficina_display,
-                        pd.DataFrame([linha_total])
-                    ], ignore_index=True)
-                    
-                    st.dataframe(df_oficina_display, use_container_width=True)
+                    df_oficina_display = df_oficina.drop(columns=['Oficina', NIVEL]).reset_index(drop=True)
+                    st.dataframe(df_oficina_display, use_container_width=True, column_config=config_valores)
             
-            # Botão de download da tabela
-            if st.button(
-                "📥 Baixar Tabela por Veículo e Oficina (Excel)",
-                use_container_width=True,
-                key="download_tabela_veiculo_oficina"
-            ):
-                with st.spinner("Gerando arquivo da tabela..."):
-                    try:
-                        # Criar DataFrame completo para download (com todas as oficinas e totais)
-                        df_download_list = []
-                        
-                        for oficina in sorted(oficinas):
-                            # Dados da oficina (sem formatação para manter valores numéricos)
-                            df_oficina_download = df_tabela[df_tabela['Oficina'] == oficina].copy()
-                            
-                            # Adicionar linha de total da oficina
-                            linha_total_download = {'Oficina': oficina, 'Veículo': 'TOTAL'}
-                            df_oficina_numerico = df_tabela[df_tabela['Oficina'] == oficina].copy()
-                            df_oficina_numerico = df_oficina_numerico.drop(columns=['Oficina'])
-                            
-                            for col in df_oficina_numerico.columns:
-                                if col != 'Veículo':
-                                    total_col = df_oficina_numerico[col].sum()
-                                    linha_total_download[col] = total_col
-                            
-                            # Adicionar dados da oficina
-                            df_download_list.append(df_oficina_download)
-                            # Adicionar linha de total
-                            df_download_list.append(pd.DataFrame([linha_total_download]))
-                        
-                        # Concatenar todos os DataFrames
-                        df_download = pd.concat(df_download_list, ignore_index=True)
-                        
-                        # Obter pasta Downloads do usuário
-                        downloads_path = os.path.join(
-                            os.path.expanduser("~"), "Downloads"
-                        )
-                        tipo_nome = "CPU" if tipo_visualizacao == "CPU (Custo por Unidade)" else "Custo_Total"
-                        file_name = f"TC_Ext_tabela_veiculo_oficina_{tipo_nome}.xlsx"
-                        file_path = os.path.join(downloads_path, file_name)
-                        
-                        # Salvar arquivo diretamente na pasta Downloads
-                        with pd.ExcelWriter(
-                            file_path, engine='openpyxl'
-                        ) as writer:
-                            df_download.to_excel(
-                                writer, index=False, sheet_name='Veiculo_Oficina'
-                            )
-                        
-                        st.success(
-                            f"✅ Arquivo salvo com sucesso em: {file_path}"
-                        )
-                        st.info(
-                            f"📁 Verifique sua pasta Downloads: {downloads_path}"
-                        )
-                    except Exception as e:
-                        st.error(f"❌ Erro ao salvar arquivo: {str(e)}")
-            else:
-                st.info(f"ℹ️ Coluna '{coluna_visualizacao}' não encontrada para criar a tabela.")
+            tipo_nome = "CPU" if tipo_visualizacao == "CPU (Custo por Unidade)" else "Custo_Total"
+            botao_exportacao(
+                df_tabela.drop(columns=[NIVEL]),
+                "Tabela por Veículo e Oficina", f"TC_Ext_tabela_veiculo_oficina_{tipo_nome}",
+                "download_tabela_veiculo_oficina",
+                identidade=(ano_selecionado, filtro.chave, tipo_visualizacao),
+                nome_planilha='Veiculo_Oficina'
+            )
         else:
             colunas_faltando = []
             if not tem_veiculo:
@@ -1739,12 +859,10 @@ if (coluna_visualizacao in df_visualizacao.columns and
                     
                     # Agrupar por Veículo e Período+Ano, somar Total e Volume, calcular CPU
                     # Usar a mesma coluna_periodo_pivot que foi determinada anteriormente
+                    # (CPU = soma do Total / soma do Volume, mesma lógica do gráfico)
                     if tem_multiplos_anos:
                         # Agrupar por Veículo, Período e Ano
-                        df_agrupado_periodo = df_visualizacao.groupby(['Veículo', 'Período', 'Ano']).agg({
-                            'Total': 'sum',
-                            'Volume': 'sum'
-                        }).reset_index()
+                        df_agrupado_periodo = cpu_por(df_visualizacao, ['Veículo', 'Período', 'Ano'])
                         # Criar coluna Período_Ano para fazer o pivot (usar o mesmo formato)
                         df_agrupado_periodo[coluna_periodo_pivot] = (
                             df_agrupado_periodo['Período'].astype(str) + ' ' + 
@@ -1752,20 +870,7 @@ if (coluna_visualizacao in df_visualizacao.columns and
                         )
                     else:
                         # Agrupar por Veículo e Período
-                        df_agrupado_periodo = df_visualizacao.groupby(['Veículo', 'Período']).agg({
-                            'Total': 'sum',
-                            'Volume': 'sum'
-                        }).reset_index()
-                    
-                    # Calcular CPU por período (mesma lógica do gráfico)
-                    df_agrupado_periodo['CPU'] = df_agrupado_periodo.apply(
-                        lambda row: (
-                            row['Total'] / row['Volume']
-                            if pd.notnull(row['Volume']) and row['Volume'] != 0
-                            else 0
-                        ),
-                        axis=1
-                    )
+                        df_agrupado_periodo = cpu_por(df_visualizacao, ['Veículo', 'Período'])
                     
                     # Criar tabelas pivot de Total e Volume apenas com dados existentes
                     # Usar coluna_periodo_pivot que já foi determinada
@@ -1774,7 +879,8 @@ if (coluna_visualizacao in df_visualizacao.columns and
                         columns=coluna_periodo_pivot,
                         values='Total',
                         aggfunc='sum',
-                        fill_value=0
+                        fill_value=0,
+                        observed=True
                     )
                     
                     df_tabela_total_volumes = df_agrupado_periodo.pivot_table(
@@ -1782,7 +888,8 @@ if (coluna_visualizacao in df_visualizacao.columns and
                         columns=coluna_periodo_pivot,
                         values='Volume',
                         aggfunc='sum',
-                        fill_value=0
+                        fill_value=0,
+                        observed=True
                     )
                     
                     # Dividir Total / Volume para obter CPU
@@ -1797,47 +904,8 @@ if (coluna_visualizacao in df_visualizacao.columns and
                     # Reordenar para usar exatamente as mesmas colunas
                     df_tabela_total = df_tabela_total[colunas_periodos]
                     
-                    # Calcular total por linha: usar EXATAMENTE a mesma lógica do gráfico "CPU por Veículo"
-                    # Primeiro agrupar por Veículo e Período+Ano, depois por Veículo
-                    if tem_multiplos_anos:
-                        # Agrupar por Veículo, Período e Ano primeiro (mesma lógica do gráfico linha 2030)
-                        df_agrupado_periodo_total = df_visualizacao.groupby(['Veículo', 'Período', 'Ano']).agg({
-                            'Total': 'sum',
-                            'Volume': 'sum'
-                        }).reset_index()
-                        # Agora agrupar por Veículo, somar Total e Volume de todos os períodos
-                        df_total_veiculo = df_agrupado_periodo_total.groupby('Veículo').agg({
-                            'Total': 'sum',
-                            'Volume': 'sum'
-                        }).reset_index()
-                    else:
-                        # Agrupar por Veículo e Período primeiro (mesma lógica do gráfico linha 2054)
-                        if 'Período' in df_visualizacao.columns:
-                            df_agrupado_periodo_total = df_visualizacao.groupby(['Veículo', 'Período']).agg({
-                                'Total': 'sum',
-                                'Volume': 'sum'
-                            }).reset_index()
-                            # Agora agrupar por Veículo, somar Total e Volume de todos os períodos
-                            df_total_veiculo = df_agrupado_periodo_total.groupby('Veículo').agg({
-                                'Total': 'sum',
-                                'Volume': 'sum'
-                            }).reset_index()
-                        else:
-                            # Se não tiver Período, agrupar apenas por Veículo
-                            df_total_veiculo = df_visualizacao.groupby('Veículo').agg({
-                                'Total': 'sum',
-                                'Volume': 'sum'
-                            }).reset_index()
-                    
-                    # Recalcular CPU (mesma lógica do gráfico linha 2080)
-                    df_total_veiculo['CPU'] = df_total_veiculo.apply(
-                        lambda row: (
-                            row['Total'] / row['Volume']
-                            if pd.notnull(row['Volume']) and row['Volume'] != 0
-                            else 0
-                        ),
-                        axis=1
-                    )
+                    # Calcular total por linha: soma do Total e do Volume de todos os períodos do Veículo
+                    df_total_veiculo = cpu_por(df_agrupado_periodo, ['Veículo'])
                     # Fazer merge com df_tabela_total para adicionar coluna Total
                     df_tabela_total = df_tabela_total.reset_index()
                     df_tabela_total = pd.merge(
@@ -1854,7 +922,8 @@ if (coluna_visualizacao in df_visualizacao.columns and
                         columns=coluna_periodo_pivot,
                         values=coluna_visualizacao,
                         aggfunc='sum',
-                        fill_value=0
+                        fill_value=0,
+                        observed=True
                     )
                     
                     # Garantir que tenha as mesmas colunas (adicionar colunas faltantes com 0)
@@ -1885,7 +954,7 @@ if (coluna_visualizacao in df_visualizacao.columns and
                     if colunas_adicionais_validas:
                         # Agrupar por Veículo e pegar o primeiro valor não nulo de cada coluna adicional
                         # Usar df_visualizacao original para ter todas as colunas
-                        df_colunas_adicionais = df_visualizacao.groupby('Veículo')[colunas_adicionais_validas].first().reset_index()
+                        df_colunas_adicionais = df_visualizacao.groupby('Veículo', observed=True)[colunas_adicionais_validas].first().reset_index()
                         # Fazer merge com a tabela total
                         df_tabela_total = pd.merge(
                             df_tabela_total,
@@ -1904,31 +973,11 @@ if (coluna_visualizacao in df_visualizacao.columns and
                         colunas_finais = [col for col in colunas_finais if col in df_tabela_total.columns]
                         df_tabela_total = df_tabela_total[colunas_finais]
                 
-                # Formatar valores baseado no tipo de visualização
-                def formatar_valor(val, tipo):
-                    if isinstance(val, (int, float)):
-                        if tipo == "CPU (Custo por Unidade)":
-                            return f"{val:,.4f}"
-                        else:
-                            return f"R$ {val:,.2f}"
-                    return val
-                
-                # Aplicar formatação apenas nas colunas numéricas (exceto Veículo e colunas adicionais)
-                df_tabela_total_formatado = df_tabela_total.copy()
                 # Obter colunas adicionais que foram realmente adicionadas à tabela
                 colunas_adicionais_na_tabela = [
-                    col for col in df_tabela_total_formatado.columns 
+                    col for col in df_tabela_total.columns 
                     if col not in ['Veículo'] + colunas_periodos + ['Total']
                 ]
-                colunas_formatar_total = [
-                    col for col in df_tabela_total_formatado.columns 
-                    if col not in ['Veículo'] + colunas_adicionais_na_tabela and 
-                    df_tabela_total_formatado[col].dtype in ['float64', 'float32', 'int64', 'int32']
-                ]
-                for col in colunas_formatar_total:
-                    df_tabela_total_formatado[col] = df_tabela_total_formatado[col].apply(
-                        lambda x: formatar_valor(x, tipo_visualizacao)
-                    )
                 
                 # Calcular totais por coluna (meses) usando dados numéricos
                 linha_total_geral = {'Veículo': '**TOTAL**'}
@@ -1939,130 +988,27 @@ if (coluna_visualizacao in df_visualizacao.columns and
                         linha_total_geral[col] = ''
                 
                 # Adicionar totais por coluna (meses e Total)
-                # LÓGICA CORRIGIDA: Quando filtra por um veículo, o total deve ser o valor desse veículo
+                # Para CPU: soma do Total / soma do Volume de todos os veículos em cada período (e no geral)
                 if tipo_visualizacao == "CPU (Custo por Unidade)" and 'Total' in df_visualizacao.columns and 'Volume' in df_visualizacao.columns:
-                    # Verificar quantos veículos há na tabela
-                    num_veiculos_tabela = len(df_tabela_total)
-                    
-                    for col in df_tabela_total.columns:
-                        if col not in ['Veículo'] + colunas_adicionais_na_tabela:
-                            if col in colunas_periodos:
-                                # Se houver apenas um veículo na tabela, recalcular a partir de df_visualizacao filtrado
-                                # Isso garante que o valor seja calculado corretamente mesmo quando há apenas 1 veículo
-                                if num_veiculos_tabela == 1:
-                                    # Quando filtra por um veículo, recalcular a partir dos dados filtrados
-                                    tem_multiplos_anos = 'Ano' in df_visualizacao.columns and df_visualizacao['Ano'].nunique() > 1
-                                    
-                                    if tem_multiplos_anos:
-                                        # Filtrar df_visualizacao pelo período específico
-                                        df_temp = df_visualizacao.copy()
-                                        df_temp['Período_Ano_temp'] = df_temp['Período'].astype(str) + ' ' + df_temp['Ano'].astype(str)
-                                        df_periodo_filtrado = df_temp[df_temp['Período_Ano_temp'] == col].copy()
-                                        
-                                        if len(df_periodo_filtrado) > 0:
-                                            # Agrupar por Ano e Período e calcular CPU
-                                            df_agrupado = df_periodo_filtrado.groupby(['Ano', 'Período']).agg({
-                                                'Total': 'sum',
-                                                'Volume': 'sum'
-                                            }).reset_index()
-                                            total_periodo = df_agrupado['Total'].sum()
-                                            volume_periodo = df_agrupado['Volume'].sum()
-                                            if pd.notnull(volume_periodo) and volume_periodo != 0:
-                                                cpu_periodo = total_periodo / volume_periodo
-                                            else:
-                                                cpu_periodo = 0
-                                            linha_total_geral[col] = formatar_valor(cpu_periodo, tipo_visualizacao)
-                                        else:
-                                            linha_total_geral[col] = formatar_valor(0, tipo_visualizacao)
-                                    else:
-                                        # Sem múltiplos anos, filtrar apenas por Período
-                                        df_periodo_filtrado = df_visualizacao[df_visualizacao['Período'] == col].copy()
-                                        
-                                        if len(df_periodo_filtrado) > 0:
-                                            # Agrupar por Período e calcular CPU
-                                            df_agrupado = df_periodo_filtrado.groupby('Período').agg({
-                                                'Total': 'sum',
-                                                'Volume': 'sum'
-                                            }).reset_index()
-                                            total_periodo = df_agrupado['Total'].sum()
-                                            volume_periodo = df_agrupado['Volume'].sum()
-                                            if pd.notnull(volume_periodo) and volume_periodo != 0:
-                                                cpu_periodo = total_periodo / volume_periodo
-                                            else:
-                                                cpu_periodo = 0
-                                            linha_total_geral[col] = formatar_valor(cpu_periodo, tipo_visualizacao)
-                                        else:
-                                            linha_total_geral[col] = formatar_valor(0, tipo_visualizacao)
-                                else:
-                                    # Se houver múltiplos veículos, calcular a partir dos dados filtrados
-                                    # Agrupar por período usando df_visualizacao filtrado, somar Total e Volume, calcular CPU
-                                    tem_multiplos_anos = 'Ano' in df_visualizacao.columns and df_visualizacao['Ano'].nunique() > 1
-                                    
-                                    if tem_multiplos_anos:
-                                        # Extrair mês e ano da coluna (formato: "mês ano")
-                                        # Filtrar df_visualizacao pelo período específico
-                                        df_temp = df_visualizacao.copy()
-                                        df_temp['Período_Ano_temp'] = df_temp['Período'].astype(str) + ' ' + df_temp['Ano'].astype(str)
-                                        df_periodo_filtrado = df_temp[df_temp['Período_Ano_temp'] == col].copy()
-                                        
-                                        if len(df_periodo_filtrado) > 0:
-                                            # Agrupar por Ano e Período (mesma lógica da tabela)
-                                            df_agrupado = df_periodo_filtrado.groupby(['Ano', 'Período']).agg({
-                                                'Total': 'sum',
-                                                'Volume': 'sum'
-                                            }).reset_index()
-                                            total_periodo = df_agrupado['Total'].sum()
-                                            volume_periodo = df_agrupado['Volume'].sum()
-                                            if pd.notnull(volume_periodo) and volume_periodo != 0:
-                                                cpu_periodo = total_periodo / volume_periodo
-                                            else:
-                                                cpu_periodo = 0
-                                            linha_total_geral[col] = formatar_valor(cpu_periodo, tipo_visualizacao)
-                                        else:
-                                            linha_total_geral[col] = formatar_valor(0, tipo_visualizacao)
-                                    else:
-                                        # Sem múltiplos anos, filtrar apenas por Período
-                                        df_periodo_filtrado = df_visualizacao[df_visualizacao['Período'] == col].copy()
-                                        
-                                        if len(df_periodo_filtrado) > 0:
-                                            # Agrupar por Período
-                                            df_agrupado = df_periodo_filtrado.groupby('Período').agg({
-                                                'Total': 'sum',
-                                                'Volume': 'sum'
-                                            }).reset_index()
-                                            total_periodo = df_agrupado['Total'].sum()
-                                            volume_periodo = df_agrupado['Volume'].sum()
-                                            if pd.notnull(volume_periodo) and volume_periodo != 0:
-                                                cpu_periodo = total_periodo / volume_periodo
-                                            else:
-                                                cpu_periodo = 0
-                                            linha_total_geral[col] = formatar_valor(cpu_periodo, tipo_visualizacao)
-                                        else:
-                                            linha_total_geral[col] = formatar_valor(0, tipo_visualizacao)
-                            elif col == 'Total':
-                                # Para a coluna Total, agregar Total e Volume de todos os veículos e períodos
-                                total_geral = df_visualizacao['Total'].sum()
-                                volume_geral = df_visualizacao['Volume'].sum()
-                                if pd.notnull(volume_geral) and volume_geral != 0:
-                                    cpu_geral = total_geral / volume_geral
-                                else:
-                                    cpu_geral = 0
-                                linha_total_geral[col] = formatar_valor(cpu_geral, tipo_visualizacao)
-                    # NÃO processar outras colunas numéricas aqui - apenas colunas de período já foram processadas acima
-                    # elif df_tabela_total[col].dtype in ['float64', 'float32', 'int64', 'int32']:
-                    #     total_col = df_tabela_total[col].sum()
-                    #     linha_total_geral[col] = formatar_valor(total_col, tipo_visualizacao)
+                    cpu_por_periodo = cpu_por(df_agrupado_periodo, [coluna_periodo_pivot])
+                    cpu_por_periodo = cpu_por_periodo.set_index(coluna_periodo_pivot)['CPU']
+                    for col in colunas_periodos:
+                        if col in df_tabela_total.columns:
+                            linha_total_geral[col] = float(cpu_por_periodo.get(col, 0))
+                    linha_total_geral['Total'] = float(
+                        calcular_cpu(somar(df_visualizacao['Total']), df_visualizacao['Volume'].sum())
+                    )
                 else:
                     # Para Custo Total, somar normalmente
                     for col in df_tabela_total.columns:
                         if col not in ['Veículo'] + colunas_adicionais_na_tabela:
                             if df_tabela_total[col].dtype in ['float64', 'float32', 'int64', 'int32']:
                                 total_col = df_tabela_total[col].sum()
-                                linha_total_geral[col] = formatar_valor(total_col, tipo_visualizacao)
+                                linha_total_geral[col] = total_col
                 
                 # Adicionar linha de total ao DataFrame
                 df_tabela_total_display = pd.concat([
-                    df_tabela_total_formatado,
+                    df_tabela_total,
                     pd.DataFrame([linha_total_geral])
                 ], ignore_index=True)
                 
@@ -2072,122 +1018,105 @@ if (coluna_visualizacao in df_visualizacao.columns and
                     if col in df_tabela_total_display.columns:
                         df_tabela_total_display = df_tabela_total_display.drop(columns=[col])
                 
-                st.dataframe(df_tabela_total_display, use_container_width=True)
+                # Valores continuam numéricos: R$ / CPU formatados na exibição
+                st.dataframe(
+                    df_tabela_total_display, use_container_width=True,
+                    column_config=config_colunas_valor(colunas_periodos + ['Total'], tipo_visualizacao)
+                )
                 
-                # Botão de download da tabela total
-                if st.button(
-                    "📥 Baixar Tabela Total por Veículo (Excel)",
-                    use_container_width=True,
-                    key="download_tabela_total_veiculo"
-                ):
-                    with st.spinner("Gerando arquivo da tabela total..."):
-                        try:
-                            # Criar DataFrame completo para download (com linha de total)
-                            df_total_download = df_tabela_total.copy()
-                            
-                            # Adicionar linha de total
-                            linha_total_download = {'Veículo': 'TOTAL'}
-                            # Para CPU, usar df_visualizacao diretamente para garantir agrupamento correto por Período+Ano
-                            if tipo_visualizacao == "CPU (Custo por Unidade)" and 'Total' in df_visualizacao.columns and 'Volume' in df_visualizacao.columns:
-                                # Verificar se há múltiplos anos
-                                tem_multiplos_anos = 'Ano' in df_visualizacao.columns and df_visualizacao['Ano'].nunique() > 1
-                                
-                                for col in df_tabela_total.columns:
-                                    if col != 'Veículo':
-                                        if col in colunas_periodos:
-                                            # Usar EXATAMENTE a mesma lógica do gráfico "CPU por Período" (linha 2157)
-                                            # Agrupar diretamente por Ano e Período de df_visualizacao, sem filtrar primeiro
-                                            if tem_multiplos_anos:
-                                                # Agrupar por Ano e Período de TODOS os dados, depois filtrar pelo período específico
-                                                df_agrupado_todos = df_visualizacao.groupby(['Ano', 'Período']).agg({
-                                                    'Total': 'sum',
-                                                    'Volume': 'sum'
-                                                }).reset_index()
-                                                # Criar coluna Período_Ano para fazer match
-                                                df_agrupado_todos['Período_Ano_temp'] = (
-                                                    df_agrupado_todos['Período'].astype(str) + ' ' + 
-                                                    df_agrupado_todos['Ano'].astype(str)
-                                                )
-                                                # Filtrar pelo período específico
-                                                df_periodo_especifico = df_agrupado_todos[df_agrupado_todos['Período_Ano_temp'] == col]
-                                                
-                                                if len(df_periodo_especifico) > 0:
-                                                    total_periodo = df_periodo_especifico['Total'].iloc[0]
-                                                    volume_periodo = df_periodo_especifico['Volume'].iloc[0]
-                                                    if pd.notnull(volume_periodo) and volume_periodo != 0:
-                                                        cpu_periodo = total_periodo / volume_periodo
-                                                    else:
-                                                        cpu_periodo = 0
-                                                    linha_total_download[col] = cpu_periodo
-                                                else:
-                                                    linha_total_download[col] = 0
+                # Download da tabela total (montada e gerada em memória só no clique)
+                def montar_download_total_veiculo(df_tabela_total, df_visualizacao, colunas_periodos, tipo_visualizacao):
+                    """Tabela Total por Veículo com a linha TOTAL (CPU do total: Total / Volume)"""
+                    # Criar DataFrame completo para download (com linha de total)
+                    df_total_download = df_tabela_total.copy()
+
+                    # Adicionar linha de total
+                    linha_total_download = {'Veículo': 'TOTAL'}
+                    # Para CPU, usar df_visualizacao diretamente para garantir agrupamento correto por Período+Ano
+                    if tipo_visualizacao == "CPU (Custo por Unidade)" and 'Total' in df_visualizacao.columns and 'Volume' in df_visualizacao.columns:
+                        # Verificar se há múltiplos anos
+                        tem_multiplos_anos = 'Ano' in df_visualizacao.columns and df_visualizacao['Ano'].nunique() > 1
+
+                        for col in df_tabela_total.columns:
+                            if col != 'Veículo':
+                                if col in colunas_periodos:
+                                    # Usar EXATAMENTE a mesma lógica do gráfico "CPU por Período" (linha 2157)
+                                    # Agrupar diretamente por Ano e Período de df_visualizacao, sem filtrar primeiro
+                                    if tem_multiplos_anos:
+                                        # Agrupar por Ano e Período de TODOS os dados, depois filtrar pelo período específico
+                                        df_agrupado_todos = df_visualizacao.groupby(['Ano', 'Período'], observed=True).agg({
+                                            'Total': 'sum',
+                                            'Volume': 'sum'
+                                        }).reset_index()
+                                        # Criar coluna Período_Ano para fazer match
+                                        df_agrupado_todos['Período_Ano_temp'] = (
+                                            df_agrupado_todos['Período'].astype(str) + ' ' + 
+                                            df_agrupado_todos['Ano'].astype(str)
+                                        )
+                                        # Filtrar pelo período específico
+                                        df_periodo_especifico = df_agrupado_todos[df_agrupado_todos['Período_Ano_temp'] == col]
+
+                                        if len(df_periodo_especifico) > 0:
+                                            total_periodo = df_periodo_especifico['Total'].iloc[0]
+                                            volume_periodo = df_periodo_especifico['Volume'].iloc[0]
+                                            if pd.notnull(volume_periodo) and volume_periodo != 0:
+                                                cpu_periodo = total_periodo / volume_periodo
                                             else:
-                                                # Sem múltiplos anos, agrupar apenas por Período
-                                                df_agrupado_todos = df_visualizacao.groupby('Período').agg({
-                                                    'Total': 'sum',
-                                                    'Volume': 'sum'
-                                                }).reset_index()
-                                                # Filtrar pelo período específico
-                                                df_periodo_especifico = df_agrupado_todos[df_agrupado_todos['Período'] == col]
-                                                
-                                                if len(df_periodo_especifico) > 0:
-                                                    total_periodo = df_periodo_especifico['Total'].iloc[0]
-                                                    volume_periodo = df_periodo_especifico['Volume'].iloc[0]
-                                                    if pd.notnull(volume_periodo) and volume_periodo != 0:
-                                                        cpu_periodo = total_periodo / volume_periodo
-                                                    else:
-                                                        cpu_periodo = 0
-                                                    linha_total_download[col] = cpu_periodo
-                                                else:
-                                                    linha_total_download[col] = 0
-                                        elif col == 'Total':
-                                            # Para a coluna Total, agregar Total e Volume de todos os veículos e períodos
-                                            total_geral = df_visualizacao['Total'].sum()
-                                            volume_geral = df_visualizacao['Volume'].sum()
-                                            if pd.notnull(volume_geral) and volume_geral != 0:
-                                                cpu_geral = total_geral / volume_geral
+                                                cpu_periodo = 0
+                                            linha_total_download[col] = cpu_periodo
+                                        else:
+                                            linha_total_download[col] = 0
+                                    else:
+                                        # Sem múltiplos anos, agrupar apenas por Período
+                                        df_agrupado_todos = df_visualizacao.groupby('Período', observed=True).agg({
+                                            'Total': 'sum',
+                                            'Volume': 'sum'
+                                        }).reset_index()
+                                        # Filtrar pelo período específico
+                                        df_periodo_especifico = df_agrupado_todos[df_agrupado_todos['Período'] == col]
+
+                                        if len(df_periodo_especifico) > 0:
+                                            total_periodo = df_periodo_especifico['Total'].iloc[0]
+                                            volume_periodo = df_periodo_especifico['Volume'].iloc[0]
+                                            if pd.notnull(volume_periodo) and volume_periodo != 0:
+                                                cpu_periodo = total_periodo / volume_periodo
                                             else:
-                                                cpu_geral = 0
-                                            linha_total_download[col] = cpu_geral
+                                                cpu_periodo = 0
+                                            linha_total_download[col] = cpu_periodo
                                         else:
-                                            total_col = df_tabela_total[col].sum()
-                                            linha_total_download[col] = total_col
-                            else:
-                                # Para Custo Total, somar normalmente
-                                for col in df_tabela_total.columns:
-                                    if col != 'Veículo':
-                                        total_col = df_tabela_total[col].sum()
-                                        linha_total_download[col] = total_col
-                            
-                            df_total_download = pd.concat([
-                                df_total_download,
-                                pd.DataFrame([linha_total_download])
-                            ], ignore_index=True)
-                            
-                            # Obter pasta Downloads do usuário
-                            downloads_path = os.path.join(
-                                os.path.expanduser("~"), "Downloads"
-                            )
-                            tipo_nome = "CPU" if tipo_visualizacao == "CPU (Custo por Unidade)" else "Custo_Total"
-                            file_name = f"TC_Ext_tabela_total_veiculo_{tipo_nome}.xlsx"
-                            file_path = os.path.join(downloads_path, file_name)
-                            
-                            # Salvar arquivo diretamente na pasta Downloads
-                            with pd.ExcelWriter(
-                                file_path, engine='openpyxl'
-                            ) as writer:
-                                df_total_download.to_excel(
-                                    writer, index=False, sheet_name='Total_Veiculo'
-                                )
-                            
-                            st.success(
-                                f"✅ Arquivo salvo com sucesso em: {file_path}"
-                            )
-                            st.info(
-                                f"📁 Verifique sua pasta Downloads: {downloads_path}"
-                            )
-                        except Exception as e:
-                            st.error(f"❌ Erro ao salvar arquivo: {str(e)}")
+                                            linha_total_download[col] = 0
+                                elif col == 'Total':
+                                    # Para a coluna Total, agregar Total e Volume de todos os veículos e períodos
+                                    total_geral = df_visualizacao['Total'].sum()
+                                    volume_geral = df_visualizacao['Volume'].sum()
+                                    if pd.notnull(volume_geral) and volume_geral != 0:
+                                        cpu_geral = total_geral / volume_geral
+                                    else:
+                                        cpu_geral = 0
+                                    linha_total_download[col] = cpu_geral
+                                else:
+                                    total_col = df_tabela_total[col].sum()
+                                    linha_total_download[col] = total_col
+                    else:
+                        # Para Custo Total, somar normalmente
+                        for col in df_tabela_total.columns:
+                            if col != 'Veículo':
+                                total_col = df_tabela_total[col].sum()
+                                linha_total_download[col] = total_col
+
+                    df_total_download = pd.concat([
+                        df_total_download,
+                        pd.DataFrame([linha_total_download])
+                    ], ignore_index=True)
+                    return df_total_download
+
+                tipo_nome = "CPU" if tipo_visualizacao == "CPU (Custo por Unidade)" else "Custo_Total"
+                botao_download(
+                    functools.partial(montar_download_total_veiculo, df_tabela_total, df_visualizacao,
+                                      colunas_periodos, tipo_visualizacao),
+                    "📥 Baixar Tabela Total por Veículo", f"TC_Ext_tabela_total_veiculo_{tipo_nome}",
+                    "download_tabela_total_veiculo", nome_planilha='Total_Veiculo'
+                )
             else:
                 if not tem_veiculo or not tem_periodo:
                     colunas_faltando_total = []
@@ -2198,581 +1127,47 @@ if (coluna_visualizacao in df_visualizacao.columns and
                     st.info(f"ℹ️ Colunas necessárias não encontradas para criar a tabela total: {', '.join(colunas_faltando_total)}")
 
 
-# Gráfico 2: Soma do Valor por Oficina
-@st.cache_data(ttl=900, max_entries=2)
-def create_oficina_chart(df_data, coluna, tipo_viz):
-    """Cria gráfico de barras por Oficina"""
-    try:
-        if (coluna not in df_data.columns or
-                'Oficina' not in df_data.columns):
-            return None
-
-        # Se for CPU e tiver coluna Veículo, agrupar por Oficina e Veículo
-        # IMPORTANTE: Sempre agrupar por Período+Ano primeiro, depois por Oficina+Veículo
-        if (tipo_viz == "CPU (Custo por Unidade)" and
-                'Veículo' in df_data.columns and
-                'Total' in df_data.columns and 'Volume' in df_data.columns):
-            # Verificar se há múltiplos anos
-            tem_multiplos_anos = 'Ano' in df_data.columns and df_data['Ano'].nunique() > 1
-            
-            if tem_multiplos_anos and 'Período' in df_data.columns:
-                # Agrupar por Oficina, Veículo, Período E Ano, somar Total e Volume, calcular CPU
-                df_agrupado_periodo = df_data.groupby(['Oficina', 'Veículo', 'Período', 'Ano']).agg({
-                    'Total': 'sum',
-                    'Volume': 'sum'
-                }).reset_index()
-                # Recalcular CPU por Período+Ano
-                df_agrupado_periodo['CPU_temp'] = df_agrupado_periodo.apply(
-                    lambda row: (
-                        row['Total'] / row['Volume']
-                        if pd.notnull(row['Volume']) and row['Volume'] != 0
-                        else 0
-                    ),
-                    axis=1
-                )
-                # Agora agrupar por Oficina e Veículo, somar Total e Volume de todos os períodos
-                chart_data = df_agrupado_periodo.groupby(['Oficina', 'Veículo']).agg({
-                    'Total': 'sum',
-                    'Volume': 'sum'
-                }).reset_index()
-            elif 'Período' in df_data.columns:
-                # Agrupar por Oficina, Veículo e Período, somar Total e Volume, calcular CPU
-                df_agrupado_periodo = df_data.groupby(['Oficina', 'Veículo', 'Período']).agg({
-                    'Total': 'sum',
-                    'Volume': 'sum'
-                }).reset_index()
-                # Recalcular CPU por Período
-                df_agrupado_periodo['CPU_temp'] = df_agrupado_periodo.apply(
-                    lambda row: (
-                        row['Total'] / row['Volume']
-                        if pd.notnull(row['Volume']) and row['Volume'] != 0
-                        else 0
-                    ),
-                    axis=1
-                )
-                # Agora agrupar por Oficina e Veículo, somar Total e Volume de todos os períodos
-                chart_data = df_agrupado_periodo.groupby(['Oficina', 'Veículo']).agg({
-                    'Total': 'sum',
-                    'Volume': 'sum'
-                }).reset_index()
-            else:
-                # Se não tiver Período, agrupar apenas por Oficina e Veículo
-                chart_data = df_data.groupby(['Oficina', 'Veículo']).agg({
-                    'Total': 'sum',
-                    'Volume': 'sum'
-                }).reset_index()
-            
-            # Recalcular CPU final (Total agregado / Volume agregado)
-            chart_data[coluna] = chart_data.apply(
-                lambda row: (
-                    row['Total'] / row['Volume']
-                    if pd.notnull(row['Volume']) and row['Volume'] != 0
-                    else 0
-                ),
-                axis=1
-            )
-            chart_data = chart_data[['Oficina', 'Veículo', coluna]]
-        elif (tipo_viz == "CPU (Custo por Unidade)" and
-                'Veículo' in df_data.columns):
-            chart_data = df_data.groupby(
-                ['Oficina', 'Veículo'], as_index=False
-            )[coluna].sum()
-
-            # Ordenar por Oficina e depois por CPU decrescente
-            chart_data = chart_data.sort_values(
-                ['Oficina', coluna], ascending=[True, False]
-            )
-
-            titulo_y = "CPU (R$/Unidade)"
-            titulo_grafico = "CPU por Oficina e Veículo"
-
-            # Criar gráfico de barras agrupadas
-            grafico_barras = alt.Chart(chart_data).mark_bar().encode(
-                x=alt.X('Oficina:N', title='Oficina', sort='-y'),
-                y=alt.Y(f'{coluna}:Q', title=titulo_y),
-                color=alt.Color(
-                    'Veículo:N',
-                    title='Veículo',
-                    scale=alt.Scale(scheme='blues')
-                ),
-                tooltip=[
-                    alt.Tooltip('Oficina:N', title='Oficina'),
-                    alt.Tooltip('Veículo:N', title='Veículo'),
-                    alt.Tooltip(
-                        f'{coluna}:Q',
-                        title=coluna,
-                        format=',.4f'
-                    )
-                ]
-            ).properties(
-                title=titulo_grafico,
-                height=400
-            )
-
-            # Adicionar rótulos com valores nas barras
-            rotulos = grafico_barras.mark_text(
-                align='center',
-                baseline='middle',
-                dy=-10,
-                color='black',
-                fontSize=10
-            ).encode(
-                text=alt.Text(f'{coluna}:Q', format=',.4f')
-            )
-
-            return grafico_barras + rotulos
-        else:
-            # Gráfico normal sem separação por veículo
-            # Para CPU, recalcular a partir de Total e Volume agregados
-            if tipo_viz == "CPU (Custo por Unidade)" and 'Total' in df_data.columns and 'Volume' in df_data.columns:
-                # Verificar se há múltiplos anos
-                tem_multiplos_anos = 'Ano' in df_data.columns and df_data['Ano'].nunique() > 1
-                
-                if tem_multiplos_anos and 'Período' in df_data.columns:
-                    # Agrupar por Oficina, Período E Ano, somar Total e Volume, calcular CPU
-                    df_agrupado_periodo = df_data.groupby(['Oficina', 'Período', 'Ano']).agg({
-                        'Total': 'sum',
-                        'Volume': 'sum'
-                    }).reset_index()
-                    # Recalcular CPU por Período+Ano
-                    df_agrupado_periodo['CPU_temp'] = df_agrupado_periodo.apply(
-                        lambda row: (
-                            row['Total'] / row['Volume']
-                            if pd.notnull(row['Volume']) and row['Volume'] != 0
-                            else 0
-                        ),
-                        axis=1
-                    )
-                    # Agora agrupar por Oficina, somar Total e Volume de todos os períodos
-                    chart_data = df_agrupado_periodo.groupby('Oficina').agg({
-                        'Total': 'sum',
-                        'Volume': 'sum'
-                    }).reset_index()
-                elif 'Período' in df_data.columns:
-                    # Agrupar por Oficina e Período, somar Total e Volume, calcular CPU
-                    df_agrupado_periodo = df_data.groupby(['Oficina', 'Período']).agg({
-                        'Total': 'sum',
-                        'Volume': 'sum'
-                    }).reset_index()
-                    # Recalcular CPU por Período
-                    df_agrupado_periodo['CPU_temp'] = df_agrupado_periodo.apply(
-                        lambda row: (
-                            row['Total'] / row['Volume']
-                            if pd.notnull(row['Volume']) and row['Volume'] != 0
-                            else 0
-                        ),
-                        axis=1
-                    )
-                    # Agora agrupar por Oficina, somar Total e Volume de todos os períodos
-                    chart_data = df_agrupado_periodo.groupby('Oficina').agg({
-                        'Total': 'sum',
-                        'Volume': 'sum'
-                    }).reset_index()
-                else:
-                    # Se não tiver Período, agrupar apenas por Oficina
-                    chart_data = df_data.groupby('Oficina').agg({
-                        'Total': 'sum',
-                        'Volume': 'sum'
-                    }).reset_index()
-                
-                # Recalcular CPU final (Total agregado / Volume agregado)
-                chart_data[coluna] = chart_data.apply(
-                    lambda row: (
-                        row['Total'] / row['Volume']
-                        if pd.notnull(row['Volume']) and row['Volume'] != 0
-                        else 0
-                    ),
-                    axis=1
-                )
-                chart_data = chart_data[['Oficina', coluna]]
-            else:
-                chart_data = df_data.groupby('Oficina')[coluna].sum().reset_index()
-            chart_data = chart_data.sort_values(coluna, ascending=False)
-
-            # Definir título do eixo Y baseado no tipo
-            if tipo_viz == "CPU (Custo por Unidade)":
-                titulo_y = "CPU (R$/Unidade)"
-                titulo_grafico = "CPU por Oficina"
-            else:
-                titulo_y = "Soma do Valor (R$)"
-                titulo_grafico = "Soma do Valor por Oficina"
-
-            grafico_barras = alt.Chart(chart_data).mark_bar().encode(
-                x=alt.X('Oficina:N', title='Oficina', sort='-y'),
-                y=alt.Y(f'{coluna}:Q', title=titulo_y),
-                color=alt.Color(
-                    f'{coluna}:Q',
-                    title=coluna,
-                    scale=alt.Scale(scheme='blues')
-                ),
-                tooltip=[
-                    alt.Tooltip('Oficina:N', title='Oficina'),
-                    alt.Tooltip(
-                        f'{coluna}:Q',
-                        title=coluna,
-                        format=',.4f' if tipo_viz == "CPU (Custo por Unidade)"
-                        else ',.2f'
-                    )
-                ]
-            ).properties(
-                title=titulo_grafico,
-                height=400
-            )
-
-            # Adicionar rótulos com valores nas barras
-            formato_rotulo = (
-                ',.4f' if tipo_viz == "CPU (Custo por Unidade)" else ',.2f'
-            )
-            rotulos = grafico_barras.mark_text(
-                align='center',
-                baseline='middle',
-                dy=-10,
-                color='black',
-                fontSize=12
-            ).encode(
-                text=alt.Text(f'{coluna}:Q', format=formato_rotulo)
-            )
-
-            return grafico_barras + rotulos
-    except Exception as e:
-        st.error(f"Erro ao criar gráfico: {e}")
-        return None
-
+# Cubo dos gráficos por Oficina/Veículo (tc_dados.graficos): df_visualizacao agregado uma vez
+cubo_graficos = montar_cubo(df_visualizacao, ['Oficina', 'Veículo'], [coluna_visualizacao, 'Total', 'Volume'])
+if tipo_visualizacao == "CPU (Custo por Unidade)":
+    titulo_y_valor = "CPU (R$/Unidade)"
+    formato_valor = ',.4f'
+else:
+    titulo_y_valor = "Soma do Valor (R$)"
+    formato_valor = ',.2f'
 
 # Exibir gráfico por Oficina
 if ('Oficina' in df_visualizacao.columns and
         coluna_visualizacao in df_visualizacao.columns):
     if tipo_visualizacao == "CPU (Custo por Unidade)":
         st.subheader("📊 CPU por Oficina")
+        if 'Veículo' in df_visualizacao.columns:
+            # Barras agrupadas: CPU de cada Veículo dentro da Oficina
+            grafico_oficina = criar_grafico(
+                cubo_graficos, coluna_visualizacao, "CPU por Oficina e Veículo", titulo_y_valor,
+                dimensao=('Oficina', 'Veículo'), ponderado=True, formato=formato_valor
+            )
+        else:
+            grafico_oficina = criar_grafico(
+                cubo_graficos, coluna_visualizacao, "CPU por Oficina", titulo_y_valor,
+                dimensao='Oficina', ponderado=True, formato=formato_valor
+            )
     else:
         st.subheader("📊 Soma do Valor por Oficina")
-    grafico_oficina = create_oficina_chart(
-        df_visualizacao, coluna_visualizacao, tipo_visualizacao
-    )
+        grafico_oficina = criar_grafico(
+            cubo_graficos, coluna_visualizacao, "Soma do Valor por Oficina", titulo_y_valor,
+            dimensao='Oficina', formato=formato_valor
+        )
     if grafico_oficina:
         st.altair_chart(grafico_oficina, use_container_width=True)
 
 
-# Gráfico 4.5: Volume por Veículo
-@st.cache_data(ttl=900, max_entries=2)
-def create_volume_veiculo_chart(df_data):
-    """Cria gráfico de barras de Volume por Veículo"""
-    try:
-        if 'Volume' not in df_data.columns or 'Veículo' not in df_data.columns:
-            return None
-        
-        # Filtrar linhas com Volume e Veículo não nulos
-        df_data = df_data[df_data['Volume'].notna() & df_data['Veículo'].notna()].copy()
-        
-        if len(df_data) == 0:
-            return None
-        
-        # Agrupar por Veículo e somar Volume
-        # Se houver múltiplos anos, agrupar por Veículo, Período e Ano primeiro
-        tem_multiplos_anos = 'Ano' in df_data.columns and df_data['Ano'].nunique() > 1
-        
-        if tem_multiplos_anos and 'Período' in df_data.columns:
-            # Agrupar por Veículo, Período e Ano, somar Volume
-            df_agrupado_periodo = df_data.groupby(['Veículo', 'Período', 'Ano']).agg({
-                'Volume': 'sum'
-            }).reset_index()
-            # Agora agrupar por Veículo, somar Volume de todos os períodos
-            chart_data = df_agrupado_periodo.groupby('Veículo').agg({
-                'Volume': 'sum'
-            }).reset_index()
-        elif 'Período' in df_data.columns:
-            # Agrupar por Veículo e Período, somar Volume
-            df_agrupado_periodo = df_data.groupby(['Veículo', 'Período']).agg({
-                'Volume': 'sum'
-            }).reset_index()
-            # Agora agrupar por Veículo, somar Volume de todos os períodos
-            chart_data = df_agrupado_periodo.groupby('Veículo').agg({
-                'Volume': 'sum'
-            }).reset_index()
-        else:
-            # Se não tiver Período, agrupar apenas por Veículo
-            chart_data = df_data.groupby('Veículo').agg({
-                'Volume': 'sum'
-            }).reset_index()
-        
-        # Verificar se há dados
-        if len(chart_data) == 0:
-            return None
-        
-        # Filtrar valores nulos
-        chart_data = chart_data[chart_data['Volume'].notna()].copy()
-        
-        if len(chart_data) == 0:
-            return None
-        
-        chart_data = chart_data.sort_values('Volume', ascending=False)
-        
-        grafico_barras = alt.Chart(chart_data).mark_bar().encode(
-            x=alt.X(
-                'Veículo:N',
-                title='Veículo',
-                sort='-y'
-            ),
-            y=alt.Y('Volume:Q', title='Volume (Unidades)'),
-            color=alt.Color(
-                'Volume:Q',
-                title='Volume',
-                scale=alt.Scale(scheme='greens')
-            ),
-            tooltip=[
-                alt.Tooltip('Veículo:N', title='Veículo'),
-                alt.Tooltip('Volume:Q', title='Volume', format=',.0f')
-            ]
-        ).properties(
-            title="Volume por Veículo",
-            height=400
-        )
-        
-        # Adicionar rótulos
-        rotulos = grafico_barras.mark_text(
-            align='center',
-            baseline='middle',
-            dy=-10,
-            color='black',
-            fontSize=12
-        ).encode(
-            text=alt.Text('Volume:Q', format=',.0f')
-        )
-        
-        return grafico_barras + rotulos
-    except Exception as e:
-        st.error(f"Erro ao criar gráfico de volume: {e}")
-        return None
-
-
-# Gráfico 4: Total/CPU por Veículo
-@st.cache_data(ttl=900, max_entries=2)
-def create_total_chart(df_data, coluna, tipo_viz):
-    """Cria gráfico de barras de Total/CPU por Veículo"""
-    try:
-        if coluna not in df_data.columns:
-            return None
-
-        # Definir título e formato baseado no tipo
-        if tipo_viz == "CPU (Custo por Unidade)":
-            titulo_y = "CPU (R$/Unidade)"
-            formato = ',.4f'
-            if 'Veículo' in df_data.columns:
-                titulo_grafico = "CPU por Veículo"
-            else:
-                titulo_grafico = "CPU por Período"
-        else:
-            titulo_y = "Total (R$)"
-            formato = ',.2f'
-            if 'Veículo' in df_data.columns:
-                titulo_grafico = "Total por Veículo"
-            else:
-                titulo_grafico = "Total por Período"
-
-        # Verificar se tem coluna Veículo
-        if 'Veículo' in df_data.columns:
-            # Para CPU, recalcular a partir de Total e Volume agregados
-            # IMPORTANTE: Sempre agrupar por Período+Ano primeiro, depois por Veículo
-            if tipo_viz == "CPU (Custo por Unidade)" and 'Total' in df_data.columns and 'Volume' in df_data.columns:
-                # Verificar se há múltiplos anos e agrupar corretamente
-                tem_multiplos_anos = 'Ano' in df_data.columns and df_data['Ano'].nunique() > 1
-                
-                if tem_multiplos_anos:
-                    # Agrupar por Veículo, Período E Ano, somar Total e Volume, calcular CPU
-                    # Depois agrupar por Veículo, somar Total e Volume, e recalcular CPU final
-                    df_agrupado_periodo = df_data.groupby(['Veículo', 'Período', 'Ano']).agg({
-                        'Total': 'sum',
-                        'Volume': 'sum'
-                    }).reset_index()
-                    # Recalcular CPU por Período+Ano
-                    df_agrupado_periodo['CPU_temp'] = df_agrupado_periodo.apply(
-                        lambda row: (
-                            row['Total'] / row['Volume']
-                            if pd.notnull(row['Volume']) and row['Volume'] != 0
-                            else 0
-                        ),
-                        axis=1
-                    )
-                    # Agora agrupar por Veículo, somar Total e Volume de todos os períodos
-                    chart_data = df_agrupado_periodo.groupby('Veículo').agg({
-                        'Total': 'sum',
-                        'Volume': 'sum'
-                    }).reset_index()
-                else:
-                    # Agrupar por Veículo e Período, somar Total e Volume, calcular CPU
-                    # Depois agrupar por Veículo, somar Total e Volume, e recalcular CPU final
-                    if 'Período' in df_data.columns:
-                        df_agrupado_periodo = df_data.groupby(['Veículo', 'Período']).agg({
-                            'Total': 'sum',
-                            'Volume': 'sum'
-                        }).reset_index()
-                        # Recalcular CPU por Período
-                        df_agrupado_periodo['CPU_temp'] = df_agrupado_periodo.apply(
-                            lambda row: (
-                                row['Total'] / row['Volume']
-                                if pd.notnull(row['Volume']) and row['Volume'] != 0
-                                else 0
-                            ),
-                            axis=1
-                        )
-                        # Agora agrupar por Veículo, somar Total e Volume de todos os períodos
-                        chart_data = df_agrupado_periodo.groupby('Veículo').agg({
-                            'Total': 'sum',
-                            'Volume': 'sum'
-                        }).reset_index()
-                    else:
-                        # Se não tiver Período, agrupar apenas por Veículo
-                        chart_data = df_data.groupby('Veículo').agg({
-                            'Total': 'sum',
-                            'Volume': 'sum'
-                        }).reset_index()
-                
-                # Recalcular CPU final (Total agregado / Volume agregado)
-                chart_data[coluna] = chart_data.apply(
-                    lambda row: (
-                        row['Total'] / row['Volume']
-                        if pd.notnull(row['Volume']) and row['Volume'] != 0
-                        else 0
-                    ),
-                    axis=1
-                )
-                chart_data = chart_data[['Veículo', coluna]]
-            else:
-                chart_data = (
-                    df_data.groupby('Veículo')[coluna].sum().reset_index()
-                )
-            chart_data = chart_data.sort_values(coluna, ascending=False)
-
-            grafico_barras = alt.Chart(chart_data).mark_bar().encode(
-                x=alt.X(
-                    'Veículo:N',
-                    title='Veículo',
-                    sort='-y'
-                ),
-                y=alt.Y(f'{coluna}:Q', title=titulo_y),
-                color=alt.Color(
-                    f'{coluna}:Q',
-                    title=coluna,
-                    scale=alt.Scale(scheme='blues')
-                ),
-                tooltip=[
-                    alt.Tooltip('Veículo:N', title='Veículo'),
-                    alt.Tooltip(
-                        f'{coluna}:Q',
-                        title=coluna,
-                        format=formato
-                    )
-                ]
-            ).properties(
-                title=titulo_grafico,
-                height=400
-            )
-        else:
-            # Se não tiver Veículo, usar Período como fallback
-            if 'Período' not in df_data.columns:
-                return None
-            
-            # Verificar se há múltiplos anos
-            tem_multiplos_anos = 'Ano' in df_data.columns and df_data['Ano'].nunique() > 1
-            
-            if tem_multiplos_anos:
-                # Agrupar por Ano e Período
-                # Para CPU, usar EXATAMENTE a mesma lógica da tabela (que está correta)
-                # IMPORTANTE: A tabela funciona porque agrupa df_visualizacao por Ano e Período, soma Total e Volume, e calcula CPU
-                # O gráfico deve fazer EXATAMENTE o mesmo
-                if tipo_viz == "CPU (Custo por Unidade)" and 'Total' in df_data.columns and 'Volume' in df_data.columns:
-                    # MESMA LÓGICA DA TABELA (linha 1577-1589): Agrupar por Ano e Período, somar Total e Volume, calcular CPU
-                    # Isso garante que valores sejam calculados corretamente, não somando CPUs já calculados
-                    chart_data = df_data.groupby(['Ano', 'Período']).agg({
-                        'Total': 'sum',
-                        'Volume': 'sum'
-                    }).reset_index()
-                    # Recalcular CPU (EXATAMENTE como a tabela linha 1582-1588)
-                    chart_data[coluna] = chart_data.apply(
-                        lambda row: (
-                            row['Total'] / row['Volume']
-                            if pd.notnull(row['Volume']) and row['Volume'] != 0
-                            else 0
-                        ),
-                        axis=1
-                    )
-                    chart_data = chart_data[['Ano', 'Período', coluna]]
-                else:
-                    chart_data = df_data.groupby(['Ano', 'Período'])[coluna].sum().reset_index()
-                
-                # Criar coluna combinada para o rótulo do gráfico
-                chart_data['Período_Completo'] = chart_data['Período'].astype(str) + ' ' + chart_data['Ano'].astype(str)
-                
-                # Ordenar por ano e mês
-                chart_data = ordenar_por_mes(chart_data, 'Período')
-                ordem_periodos = chart_data['Período_Completo'].tolist()
-                
-                # Usar Período_Completo no gráfico
-                coluna_periodo_grafico = 'Período_Completo'
-            else:
-                # Comportamento original: agrupar apenas por Período
-                # Para CPU, recalcular a partir de Total e Volume agregados
-                if tipo_viz == "CPU (Custo por Unidade)" and 'Total' in df_data.columns and 'Volume' in df_data.columns:
-                    chart_data = df_data.groupby('Período').agg({
-                        'Total': 'sum',
-                        'Volume': 'sum'
-                    }).reset_index()
-                    # Recalcular CPU
-                    chart_data[coluna] = chart_data.apply(
-                        lambda row: (
-                            row['Total'] / row['Volume']
-                            if pd.notnull(row['Volume']) and row['Volume'] != 0
-                            else 0
-                        ),
-                        axis=1
-                    )
-                    chart_data = chart_data[['Período', coluna]]
-                else:
-                    chart_data = df_data.groupby('Período')[coluna].sum().reset_index()
-                chart_data = ordenar_por_mes(chart_data, 'Período')
-                ordem_periodos = chart_data['Período'].tolist()
-                coluna_periodo_grafico = 'Período'
-
-            grafico_barras = alt.Chart(chart_data).mark_bar().encode(
-                x=alt.X(
-                    f'{coluna_periodo_grafico}:N',
-                    title='Período',
-                    sort=ordem_periodos
-                ),
-                y=alt.Y(f'{coluna}:Q', title=titulo_y),
-                color=alt.Color(
-                    f'{coluna}:Q',
-                    title=coluna,
-                    scale=alt.Scale(scheme='blues')
-                ),
-                tooltip=[
-                    alt.Tooltip(f'{coluna_periodo_grafico}:N', title='Período'),
-                    alt.Tooltip(
-                        f'{coluna}:Q',
-                        title=coluna,
-                        format=formato
-                    )
-                ]
-            ).properties(
-                title=titulo_grafico,
-                height=400
-            )
-
-        # Adicionar rótulos
-        rotulos = grafico_barras.mark_text(
-            align='center',
-            baseline='middle',
-            dy=-10,
-            color='black',
-            fontSize=12
-        ).encode(
-            text=alt.Text(f'{coluna}:Q', format=formato)
-        )
-
-        return grafico_barras + rotulos
-    except Exception as e:
-        st.error(f"Erro ao criar gráfico: {e}")
-        return None
+def criar_grafico_volume_veiculo(cubo):
+    """Volume por Veículo a partir do cubo da página"""
+    return criar_grafico(
+        cubo, 'Volume', "Volume por Veículo", 'Volume (Unidades)', dimensao='Veículo',
+        formato=',.0f', esquema='greens'
+    )
 
 
 # Exibir gráfico de Total/CPU por Veículo
@@ -2780,8 +1175,9 @@ if 'Veículo' in df_visualizacao.columns:
     if tipo_visualizacao == "CPU (Custo por Unidade)":
         if coluna_visualizacao in df_visualizacao.columns:
             st.subheader("📊 CPU por Veículo")
-            grafico_total = create_total_chart(
-                df_visualizacao, coluna_visualizacao, tipo_visualizacao
+            grafico_total = criar_grafico(
+                cubo_graficos, coluna_visualizacao, "CPU por Veículo", titulo_y_valor,
+                dimensao='Veículo', ponderado=True, formato=formato_valor
             )
             if grafico_total:
                 st.altair_chart(grafico_total, use_container_width=True)
@@ -2789,7 +1185,7 @@ if 'Veículo' in df_visualizacao.columns:
             # Gráfico de Volume por Veículo (logo abaixo do gráfico de CPU)
             if 'Volume' in df_visualizacao.columns and 'Veículo' in df_visualizacao.columns:
                 st.subheader("📊 Volume por Veículo")
-                grafico_volume = create_volume_veiculo_chart(df_visualizacao)
+                grafico_volume = criar_grafico_volume_veiculo(cubo_graficos)
                 if grafico_volume is not None:
                     st.altair_chart(grafico_volume, use_container_width=True)
                 else:
@@ -2808,7 +1204,7 @@ if 'Veículo' in df_visualizacao.columns:
                         try:
                             df_test = df_visualizacao[['Veículo', 'Volume']].dropna()
                             if len(df_test) > 0:
-                                df_grouped = df_test.groupby('Veículo')['Volume'].sum().reset_index()
+                                df_grouped = df_test.groupby('Veículo', observed=True)['Volume'].sum().reset_index()
                                 st.write("**Dados agrupados:**")
                                 st.dataframe(df_grouped)
                         except Exception as e:
@@ -2816,8 +1212,8 @@ if 'Veículo' in df_visualizacao.columns:
     elif tipo_visualizacao == "Custo Total":
         if 'Total' in df_filtrado.columns:
             st.subheader("📊 Total por Veículo")
-            grafico_total = create_total_chart(
-                df_filtrado, 'Total', tipo_visualizacao
+            grafico_total = criar_grafico(
+                cubo_graficos, 'Total', "Total por Veículo", "Total (R$)", dimensao='Veículo'
             )
             if grafico_total:
                 st.altair_chart(grafico_total, use_container_width=True)
@@ -2827,7 +1223,7 @@ if 'Veículo' in df_visualizacao.columns:
         # No modo CPU funciona porque df_visualizacao já tem Volume e está agrupado corretamente
         if 'Volume' in df_visualizacao.columns and 'Veículo' in df_visualizacao.columns:
             st.subheader("📊 Volume por Veículo")
-            grafico_volume = create_volume_veiculo_chart(df_visualizacao)
+            grafico_volume = criar_grafico_volume_veiculo(cubo_graficos)
             if grafico_volume is not None:
                 st.altair_chart(grafico_volume, use_container_width=True)
 elif 'Período' in df_visualizacao.columns:
@@ -2835,17 +1231,16 @@ elif 'Período' in df_visualizacao.columns:
     if tipo_visualizacao == "CPU (Custo por Unidade)":
         if coluna_visualizacao in df_visualizacao.columns:
             st.subheader("📊 CPU por Período")
-            grafico_total = create_total_chart(
-                df_visualizacao, coluna_visualizacao, tipo_visualizacao
+            grafico_total = criar_grafico(
+                cubo_graficos, coluna_visualizacao, "CPU por Período", titulo_y_valor,
+                ponderado=True, formato=formato_valor
             )
             if grafico_total:
                 st.altair_chart(grafico_total, use_container_width=True)
     elif tipo_visualizacao == "Custo Total":
         if 'Total' in df_filtrado.columns:
             st.subheader("📊 Total por Período")
-            grafico_total = create_total_chart(
-                df_filtrado, 'Total', tipo_visualizacao
-            )
+            grafico_total = criar_grafico(cubo_graficos, 'Total', "Total por Período", "Total (R$)")
             if grafico_total:
                 st.altair_chart(grafico_total, use_container_width=True)
 
@@ -2873,14 +1268,26 @@ if ('Oficina' in df_visualizacao.columns and
                     df_visualizacao_pivot['Ano'].astype(str)
                 )
                 
-                # Criar tabela pivot
-                df_pivot = df_visualizacao_pivot.pivot_table(
-                    index='Oficina',
-                    columns='Período_Ano',
-                    values=coluna_visualizacao,
-                    aggfunc='sum',
-                    fill_value=0
-                )
+                # Criar tabela pivot (soma exata em inteiros para valores em R$)
+                if tipo_visualizacao == "CPU (Custo por Unidade)":
+                    # CPU da Oficina no mês = soma do Total / soma do Volume (não a soma dos CPUs dos Veículos)
+                    df_pivot = tabela_cpu(
+                        cubo_cpu.assign(**{'Período_Ano': cubo_cpu['Período'].astype(str) + ' ' + cubo_cpu['Ano'].astype(str)}),
+                        'Oficina', 'Período_Ano', coluna_custo
+                    )
+                elif coluna_visualizacao in COLUNAS_MONETARIAS:
+                    df_pivot = tabela_soma(
+                        df_visualizacao_pivot, 'Oficina', 'Período_Ano', coluna_visualizacao
+                    )
+                else:
+                    df_pivot = df_visualizacao_pivot.pivot_table(
+                        index='Oficina',
+                        columns='Período_Ano',
+                        values=coluna_visualizacao,
+                        aggfunc='sum',
+                        fill_value=0,
+                        observed=True
+                    )
                 
                 # Ordenar colunas por ano e mês
                 colunas_ordenadas = []
@@ -2899,14 +1306,23 @@ if ('Oficina' in df_visualizacao.columns and
                 ]
                 df_pivot = df_pivot[colunas_ordenadas + colunas_restantes]
             else:
-                # Criar tabela pivot
-                df_pivot = df_visualizacao.pivot_table(
-                    index='Oficina',
-                    columns='Período',
-                    values=coluna_visualizacao,
-                    aggfunc='sum',
-                    fill_value=0
-                )
+                # Criar tabela pivot (soma exata em inteiros para valores em R$)
+                if tipo_visualizacao == "CPU (Custo por Unidade)":
+                    # CPU da Oficina no mês = soma do Total / soma do Volume (não a soma dos CPUs dos Veículos)
+                    df_pivot = tabela_cpu(cubo_cpu, 'Oficina', 'Período', coluna_custo)
+                elif coluna_visualizacao in COLUNAS_MONETARIAS:
+                    df_pivot = tabela_soma(
+                        df_visualizacao, 'Oficina', 'Período', coluna_visualizacao
+                    )
+                else:
+                    df_pivot = df_visualizacao.pivot_table(
+                        index='Oficina',
+                        columns='Período',
+                        values=coluna_visualizacao,
+                        aggfunc='sum',
+                        fill_value=0,
+                        observed=True
+                    )
 
                 # Ordenar colunas por ordem cronológica dos meses
                 colunas_existentes = [
@@ -2917,65 +1333,29 @@ if ('Oficina' in df_visualizacao.columns and
                 ]
                 df_pivot = df_pivot[colunas_existentes + colunas_restantes]
 
-            # Calcular total por linha
-            df_pivot['Total'] = df_pivot.sum(axis=1)
+            # Calcular total por linha (em CPU, tabela_cpu já traz o CPU da linha inteira)
+            if tipo_visualizacao != "CPU (Custo por Unidade)":
+                if coluna_visualizacao in COLUNAS_MONETARIAS:
+                    df_pivot['Total'] = somar_linhas(df_pivot)
+                else:
+                    df_pivot['Total'] = df_pivot.sum(axis=1)
             df_pivot = df_pivot.sort_values('Total', ascending=False)
 
-            # Formatar valores baseado no tipo de visualização
-            def formatar_valor(val, tipo):
-                if isinstance(val, (int, float)):
-                    if tipo == "CPU (Custo por Unidade)":
-                        return f"{val:,.4f}"
-                    else:
-                        return f"R$ {val:,.2f}"
-                return val
-
-            # Aplicar formatação
-            df_pivot_formatado = df_pivot.copy()
-            for col in df_pivot_formatado.columns:
-                df_pivot_formatado[col] = df_pivot_formatado[col].apply(
-                    lambda x: formatar_valor(x, tipo_visualizacao)
-                )
-            
             # Remover colunas 'mes', 'Mes', 'QTD', 'soma_percentuais' e 'Soma_Percentuais' se existirem
             colunas_para_remover = ['mes', 'Mes', 'QTD', 'soma_percentuais', 'Soma_Percentuais']
-            for col in colunas_para_remover:
-                if col in df_pivot_formatado.columns:
-                    df_pivot_formatado = df_pivot_formatado.drop(columns=[col])
-
-            st.dataframe(df_pivot_formatado, use_container_width=True)
-
-            # Botão de download da Tabela Dinâmica
-            if st.button(
-                "📥 Baixar Tabela Dinâmica (Excel)",
-                use_container_width=True,
-                key="download_pivot"
-            ):
-                with st.spinner("Gerando arquivo da tabela dinâmica..."):
-                    try:
-                        # Obter pasta Downloads do usuário
-                        downloads_path = os.path.join(
-                            os.path.expanduser("~"), "Downloads"
-                        )
-                        file_name = "TC_Ext_tabela_dinamica.xlsx"
-                        file_path = os.path.join(downloads_path, file_name)
-
-                        # Salvar arquivo diretamente na pasta Downloads
-                        with pd.ExcelWriter(
-                            file_path, engine='openpyxl'
-                        ) as writer:
-                            df_pivot.to_excel(
-                                writer, index=True, sheet_name='Tabela_Dinamica'
-                            )
-
-                        st.success(
-                            f"✅ Arquivo salvo com sucesso em: {file_path}"
-                        )
-                        st.info(
-                            f"📁 Verifique sua pasta Downloads: {downloads_path}"
-                        )
-                    except Exception as e:
-                        st.error(f"❌ Erro ao salvar arquivo: {str(e)}")
+            df_pivot_exibir = df_pivot.drop(
+                columns=[col for col in colunas_para_remover if col in df_pivot.columns]
+            )
+
+            # Valores continuam numéricos: R$ / CPU formatados na exibição
+            st.dataframe(
+                df_pivot_exibir, use_container_width=True,
+                column_config=config_colunas_valor(df_pivot_exibir.columns, tipo_visualizacao)
+            )
+
+            # Download da Tabela Dinâmica (gerado em memória no clique)
+            botao_download(df_pivot, "📥 Baixar Tabela Dinâmica", "TC_Ext_tabela_dinamica", "download_pivot",
+                           nome_planilha='Tabela_Dinamica', index=True)
 
 # Exibir tabela filtrada (TODAS as linhas)
 st.markdown("---")
@@ -2987,43 +1367,23 @@ else:
     titulo_expander_filtrada = "📋 **Tabela Filtrada (Todas as Linhas)**"
 
 with st.expander(titulo_expander_filtrada, expanded=False):
-    # Usar TODAS as linhas (sem limite)
-    df_display = df_visualizacao.copy()
-
     # Remover colunas 'mes', 'Mes', 'QTD', 'soma_percentuais' e 'Soma_Percentuais' se existirem
     colunas_para_remover = ['mes', 'Mes', 'QTD', 'soma_percentuais', 'Soma_Percentuais']
-    for col in colunas_para_remover:
-        if col in df_display.columns:
-            df_display = df_display.drop(columns=[col])
-
-    st.info(f"📊 Exibindo todas as {len(df_display):,} linhas e {len(df_display.columns)} colunas")
-    st.dataframe(df_display, use_container_width=True)
-
-    # Botão de download da Tabela Filtrada
-    if st.button(
-        "📥 Baixar Tabela Filtrada (Excel)",
-        use_container_width=True,
-        key="download_filtered"
-    ):
-        with st.spinner("Gerando arquivo da tabela filtrada..."):
-            try:
-                # Obter pasta Downloads do usuário
-                downloads_path = os.path.join(
-                    os.path.expanduser("~"), "Downloads"
-                )
-                file_name = "TC_Ext_tabela_filtrada.xlsx"
-                file_path = os.path.join(downloads_path, file_name)
+    df_display = df_visualizacao.drop(
+        columns=[col for col in colunas_para_remover if col in df_visualizacao.columns]
+    )
 
-                # Salvar arquivo diretamente na pasta Downloads
-                with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
-                    df_visualizacao.to_excel(
-                        writer, index=False, sheet_name='Dados_Filtrados'
-                    )
+    st.info(f"📊 {len(df_display):,} linhas e {len(df_display.columns)} colunas")
+    # TODAS as linhas, paginadas no servidor: só a página visível vai para o navegador
+    exibir_tabela_paginada(df_display, "tabela_filtrada")
+
+    # Download da Tabela Filtrada (gerado na fila de exportação, com progresso)
+    botao_exportacao(df_visualizacao, "Tabela Filtrada", "TC_Ext_tabela_filtrada", "download_filtered",
+                     identidade=(ano_selecionado, filtro.chave, tipo_visualizacao),
+                     nome_planilha='Dados_Filtrados')
 
-                st.success(f"✅ Arquivo salvo com sucesso em: {file_path}")
-                st.info(f"📁 Verifique sua pasta Downloads: {downloads_path}")
-            except Exception as e:
-                st.error(f"❌ Erro ao salvar arquivo: {str(e)}")
+# Gravar o estado da visão na URL (link compartilhável)
+sincronizar_url()
 
 # Footer
 st.markdown("---")
@@ -4,8 +4,14 @@ import altair as alt
 import os
 import numpy as np
 import re
-import shutil
 from datetime import datetime, timedelta
+from tc_dados.cenarios_forecast import (
+    CENARIO_PADRAO, aplicar_retencao, caminho_tabela, listar_execucoes, normalizar_cenario, salvar_execucao
+)
+from tc_dados.moeda import COLUNAS_MONETARIAS
+from tc_dados.versionamento import (
+    criar_versao, existe_na_versao, publicar_versao, resolver_caminho, versao_publicada
+)
 
 # Configuração da página
 st.set_page_config(
@@ -55,10 +61,10 @@ def listar_anos_disponiveis():
     return sorted(anos_disponiveis, reverse=True)  # Mais recente primeiro
 
 # Função auxiliar para encontrar arquivo parquet na ordem de prioridade
-def encontrar_arquivo_parquet(nome_arquivo, ano_selecionado=None):
+def encontrar_arquivo_parquet(nome_arquivo, ano_selecionado=None, cenario=None):
     """
     Busca arquivo parquet na seguinte ordem de prioridade:
-    1. Pasta Forecast (dados/Forecast/) - PRIORIDADE MÁXIMA
+    1. Pasta Forecast (última execução do cenário em dados/Forecast/cenarios/) - PRIORIDADE MÁXIMA
     2. Se ano_selecionado for especificado: Pasta do ano (dados/{ANO}/)
     3. Histórico consolidado (dados/historico_consolidado/)
     4. Pasta do ano mais recente (dados/{ANO}/)
@@ -66,24 +72,24 @@ def encontrar_arquivo_parquet(nome_arquivo, ano_selecionado=None):
     """
     # 1. PRIORIDADE: Tentar pasta Forecast primeiro
     if nome_arquivo == "df_final.parquet":
-        caminho_forecast = os.path.join("dados", "Forecast", "forecast_completo.parquet")
-        if os.path.exists(caminho_forecast):
+        caminho_forecast = caminho_tabela("forecast_completo", cenario=cenario) or os.path.join("dados", "Forecast", "forecast_completo.parquet")
+        if existe_na_versao(caminho_forecast):
             return caminho_forecast
     
     if nome_arquivo == "df_vol.parquet":
-        caminho_forecast_vol = os.path.join("dados", "Forecast", "df_vol_historico.parquet")
-        if os.path.exists(caminho_forecast_vol):
+        caminho_forecast_vol = caminho_tabela("df_vol_historico", cenario=cenario) or os.path.join("dados", "Forecast", "df_vol_historico.parquet")
+        if existe_na_versao(caminho_forecast_vol):
             return caminho_forecast_vol
     
     # Se ano específico foi selecionado, buscar na pasta do ano
     if ano_selecionado is not None and ano_selecionado != "Todos":
         caminho_ano = os.path.join("dados", str(ano_selecionado), nome_arquivo)
-        if os.path.exists(caminho_ano):
+        if existe_na_versao(caminho_ano):
             return caminho_ano
     
     # 2. Tentar histórico consolidado (fallback)
     caminho_historico = os.path.join("dados", "historico_consolidado", nome_arquivo.replace(".parquet", "_historico.parquet"))
-    if os.path.exists(caminho_historico):
+    if existe_na_versao(caminho_historico):
         return caminho_historico
     
     # 3. Tentar pasta do ano mais recente
@@ -98,7 +104,7 @@ def encontrar_arquivo_parquet(nome_arquivo, ano_selecionado=None):
         if anos_disponiveis:
             ano_mais_recente = max(anos_disponiveis)
             caminho_ano = os.path.join(pasta_dados, str(ano_mais_recente), nome_arquivo)
-            if os.path.exists(caminho_ano):
+            if existe_na_versao(caminho_ano):
                 return caminho_ano
     
     # 4. Tentar raiz (compatibilidade)
@@ -141,13 +147,13 @@ st.sidebar.markdown("---")
     max_entries=10,  # Aumentar para cachear diferentes anos
     show_spinner=True
 )
-def load_data(ano_selecionado_param):
-    """Carrega os dados do arquivo parquet - PRIORIZA PASTA FORECAST"""
+def load_data(ano_selecionado_param, cenario_param=None):
+    """Carrega os dados do arquivo parquet - PRIORIZA PASTA FORECAST (última execução do cenário)"""
     try:
         # PRIORIDADE 1: Tentar carregar de forecast_completo.parquet na pasta Forecast
-        caminho_forecast = os.path.join("dados", "Forecast", "forecast_completo.parquet")
-        if os.path.exists(caminho_forecast):
-            df = pd.read_parquet(caminho_forecast)
+        caminho_forecast = caminho_tabela("forecast_completo", cenario=cenario_param) or os.path.join("dados", "Forecast", "forecast_completo.parquet")
+        if existe_na_versao(caminho_forecast):
+            df = pd.read_parquet(resolver_caminho(caminho_forecast))
             
             # Se um ano específico foi selecionado, filtrar
             if ano_selecionado_param != "Todos" and "Ano" in df.columns:
@@ -161,7 +167,7 @@ def load_data(ano_selecionado_param):
                         df[col] = df[col].astype('category')
             
             # Converter floats para tipos menores
-            for col in df.select_dtypes(include=['float64']).columns:
+            for col in df.select_dtypes(include=['float64']).columns.difference(COLUNAS_MONETARIAS):
                 df[col] = pd.to_numeric(df[col], downcast='float')
             
             # Converter ints para tipos menores
@@ -172,7 +178,7 @@ def load_data(ano_selecionado_param):
         
         # FALLBACK: Usar função encontrar_arquivo_parquet (que também prioriza Forecast)
         ano_para_busca = None if ano_selecionado_param == "Todos" else ano_selecionado_param
-        arquivo_parquet = encontrar_arquivo_parquet("df_final.parquet", ano_para_busca)
+        arquivo_parquet = encontrar_arquivo_parquet("df_final.parquet", ano_para_busca, cenario_param)
 
         if arquivo_parquet is None:
             st.error(f"❌ Arquivo não encontrado: df_final.parquet")
@@ -183,7 +189,7 @@ def load_data(ano_selecionado_param):
             st.stop()
 
         # Carregar dados
-        df = pd.read_parquet(arquivo_parquet)
+        df = pd.read_parquet(resolver_caminho(arquivo_parquet))
 
         # Se carregou do histórico consolidado e um ano específico foi selecionado, filtrar
         if ano_selecionado_param != "Todos" and "Ano" in df.columns:
@@ -197,7 +203,7 @@ def load_data(ano_selecionado_param):
                     df[col] = df[col].astype('category')
 
         # Converter floats para tipos menores
-        for col in df.select_dtypes(include=['float64']).columns:
+        for col in df.select_dtypes(include=['float64']).columns.difference(COLUNAS_MONETARIAS):
             df[col] = pd.to_numeric(df[col], downcast='float')
 
         # Converter ints para tipos menores
@@ -216,13 +222,13 @@ def load_data(ano_selecionado_param):
     max_entries=10,  # Aumentar para cachear diferentes anos
     show_spinner=True
 )
-def load_volume_data(ano_selecionado_param):
-    """Carrega os dados de volume do arquivo parquet - PRIORIZA PASTA FORECAST"""
+def load_volume_data(ano_selecionado_param, cenario_param=None):
+    """Carrega os dados de volume do arquivo parquet - PRIORIZA PASTA FORECAST (última execução do cenário)"""
     try:
         # PRIORIDADE 1: Tentar carregar de df_vol_historico.parquet na pasta Forecast
-        caminho_forecast_vol = os.path.join("dados", "Forecast", "df_vol_historico.parquet")
-        if os.path.exists(caminho_forecast_vol):
-            df = pd.read_parquet(caminho_forecast_vol)
+        caminho_forecast_vol = caminho_tabela("df_vol_historico", cenario=cenario_param) or os.path.join("dados", "Forecast", "df_vol_historico.parquet")
+        if existe_na_versao(caminho_forecast_vol):
+            df = pd.read_parquet(resolver_caminho(caminho_forecast_vol))
             
             # Se um ano específico foi selecionado, filtrar
             if ano_selecionado_param != "Todos" and "Ano" in df.columns:
@@ -236,7 +242,7 @@ def load_volume_data(ano_selecionado_param):
                         df[col] = df[col].astype('category')
             
             # Converter floats para tipos menores
-            for col in df.select_dtypes(include=['float64']).columns:
+            for col in df.select_dtypes(include=['float64']).columns.difference(COLUNAS_MONETARIAS):
                 df[col] = pd.to_numeric(df[col], downcast='float')
             
             # Converter ints para tipos menores
@@ -247,12 +253,12 @@ def load_volume_data(ano_selecionado_param):
         
         # FALLBACK: Usar função encontrar_arquivo_parquet
         ano_para_busca = None if ano_selecionado_param == "Todos" else ano_selecionado_param
-        arquivo_parquet = encontrar_arquivo_parquet("df_vol.parquet", ano_para_busca)
+        arquivo_parquet = encontrar_arquivo_parquet("df_vol.parquet", ano_para_busca, cenario_param)
 
         if arquivo_parquet is None:
             return None
 
-        df = pd.read_parquet(arquivo_parquet)
+        df = pd.read_parquet(resolver_caminho(arquivo_parquet))
 
         # Se carregou do histórico consolidado e um ano específico foi selecionado, filtrar
         if ano_selecionado_param != "Todos" and "Ano" in df.columns:
@@ -266,7 +272,7 @@ def load_volume_data(ano_selecionado_param):
                     df[col] = df[col].astype('category')
 
         # Converter floats para tipos menores
-        for col in df.select_dtypes(include=['float64']).columns:
+        for col in df.select_dtypes(include=['float64']).columns.difference(COLUNAS_MONETARIAS):
             df[col] = pd.to_numeric(df[col], downcast='float')
 
         # Converter ints para tipos menores
@@ -278,14 +284,14 @@ def load_volume_data(ano_selecionado_param):
         return None
 
 @st.cache_data(ttl=3600, show_spinner=False)
-def load_volume_historico_data():
-    """Carrega os dados de volume histórico da pasta Forecast"""
+def load_volume_historico_data(cenario_param=None):
+    """Carrega os dados de volume histórico da pasta Forecast (última execução do cenário)"""
     try:
         # PRIORIDADE: Buscar arquivo na pasta Forecast
-        caminho_forecast = os.path.join("dados", "Forecast", "df_vol_historico.parquet")
+        caminho_forecast = caminho_tabela("df_vol_historico", cenario=cenario_param) or os.path.join("dados", "Forecast", "df_vol_historico.parquet")
         
-        if os.path.exists(caminho_forecast):
-            df = pd.read_parquet(caminho_forecast)
+        if existe_na_versao(caminho_forecast):
+            df = pd.read_parquet(resolver_caminho(caminho_forecast))
             
             # Otimizar tipos de dados
             for col in df.columns:
@@ -298,7 +304,7 @@ def load_volume_historico_data():
                         pass
             
             # Converter floats para tipos menores
-            for col in df.select_dtypes(include=['float64']).columns:
+            for col in df.select_dtypes(include=['float64']).columns.difference(COLUNAS_MONETARIAS):
                 df[col] = pd.to_numeric(df[col], downcast='float')
             
             # Converter ints para tipos menores
@@ -309,8 +315,8 @@ def load_volume_historico_data():
         
         # FALLBACK: Tentar histórico consolidado
         caminho_historico = os.path.join("dados", "historico_consolidado", "df_vol_historico.parquet")
-        if os.path.exists(caminho_historico):
-            df = pd.read_parquet(caminho_historico)
+        if existe_na_versao(caminho_historico):
+            df = pd.read_parquet(resolver_caminho(caminho_historico))
             
             # Otimizar tipos de dados
             for col in df.columns:
@@ -323,7 +329,7 @@ def load_volume_historico_data():
                         pass
             
             # Converter floats para tipos menores
-            for col in df.select_dtypes(include=['float64']).columns:
+            for col in df.select_dtypes(include=['float64']).columns.difference(COLUNAS_MONETARIAS):
                 df[col] = pd.to_numeric(df[col], downcast='float')
             
             # Converter ints para tipos menores
@@ -337,9 +343,13 @@ def load_volume_historico_data():
         return None
 
 
+# Cenário do forecast (campo "Nome do cenário" mais abaixo): as tabelas da
+# pasta Forecast vêm da última execução deste cenário, não de qualquer cenário
+cenario_atual = normalizar_cenario(st.session_state.get('cenario_forecast', CENARIO_PADRAO))
+
 # Carregar dados com o ano selecionado
 try:
-    df_total = load_data(ano_selecionado)
+    df_total = load_data(ano_selecionado, cenario_atual)
     st.sidebar.success("✅ Dados carregados com sucesso")
     if ano_selecionado == "Todos":
         st.sidebar.info(f"📊 {len(df_total):,} registros (Todos os anos)")
@@ -564,10 +574,10 @@ def ordenar_periodo_para_select(periodo_str):
 periodos_disponiveis = []
 caminho_historico = os.path.join("dados", "historico_consolidado", "df_final_historico.parquet")
 
-if os.path.exists(caminho_historico):
+if existe_na_versao(caminho_historico):
     try:
         # Carregar dados do histórico consolidado para obter todos os períodos disponíveis
-        df_historico_periodos = pd.read_parquet(caminho_historico)
+        df_historico_periodos = pd.read_parquet(resolver_caminho(caminho_historico))
         
         if 'Período' in df_historico_periodos.columns:
             # Pegar períodos únicos dos dados históricos consolidados
@@ -1329,6 +1339,12 @@ config_forecast_temp = {
 # Botão unificado para aplicar todas as configurações
 col_btn1, col_btn2, col_btn3 = st.columns([1, 2, 1])
 with col_btn2:
+    st.text_input(
+        "🏷️ Nome do cenário:",
+        value="padrao",
+        key="cenario_forecast",
+        help="O forecast gerado é salvo em dados/Forecast/cenarios/<cenário>/<data-hora>, sem sobrescrever execuções anteriores"
+    )
     aplicar_config_forecast = st.button(
         "✅ Aplicar Configurações do Forecast",
         use_container_width=True,
@@ -1371,6 +1387,53 @@ if aplicar_config_forecast:
     st.success("✅ Configurações aplicadas com sucesso! Recalculando forecast...")
     st.rerun()
 
+# ====================================================================
+# 📂 CENÁRIOS SALVOS - recarregar forecasts anteriores sem recalcular
+# ====================================================================
+@st.cache_data(max_entries=20, show_spinner=False)
+def carregar_total_execucao(id_execucao):
+    """Total do forecast por Período de uma execução salva (execuções são imutáveis: sem TTL)"""
+    caminho = caminho_tabela("forecast_completo", id_execucao)
+    if caminho is None or not existe_na_versao(caminho):
+        return None
+    df = pd.read_parquet(resolver_caminho(caminho), columns=['Período', 'Total'])
+    return df.groupby('Período', sort=False)['Total'].sum()
+
+execucoes_salvas = listar_execucoes()
+if execucoes_salvas:
+    with st.expander(f"📂 Cenários salvos ({len(execucoes_salvas)} execuções)", expanded=False):
+        df_execucoes = pd.DataFrame([
+            {
+                'Execução': m['id'],
+                'Criado em': m['criado_em'],
+                'Último período real': m['config'].get('ultimo_periodo_dados'),
+                'Meses na média': m['config'].get('num_meses_media'),
+                'Sens. Fixo': m['config'].get('sensibilidade_fixo'),
+                'Sens. Variável': m['config'].get('sensibilidade_variavel'),
+                'Inflação (%)': m['config'].get('inflacao_global'),
+                'Linhas': m['tabelas'].get('forecast_completo', 0),
+            }
+            for m in execucoes_salvas
+        ])
+        st.dataframe(df_execucoes, use_container_width=True, hide_index=True)
+        
+        execucoes_comparar = st.multiselect(
+            "Comparar execuções (Total por Período):",
+            options=[m['id'] for m in execucoes_salvas],
+            default=[m['id'] for m in execucoes_salvas[:2]],
+            max_selections=5,
+            key="execucoes_comparar"
+        )
+        totais_execucoes = {}
+        for id_execucao in execucoes_comparar:
+            total_execucao = carregar_total_execucao(id_execucao)
+            if total_execucao is not None:
+                totais_execucoes[id_execucao] = total_execucao
+        if totais_execucoes:
+            df_comparacao = pd.DataFrame(totais_execucoes)
+            df_comparacao.loc['Total'] = df_comparacao.sum()
+            st.dataframe(df_comparacao.style.format("R$ {:,.2f}"), use_container_width=True)
+
 # Usar configurações aplicadas (se existirem) ou temporárias
 if st.session_state.config_forecast_aplicada['ultimo_periodo_dados'] is not None:
     # Usar configurações aplicadas
@@ -1531,9 +1594,9 @@ else:
     
     try:
         # Carregar dados do arquivo forecast gerado na pasta Forecast
-        caminho_forecast_grafico = os.path.join("dados", "Forecast", "forecast_completo.parquet")
-        if os.path.exists(caminho_forecast_grafico):
-            df_forecast_grafico = pd.read_parquet(caminho_forecast_grafico)
+        caminho_forecast_grafico = caminho_tabela("forecast_completo", cenario=cenario_atual) or os.path.join("dados", "Forecast", "forecast_completo.parquet")
+        if existe_na_versao(caminho_forecast_grafico):
+            df_forecast_grafico = pd.read_parquet(resolver_caminho(caminho_forecast_grafico))
             
             # Aplicar filtros (Oficina, Veículo, USI) mas NÃO filtrar por Período
             # As variáveis já estão definidas no escopo global
@@ -1637,7 +1700,7 @@ else:
 st.markdown("---")
 
 # Carregar dados de volume
-df_vol = load_volume_data(ano_selecionado)
+df_vol = load_volume_data(ano_selecionado, cenario_atual)
 
 # 🔧 CORREÇÃO: Filtrar volumes pelas oficinas e veículos selecionados
 if df_vol is not None and not df_vol.empty:
@@ -1655,7 +1718,7 @@ if df_vol is not None and not df_vol.empty:
             ].copy()
 
 # Carregar dados de volume histórico (prioritário para meses futuros)
-df_vol_historico = load_volume_historico_data()
+df_vol_historico = load_volume_historico_data(cenario_atual)
 
 # 🔧 CORREÇÃO: Filtrar volumes históricos pelas oficinas e veículos selecionados
 if df_vol_historico is not None and not df_vol_historico.empty:
@@ -3763,6 +3826,13 @@ else:
                         df_forecast_completo = df_forecast_completo.drop(columns=colunas_todas_nulas)
                         st.info(f"🧹 Removidas {len(colunas_todas_nulas)} colunas completamente nulas: {', '.join(colunas_todas_nulas[:5])}{'...' if len(colunas_todas_nulas) > 5 else ''}")
                     
+                    # Garantir um snapshot do estado atual antes de sobrescrever (ponto de rollback)
+                    try:
+                        if versao_publicada() is None:
+                            publicar_versao(criar_versao("Estado anterior ao forecast"))
+                    except Exception as e_versao:
+                        st.warning(f"⚠️ Não foi possível criar snapshot dos dados: {str(e_versao)}")
+                    
                     # Criar pasta Forecast em dados/Forecast (ANTES de tentar salvar)
                     pasta_dados = "dados"
                     pasta_forecast = os.path.join(pasta_dados, "Forecast")
@@ -3793,144 +3863,58 @@ else:
                             pasta_forecast = "."  # Último fallback: diretório atual
                             st.error(f"❌ Usando diretório atual como fallback: {os.path.abspath(pasta_forecast)}")
                     
-                    # Usar nome fixo para substituir arquivo existente (não usar timestamp)
-                    nome_arquivo_base = "forecast_completo"
-                    
                     # ============================================================
-                    # PASSO 1: Copiar arquivo completo de volume histórico
+                    # Salvar execução no armazenamento de cenários
+                    # (dados/Forecast/cenarios/<cenario>/<execucao>/) sem sobrescrever as anteriores
                     # ============================================================
-                    try:
-                        # Carregar arquivo completo de volume histórico (antes dos filtros)
-                        caminho_vol_historico_original = os.path.join("dados", "historico_consolidado", "df_vol_historico.parquet")
-                        
-                        if os.path.exists(caminho_vol_historico_original):
-                            # Copiar arquivo completo para a pasta Forecast
-                            caminho_vol_historico_destino = os.path.join(pasta_forecast, "df_vol_historico.parquet")
-                            shutil.copy2(caminho_vol_historico_original, caminho_vol_historico_destino)
-                            
-                            # Também salvar em Excel
-                            df_vol_historico_completo = pd.read_parquet(caminho_vol_historico_original)
-                            caminho_vol_historico_excel = os.path.join(pasta_forecast, "df_vol_historico.xlsx")
-                            df_vol_historico_completo.to_excel(caminho_vol_historico_excel, index=False, engine='openpyxl')
-                            
-                            st.success(f"✅ Arquivo de volume histórico copiado: {os.path.abspath(caminho_vol_historico_destino)}")
-                            st.info(f"   📊 Total de linhas: {len(df_vol_historico_completo):,}")
-                        else:
-                            st.warning(f"⚠️ Arquivo de volume histórico não encontrado: {caminho_vol_historico_original}")
-                    except Exception as e_volume:
-                        st.warning(f"⚠️ Erro ao copiar arquivo de volume histórico: {str(e_volume)}")
-                        import traceback
-                        st.error(f"Detalhes: {traceback.format_exc()}")
+                    df_vol_historico_completo = None
+                    caminho_vol_historico_original = os.path.join("dados", "historico_consolidado", "df_vol_historico.parquet")
+                    if existe_na_versao(caminho_vol_historico_original):
+                        df_vol_historico_completo = pd.read_parquet(resolver_caminho(caminho_vol_historico_original))
+                    else:
+                        st.warning(f"⚠️ Arquivo de volume histórico não encontrado: {caminho_vol_historico_original}")
+                    
+                    config_execucao = {
+                        'ultimo_periodo_dados': ultimo_periodo_dados,
+                        'num_meses_prever': num_meses_prever,
+                        'num_meses_media': num_meses_media,
+                        'periodos_para_media': periodos_para_media,
+                        'meses_excluir_media': meses_excluir_media,
+                        'periodos_restantes': periodos_restantes,
+                        'sensibilidade_fixo': sensibilidade_fixo,
+                        'sensibilidade_variavel': sensibilidade_variavel,
+                        'sensibilidades_type06': sensibilidades_type06,
+                        'inflacao_global': st.session_state.get('inflacao_global_aplicada'),
+                        'inflacao_type06': inflacao_type06,
+                        'filtros': {
+                            'Oficina': oficina_selecionadas,
+                            'Veículo': veiculo_selecionados,
+                            'USI': usi_selecionada,
+                        },
+                    }
                     
-                    # ============================================================
-                    # PASSO 2: Salvar forecast_completo
-                    # ============================================================
-                    # Salvar em parquet (sempre substituir se existir)
-                    caminho_parquet = os.path.join(pasta_forecast, f"{nome_arquivo_base}.parquet")
-                    caminho_parquet_absoluto = os.path.abspath(caminho_parquet)
                     try:
-                        st.info(f"💾 Salvando Parquet em: {caminho_parquet_absoluto}")
-                        st.info(f"📊 Total de linhas: {len(df_forecast_completo):,}")
-                        df_forecast_completo.to_parquet(caminho_parquet, index=False, engine='pyarrow')
+                        id_execucao = salvar_execucao(
+                            st.session_state.get('cenario_forecast', ''),
+                            {
+                                'forecast_completo': df_forecast_completo,
+                                'volume_base': volume_base,
+                                'volume_por_mes': volume_por_mes,
+                                'df_vol_historico': df_vol_historico_completo,
+                            },
+                            config_execucao
+                        )
+                        st.success(f"✅ Forecast salvo no cenário: **{id_execucao}**")
                         
-                        # Verificar se foi salvo
-                        if os.path.exists(caminho_parquet):
-                            tamanho_arquivo = os.path.getsize(caminho_parquet) / (1024 * 1024)  # MB
-                            st.success(f"✅ Parquet salvo com sucesso!")
-                            st.info(f"   📄 Arquivo: {caminho_parquet_absoluto}")
-                            st.info(f"   📏 Tamanho: {tamanho_arquivo:.2f} MB")
-                        else:
-                            st.error(f"❌ Arquivo Parquet não foi criado: {caminho_parquet_absoluto}")
+                        removidas = aplicar_retencao()
+                        if removidas:
+                            st.info(f"🧹 Execuções antigas removidas pela política de retenção: {len(removidas)}")
                     except Exception as e_parquet:
-                        st.error(f"❌ Erro ao salvar Parquet: {str(e_parquet)}")
+                        st.error(f"❌ Erro ao salvar forecast: {str(e_parquet)}")
                         import traceback
                         st.error(f"Detalhes: {traceback.format_exc()}")
                     
-                    # Salvar em excel (sempre substituir se existir)
-                    caminho_excel = os.path.join(pasta_forecast, f"{nome_arquivo_base}.xlsx")
-                    caminho_excel_absoluto = os.path.abspath(caminho_excel)
-                    excel_salvo = False
-                    
-                    try:
-                        st.info(f"💾 Salvando Excel em: {caminho_excel_absoluto}")
-                        st.info(f"📊 Total de linhas para salvar: {len(df_forecast_completo):,}")
-                        
-                        # Tentar remover arquivo existente se houver (pode estar bloqueado)
-                        if os.path.exists(caminho_excel):
-                            try:
-                                os.remove(caminho_excel)
-                                st.info(f"🗑️ Arquivo Excel antigo removido")
-                            except PermissionError:
-                                st.warning(f"⚠️ Não foi possível remover arquivo Excel existente (pode estar aberto)")
-                                st.info(f"💡 Por favor, feche o arquivo Excel se estiver aberto: {caminho_excel_absoluto}")
-                            except Exception as e_remove:
-                                st.warning(f"⚠️ Erro ao remover arquivo Excel existente: {str(e_remove)}")
-                        
-                        # Tentar salvar com openpyxl
-                        try:
-                            with pd.ExcelWriter(caminho_excel, engine='openpyxl', mode='w') as writer:
-                                df_forecast_completo.to_excel(writer, index=False, sheet_name='Forecast')
-                            
-                            if os.path.exists(caminho_excel):
-                                tamanho_arquivo = os.path.getsize(caminho_excel) / (1024 * 1024)  # Tamanho em MB
-                                st.success(f"✅ Excel salvo/substituído com sucesso!")
-                                st.info(f"   📄 Arquivo: {caminho_excel_absoluto}")
-                                st.info(f"   📏 Tamanho: {tamanho_arquivo:.2f} MB")
-                                excel_salvo = True
-                        except PermissionError as e_perm:
-                            st.warning(f"⚠️ Erro de permissão ao salvar Excel: {str(e_perm)}")
-                            st.info(f"💡 O arquivo pode estar aberto em outro programa (Excel, etc.)")
-                            st.info(f"💡 Por favor, feche o arquivo e tente novamente: {caminho_excel_absoluto}")
-                            st.info(f"ℹ️ O arquivo Parquet foi salvo com sucesso, você pode continuar usando o sistema.")
-                            excel_salvo = False
-                        except Exception as e_openpyxl:
-                            st.warning(f"⚠️ Erro ao salvar com openpyxl: {str(e_openpyxl)}")
-                            excel_salvo = False
-                        
-                        # Se não conseguiu salvar com openpyxl, tentar com xlsxwriter
-                        if not excel_salvo:
-                            try:
-                                import xlsxwriter
-                                st.info(f"🔄 Tentando salvar com xlsxwriter como alternativa...")
-                                
-                                # Tentar remover novamente antes de salvar com xlsxwriter
-                                if os.path.exists(caminho_excel):
-                                    try:
-                                        os.remove(caminho_excel)
-                                    except:
-                                        pass
-                                
-                                with pd.ExcelWriter(caminho_excel, engine='xlsxwriter') as writer:
-                                    df_forecast_completo.to_excel(writer, index=False, sheet_name='Forecast')
-                                
-                                if os.path.exists(caminho_excel):
-                                    tamanho_arquivo = os.path.getsize(caminho_excel) / (1024 * 1024)
-                                    st.success(f"✅ Excel salvo com xlsxwriter: {os.path.abspath(caminho_excel)} ({tamanho_arquivo:.2f} MB)")
-                                    excel_salvo = True
-                            except PermissionError as e_perm_xlsx:
-                                st.warning(f"⚠️ Erro de permissão ao salvar Excel com xlsxwriter: {str(e_perm_xlsx)}")
-                                st.info(f"💡 O arquivo pode estar aberto em outro programa (Excel, etc.)")
-                                st.info(f"💡 Por favor, feche o arquivo e tente novamente: {caminho_excel_absoluto}")
-                                st.info(f"ℹ️ O arquivo Parquet foi salvo com sucesso, você pode continuar usando o sistema.")
-                            except Exception as e_xlsxwriter:
-                                st.warning(f"⚠️ Erro ao salvar Excel com xlsxwriter: {str(e_xlsxwriter)}")
-                                st.info(f"ℹ️ O arquivo Parquet foi salvo com sucesso, você pode continuar usando o sistema.")
-                        
-                        if not excel_salvo:
-                            st.warning(f"⚠️ Não foi possível salvar o arquivo Excel, mas o Parquet foi salvo com sucesso.")
-                            st.info(f"💡 Você pode tentar salvar o Excel manualmente ou fechar o arquivo se estiver aberto.")
-                    except Exception as e_excel:
-                        st.warning(f"⚠️ Erro ao salvar Excel: {str(e_excel)}")
-                        if isinstance(e_excel, PermissionError):
-                            st.info(f"💡 O arquivo pode estar aberto. Por favor, feche o arquivo: {caminho_excel_absoluto}")
-                        st.info(f"ℹ️ O arquivo Parquet foi salvo com sucesso, você pode continuar usando o sistema.")
-                    
                     st.success(f"✅ Tabela completa gerada com sucesso!")
-                    st.info(f"📁 Arquivos salvos em: **{pasta_forecast}/**")
-                    if os.path.exists(caminho_parquet):
-                        st.info(f"   ✅ {nome_arquivo_base}.parquet")
-                    if os.path.exists(caminho_excel):
-                        st.info(f"   ✅ {nome_arquivo_base}.xlsx")
                     st.info(f"📊 Total de linhas: {len(df_forecast_completo):,}")
                     
                     # ====================================================================
@@ -4248,6 +4232,13 @@ else:
                         import traceback
                         st.error(f"Detalhes: {traceback.format_exc()}")
                     
+                    # Publicar nova versão dos dados (troca atômica para os dashboards)
+                    try:
+                        versao_nova = publicar_versao(criar_versao("Forecast gerado pelo dashboard"))
+                        st.success(f"🚀 Versão dos dados publicada: {versao_nova}")
+                    except Exception as e_versao:
+                        st.warning(f"⚠️ Não foi possível publicar a versão dos dados: {str(e_versao)}")
+                    
                     # Limpar flag
                     st.session_state.gerar_tabela_completa_forecast = False
                     
@@ -4403,9 +4394,9 @@ else:
     
     try:
         # Carregar dados do arquivo forecast gerado na pasta Forecast
-        caminho_forecast_grafico = os.path.join("dados", "Forecast", "forecast_completo.parquet")
-        if os.path.exists(caminho_forecast_grafico):
-            df_forecast_grafico = pd.read_parquet(caminho_forecast_grafico)
+        caminho_forecast_grafico = caminho_tabela("forecast_completo", cenario=cenario_atual) or os.path.join("dados", "Forecast", "forecast_completo.parquet")
+        if existe_na_versao(caminho_forecast_grafico):
+            df_forecast_grafico = pd.read_parquet(resolver_caminho(caminho_forecast_grafico))
             
             # Aplicar filtros (Oficina, Veículo, USI) mas NÃO filtrar por Período
             # As variáveis já estão definidas no escopo global
@@ -4541,9 +4532,9 @@ def ordenar_por_mes_forecast(df, coluna_periodo='Período'):
 
 try:
     # Carregar dados do arquivo forecast gerado na pasta Forecast
-    caminho_forecast_grafico = os.path.join("dados", "Forecast", "forecast_completo.parquet")
-    if os.path.exists(caminho_forecast_grafico):
-        df_forecast_grafico = pd.read_parquet(caminho_forecast_grafico)
+    caminho_forecast_grafico = caminho_tabela("forecast_completo", cenario=cenario_atual) or os.path.join("dados", "Forecast", "forecast_completo.parquet")
+    if existe_na_versao(caminho_forecast_grafico):
+        df_forecast_grafico = pd.read_parquet(resolver_caminho(caminho_forecast_grafico))
         
         # Aplicar filtros (Oficina, Veículo, USI) mas NÃO filtrar por Período
         # As variáveis já estão definidas no escopo global
@@ -1,10 +1,21 @@
 import streamlit as st
 import pandas as pd
 import altair as alt
-import os
+import functools
 import numpy as np
 import re
 from datetime import datetime, timedelta
+from tc_dados.agregacao import calcular_cpu
+from tc_dados.carregamento import carregar_dados, listar_anos_disponiveis
+from tc_dados.exportacao import botao_exportacao
+from tc_dados.filtros import FiltroSpec
+from tc_dados.forecast import (
+    MESES_ANO, NUM_MESES_PADRAO, anos_dos_dados, calcular_medias_forecast, calcular_periodos_media,
+    contar_meses_com_valor, definir_periodo_padrao, listar_periodos_disponiveis, marcar_tipo_custo
+)
+from tc_dados.metadados import carregar_dimensoes, carregar_visao, contar_linhas, opcoes_filtro
+from tc_dados.preaquecimento import iniciar_preaquecimento
+from tc_dados.subtotais import NIVEL, com_subtotais
 
 # Configuração da página
 st.set_page_config(
@@ -14,6 +25,9 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Pré-aquecer o cache compartilhado em segundo plano (uma vez por processo e versão dos dados)
+preaquecimento = iniciar_preaquecimento()
+
 # CSS para customização
 st.markdown("""
     <style>
@@ -39,61 +53,6 @@ st.subheader("Análise preditiva e previsões de custos e volumes")
 
 st.markdown("---")
 
-# Função auxiliar para listar anos disponíveis
-def listar_anos_disponiveis():
-    """Lista todos os anos disponíveis nas pastas de dados"""
-    pasta_dados = "dados"
-    anos_disponiveis = []
-    
-    if os.path.exists(pasta_dados):
-        for item in os.listdir(pasta_dados):
-            caminho_item = os.path.join(pasta_dados, item)
-            if os.path.isdir(caminho_item) and item.isdigit():
-                anos_disponiveis.append(int(item))
-    
-    return sorted(anos_disponiveis, reverse=True)  # Mais recente primeiro
-
-# Função auxiliar para encontrar arquivo parquet na ordem de prioridade
-def encontrar_arquivo_parquet(nome_arquivo, ano_selecionado=None):
-    """
-    Busca arquivo parquet na seguinte ordem de prioridade:
-    1. Se ano_selecionado for None ou "Todos": Histórico consolidado (dados/historico_consolidado/)
-    2. Se ano_selecionado for especificado: Pasta do ano (dados/{ANO}/)
-    3. Pasta do ano mais recente (dados/{ANO}/)
-    4. Raiz do projeto (compatibilidade)
-    """
-    # Se ano específico foi selecionado, buscar na pasta do ano
-    if ano_selecionado is not None and ano_selecionado != "Todos":
-        caminho_ano = os.path.join("dados", str(ano_selecionado), nome_arquivo)
-        if os.path.exists(caminho_ano):
-            return caminho_ano
-    
-    # 1. Tentar histórico consolidado (para "Todos" ou quando não especificado)
-    caminho_historico = os.path.join("dados", "historico_consolidado", nome_arquivo.replace(".parquet", "_historico.parquet"))
-    if os.path.exists(caminho_historico):
-        return caminho_historico
-    
-    # 2. Tentar pasta do ano mais recente
-    pasta_dados = "dados"
-    if os.path.exists(pasta_dados):
-        anos_disponiveis = []
-        for item in os.listdir(pasta_dados):
-            caminho_item = os.path.join(pasta_dados, item)
-            if os.path.isdir(caminho_item) and item.isdigit():
-                anos_disponiveis.append(int(item))
-        
-        if anos_disponiveis:
-            ano_mais_recente = max(anos_disponiveis)
-            caminho_ano = os.path.join(pasta_dados, str(ano_mais_recente), nome_arquivo)
-            if os.path.exists(caminho_ano):
-                return caminho_ano
-    
-    # 3. Tentar raiz (compatibilidade)
-    if os.path.exists(nome_arquivo):
-        return nome_arquivo
-    
-    return None
-
 # Filtros na sidebar - ANTES de carregar dados
 st.sidebar.markdown("---")
 st.sidebar.markdown("**📅 Seleção de Ano**")
@@ -121,301 +80,113 @@ tipo_visualizacao = st.sidebar.radio(
 )
 st.sidebar.markdown("---")
 
-# Botão para limpar cache (útil após mudanças no código)
-if st.sidebar.button("🗑️ Limpar Cache", help="Limpa o cache do Streamlit para forçar recálculo"):
-    st.cache_data.clear()
-    st.sidebar.success("✅ Cache limpo! Recarregue a página.")
-st.sidebar.markdown("---")
 
-# Função para carregar dados com cache
-@st.cache_data(
-    ttl=3600,
-    max_entries=10,  # Aumentar para cachear diferentes anos
-    show_spinner=True
-)
+# Função para carregar dados (cache compartilhado entre as páginas em tc_dados.carregamento)
 def load_data(ano_selecionado_param):
     """Carrega os dados do arquivo parquet"""
     try:
-        # Converter "Todos" para None
-        ano_para_busca = None if ano_selecionado_param == "Todos" else ano_selecionado_param
-        
-        # Buscar arquivo na ordem de prioridade
-        arquivo_parquet = encontrar_arquivo_parquet("df_final.parquet", ano_para_busca)
-
-        if arquivo_parquet is None:
-            st.error(f"❌ Arquivo não encontrado: df_final.parquet")
-            st.info("💡 Verifique se o arquivo existe em:")
-            st.info("   - dados/historico_consolidado/df_final_historico.parquet")
-            st.info("   - dados/{ANO}/df_final.parquet")
-            st.info("   - df_final.parquet (raiz)")
-            st.stop()
-
-        # Carregar dados
-        df = pd.read_parquet(arquivo_parquet)
-
-        # Se carregou do histórico consolidado e um ano específico foi selecionado, filtrar
-        if ano_selecionado_param != "Todos" and "Ano" in df.columns:
-            df = df[df['Ano'] == int(ano_selecionado_param)].copy()
-
-        # Otimizar tipos de dados
-        for col in df.columns:
-            if df[col].dtype == 'object':
-                unique_ratio = df[col].nunique() / len(df)
-                if unique_ratio < 0.5:
-                    df[col] = df[col].astype('category')
-
-        # Converter floats para tipos menores
-        for col in df.select_dtypes(include=['float64']).columns:
-            df[col] = pd.to_numeric(df[col], downcast='float')
-
-        # Converter ints para tipos menores
-        for col in df.select_dtypes(include=['int64']).columns:
-            df[col] = pd.to_numeric(df[col], downcast='integer')
-
-        return df
+        df = carregar_dados(ano_selecionado_param, "df_final")
     except Exception as e:
         st.error(f"❌ Erro ao carregar dados: {str(e)}")
         st.stop()
 
+    if df is None:
+        st.error(f"❌ Arquivo não encontrado: df_final.parquet")
+        st.info("💡 Verifique se o arquivo existe em:")
+        st.info("   - dados/historico_consolidado/df_final_historico.parquet")
+        st.info("   - dados/{ANO}/df_final.parquet")
+        st.info("   - df_final.parquet (raiz)")
+        st.stop()
 
-# Função para carregar dados de volume com cache
-@st.cache_data(
-    ttl=3600,
-    max_entries=10,  # Aumentar para cachear diferentes anos
-    show_spinner=True
-)
+    return df
+
+
+# Função para carregar dados de volume
 def load_volume_data(ano_selecionado_param):
     """Carrega os dados de volume do arquivo parquet"""
     try:
-        # Converter "Todos" para None
-        ano_para_busca = None if ano_selecionado_param == "Todos" else ano_selecionado_param
-        
-        # Buscar arquivo na ordem de prioridade
-        arquivo_parquet = encontrar_arquivo_parquet("df_vol.parquet", ano_para_busca)
-
-        if arquivo_parquet is None:
-            return None
-
-        df = pd.read_parquet(arquivo_parquet)
-
-        # Se carregou do histórico consolidado e um ano específico foi selecionado, filtrar
-        if ano_selecionado_param != "Todos" and "Ano" in df.columns:
-            df = df[df['Ano'] == int(ano_selecionado_param)].copy()
-
-        # Otimizar tipos de dados
-        for col in df.columns:
-            if df[col].dtype == 'object':
-                unique_ratio = df[col].nunique() / len(df)
-                if unique_ratio < 0.5:
-                    df[col] = df[col].astype('category')
-
-        # Converter floats para tipos menores
-        for col in df.select_dtypes(include=['float64']).columns:
-            df[col] = pd.to_numeric(df[col], downcast='float')
-
-        # Converter ints para tipos menores
-        for col in df.select_dtypes(include=['int64']).columns:
-            df[col] = pd.to_numeric(df[col], downcast='integer')
-
-        return df
+        return carregar_dados(ano_selecionado_param, "df_vol")
     except Exception:
         return None
 
-@st.cache_data(ttl=3600, show_spinner=False)
+
 def load_volume_historico_data():
     """Carrega os dados de volume histórico consolidado do arquivo parquet"""
-    try:
-        # Buscar arquivo na pasta dados/historico_consolidado
-        caminho_base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        caminho_historico = os.path.join(caminho_base, "dados", "historico_consolidado", "df_vol_historico.parquet")
-        
-        if os.path.exists(caminho_historico):
-            df = pd.read_parquet(caminho_historico)
-            
-            # Otimizar tipos de dados
-            for col in df.columns:
-                if df[col].dtype == 'object':
-                    try:
-                        unique_ratio = df[col].nunique() / len(df)
-                        if unique_ratio < 0.5:
-                            df[col] = df[col].astype('category')
-                    except:
-                        pass
-            
-            # Converter floats para tipos menores
-            for col in df.select_dtypes(include=['float64']).columns:
-                df[col] = pd.to_numeric(df[col], downcast='float')
-            
-            # Converter ints para tipos menores
-            for col in df.select_dtypes(include=['int64']).columns:
-                df[col] = pd.to_numeric(df[col], downcast='integer')
-            
-            return df
-        else:
-            return None
-    except Exception:
-        return None
+    return load_volume_data("Todos")
 
 
-# Carregar dados com o ano selecionado
+# Metadados das dimensões (poucos KB): os filtros são montados sem ler a tabela completa
 try:
-    df_total = load_data(ano_selecionado)
-    st.sidebar.success("✅ Dados carregados com sucesso")
-    if ano_selecionado == "Todos":
-        st.sidebar.info(f"📊 {len(df_total):,} registros (Todos os anos)")
-    else:
-        st.sidebar.info(f"📊 {len(df_total):,} registros (Ano {ano_selecionado})")
+    df_dimensoes = carregar_dimensoes(ano_selecionado, "df_final")
 except Exception as e:
     st.error(f"❌ Erro: {str(e)}")
     st.stop()
 
+if df_dimensoes is None:
+    load_data(ano_selecionado)  # Exibe o erro de arquivo não encontrado
+
+if ano_selecionado == "Todos":
+    st.sidebar.info(f"📊 {contar_linhas(df_dimensoes):,} registros (Todos os anos)")
+else:
+    st.sidebar.info(f"📊 {contar_linhas(df_dimensoes):,} registros (Ano {ano_selecionado})")
+
 # Filtros na sidebar
 st.sidebar.markdown("---")
 st.sidebar.markdown("**🔍 Filtros**")
 
-# Função auxiliar para obter opções de filtro
-@st.cache_data(ttl=1800, max_entries=5)
-def get_filter_options(df, column_name):
-    """Obtém opções de filtro com cache"""
-    if column_name in df.columns:
-        opcoes = sorted(
-            df[column_name].dropna().astype(str).unique().tolist()
-        )
-        return ["Todos"] + opcoes
-    return ["Todos"]
-
-# Botão de atualizar dados na sidebar (após definir todas as funções com cache)
+# Os caches são indexados pela versão dos dados: uma nova publicação do ETL
+# aparece na próxima interação, sem botão de atualizar/limpar cache
 st.sidebar.markdown("---")
-if st.sidebar.button("🔄 Atualizar Dados", use_container_width=True):
-    # Limpar cache de todas as funções (verificar se existem)
-    try:
-        load_data.clear()
-        load_volume_data.clear()
-        get_filter_options.clear()
-        aplicar_filtros.clear()
-    except:
-        pass
-    
-    # Funções que podem não existir se houver colunas faltando
-    try:
-        calcular_medias_forecast.clear()
-        calcular_volumes_cpu.clear()
-        calcular_forecast_completo.clear()
-        processar_tabela_forecast.clear()
-    except:
-        pass
-    
-    st.rerun()
-
-
-# Ordem dos meses para ordenação cronológica
-ORDEM_MESES = [
-    'janeiro', 'fevereiro', 'março', 'abril', 'maio', 'junho',
-    'julho', 'agosto', 'setembro', 'outubro', 'novembro', 'dezembro'
-]
+st.sidebar.caption(f"📦 Versão dos dados: {preaquecimento.versao}")
 
 
-# Função para aplicar filtros com cache
-@st.cache_data(ttl=3600, max_entries=50, show_spinner=False)
-def aplicar_filtros(df_total_cache, oficina_selecionadas_cache, veiculo_selecionados_cache, 
-                     usi_selecionada_cache, periodo_selecionado_cache):
-    """Aplica filtros ao DataFrame com cache"""
-    df_filtrado = df_total_cache.copy()
-    
-    # Filtro 1: Oficina
-    if 'Oficina' in df_filtrado.columns:
-        if oficina_selecionadas_cache and "Todos" not in oficina_selecionadas_cache:
-            df_filtrado = df_filtrado[
-                df_filtrado['Oficina'].astype(str).isin(oficina_selecionadas_cache)
-            ].copy()
-    
-    # Filtro 2: Veículo
-    if 'Veículo' in df_filtrado.columns:
-        if veiculo_selecionados_cache and "Todos" not in veiculo_selecionados_cache:
-            df_filtrado = df_filtrado[
-                df_filtrado['Veículo'].astype(str).isin(veiculo_selecionados_cache)
-            ].copy()
-    
-    # Filtro 3: USI
-    if 'USI' in df_filtrado.columns:
-        if usi_selecionada_cache and "Todos" not in usi_selecionada_cache:
-            df_filtrado = df_filtrado[
-                df_filtrado['USI'].astype(str).isin(usi_selecionada_cache)
-            ].copy()
-    
-    # Filtro 4: Período
-    if 'Período' in df_filtrado.columns:
-        if periodo_selecionado_cache and periodo_selecionado_cache != "Todos":
-            df_filtrado = df_filtrado[
-                df_filtrado['Período'].astype(str) == str(periodo_selecionado_cache)
-            ].copy()
-    
-    return df_filtrado
-
 # Filtro 1: Oficina
 oficina_selecionadas = ["Todos"]
-if 'Oficina' in df_total.columns:
-    oficina_opcoes = get_filter_options(df_total, 'Oficina')
+if 'Oficina' in df_dimensoes.columns:
     oficina_selecionadas = st.sidebar.multiselect(
-        "Selecione a Oficina:", oficina_opcoes, default=["Todos"]
+        "Selecione a Oficina:", opcoes_filtro(df_dimensoes, 'Oficina'), default=["Todos"]
     )
 
 # Filtro 2: Veículo
 veiculo_selecionados = ["Todos"]
-if 'Veículo' in df_total.columns:
-    # Usar df_total para opções, mas depois filtrar
-    veiculo_opcoes = get_filter_options(df_total, 'Veículo')
+if 'Veículo' in df_dimensoes.columns:
     veiculo_selecionados = st.sidebar.multiselect(
-        "Selecione o Veículo:", veiculo_opcoes, default=["Todos"]
+        "Selecione o Veículo:", opcoes_filtro(df_dimensoes, 'Veículo'), default=["Todos"]
     )
 
 # Filtro 3: USI
 usi_selecionada = ["TC Ext"]
-if 'USI' in df_total.columns:
-    usi_opcoes = get_filter_options(df_total, 'USI')
+if 'USI' in df_dimensoes.columns:
+    usi_opcoes = opcoes_filtro(df_dimensoes, 'USI')
     default_usi = ["TC Ext"] if "TC Ext" in usi_opcoes else ["Todos"]
     usi_selecionada = st.sidebar.multiselect(
         "Selecione a USI:", usi_opcoes, default=default_usi
     )
 
-# Filtro 4: Período
+# Filtro 4: Período (meses em ordem cronológica)
 periodo_selecionado = "Todos"
-if 'Período' in df_total.columns:
-    periodo_opcoes_raw = get_filter_options(df_total, 'Período')
-    
-    # Ordenar meses cronologicamente
-    periodo_opcoes = ["Todos"]
-    meses_ordenados = []
-    outros_periodos = []
-    
-    for periodo in periodo_opcoes_raw[1:]:  # Pular "Todos"
-        periodo_lower = str(periodo).lower()
-        if periodo_lower in ORDEM_MESES:
-            meses_ordenados.append(periodo)
-        else:
-            outros_periodos.append(periodo)
-    
-    # Ordenar meses pela ordem cronológica
-    meses_ordenados.sort(
-        key=lambda x: ORDEM_MESES.index(str(x).lower())
-        if str(x).lower() in ORDEM_MESES else 999
-    )
-    
-    # Combinar: Todos + meses ordenados + outros períodos
-    periodo_opcoes = periodo_opcoes + meses_ordenados + outros_periodos
-    
+if 'Período' in df_dimensoes.columns:
     periodo_selecionado = st.sidebar.selectbox(
-        "Selecione o Período:", periodo_opcoes
+        "Selecione o Período:", opcoes_filtro(df_dimensoes, 'Período')
     )
 
-# Aplicar todos os filtros com cache
-df_filtrado = aplicar_filtros(
-    df_total,
-    tuple(oficina_selecionadas) if oficina_selecionadas else tuple(),
-    tuple(veiculo_selecionados) if veiculo_selecionados else tuple(),
-    tuple(usi_selecionada) if usi_selecionada else tuple(),
-    periodo_selecionado
-)
+# Carregar a tabela completa só agora (os filtros já estão na tela), já filtrada
+# com cache: a visão padrão vem pronta do pré-aquecimento
+filtro = FiltroSpec({
+    'Oficina': oficina_selecionadas,
+    'Veículo': veiculo_selecionados,
+    'USI': usi_selecionada,
+    'Período': periodo_selecionado,
+})
+try:
+    df_filtrado = carregar_visao(ano_selecionado, "df_final", filtro)
+except Exception as e:
+    st.error(f"❌ Erro: {str(e)}")
+    st.stop()
+
+if df_filtrado is None:
+    load_data(ano_selecionado)  # Exibe o erro de arquivo não encontrado
+st.sidebar.success("✅ Dados carregados com sucesso")
 
 # Resumo na sidebar
 st.sidebar.markdown("---")
@@ -439,73 +210,13 @@ st.markdown("## 📈 Forecast - Previsão de Custo Total")
 st.markdown("### 🔮 Configuração do Forecast")
 
 # Lista de meses do ano (necessária para a configuração)
-meses_ano = ['Janeiro', 'Fevereiro', 'Março', 'Abril', 'Maio', 'Junho',
-             'Julho', 'Agosto', 'Setembro', 'Outubro', 'Novembro', 'Dezembro']
+meses_ano = MESES_ANO
 
-# Verificar se temos dados com múltiplos anos
-tem_anos = 'Ano' in df_filtrado.columns and df_filtrado['Ano'].nunique() > 1
-
-# Determinar o ano dos dados
-if tem_anos and 'Ano' in df_filtrado.columns:
-    anos_disponiveis = sorted(df_filtrado['Ano'].dropna().unique())
-    ano_maximo = int(df_filtrado['Ano'].max())
-else:
-    from datetime import datetime
-    anos_disponiveis = [datetime.now().year]
-    ano_maximo = datetime.now().year
-
-# Função auxiliar para ordenar períodos (definir antes de usar)
-def ordenar_periodo_para_select(periodo_str):
-    """Ordena períodos para o selectbox"""
-    periodo_str = str(periodo_str).strip()
-    # Se tiver ano (ex: "Novembro 2025")
-    if ' ' in periodo_str:
-        partes = periodo_str.split(' ', 1)
-        mes_nome = partes[0]
-        ano = int(partes[1]) if partes[1].isdigit() else 0
-        # Normalizar nome do mês (capitalizar)
-        mes_nome_capitalizado = mes_nome.capitalize()
-        mes_idx = meses_ano.index(mes_nome_capitalizado) if mes_nome_capitalizado in meses_ano else 0
-        return (ano, mes_idx)
-    else:
-        # Apenas mês - normalizar (capitalizar)
-        mes_nome_capitalizado = periodo_str.capitalize()
-        mes_idx = meses_ano.index(mes_nome_capitalizado) if mes_nome_capitalizado in meses_ano else 0
-        return (0, mes_idx)
+# Verificar se temos dados com múltiplos anos e determinar o ano dos dados
+tem_anos, anos_disponiveis, ano_maximo = anos_dos_dados(df_filtrado)
 
 # Criar lista de períodos disponíveis com ano (baseado nos dados reais)
-periodos_disponiveis = []
-if 'Período' in df_filtrado.columns:
-    # Pegar períodos únicos dos dados
-    periodos_unicos = df_filtrado['Período'].dropna().unique()
-    
-    # Verificar se os períodos já têm ano ou não
-    periodos_com_ano = any(' ' in str(p) and str(p).split(' ', 1)[1].isdigit() for p in periodos_unicos)
-    
-    # Se não tiver ano nos períodos mas temos múltiplos anos, adicionar ano
-    if not periodos_com_ano and tem_anos:
-        # Criar períodos com ano baseado no ano dos dados
-        periodos_com_ano_lista = []
-        for periodo in periodos_unicos:
-            periodo_str = str(periodo).strip()
-            # Capitalizar primeira letra
-            periodo_capitalizado = periodo_str.capitalize() if periodo_str else periodo_str
-            # Adicionar ano máximo (ano dos dados)
-            periodo_com_ano = f"{periodo_capitalizado} {ano_maximo}"
-            periodos_com_ano_lista.append(periodo_com_ano)
-        periodos_disponiveis = sorted(periodos_com_ano_lista, key=lambda x: ordenar_periodo_para_select(x))
-    else:
-        # Se já tem ano ou não tem múltiplos anos, usar como está
-        periodos_disponiveis = sorted(periodos_unicos, key=lambda x: ordenar_periodo_para_select(x))
-else:
-    # Fallback: criar períodos baseado nos meses e anos disponíveis
-    for ano in anos_disponiveis:
-        for mes in meses_ano:
-            if tem_anos:
-                periodo = f"{mes} {ano}"
-            else:
-                periodo = mes
-            periodos_disponiveis.append(periodo)
+periodos_disponiveis = listar_periodos_disponiveis(df_filtrado, tem_anos, ano_maximo, anos_disponiveis)
 
 # Layout em 2 colunas para os controles principais
 col_config1, col_config2 = st.columns(2)
@@ -513,19 +224,9 @@ col_config1, col_config2 = st.columns(2)
 with col_config1:
     # 1. Selecionar último período com dados reais (com ano)
     from datetime import datetime
-    mes_atual_sistema = datetime.now().month
-    mes_atual_nome = meses_ano[mes_atual_sistema - 1] if mes_atual_sistema <= 12 else meses_ano[11]
-    
-    # Determinar período padrão
-    if tem_anos:
-        periodo_padrao = f"{mes_atual_nome} {ano_maximo}"
-        # Se o período padrão não estiver na lista, usar o último disponível
-        if periodo_padrao not in periodos_disponiveis and periodos_disponiveis:
-            periodo_padrao = periodos_disponiveis[-1]
-    else:
-        periodo_padrao = mes_atual_nome
-        if periodo_padrao not in periodos_disponiveis and periodos_disponiveis:
-            periodo_padrao = periodos_disponiveis[-1]
+
+    # Determinar período padrão (mês atual ou o último disponível)
+    periodo_padrao = definir_periodo_padrao(periodos_disponiveis, tem_anos, ano_maximo)
     
     # Encontrar índice do período padrão
     try:
@@ -571,57 +272,14 @@ with col_config2:
     
     # 🔧 NOVA LÓGICA: Contar quantos meses até o último período têm valores (Total != 0)
     # Isso limita o filtro apenas aos meses que realmente têm dados (inclui valores negativos, exclui apenas zeros)
-    meses_com_valor = len(meses_historicos_disponiveis)  # Valor padrão
-    if meses_historicos_disponiveis and not df_filtrado.empty and 'Período' in df_filtrado.columns and 'Total' in df_filtrado.columns:
-        # Extrair ano do último período
-        ano_referencia_contagem = None
-        if ' ' in str(ultimo_periodo_dados):
-            partes_periodo = str(ultimo_periodo_dados).split(' ', 1)
-            if len(partes_periodo) > 1 and partes_periodo[1].isdigit():
-                ano_referencia_contagem = partes_periodo[1]
-        if ano_referencia_contagem is None:
-            ano_referencia_contagem = str(ano_maximo) if 'ano_maximo' in locals() else str(datetime.now().year)
-        
-        # Criar lista de períodos até o último mês selecionado
-        periodos_ate_ultimo = []
-        for mes in meses_historicos_disponiveis:
-            # Adicionar período com ano
-            periodo_com_ano = f"{mes} {ano_referencia_contagem}".lower()
-            periodos_ate_ultimo.append(periodo_com_ano)
-            # Também adicionar apenas o mês (para compatibilidade com dados antigos)
-            periodos_ate_ultimo.append(mes.lower())
-        
-        # Normalizar períodos do DataFrame para comparação
-        df_filtrado_copy = df_filtrado.copy()
-        df_filtrado_copy['Período_Normalizado'] = df_filtrado_copy['Período'].astype(str).str.strip().str.lower()
-        
-        # Filtrar df_filtrado para períodos até o último mês
-        mask_periodos_ate_ultimo = df_filtrado_copy['Período_Normalizado'].isin(periodos_ate_ultimo)
-        df_periodos_ate_ultimo = df_filtrado_copy[mask_periodos_ate_ultimo].copy()
-        
-        # Contar períodos únicos que têm pelo menos uma linha com Total != 0 (inclui valores negativos, exclui apenas zeros)
-        if not df_periodos_ate_ultimo.empty:
-            # Verificar se há pelo menos uma linha com Total != 0 para cada período
-            # Agrupar por Período_Normalizado e verificar se há algum Total != 0
-            periodos_unicos = df_periodos_ate_ultimo['Período_Normalizado'].unique()
-            periodos_com_valor_lista = []
-            for periodo in periodos_unicos:
-                df_periodo = df_periodos_ate_ultimo[df_periodos_ate_ultimo['Período_Normalizado'] == periodo]
-                # Verificar se há pelo menos uma linha com Total != 0
-                if (df_periodo['Total'] != 0).any():
-                    periodos_com_valor_lista.append(periodo)
-            meses_com_valor = len(periodos_com_valor_lista)
-            
-            # Se não encontrou nenhum período com valor, usar o número de meses históricos disponíveis
-            if meses_com_valor == 0:
-                meses_com_valor = len(meses_historicos_disponiveis)
+    meses_com_valor = contar_meses_com_valor(df_filtrado, meses_historicos_disponiveis, ultimo_periodo_dados, ano_maximo)
     
     # Limitar max_value aos meses que têm valores
     max_meses_media = max(1, meses_com_valor)  # Garantir pelo menos 1
     
     # 🔧 CORREÇÃO: Ajustar valor inicial baseado no session_state ou no max disponível
     # Se houver valor salvo, usar ele, mas limitar ao novo max_meses_media
-    valor_inicial_media = min(max_meses_media, 6)  # Valor padrão
+    valor_inicial_media = min(max_meses_media, NUM_MESES_PADRAO)  # Valor padrão
     if 'config_forecast_aplicada' in st.session_state and st.session_state.config_forecast_aplicada.get('num_meses_media') is not None:
         valor_salvo = st.session_state.config_forecast_aplicada['num_meses_media']
         # Ajustar valor salvo se ele exceder o novo máximo (quando último período mudar)
@@ -719,34 +377,9 @@ for i in range(num_meses_prever):
     periodos_restantes.append(periodo_futuro)
 
 # Calcular quais períodos serão usados para a média (com ano)
-periodos_para_media = []
-meses_para_media = []
-
-if meses_historicos_disponiveis:
-    meses_considerados = meses_historicos_disponiveis.copy()
-    
-    # Remover meses excluídos
-    for mes_excluir in meses_excluir_media:
-        if mes_excluir in meses_considerados:
-            meses_considerados.remove(mes_excluir)
-    
-    # Pegar os últimos N meses (após excluir)
-    if meses_considerados:
-        meses_para_media = meses_considerados[-num_meses_media:] if len(meses_considerados) >= num_meses_media else meses_considerados
-        
-        # Criar períodos com ano se necessário
-        if tem_anos:
-            for mes in meses_para_media:
-                periodo_com_ano = f"{mes} {ultimo_ano_dados}"
-                periodos_para_media.append(periodo_com_ano)
-        else:
-            periodos_para_media = meses_para_media.copy()
-    else:
-        meses_para_media = []
-        periodos_para_media = []
-else:
-    meses_para_media = []
-    periodos_para_media = []
+meses_para_media, periodos_para_media = calcular_periodos_media(
+    meses_historicos_disponiveis, meses_excluir_media, num_meses_media, tem_anos, ultimo_ano_dados
+)
 
 # Mostrar resumo da configuração
 col_resumo1, col_resumo2 = st.columns(2)
@@ -1179,15 +812,8 @@ if aplicar_config_forecast:
     if config_sensibilidade_temp['inflacao_type06'] is not None:
         st.session_state.inflacao_aplicada = config_sensibilidade_temp['inflacao_type06']
     
-    # Limpar cache das funções de forecast
-    try:
-        calcular_medias_forecast.clear()
-        calcular_volumes_cpu.clear()
-        calcular_forecast_completo.clear()
-        processar_tabela_forecast.clear()
-    except:
-        pass
-    
+    # Não é preciso limpar cache: as funções de forecast são indexadas pelos
+    # parâmetros aplicados (e os dados pela versão)
     st.success("✅ Configurações aplicadas com sucesso! Recalculando forecast...")
     st.rerun()
 
@@ -1372,19 +998,8 @@ if colunas_faltando:
     st.error(f"❌ Colunas necessárias não encontradas: {', '.join(colunas_faltando)}")
     st.info("ℹ️ Certifique-se de que o arquivo df_final.parquet contém todas as colunas necessárias.")
 else:
-    # Função para identificar se é custo fixo ou variável
-    def is_custo_fixo(valor_custo):
-        """Identifica se o custo é fixo baseado no valor da coluna Custo"""
-        if pd.isna(valor_custo):
-            return False
-        valor_str = str(valor_custo).strip().upper()
-        # Considerar como fixo se contém palavras-chave
-        palavras_fixo = ['FIXO', 'FIX', 'FIXED']
-        return any(palavra in valor_str for palavra in palavras_fixo)
-    
     # Criar coluna indicando se é fixo ou variável
-    df_filtrado['Tipo_Custo'] = df_filtrado['Custo'].apply(is_custo_fixo)
-    df_filtrado['Tipo_Custo'] = df_filtrado['Tipo_Custo'].map({True: 'Fixo', False: 'Variável'})
+    df_filtrado = marcar_tipo_custo(df_filtrado)
     
     # Validação: verificar se há períodos para calcular a média
     # Se não houver períodos configurados, tentar usar períodos disponíveis nos dados
@@ -1451,372 +1066,8 @@ else:
         st.info("   - Defina quantos meses prever")
         st.stop()
     
-    # Função para calcular médias com cache
-    @st.cache_data(ttl=3600, max_entries=10, show_spinner=False)
-    def calcular_medias_forecast(df_filtrado_cache, colunas_adicionais_cache, periodos_para_media_cache, ultimo_periodo_dados_cache=None):
-        """Calcula médias mensais históricas com cache, usando apenas os períodos selecionados"""
-        # 🔧 CORREÇÃO CRÍTICA: Extrair ano de referência ANTES de qualquer filtro
-        # Isso garante que o mesmo ano seja usado em todos os filtros
-        ano_referencia_filtro = None
-        if periodos_para_media_cache:
-            # Extrair ano dos períodos procurados
-            anos_nos_periodos = []
-            for periodo_procurado in periodos_para_media_cache:
-                periodo_str = str(periodo_procurado).strip()
-                if ' ' in periodo_str:
-                    partes = periodo_str.split(' ', 1)
-                    if len(partes) > 1 and partes[1].isdigit():
-                        anos_nos_periodos.append(int(partes[1]))
-            if anos_nos_periodos:
-                ano_referencia_filtro = max(anos_nos_periodos)
-        if ano_referencia_filtro is None and ultimo_periodo_dados_cache:
-            ultimo_periodo_str = str(ultimo_periodo_dados_cache).strip()
-            if ' ' in ultimo_periodo_str:
-                ano_str = ultimo_periodo_str.split(' ', 1)[1]
-                if ano_str.isdigit():
-                    ano_referencia_filtro = int(ano_str)
-        
-        # Filtrar apenas os períodos que serão usados para calcular a média
-        if periodos_para_media_cache and 'Período' in df_filtrado_cache.columns:
-            # Normalizar períodos procurados (manter mês + ano se disponível)
-            periodos_procurados_normalizados = []
-            for periodo_procurado in periodos_para_media_cache:
-                periodo_str = str(periodo_procurado).strip()
-                # Normalizar para minúsculas para comparação
-                periodos_procurados_normalizados.append(periodo_str.lower())
-            
-            # Extrair último mês e ano para validação
-            ultimo_mes_limite = None
-            ultimo_ano_limite = None
-            if ultimo_periodo_dados_cache:
-                ultimo_periodo_str = str(ultimo_periodo_dados_cache).strip().lower()
-                if ' ' in ultimo_periodo_str:
-                    ultimo_mes_limite = ultimo_periodo_str.split(' ', 1)[0]
-                    ultimo_ano_limite = int(ultimo_periodo_str.split(' ', 1)[1]) if ultimo_periodo_str.split(' ', 1)[1].isdigit() else None
-                else:
-                    ultimo_mes_limite = ultimo_periodo_str
-                    ultimo_ano_limite = None
-            
-            # Verificar períodos no DataFrame
-            periodos_no_df = df_filtrado_cache['Período'].astype(str).str.strip().str.lower()
-            
-            # 🔧 CORREÇÃO: Usar ano_referencia_filtro já definido no início da função
-            # Se não foi definido, usar ultimo_ano_limite como fallback
-            if ano_referencia_filtro is None:
-                ano_referencia_filtro = ultimo_ano_limite
-            
-            # Criar máscara: comparar período completo (mês + ano) quando disponível
-            # 🔧 CORREÇÃO CRÍTICA: Garantir que apenas períodos do ano de referência sejam incluídos
-            def periodo_corresponde(periodo_df):
-                periodo_df_lower = str(periodo_df).strip().lower()
-                
-                # 🔧 CORREÇÃO CRÍTICA: Se há ano de referência definido, filtrar APENAS esse ano
-                if ano_referencia_filtro:
-                    periodo_df_tem_ano = ' ' in periodo_df_lower and len(periodo_df_lower.split(' ', 1)) > 1
-                    if periodo_df_tem_ano:
-                        periodo_df_ano = int(periodo_df_lower.split(' ', 1)[1]) if periodo_df_lower.split(' ', 1)[1].isdigit() else None
-                        # Se o período tem ano diferente do ano de referência, NÃO incluir
-                        if periodo_df_ano != ano_referencia_filtro:
-                            return False
-                    else:
-                        # Se o período não tem ano mas há ano de referência, NÃO incluir
-                        # (evita incluir períodos sem ano quando há períodos com ano)
-                        return False
-                
-                # Verificar se o período está antes ou no último mês selecionado
-                if ultimo_mes_limite and ultimo_ano_limite:
-                    periodo_df_tem_ano = ' ' in periodo_df_lower and len(periodo_df_lower.split(' ', 1)) > 1
-                    if periodo_df_tem_ano:
-                        periodo_df_ano = int(periodo_df_lower.split(' ', 1)[1]) if periodo_df_lower.split(' ', 1)[1].isdigit() else None
-                        periodo_df_mes = periodo_df_lower.split(' ', 1)[0]
-                        
-                        # Verificar se está antes do último mês
-                        if periodo_df_ano and periodo_df_ano > ultimo_ano_limite:
-                            return False
-                        if periodo_df_ano == ultimo_ano_limite:
-                            # Comparar meses usando índice
-                            meses_ano_lower = [m.lower() for m in meses_ano]
-                            if periodo_df_mes in meses_ano_lower and ultimo_mes_limite in meses_ano_lower:
-                                idx_periodo = meses_ano_lower.index(periodo_df_mes)
-                                idx_limite = meses_ano_lower.index(ultimo_mes_limite)
-                                if idx_periodo > idx_limite:
-                                    return False
-                    else:
-                        # Se o período do DataFrame não tem ano, verificar apenas pelo mês
-                        periodo_df_mes = periodo_df_lower
-                        meses_ano_lower = [m.lower() for m in meses_ano]
-                        if periodo_df_mes in meses_ano_lower and ultimo_mes_limite in meses_ano_lower:
-                            idx_periodo = meses_ano_lower.index(periodo_df_mes)
-                            idx_limite = meses_ano_lower.index(ultimo_mes_limite)
-                            if idx_periodo > idx_limite:
-                                return False
-                
-                # Comparação exata primeiro (período completo)
-                if periodo_df_lower in periodos_procurados_normalizados:
-                    return True
-                
-                # Se não houver correspondência exata, verificar se ambos têm ano
-                periodo_df_tem_ano = ' ' in periodo_df_lower and len(periodo_df_lower.split(' ', 1)) > 1
-                
-                for periodo_procurado in periodos_procurados_normalizados:
-                    periodo_procurado_tem_ano = ' ' in periodo_procurado and len(periodo_procurado.split(' ', 1)) > 1
-                    
-                    # Se ambos têm ano, comparar período completo (já verificamos exato acima)
-                    if periodo_df_tem_ano and periodo_procurado_tem_ano:
-                        # Se ambos têm ano mas não são iguais, não corresponde
-                        continue
-                    
-                    # Se nenhum tem ano ou apenas um tem, comparar apenas o mês
-                    # MAS APENAS se não houver ano de referência definido
-                    if not ano_referencia_filtro:
-                        mes_df = periodo_df_lower.split(' ', 1)[0] if ' ' in periodo_df_lower else periodo_df_lower
-                        mes_procurado = periodo_procurado.split(' ', 1)[0] if ' ' in periodo_procurado else periodo_procurado
-                        
-                        if mes_df == mes_procurado:
-                            # Se o período procurado tem ano mas o do DF não tem, não incluir
-                            if periodo_procurado_tem_ano and not periodo_df_tem_ano:
-                                continue
-                            return True
-                
-                return False
-            
-            df_filtrado_media = df_filtrado_cache[
-                periodos_no_df.apply(periodo_corresponde)
-            ].copy()
-            
-            # Se não encontrou correspondências, tentar encontrar períodos alternativos pelos meses
-            # MAS APENAS se estiverem antes do último mês selecionado
-            if df_filtrado_media.empty:
-                # Tentar encontrar períodos disponíveis nos dados que correspondem aos meses solicitados
-                periodos_disponiveis_df = df_filtrado_cache['Período'].dropna().unique()
-                periodos_encontrados_alternativos = []
-                
-                # Extrair apenas os meses dos períodos procurados
-                meses_procurados = []
-                for periodo_procurado in periodos_para_media_cache:
-                    periodo_str = str(periodo_procurado).strip().lower()
-                    mes_procurado = periodo_str.split(' ', 1)[0] if ' ' in periodo_str else periodo_str
-                    meses_procurados.append(mes_procurado)
-                
-                # Procurar períodos no DataFrame que correspondem aos meses procurados
-                # MAS APENAS se estiverem antes ou no último mês selecionado
-                for periodo_df in periodos_disponiveis_df:
-                    periodo_df_str = str(periodo_df).strip().lower()
-                    periodo_df_mes = periodo_df_str.split(' ', 1)[0] if ' ' in periodo_df_str else periodo_df_str
-                    periodo_df_ano = int(periodo_df_str.split(' ', 1)[1]) if ' ' in periodo_df_str and periodo_df_str.split(' ', 1)[1].isdigit() else None
-                    
-                    # Verificar se o mês corresponde
-                    if periodo_df_mes in meses_procurados:
-                        # Verificar se está antes ou no último mês selecionado
-                        if ultimo_mes_limite and ultimo_ano_limite:
-                            if periodo_df_ano:
-                                if periodo_df_ano > ultimo_ano_limite:
-                                    continue
-                                if periodo_df_ano == ultimo_ano_limite:
-                                    # Comparar meses usando índice
-                                    meses_ano_lower = [m.lower() for m in meses_ano]
-                                    if periodo_df_mes in meses_ano_lower and ultimo_mes_limite in meses_ano_lower:
-                                        idx_periodo = meses_ano_lower.index(periodo_df_mes)
-                                        idx_limite = meses_ano_lower.index(ultimo_mes_limite)
-                                        if idx_periodo > idx_limite:
-                                            continue
-                            elif not periodo_df_ano:
-                                # Se não tem ano, verificar pelo mês
-                                meses_ano_lower = [m.lower() for m in meses_ano]
-                                if periodo_df_mes in meses_ano_lower and ultimo_mes_limite in meses_ano_lower:
-                                    idx_periodo = meses_ano_lower.index(periodo_df_mes)
-                                    idx_limite = meses_ano_lower.index(ultimo_mes_limite)
-                                    if idx_periodo > idx_limite:
-                                        continue
-                        
-                        periodos_encontrados_alternativos.append(str(periodo_df))
-                
-                # Se encontrou períodos alternativos, usar eles
-                if periodos_encontrados_alternativos:
-                    periodos_alternativos_normalizados = [p.strip().lower() for p in periodos_encontrados_alternativos]
-                    df_filtrado_media = df_filtrado_cache[
-                        periodos_no_df.isin(periodos_alternativos_normalizados)
-                    ].copy()
-        else:
-            # Se não houver períodos selecionados, usar todos os dados (comportamento original)
-            df_filtrado_media = df_filtrado_cache.copy()
-        
-        if df_filtrado_media.empty:
-            # Retornar DataFrames vazios se não houver dados
-            colunas_base = ['Oficina', 'Veículo', 'Período', 'Tipo_Custo'] + colunas_adicionais_cache
-            df_medias = pd.DataFrame(columns=colunas_base + ['Total'])
-            colunas_media = ['Oficina', 'Veículo', 'Tipo_Custo'] + colunas_adicionais_cache
-            df_media_mensal = pd.DataFrame(columns=colunas_media + ['Total'])
-            return df_medias, df_media_mensal
-        
-        # 🔧 CORREÇÃO CRÍTICA: Normalizar Período para SEMPRE incluir o ano antes do groupby
-        # Isso evita somar meses de anos diferentes (ex: "Novembro 2024" + "Novembro 2025")
-        # 🔧 CORREÇÃO: Usar o mesmo ano_referencia_filtro que foi usado no filtro inicial
-        ano_referencia = ano_referencia_filtro
-        if ano_referencia is None:
-            if ultimo_periodo_dados_cache:
-                ultimo_periodo_str = str(ultimo_periodo_dados_cache).strip()
-                if ' ' in ultimo_periodo_str:
-                    ano_str = ultimo_periodo_str.split(' ', 1)[1]
-                    if ano_str.isdigit():
-                        ano_referencia = int(ano_str)
-            elif periodos_para_media_cache:
-                # Tentar extrair ano dos períodos selecionados
-                for p in periodos_para_media_cache:
-                    p_str = str(p).strip()
-                    if ' ' in p_str:
-                        ano_str = p_str.split(' ', 1)[1]
-                        if ano_str.isdigit():
-                            ano_referencia = int(ano_str)
-                            break
-        
-        # 🔧 CORREÇÃO CRÍTICA: Normalizar Período usando coluna Ano ORIGINAL (não ano_referencia)
-        # Estratégia: Se Período não tem ano, usar coluna Ano original dos dados
-        # Isso garante que Período e Ano sejam sempre consistentes
-        if 'Período' in df_filtrado_media.columns:
-            df_filtrado_media = df_filtrado_media.copy()
-            # 🔧 CORREÇÃO: Converter Período para string ANTES de qualquer operação (pode ser Categorical)
-            df_filtrado_media['Período'] = df_filtrado_media['Período'].astype(str).str.lower().str.strip()
-            
-            def extrair_ano_do_periodo(periodo_str):
-                periodo_str = str(periodo_str).strip()
-                if ' ' in periodo_str:
-                    partes = periodo_str.split(' ', 1)
-                    if len(partes) > 1 and partes[1].isdigit():
-                        return int(partes[1])
-                return None
-            
-            # Verificar quais períodos não têm ano
-            df_filtrado_media['Ano_Do_Periodo'] = df_filtrado_media['Período'].apply(extrair_ano_do_periodo)
-            mask_sem_ano_periodo = df_filtrado_media['Ano_Do_Periodo'].isna()
-            
-            # 🔧 CORREÇÃO: Usar coluna Ano ORIGINAL dos dados para normalizar Período
-            if 'Ano' in df_filtrado_media.columns:
-                # Converter Ano para int (remover .0 se for float)
-                df_filtrado_media['Ano'] = pd.to_numeric(df_filtrado_media['Ano'], errors='coerce')
-                
-                # Se Período não tem ano, adicionar ano da coluna Ano ORIGINAL
-                mask_ano_valido = df_filtrado_media.loc[mask_sem_ano_periodo, 'Ano'].notna()
-                # 🔧 CORREÇÃO: Converter Período para string antes de concatenar (pode ser Categorical)
-                df_filtrado_media.loc[mask_sem_ano_periodo & mask_ano_valido, 'Período'] = (
-                    df_filtrado_media.loc[mask_sem_ano_periodo & mask_ano_valido, 'Período'].astype(str) + ' ' +
-                    df_filtrado_media.loc[mask_sem_ano_periodo & mask_ano_valido, 'Ano'].astype(int).astype(str)
-                )
-                # Re-extrair ano após adicionar
-                df_filtrado_media.loc[mask_sem_ano_periodo & mask_ano_valido, 'Ano_Do_Periodo'] = (
-                    df_filtrado_media.loc[mask_sem_ano_periodo & mask_ano_valido, 'Período'].apply(extrair_ano_do_periodo)
-                )
-                
-                # Se Período já tem ano, sincronizar coluna Ano com o ano do Período
-                # Mas manter a coluna Ano original se não houver conflito
-                mask_ano_periodo_valido = df_filtrado_media['Ano_Do_Periodo'].notna()
-                # Sincronizar: usar ano do Período na coluna Ano (já está normalizado)
-                df_filtrado_media.loc[mask_ano_periodo_valido, 'Ano'] = df_filtrado_media.loc[mask_ano_periodo_valido, 'Ano_Do_Periodo']
-            
-            df_filtrado_media = df_filtrado_media.drop(columns=['Ano_Do_Periodo'], errors='ignore')
-        
-        # 🔧 CORREÇÃO CRÍTICA: Filtrar por ano ANTES do groupby para evitar incluir dados de ambos os anos
-        # Isso garante que apenas períodos do ano de referência sejam agrupados
-        if ano_referencia:
-            if 'Ano' in df_filtrado_media.columns:
-                # Filtrar diretamente pela coluna Ano ANTES do groupby
-                df_filtrado_media = df_filtrado_media[df_filtrado_media['Ano'] == ano_referencia].copy()
-            elif 'Período' in df_filtrado_media.columns:
-                # Filtrar pelo ano no Período se não houver coluna Ano
-                def periodo_tem_ano_correto_pre_groupby(periodo_val):
-                    periodo_str = str(periodo_val).strip()
-                    if ' ' in periodo_str:
-                        ano_val = periodo_str.split(' ', 1)[1]
-                        if ano_val.isdigit():
-                            return int(ano_val) == ano_referencia
-                    return False
-                df_filtrado_media = df_filtrado_media[
-                    df_filtrado_media['Período'].apply(periodo_tem_ano_correto_pre_groupby)
-                ].copy()
-        
-        # Agrupar por Oficina, Veículo, Período (com ano) e Tipo_Custo para obter totais
-        # 🔧 CORREÇÃO: Se houver coluna Ano, incluí-la no groupby (mesma lógica da TC_Ext)
-        # Isso garante que "Julho 2024" e "Julho 2025" sejam tratados separadamente
-        # MAS agora df_filtrado_media já contém APENAS o ano de referência
-        colunas_groupby = ['Oficina', 'Veículo', 'Período', 'Tipo_Custo'] + colunas_adicionais_cache
-        # Se houver coluna Ano, incluí-la no groupby para evitar somar meses de anos diferentes
-        if 'Ano' in df_filtrado_media.columns:
-            colunas_groupby = ['Ano'] + colunas_groupby
-        colunas_groupby = [col for col in colunas_groupby if col in df_filtrado_media.columns]
-        agg_dict = {'Total': 'sum'}  # Usar 'sum' para ter valores totais reais
-        df_medias = df_filtrado_media.groupby(colunas_groupby).agg(agg_dict).reset_index()
-        
-        # 🔧 CORREÇÃO: df_medias já contém apenas o ano de referência (foi filtrado antes do groupby)
-        # Mas vamos garantir novamente para segurança
-        df_medias_ano_recente = df_medias.copy()
-        if ano_referencia:
-            if 'Ano' in df_medias_ano_recente.columns:
-                # Filtrar diretamente pela coluna Ano (mais eficiente e correto)
-                df_medias_ano_recente = df_medias_ano_recente[df_medias_ano_recente['Ano'] == ano_referencia].copy()
-            elif 'Período' in df_medias.columns:
-                # Fallback: filtrar pelo ano no Período
-                def periodo_tem_ano_correto(periodo_val):
-                    periodo_str = str(periodo_val).strip()
-                    if ' ' in periodo_str:
-                        ano_val = periodo_str.split(' ', 1)[1]
-                        if ano_val.isdigit():
-                            return int(ano_val) == ano_referencia
-                    # Se não tem ano após normalização, excluir
-                    return False
-                df_medias_ano_recente = df_medias[
-                    df_medias['Período'].apply(periodo_tem_ano_correto)
-                ].copy()
-            else:
-                # Se não temos coluna Ano nem Período, usar todos (compatibilidade)
-                df_medias_ano_recente = df_medias.copy()
-        else:
-            # Se não temos ano de referência, usar todos (compatibilidade)
-            df_medias_ano_recente = df_medias.copy()
-        
-        # Calcular média geral mensal por linha (média das médias dos meses selecionados)
-        # 🔧 CORREÇÃO CRÍTICA: Garantir que df_medias_ano_recente contém APENAS o ano de referência
-        # Se ainda houver dados de outros anos após o filtro, filtrar novamente
-        if ano_referencia and 'Ano' in df_medias_ano_recente.columns:
-            anos_ainda_presentes = df_medias_ano_recente['Ano'].dropna().unique()
-            if len(anos_ainda_presentes) > 1 or (len(anos_ainda_presentes) == 1 and anos_ainda_presentes[0] != ano_referencia):
-                # Forçar filtro novamente
-                df_medias_ano_recente = df_medias_ano_recente[df_medias_ano_recente['Ano'] == ano_referencia].copy()
-        elif ano_referencia and 'Período' in df_medias_ano_recente.columns:
-            # Filtrar pelo ano no Período se não houver coluna Ano
-            def periodo_tem_ano_correto_final(periodo_val):
-                periodo_str = str(periodo_val).strip()
-                if ' ' in periodo_str:
-                    ano_val = periodo_str.split(' ', 1)[1]
-                    if ano_val.isdigit():
-                        return int(ano_val) == ano_referencia
-                return False
-            df_medias_ano_recente = df_medias_ano_recente[
-                df_medias_ano_recente['Período'].apply(periodo_tem_ano_correto_final)
-            ].copy()
-        
-        # Calcular média geral mensal por linha (média das médias dos meses selecionados)
-        # 🔧 CORREÇÃO: Incluir 'Ano' no groupby se existir (preservar ano para forecast)
-        # IMPORTANTE: df_medias_ano_recente já deve conter APENAS o ano de referência
-        colunas_groupby_media = ['Oficina', 'Veículo', 'Tipo_Custo'] + colunas_adicionais_cache
-        if 'Ano' in df_medias_ano_recente.columns:
-            colunas_groupby_media.insert(2, 'Ano')  # Inserir Ano após Veículo
-        colunas_groupby_media = [col for col in colunas_groupby_media if col in df_medias_ano_recente.columns]
-        agg_dict_media = {'Total': 'mean'}
-        df_media_mensal = df_medias_ano_recente.groupby(colunas_groupby_media).agg(agg_dict_media).reset_index()
-        
-        # 🔧 VERIFICAÇÃO FINAL: Garantir que não há duplicatas após o agrupamento
-        # Se ainda houver duplicatas, significa que o agrupamento não está funcionando corretamente
-        if len(colunas_groupby_media) > 0:
-            duplicatas_final = df_media_mensal.duplicated(subset=colunas_groupby_media, keep=False)
-            if duplicatas_final.any():
-                # Se ainda houver duplicatas, forçar agrupamento novamente
-                df_media_mensal = df_media_mensal.groupby(
-                    colunas_groupby_media, as_index=False
-                ).agg(agg_dict_media)
-        
-        return df_medias, df_media_mensal
-
     # Calcular médias mensais históricas por Oficina, Veículo e Período
+    # (calcular_medias_forecast fica em tc_dados.forecast para o pré-aquecimento do cache)
     st.markdown("### 📊 Cálculo de Médias Mensais Históricas")
     
     st.markdown("---")
@@ -2148,7 +1399,7 @@ else:
             st.info(f"ℹ️ **Informação:** Foram encontrados {len(periodos_encontrados)} período(s) nos dados (solicitados: {len(periodos_para_media)}). O cálculo será feito com os períodos disponíveis.")
     
     # Função para calcular volumes e CPU com cache
-    @st.cache_data(ttl=3600, max_entries=10, show_spinner=False)
+    @st.cache_data(max_entries=10, show_spinner=False)
     def calcular_volumes_cpu(df_vol_cache, df_medias_cache, colunas_adicionais_cache, periodos_para_media_cache, ultimo_periodo_dados_cache=None, meses_excluir_media_cache=None):
         """
         Calcula volumes e CPU histórico com cache, usando apenas os períodos selecionados
@@ -2382,10 +1633,9 @@ else:
             how='left'
         )
         
-        # Calcular CPU histórico
-        df_custo_volume['CPU_Historico'] = df_custo_volume.apply(
-            lambda row: row['Total'] / row['Volume'] if pd.notnull(row['Volume']) and row['Volume'] > 0 else 0,
-            axis=1
+        # Calcular CPU histórico (0 sem volume positivo)
+        df_custo_volume['CPU_Historico'] = calcular_cpu(
+            df_custo_volume['Total'], df_custo_volume['Volume'].where(df_custo_volume['Volume'] > 0)
         )
         
         # Calcular CPU médio
@@ -2410,7 +1660,7 @@ else:
         df_cpu_medio = pd.DataFrame(columns=['Oficina', 'Veículo'] + colunas_adicionais + ['CPU_Historico', 'Volume_Medio_Ref'])
     
     # Função para calcular forecast completo com cache
-    @st.cache_data(ttl=3600, max_entries=10, show_spinner=False)
+    @st.cache_data(max_entries=10, show_spinner=False)
     def calcular_forecast_completo(df_media_mensal_cache, volume_base_cache, df_cpu_medio_cache, 
                                     volume_por_mes_cache, colunas_adicionais_cache, meses_restantes_cache,
                                     sensibilidade_fixo_cache, sensibilidade_variavel_cache, sensibilidades_type06_cache,
@@ -2840,7 +2090,7 @@ else:
     # Total_Forecast será calculado depois que colunas_meses for definido
     
     # Função para processar e formatar tabela com cache
-    @st.cache_data(ttl=3600, max_entries=10, show_spinner=False)
+    @st.cache_data(max_entries=10, show_spinner=False)
     def processar_tabela_forecast(df_forecast_cache, colunas_adicionais_cache, meses_restantes_cache):
         """Processa e formata a tabela de forecast com cache"""
         # Reordenar colunas
@@ -2907,7 +2157,7 @@ else:
                     else:
                         agg_dict_grupo[col] = 'first'
             df_forecast_processado = df_forecast_processado.groupby(
-                colunas_agrupamento_existentes, as_index=False
+                colunas_agrupamento_existentes, as_index=False, observed=True
             ).agg(agg_dict_grupo).reset_index()
             
             # Recalcular Total_Forecast após agrupamento (soma dos meses agrupados)
@@ -5304,70 +4554,26 @@ else:
             import traceback
             st.code(traceback.format_exc())
 
-        # Botão de download da tabela
-        if st.button(
-            "📥 Baixar Tabela Forecast (Excel)",
-            use_container_width=True,
-            key="download_tabela_forecast"
-        ):
-            with st.spinner("Gerando arquivo da tabela..."):
-                try:
-                    # Criar DataFrame completo para download (com todas as oficinas e totais)
-                    df_download_list = []
-                    
-                    for oficina in sorted(oficinas):
-                        # Dados da oficina (sem formatação para manter valores numéricos)
-                        df_oficina_download = df_forecast[df_forecast['Oficina'] == oficina].copy()
-                        
-                        # Adicionar linha de total da oficina
-                        linha_total_download = {'Oficina': oficina}
-                        df_oficina_numerico = df_forecast[df_forecast['Oficina'] == oficina].copy()
-                        df_oficina_numerico = df_oficina_numerico.drop(columns=['Oficina'])
-                        
-                        # Adicionar colunas de identificação
-                        colunas_id = ['Veículo'] + [col for col in colunas_adicionais if col in df_oficina_numerico.columns] + ['Tipo_Custo']
-                        for col in colunas_id:
-                            if col in df_oficina_numerico.columns:
-                                linha_total_download[col] = 'TOTAL'
-                        
-                        # Adicionar totais
-                        colunas_totais = ['Média_Mensal_Histórica'] + colunas_meses + ['Total_Forecast']
-                        for col in colunas_totais:
-                            if col in df_oficina_numerico.columns:
-                                total_col = df_oficina_numerico[col].sum()
-                                linha_total_download[col] = total_col
-                        
-                        # Adicionar dados da oficina
-                        df_download_list.append(df_oficina_download)
-                        # Adicionar linha de total
-                        df_download_list.append(pd.DataFrame([linha_total_download]))
-                    
-                    # Concatenar todos os DataFrames
-                    df_download = pd.concat(df_download_list, ignore_index=True)
-                    
-                    # Obter pasta Downloads do usuário
-                    downloads_path = os.path.join(
-                        os.path.expanduser("~"), "Downloads"
-                    )
-                    file_name = f"Forecast_tabela_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-                    file_path = os.path.join(downloads_path, file_name)
-                    
-                    # Salvar arquivo diretamente na pasta Downloads
-                    with pd.ExcelWriter(
-                        file_path, engine='openpyxl'
-                    ) as writer:
-                        df_download.to_excel(
-                            writer, index=False, sheet_name='Forecast'
-                        )
-                    
-                    st.success(
-                        f"✅ Arquivo salvo com sucesso em: {file_path}"
-                    )
-                    st.info(
-                        f"📁 Verifique sua pasta Downloads: {downloads_path}"
-                    )
-                except Exception as e:
-                    st.error(f"❌ Erro ao salvar arquivo: {str(e)}")
+        # Download da tabela (montada e gerada em memória só no clique)
+        def montar_download_forecast(df_forecast, colunas_adicionais, colunas_meses):
+            """Tabela Forecast com a linha TOTAL de cada oficina"""
+            colunas_id = ['Veículo'] + [col for col in colunas_adicionais if col in df_forecast.columns] + ['Tipo_Custo']
+            colunas_totais = ['Média_Mensal_Histórica'] + colunas_meses + ['Total_Forecast']
+            df_download = com_subtotais(
+                df_forecast, 'Oficina', [col for col in colunas_id if col in df_forecast.columns], colunas_totais
+            )
+            return df_download.drop(columns=[NIVEL])
+
+        botao_exportacao(
+            functools.partial(montar_download_forecast, df_forecast, colunas_adicionais, colunas_meses),
+            "Tabela Forecast", f"Forecast_tabela_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
+            "download_tabela_forecast",
+            # O forecast é definido pelos filtros e pelos parâmetros aplicados
+            identidade=(ano_selecionado, filtro.chave, ultimo_periodo_dados, tuple(periodos_para_media),
+                        tuple(periodos_restantes), sensibilidade_fixo, sensibilidade_variavel,
+                        sens_type06_cache, inflacao_type06_cache),
+            nome_planilha='Forecast'
+        )
     else:
         colunas_faltando = []
         if not tem_oficina:
@@ -1,7 +1,10 @@
 import streamlit as st
 import pandas as pd
 import plotly.graph_objects as go
-import os
+from tc_dados.carregamento import carregar_dados
+from tc_dados.metadados import carregar_dimensoes, carregar_visao, contar_linhas, filtrar, opcoes_filtro
+from tc_dados.moeda import somar, somar_grupos
+from tc_dados.preaquecimento import iniciar_preaquecimento
 
 st.set_page_config(
     page_title="Análise Waterfall - TC", 
@@ -10,6 +13,9 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Pré-aquecer o cache compartilhado em segundo plano (uma vez por processo e versão dos dados)
+iniciar_preaquecimento()
+
 st.title("🌊 Análise Waterfall - TC")
 st.markdown("---")
 
@@ -24,50 +30,31 @@ def sort_mes_unique(values):
     except Exception:
         return sorted(vals, key=lambda x: MES_POS.get(str(x).lower(), 99))
 
-@st.cache_data(ttl=3600, max_entries=3)
 def load_df_historico() -> pd.DataFrame:
-    """Carrega dados do arquivo histórico consolidado"""
-    caminho_historico = os.path.join("dados", "historico_consolidado", "df_final_historico.parquet")
+    """Carrega dados do histórico consolidado (cache compartilhado em tc_dados.carregamento)"""
+    try:
+        df = carregar_dados("Todos", "df_final")
+    except Exception as e:
+        st.error(f"❌ **Erro ao carregar dados**: {str(e)}")
+        st.stop()
+        return pd.DataFrame()
     
-    if not os.path.exists(caminho_historico):
+    if df is None:
         st.error("❌ **Arquivo histórico não encontrado**")
-        st.error(f"📁 Caminho esperado: {caminho_historico}")
+        st.error("📁 Caminho esperado: dados/historico_consolidado/df_final_historico.parquet")
         st.info("💡 **Solução**: Certifique-se de que o arquivo df_final_historico.parquet existe na pasta dados/historico_consolidado/")
         st.stop()
         return pd.DataFrame()
     
-    try:
-        df = pd.read_parquet(caminho_historico)
-        
-        # Otimizar tipos de dados
-        for col in df.columns:
-            if df[col].dtype == 'object':
-                unique_ratio = df[col].nunique() / len(df) if len(df) > 0 else 0
-                if unique_ratio < 0.5:
-                    try:
-                        df[col] = df[col].astype('category')
-                    except:
-                        pass
-        
-        return df
-    except Exception as e:
-        st.error(f"❌ **Erro ao carregar dados**: {str(e)}")
-        st.stop()
-        return pd.DataFrame()
+    return df
 
-@st.cache_data(ttl=3600, max_entries=3)
 def load_df_volume() -> pd.DataFrame:
-    """Carrega dados de volume do arquivo histórico consolidado"""
-    caminho_volume = os.path.join("dados", "historico_consolidado", "df_vol_historico.parquet")
-    
-    if not os.path.exists(caminho_volume):
-        return pd.DataFrame()  # Retorna vazio se não encontrar
-    
+    """Carrega dados de volume do histórico consolidado"""
     try:
-        df = pd.read_parquet(caminho_volume)
-        return df
+        df = carregar_dados("Todos", "df_vol")
     except Exception:
         return pd.DataFrame()
+    return df if df is not None else pd.DataFrame()  # Retorna vazio se não encontrar
 
 def obter_semestre_trimestre(mes_str, ano):
     """
@@ -202,12 +189,12 @@ def calcular_flex(df_dados, df_volume, mes_inicial, mes_final, col_mes, col_valo
         if modo_sensibilidade == "Global" and modo_inflacao == "Global":
             # Agrupar por tipo de custo
             if 'Custo' in df_mes_inicial.columns:
-                custo_por_tipo = df_mes_inicial.groupby('Custo')[col_valor].sum()
+                custo_por_tipo = somar_grupos(df_mes_inicial, 'Custo', col_valor)
                 custo_fixo = float(custo_por_tipo.get('Fixo', 0.0))
                 custo_variavel = float(custo_por_tipo.get('Variável', 0.0))
             else:
                 custo_fixo = 0.0
-                custo_variavel = float(df_mes_inicial[col_valor].sum())
+                custo_variavel = somar(df_mes_inicial[col_valor])
             
             custo_total_inicial = custo_fixo + custo_variavel
             
@@ -242,12 +229,12 @@ def calcular_flex(df_dados, df_volume, mes_inicial, mes_final, col_mes, col_valo
                     
                     # Obter custos por tipo
                     if 'Custo' in df_cat.columns:
-                        custo_por_tipo = df_cat.groupby('Custo')[col_valor].sum()
+                        custo_por_tipo = somar_grupos(df_cat, 'Custo', col_valor)
                         custo_fixo_cat = float(custo_por_tipo.get('Fixo', 0.0))
                         custo_variavel_cat = float(custo_por_tipo.get('Variável', 0.0))
                     else:
                         custo_fixo_cat = 0.0
-                        custo_variavel_cat = float(df_cat[col_valor].sum())
+                        custo_variavel_cat = somar(df_cat[col_valor])
                     
                     # Obter sensibilidade para esta categoria
                     if modo_sensibilidade == "Detalhado" and dict_sens_fixo and dict_sens_variavel:
@@ -287,18 +274,17 @@ def calcular_flex(df_dados, df_volume, mes_inicial, mes_final, col_mes, col_valo
     except Exception:
         return 0.0, 0.0
 
-# Carregar dados
-df_base = load_df_historico()
-if df_base.empty:
+# Metadados das dimensões (poucos KB): os filtros são montados sem ler a tabela completa
+try:
+    df_dimensoes = carregar_dimensoes("Todos", "df_final")
+except Exception as e:
+    st.error(f"❌ **Erro ao carregar dados**: {str(e)}")
     st.stop()
 
-# Carregar dados de volume
-df_volume = load_df_volume()
+if df_dimensoes is None:
+    load_df_historico()  # Exibe o erro de arquivo não encontrado
 
-st.sidebar.success("✅ Dados carregados com sucesso")
-st.sidebar.info(f"📊 {len(df_base):,} registros carregados")
-if not df_volume.empty:
-    st.sidebar.success(f"📈 {len(df_volume):,} registros de volume carregados")
+st.sidebar.info(f"📊 {contar_linhas(df_dimensoes):,} registros")
 
 # Aplicar filtros padrão do projeto
 st.sidebar.title("Filtros")
@@ -416,48 +402,36 @@ else:
 
 st.sidebar.markdown("---")
 
+# Filtros em cascata sobre os metadados; as seleções são aplicadas à tabela
+# completa depois, na mesma ordem
+selecoes = {}
+df_dim_filtrado = df_dimensoes
+
 # Filtro 1: Oficina
-if 'Oficina' in df_base.columns:
-    oficina_opcoes = ["Todos"] + sorted(df_base['Oficina'].dropna().astype(str).unique().tolist())
-    oficina_selecionada = st.sidebar.multiselect("Selecione a OFICINA:", oficina_opcoes, default=["Todos"])
-    
-    if "Todos" in oficina_selecionada or not oficina_selecionada:
-        df_filtrado = df_base.copy()
-    else:
-        df_filtrado = df_base[df_base['Oficina'].astype(str).isin(oficina_selecionada)]
-else:
-    df_filtrado = df_base.copy()
+if 'Oficina' in df_dim_filtrado.columns:
+    oficina_selecionada = st.sidebar.multiselect("Selecione a OFICINA:", opcoes_filtro(df_dim_filtrado, 'Oficina'), default=["Todos"])
+    selecoes['Oficina'] = oficina_selecionada
+    df_dim_filtrado = filtrar(df_dim_filtrado, 'Oficina', oficina_selecionada)
 
 # Filtro 2: Período
-if 'Período' in df_filtrado.columns:
-    periodo_opcoes = ["Todos"] + sorted(df_filtrado['Período'].dropna().astype(str).unique().tolist())
-    periodo_selecionado = st.sidebar.selectbox("Selecione o Período:", periodo_opcoes)
-    if periodo_selecionado != "Todos":
-        df_filtrado = df_filtrado[df_filtrado['Período'].astype(str) == str(periodo_selecionado)]
+if 'Período' in df_dim_filtrado.columns:
+    periodo_selecionado = st.sidebar.selectbox("Selecione o Período:", opcoes_filtro(df_dim_filtrado, 'Período'))
+    selecoes['Período'] = periodo_selecionado
+    df_dim_filtrado = filtrar(df_dim_filtrado, 'Período', periodo_selecionado)
 
 # Filtro 3: Veículo
-if 'Veículo' in df_filtrado.columns:
-    veiculo_opcoes = ["Todos"] + sorted(df_filtrado['Veículo'].dropna().astype(str).unique().tolist())
-    veiculo_selecionado = st.sidebar.multiselect("Selecione o VEÍCULO:", veiculo_opcoes, default=["Todos"])
-    if veiculo_selecionado and "Todos" not in veiculo_selecionado:
-        df_filtrado = df_filtrado[df_filtrado['Veículo'].astype(str).isin(veiculo_selecionado)]
+if 'Veículo' in df_dim_filtrado.columns:
+    veiculo_selecionado = st.sidebar.multiselect("Selecione o VEÍCULO:", opcoes_filtro(df_dim_filtrado, 'Veículo'), default=["Todos"])
+    selecoes['Veículo'] = veiculo_selecionado
+    df_dim_filtrado = filtrar(df_dim_filtrado, 'Veículo', veiculo_selecionado)
 
 # Filtro 4: Tipo de Custo
-if 'Custo' in df_filtrado.columns:
-    custo_opcoes = ["Todos"] + sorted(df_filtrado['Custo'].dropna().astype(str).unique().tolist())
-    custo_selecionado = st.sidebar.multiselect("Selecione o TIPO DE CUSTO:", custo_opcoes, default=["Todos"])
-    if custo_selecionado and "Todos" not in custo_selecionado:
-        df_filtrado = df_filtrado[df_filtrado['Custo'].astype(str).isin(custo_selecionado)]
-
-# Cache para opções de filtros (otimização de performance)
-@st.cache_data(ttl=1800, max_entries=3)
-def get_filter_options(df, column_name):
-    """Obtém opções de filtro com cache para melhor performance"""
-    if column_name in df.columns:
-        return ["Todos"] + sorted(df[column_name].dropna().astype(str).unique().tolist())
-    return ["Todos"]
-
-# Filtros principais (com cache otimizado)
+if 'Custo' in df_dim_filtrado.columns:
+    custo_selecionado = st.sidebar.multiselect("Selecione o TIPO DE CUSTO:", opcoes_filtro(df_dim_filtrado, 'Custo'), default=["Todos"])
+    selecoes['Custo'] = custo_selecionado
+    df_dim_filtrado = filtrar(df_dim_filtrado, 'Custo', custo_selecionado)
+
+# Filtros principais
 filtros_principais = [
     ("Type 05", "Type 05", "multiselect"),
     ("Type 06", "Type 06", "multiselect"), 
@@ -466,19 +440,35 @@ filtros_principais = [
 ]
 
 for col_name, label, widget_type in filtros_principais:
-    if col_name in df_filtrado.columns:
-        opcoes = get_filter_options(df_filtrado, col_name)
+    if col_name in df_dim_filtrado.columns:
+        opcoes = opcoes_filtro(df_dim_filtrado, col_name)
         if widget_type == "multiselect":
             selecionadas = st.sidebar.multiselect(f"Selecione o {label}:", opcoes, default=["Todos"])
-            if selecionadas and "Todos" not in selecionadas:
-                df_filtrado = df_filtrado[df_filtrado[col_name].astype(str).isin(selecionadas)]
+            selecoes[col_name] = selecionadas
+            df_dim_filtrado = filtrar(df_dim_filtrado, col_name, selecionadas)
 
 # Filtro 5: Ano (VISÍVEL na sidebar principal)
-if 'Ano' in df_filtrado.columns:
-    ano_opcoes = ["Todos"] + sorted(df_filtrado['Ano'].dropna().astype(str).unique().tolist())
-    ano_selecionado = st.sidebar.multiselect("Selecione o ANO:", ano_opcoes, default=["Todos"])
-    if ano_selecionado and "Todos" not in ano_selecionado:
-        df_filtrado = df_filtrado[df_filtrado['Ano'].astype(str).isin(ano_selecionado)]
+if 'Ano' in df_dim_filtrado.columns:
+    ano_selecionado = st.sidebar.multiselect("Selecione o ANO:", opcoes_filtro(df_dim_filtrado, 'Ano'), default=["Todos"])
+    selecoes['Ano'] = ano_selecionado
+    df_dim_filtrado = filtrar(df_dim_filtrado, 'Ano', ano_selecionado)
+
+# Carregar a tabela completa só agora (os filtros já estão na tela), já filtrada
+try:
+    df_filtrado = carregar_visao("Todos", "df_final", selecoes)
+except Exception as e:
+    st.error(f"❌ **Erro ao carregar dados**: {str(e)}")
+    st.stop()
+
+if df_filtrado is None:
+    load_df_historico()  # Exibe o erro de arquivo não encontrado
+
+# Carregar dados de volume
+df_volume = load_df_volume()
+
+st.sidebar.success("✅ Dados carregados com sucesso")
+if not df_volume.empty:
+    st.sidebar.success(f"📈 {len(df_volume):,} registros de volume carregados")
 
 # Filtros avançados (expansível)
 with st.sidebar.expander("🔍 Filtros Avançados"):
@@ -488,7 +478,7 @@ with st.sidebar.expander("🔍 Filtros Avançados"):
 st.sidebar.write(f"Número de linhas: {df_filtrado.shape[0]:,}")
 st.sidebar.write(f"Número de colunas: {df_filtrado.shape[1]}")
 if 'Total' in df_filtrado.columns:
-    st.sidebar.write(f"Soma do Valor total: R$ {df_filtrado['Total'].sum():,.2f}")
+    st.sidebar.write(f"Soma do Valor total: R$ {somar(df_filtrado['Total']):,.2f}")
 
 # --- Configurações do waterfall ---
 # Criar coluna Período_Ano para diferenciar meses de anos diferentes
@@ -772,7 +762,7 @@ else:  # Múltiplos Meses
 cats_all_2 = sorted([str(x).strip() for x in df_segunda_analise[chosen_dim_2].dropna().unique().tolist() if str(x).strip() != ""])
 total_cats_2 = max(1, len(cats_all_2))
 max_cats_2 = st.slider(f"Quantidade de categorias a exibir (Top N) (Total: {total_cats_2}):", 1, total_cats_2, min(total_cats_2, 20), key="max_cats_2")
-vol_mf_2 = (df_segunda_analise[df_segunda_analise[col_mes].astype(str) == str(mes_final_2)].groupby(chosen_dim_2)[col_valor].sum().sort_values(ascending=False))
+vol_mf_2 = somar_grupos(df_segunda_analise[df_segunda_analise[col_mes].astype(str) == str(mes_final_2)], chosen_dim_2, col_valor).sort_values(ascending=False)
 vol_index_2 = [str(c).strip() for c in list(vol_mf_2.index)]
 default_cats_2 = vol_index_2[:max_cats_2] if len(vol_index_2) else cats_all_2[:max_cats_2]
 
@@ -794,8 +784,8 @@ if modo_comparacao == "Ano a Ano":
     # Agrupar por ano e calcular totais
     df_ano_inicial = df_segunda_analise[df_segunda_analise['Ano'].astype(str) == str(ano_inicial)]
     df_ano_final = df_segunda_analise[df_segunda_analise['Ano'].astype(str) == str(ano_final)]
-    total_m1_all_2 = float(df_ano_inicial[col_valor].sum())
-    total_m2_all_2 = float(df_ano_final[col_valor].sum())
+    total_m1_all_2 = somar(df_ano_inicial[col_valor])
+    total_m2_all_2 = somar(df_ano_final[col_valor])
     change_all_2 = total_m2_all_2 - total_m1_all_2
     # Para FLEX, usar o primeiro e último mês de cada ano (mesma lógica de Mês a Mês)
     meses_ano_inicial = sorted(df_ano_inicial[col_mes].dropna().unique().tolist())
@@ -821,8 +811,8 @@ elif modo_comparacao == "Semestre":
         (df_segunda_analise['Ano'].astype(str) == str(ano_final)) &
             (df_segunda_analise[col_mes].astype(str).str.lower().str.split(' ', n=1).str[0].isin([m.lower() for m in meses_sem_final]))
     ]
-    total_m1_all_2 = float(df_sem_inicial[col_valor].sum())
-    total_m2_all_2 = float(df_sem_final[col_valor].sum())
+    total_m1_all_2 = somar(df_sem_inicial[col_valor])
+    total_m2_all_2 = somar(df_sem_final[col_valor])
     change_all_2 = total_m2_all_2 - total_m1_all_2
     # Para FLEX, usar o primeiro e último mês de cada semestre
     meses_sem_inicial_list = sorted(df_sem_inicial[col_mes].dropna().unique().tolist())
@@ -849,8 +839,8 @@ elif modo_comparacao == "Quarter":
         (df_segunda_analise['Ano'].astype(str) == str(ano_final)) &
             (df_segunda_analise[col_mes].astype(str).str.lower().str.split(' ', n=1).str[0].isin([m.lower() for m in meses_trim_final]))
     ]
-    total_m1_all_2 = float(df_trim_inicial[col_valor].sum())
-    total_m2_all_2 = float(df_trim_final[col_valor].sum())
+    total_m1_all_2 = somar(df_trim_inicial[col_valor])
+    total_m2_all_2 = somar(df_trim_final[col_valor])
     change_all_2 = total_m2_all_2 - total_m1_all_2
     # Para FLEX, usar o primeiro e último mês de cada quarter
     meses_trim_inicial_list = sorted(df_trim_inicial[col_mes].dropna().unique().tolist())
@@ -860,15 +850,15 @@ elif modo_comparacao == "Quarter":
 
 elif modo_comparacao == "Múltiplos Meses":
     # Para múltiplos meses, calcular do primeiro ao último
-    total_m1_all_2 = float(df_segunda_analise[df_segunda_analise[col_mes].astype(str) == str(mes_inicial_2)][col_valor].sum())
-    total_m2_all_2 = float(df_segunda_analise[df_segunda_analise[col_mes].astype(str) == str(mes_final_2)][col_valor].sum())
+    total_m1_all_2 = somar(df_segunda_analise[df_segunda_analise[col_mes].astype(str) == str(mes_inicial_2)][col_valor])
+    total_m2_all_2 = somar(df_segunda_analise[df_segunda_analise[col_mes].astype(str) == str(mes_final_2)][col_valor])
     change_all_2 = total_m2_all_2 - total_m1_all_2
     mes_inicial_flex = mes_inicial_2
     mes_final_flex = mes_final_2
 else:  # Mês a Mês
     # Calcular totais (validação será feita depois)
-    total_m1_all_2 = float(df_segunda_analise[df_segunda_analise[col_mes].astype(str) == str(mes_inicial_2)][col_valor].sum())
-    total_m2_all_2 = float(df_segunda_analise[df_segunda_analise[col_mes].astype(str) == str(mes_final_2)][col_valor].sum())
+    total_m1_all_2 = somar(df_segunda_analise[df_segunda_analise[col_mes].astype(str) == str(mes_inicial_2)][col_valor])
+    total_m2_all_2 = somar(df_segunda_analise[df_segunda_analise[col_mes].astype(str) == str(mes_final_2)][col_valor])
     change_all_2 = total_m2_all_2 - total_m1_all_2
     mes_inicial_flex = mes_inicial_2
     mes_final_flex = mes_final_2
@@ -931,8 +921,8 @@ if (modo_comparacao == "Ano a Ano" and ano_inicial != ano_final) or \
     # Calcular grupos - mesma lógica para todos os modos
     if modo_comparacao == "Ano a Ano":
         # Agrupar por ano
-        g1_2 = (dff_2[dff_2['Ano'].astype(str) == str(ano_inicial)].groupby(chosen_dim_2)[col_valor].sum())
-        g2_2 = (dff_2[dff_2['Ano'].astype(str) == str(ano_final)].groupby(chosen_dim_2)[col_valor].sum())
+        g1_2 = somar_grupos(dff_2[dff_2['Ano'].astype(str) == str(ano_inicial)], chosen_dim_2, col_valor)
+        g2_2 = somar_grupos(dff_2[dff_2['Ano'].astype(str) == str(ano_final)], chosen_dim_2, col_valor)
     elif modo_comparacao == "Semestre":
         # Agrupar por semestre
         meses_semestre = {1: ['janeiro', 'fevereiro', 'março', 'abril', 'maio', 'junho'],
@@ -947,8 +937,8 @@ if (modo_comparacao == "Ano a Ano" and ano_inicial != ano_final) or \
             (dff_2['Ano'].astype(str) == str(ano_final)) &
             (dff_2[col_mes].astype(str).str.lower().str.split(' ', n=1).str[0].isin([m.lower() for m in meses_sem_final]))
         ]
-        g1_2 = df_g1.groupby(chosen_dim_2)[col_valor].sum()
-        g2_2 = df_g2.groupby(chosen_dim_2)[col_valor].sum()
+        g1_2 = somar_grupos(df_g1, chosen_dim_2, col_valor)
+        g2_2 = somar_grupos(df_g2, chosen_dim_2, col_valor)
     elif modo_comparacao == "Quarter":
         # Agrupar por quarter
         meses_trimestre = {
@@ -967,12 +957,12 @@ if (modo_comparacao == "Ano a Ano" and ano_inicial != ano_final) or \
             (dff_2['Ano'].astype(str) == str(ano_final)) &
             (dff_2[col_mes].astype(str).str.lower().str.split(' ', n=1).str[0].isin([m.lower() for m in meses_trim_final]))
         ]
-        g1_2 = df_g1.groupby(chosen_dim_2)[col_valor].sum()
-        g2_2 = df_g2.groupby(chosen_dim_2)[col_valor].sum()
+        g1_2 = somar_grupos(df_g1, chosen_dim_2, col_valor)
+        g2_2 = somar_grupos(df_g2, chosen_dim_2, col_valor)
     else:
         # Mês a Mês ou Múltiplos Meses
-        g1_2 = (dff_2[dff_2[col_mes].astype(str) == str(mes_inicial_2)].groupby(chosen_dim_2)[col_valor].sum())
-        g2_2 = (dff_2[dff_2[col_mes].astype(str) == str(mes_final_2)].groupby(chosen_dim_2)[col_valor].sum())
+        g1_2 = somar_grupos(dff_2[dff_2[col_mes].astype(str) == str(mes_inicial_2)], chosen_dim_2, col_valor)
+        g2_2 = somar_grupos(dff_2[dff_2[col_mes].astype(str) == str(mes_final_2)], chosen_dim_2, col_valor)
 
     labels_cats_2, values_cats_2 = [], []
     for cat in sorted(set(g1_2.index).union(set(g2_2.index))):
@@ -1031,7 +1021,7 @@ if (modo_comparacao == "Ano a Ano" and ano_inicial != ano_final) or \
         
         # Para cada mês intermediário (do segundo ao penúltimo)
         for idx, mes in enumerate(meses_selecionados_2[1:-1]):
-            total_mes = float(df_segunda_analise[df_segunda_analise[col_mes].astype(str) == str(mes)][col_valor].sum())
+            total_mes = somar(df_segunda_analise[df_segunda_analise[col_mes].astype(str) == str(mes)][col_valor])
             
             # Calcular variação do mês anterior para este mês
             variacao = total_mes - total_anterior
@@ -1297,7 +1287,7 @@ if (modo_comparacao == "Ano a Ano" and ano_inicial != ano_final) or \
             st.markdown("#### Meses Intermediários")
             cols_inter = st.columns(len(meses_selecionados_2[1:-1]))
             for idx, mes in enumerate(meses_selecionados_2[1:-1]):
-                total_mes = float(df_segunda_analise[df_segunda_analise[col_mes].astype(str) == str(mes)][col_valor].sum())
+                total_mes = somar(df_segunda_analise[df_segunda_analise[col_mes].astype(str) == str(mes)][col_valor])
                 with cols_inter[idx]:
                     st.metric(f"{mes}", f"R$ {total_mes:,.2f}")
     else:  # Mês a Mês
@@ -1144,14 +1144,15 @@ elif secao == "❓ Perguntas Frequentes":
         
         1. Navegue até a página **"2 - Forecast"**
         2. Role até a seção **"📋 Tabela - Forecast por Veículo, Oficina e Período"**
-        3. Clique no botão **"📥 Download Tabela (Excel)"**
-        4. O arquivo será salvo na sua pasta Downloads
+        3. Escolha o formato (Excel, CSV ou Parquet) ao lado do botão **"⚙️ Gerar Tabela Forecast"**
+        4. Clique no botão: o arquivo é gerado em segundo plano (a barra de progresso aparece logo abaixo e o dashboard continua livre)
+        5. Quando terminar, clique em **"📥 Baixar Tabela Forecast"**: o navegador baixa o arquivo (pasta de downloads do seu computador)
         
         **Formato do arquivo:**
-        - Excel (.xlsx)
+        - Excel (.xlsx), CSV (separador `;`) ou Parquet
         - Valores numéricos sem formatação
         - Todas as colunas incluídas
-        - Nome: `Forecast_tabela_YYYYMMDD_HHMMSS.xlsx`
+        - Nome: `Forecast_tabela_YYYYMMDD_HHMMSS.xlsx` (ou `.csv` / `.parquet`)
         
         **Dica:** O arquivo pode ser aberto no Excel para análises adicionais.
         """)
@@ -0,0 +1,6 @@
+"""
+Módulos compartilhados do Dashboard TC.
+
+Reúne a infraestrutura de dados usada pelo app.py, pelas páginas em
+``pages/`` e pelo notebook de processamento (dados.ipynb).
+"""
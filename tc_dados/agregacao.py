@@ -0,0 +1,97 @@
+"""
+Agregação antes dos gráficos.
+
+Os gráficos recebem só os pontos que desenham (um por período, Oficina ou
+Veículo), já somados, em vez da visão filtrada inteira: o st.cache_data dos
+gráficos hasheia dezenas de linhas e o spec do Altair embute só esses pontos.
+
+Somas sobre as visões da sidebar saem de ``carregar_agregado``
+(tc_dados.metadados), memoizadas pela chave do FiltroSpec; tabelas que já são
+pequenas (CPU por Oficina e Período, volumes) passam direto por ``agregar``.
+Os cubos e gráficos montados a partir dessas somas ficam em tc_dados.graficos.
+
+CPU nunca é somado: o cubo de CPU (``carregar_cubo_cpu`` em tc_dados.metadados)
+guarda Total e Volume, que são aditivos, no grão mais fino, e qualquer CPU
+mais grosso sai de ``cpu_por`` (soma dos numeradores / soma dos denominadores);
+as tabelas dinâmicas de CPU saem de ``tabela_cpu``.
+"""
+import numpy as np
+
+from tc_dados.moeda import COLUNAS_MONETARIAS, de_inteiro, para_inteiro
+
+# Granularidade dos gráficos por período (Ano só quando existir na tabela)
+GRUPOS_PERIODO = ('Ano', 'Período')
+
+# Grão do cubo de CPU (as colunas ausentes dos custos ou dos volumes ficam de fora)
+GRAO_CPU = ('Ano', 'Período', 'Oficina', 'Veículo')
+# Quantidade de linhas de custo no grupo do cubo (0: só há volume)
+LINHAS_CUSTO = 'Linhas_Custo'
+
+
+def agregar(df, grupos, colunas, manter_ausentes=False):
+    """
+    Soma de uma coluna (ou lista de colunas) por grupos (só as combinações
+    presentes, ordenadas).
+
+    Grupos ausentes da tabela são ignorados; colunas em R$ usam a soma exata.
+    manter_ausentes: linhas com grupo vazio (NaN) formam um grupo próprio em
+    vez de serem descartadas.
+    """
+    grupos = [g for g in grupos if g in df.columns]
+    colunas = [colunas] if isinstance(colunas, str) else list(colunas)
+    df_soma = df[grupos].copy()
+    for coluna in colunas:
+        df_soma[coluna] = para_inteiro(df[coluna]) if coluna in COLUNAS_MONETARIAS else df[coluna]
+    resultado = df_soma.groupby(
+        grupos, observed=True, sort=True, dropna=not manter_ausentes
+    )[colunas].sum().reset_index()
+    for coluna in colunas:
+        if coluna in COLUNAS_MONETARIAS:
+            resultado[coluna] = de_inteiro(resultado[coluna])
+    return resultado
+
+
+def calcular_cpu(total, volume):
+    """CPU = total / volume elemento a elemento (0 onde não há volume)"""
+    total = np.asarray(total, dtype='float64')
+    volume = np.asarray(volume, dtype='float64')
+    return np.divide(total, volume, out=np.zeros_like(total), where=np.isfinite(volume) & (volume != 0))
+
+
+def cpu_por(cubo, grupos, coluna_custo='Total', dimensoes_visao=GRAO_CPU):
+    """
+    CPU por grupos a partir do cubo de CPU (ou de uma tabela já derivada dele,
+    com custo e Volume aditivos): soma do custo e do Volume de cada grupo e
+    CPU = custo / Volume.
+
+    dimensoes_visao: dimensões limitadas aos valores que têm lançamento de
+    custo na visão. O volume de outras Oficinas, Veículos ou meses fica de
+    fora; o de um mês sem lançamento de um veículo da visão entra (CPU 0).
+    """
+    if LINHAS_CUSTO in cubo.columns:
+        com_custo = cubo[LINHAS_CUSTO] > 0
+        da_visao = np.ones(len(cubo), dtype=bool)
+        for dimensao in dimensoes_visao:
+            if dimensao in cubo.columns:
+                da_visao &= cubo[dimensao].isin(cubo.loc[com_custo, dimensao].dropna().unique()).to_numpy()
+        cubo = cubo[da_visao]
+    pontos = agregar(cubo, grupos, [coluna_custo, 'Volume'])
+    pontos['CPU'] = calcular_cpu(pontos[coluna_custo], pontos['Volume'])
+    return pontos
+
+
+def tabela_cpu(cubo, linhas, colunas, coluna_custo='Total', dimensoes_visao=GRAO_CPU):
+    """
+    Tabela dinâmica de CPU (ex.: Oficina x Período) a partir do cubo de CPU,
+    com a coluna 'Total' do CPU da linha inteira.
+
+    Cada célula e o Total saem de cpu_por (soma do custo / soma do Volume do
+    grupo), nunca da soma dos CPUs de um grão mais fino; células sem dados
+    ficam 0.
+    """
+    celulas = cpu_por(cubo, [linhas, colunas], coluna_custo, dimensoes_visao)
+    tabela = celulas.set_index([linhas, colunas])['CPU'].unstack(colunas, fill_value=0.0)
+    tabela.columns = tabela.columns.astype(object)
+    totais = cpu_por(cubo, [linhas], coluna_custo, dimensoes_visao).set_index(linhas)['CPU']
+    tabela['Total'] = totais.reindex(tabela.index).fillna(0.0).to_numpy()
+    return tabela
@@ -0,0 +1,248 @@
+"""
+Busca nos filtros: typeahead dos filtros de alta cardinalidade e busca textual
+nas descrições dos lançamentos.
+
+Material, Texto breve, Usuário e Dt.lçto. têm milhares de valores distintos no
+histórico; mandar todos para o navegador como opções de um multiselect trava a
+página. Em vez disso, para cada coluna é montado uma vez por versão dos dados
+um índice de trigramas sobre os valores distintos (texto normalizado: minúsculo
+e sem acentos). A sidebar mostra uma caixa de busca e só os valores que casam
+com o que foi digitado viram opções; o filtro em si continua passando pelo
+FiltroSpec.
+
+A busca textual usa um índice invertido de palavras sobre Texto breve e
+Fornecedor (sem acentos, sem palavras vazias e com o plural reduzido ao
+singular): "oxigenio martins" traz as linhas em que todas as palavras
+aparecem, e entra no FiltroSpec como mais uma condição (ver com_busca).
+"""
+import bisect
+import re
+import unicodedata
+
+import numpy as np
+import streamlit as st
+
+from tc_dados.carregamento import carregar_dados
+from tc_dados.estado_url import valores_url
+from tc_dados.filtros import codigos_coluna
+from tc_dados.versionamento import versao_dados
+
+# Colunas com busca em vez de lista completa de opções
+COLUNAS_BUSCA = ['Usuário', 'Material', 'Dt.lçto.', 'Texto breve']
+
+# Quantidade máxima de valores sugeridos por busca
+LIMITE_SUGESTOES = 100
+
+# Colunas da busca textual
+COLUNAS_TEXTO = ['Texto breve', 'Fornecedor']
+
+# Palavras ignoradas na busca textual
+PALAVRAS_VAZIAS = {
+    'a', 'o', 'as', 'os', 'ao', 'aos', 'de', 'da', 'do', 'das', 'dos', 'e', 'em', 'no', 'na',
+    'nos', 'nas', 'um', 'uma', 'para', 'p', 'por', 'com', 'c', 'sem', 'ou'
+}
+
+
+def normalizar_texto(texto):
+    """Minúsculo e sem acentos ('Manutenção' -> 'manutencao')"""
+    decomposto = unicodedata.normalize("NFKD", str(texto).lower())
+    return "".join(c for c in decomposto if not unicodedata.combining(c))
+
+
+def _radical(palavra):
+    """Reduz o plural ao singular (locacoes -> locacao, fornecedores -> fornecedor)"""
+    if len(palavra) <= 3 or palavra.isdigit():
+        return palavra
+    for sufixo, troca in (('oes', 'ao'), ('aes', 'ao'), ('ais', 'al'), ('eis', 'el'), ('res', 'r')):
+        if palavra.endswith(sufixo) and len(palavra) > len(sufixo) + 2:
+            return palavra[:-len(sufixo)] + troca
+    if palavra.endswith('s') and not palavra.endswith('ss'):
+        return palavra[:-1]
+    return palavra
+
+
+def tokenizar(texto):
+    """Palavras normalizadas de um texto (sem acentos, sem palavras vazias, no singular)"""
+    return [_radical(p) for p in re.findall(r"[a-z0-9]+", normalizar_texto(texto))
+            if p not in PALAVRAS_VAZIAS]
+
+
+def _trigramas(texto):
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class IndiceBusca:
+    """Índice de trigramas sobre os valores distintos de uma coluna"""
+
+    def __init__(self, serie):
+        contagem = serie.dropna().astype(str).value_counts()
+        self.valores = contagem.index.to_numpy(dtype=object)
+        self.linhas = contagem.to_numpy()
+        self.textos = [normalizar_texto(v) for v in self.valores]
+
+        postings = {}
+        for i, texto in enumerate(self.textos):
+            for trigrama in _trigramas(texto):
+                postings.setdefault(trigrama, []).append(i)
+        self.postings = {t: np.array(ids, dtype=np.int32) for t, ids in postings.items()}
+
+    def _candidatos(self, termo):
+        """Ids dos valores que podem conter o termo (interseção das listas de trigramas)"""
+        if len(termo) < 3:
+            return np.arange(len(self.textos))
+        listas = []
+        for trigrama in _trigramas(termo):
+            ids = self.postings.get(trigrama)
+            if ids is None:
+                return np.array([], dtype=np.int32)
+            listas.append(ids)
+        listas.sort(key=len)
+        candidatos = listas[0]
+        for ids in listas[1:]:
+            candidatos = np.intersect1d(candidatos, ids, assume_unique=True)
+        return candidatos
+
+    def buscar(self, termo, limite=LIMITE_SUGESTOES, permitidos=None):
+        """
+        Valores que contêm o termo: primeiro os que começam com ele, depois os
+        demais, cada grupo do mais frequente para o menos frequente (sem termo,
+        os mais frequentes).
+
+        permitidos: conjunto opcional de valores aceitos (ex.: os da visão filtrada).
+        Retorna lista de (valor, linhas).
+        """
+        termo = normalizar_texto(termo).strip()
+        if not termo:
+            # Sem termo: os valores mais frequentes
+            ids = [i for i in range(len(self.valores))
+                   if permitidos is None or self.valores[i] in permitidos]
+            return [(self.valores[i], int(self.linhas[i])) for i in ids[:limite]]
+
+        prefixo, contem = [], []
+        for i in self._candidatos(termo):
+            texto = self.textos[i]
+            if termo not in texto:
+                continue
+            if permitidos is not None and self.valores[i] not in permitidos:
+                continue
+            (prefixo if texto.startswith(termo) else contem).append(i)
+
+        # Valores já estão em ordem de frequência (value_counts)
+        ordenados = sorted(prefixo) + sorted(contem)
+        return [(self.valores[i], int(self.linhas[i])) for i in ordenados[:limite]]
+
+
+@st.cache_resource(max_entries=24, show_spinner=False)
+def carregar_indice_busca_versao(dataset, ano, versao, coluna):
+    """Índice de busca de uma coluna; remontado a cada nova versão dos dados"""
+    df = carregar_dados(ano, dataset)
+    if df is None or coluna not in df.columns:
+        return None
+    return IndiceBusca(df[coluna])
+
+
+def buscar_valores(ano, dataset, coluna, termo, permitidos=None, limite=LIMITE_SUGESTOES):
+    """Sugestões (valor, linhas) para o termo digitado na caixa de busca de um filtro"""
+    indice = carregar_indice_busca_versao(dataset, str(ano), versao_dados(), coluna)
+    if indice is None:
+        return []
+    return indice.buscar(termo, limite, permitidos)
+
+
+def opcoes_com_busca(ano, dataset, coluna, label, opcoes, chave_widget):
+    """
+    Opções de um filtro com muitos valores: desenha a caixa de busca e
+    devolve "Todos" + os valores já selecionados + as sugestões do termo.
+
+    opcoes: lista completa ("Todos" + valores da visão), que fica no servidor.
+    chave_widget: key do multiselect, para manter as seleções entre buscas.
+    """
+    if len(opcoes) <= LIMITE_SUGESTOES + 1:
+        return opcoes
+
+    permitidos = set(opcoes[1:])
+    termo = st.text_input(
+        f"🔎 Buscar {label}:", key=f"busca_{coluna}", placeholder="Digite parte do valor..."
+    )
+    # Seleções atuais (ou as do link compartilhado, na primeira execução)
+    selecionadas = st.session_state.get(chave_widget, valores_url(chave_widget))
+    selecionadas = [v for v in selecionadas if v in permitidos]
+    sugestoes = [valor for valor, _ in buscar_valores(ano, dataset, coluna, termo, permitidos)]
+    if termo:
+        st.caption(f"{len(sugestoes)} de {len(permitidos):,} valores contêm \"{termo}\"")
+    else:
+        st.caption(f"{len(permitidos):,} valores: mostrando os mais frequentes, digite para buscar")
+    return ["Todos"] + list(dict.fromkeys(selecionadas + sugestoes))
+
+
+class IndiceTextual:
+    """
+    Índice invertido palavra -> valores distintos de cada coluna de texto.
+
+    A consulta é resolvida sobre os valores distintos e só no final vira
+    máscara de linhas pelos códigos da coluna. Cada termo casa com palavras
+    que começam com ele ('locac' acha 'locacao'); todos os termos precisam
+    aparecer na linha, em qualquer uma das colunas.
+    """
+
+    def __init__(self, df, colunas=COLUNAS_TEXTO):
+        self.n_linhas = len(df)
+        self.colunas = {}
+        for coluna in colunas:
+            if coluna not in df.columns:
+                continue
+            codigos, rotulos = codigos_coluna(df[coluna])
+            postings = {}
+            for i, rotulo in enumerate(rotulos):
+                for palavra in set(tokenizar(rotulo)):
+                    postings.setdefault(palavra, []).append(i)
+            self.colunas[coluna] = {
+                'codigos': codigos,
+                'n_valores': len(rotulos),
+                'postings': {p: np.array(ids, dtype=np.int32) for p, ids in postings.items()},
+                'vocabulario': sorted(postings),
+            }
+
+    def _valores_com_termo(self, coluna, termo):
+        """Ids dos valores da coluna com alguma palavra que começa com o termo"""
+        dados = self.colunas[coluna]
+        vocabulario = dados['vocabulario']
+        inicio = bisect.bisect_left(vocabulario, termo)
+        ids = []
+        for palavra in vocabulario[inicio:]:
+            if not palavra.startswith(termo):
+                break
+            ids.append(dados['postings'][palavra])
+        return np.unique(np.concatenate(ids)) if ids else np.array([], dtype=np.int32)
+
+    def mascara(self, termos):
+        """Máscara das linhas que contêm todos os termos (AND), em qualquer coluna (OR)"""
+        mascara = np.ones(self.n_linhas, dtype=bool)
+        for termo in termos:
+            mascara_termo = np.zeros(self.n_linhas, dtype=bool)
+            for coluna, dados in self.colunas.items():
+                tabela = np.zeros(dados['n_valores'] + 1, dtype=bool)
+                tabela[self._valores_com_termo(coluna, termo)] = True
+                # Última posição = código -1 (valor ausente)
+                mascara_termo |= tabela[dados['codigos']]
+            mascara &= mascara_termo
+        return mascara
+
+
+def termos_busca(consulta):
+    """Termos de uma consulta da busca textual (tupla, para entrar na chave do FiltroSpec)"""
+    return tuple(dict.fromkeys(tokenizar(consulta or "")))
+
+
+@st.cache_resource(max_entries=12, show_spinner=False)
+def carregar_indice_textual_versao(dataset, ano, versao):
+    """Índice textual de um conjunto; remontado a cada nova versão dos dados"""
+    df = carregar_dados(ano, dataset)
+    if df is None:
+        return None
+    return IndiceTextual(df)
+
+
+def carregar_indice_textual(ano="Todos", dataset="df_final"):
+    """Índice textual do conjunto (None se o conjunto não for encontrado)"""
+    return carregar_indice_textual_versao(dataset, str(ano), versao_dados())
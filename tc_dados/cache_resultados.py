@@ -0,0 +1,193 @@
+"""
+Cache de resultados (visões filtradas, máscaras, facetas) limitado por bytes.
+
+O st.cache_data limita por quantidade de entradas: um limite baixo descarta
+resultados úteis na hora e um alto pode segurar dezenas de DataFrames de
+vários MB. Este cache é único por processo (compartilhado entre as sessões:
+specs iguais reaproveitam o mesmo resultado) e é limitado pelo tamanho em
+memória dos resultados.
+
+A remoção é LRU segmentada (SLRU): um resultado novo entra no segmento
+provisório e, se for usado de novo, passa ao protegido (80% do limite).
+Quando falta espaço saem primeiro os provisórios menos recentes, então uma
+visão acessada uma única vez não expulsa as que estão sendo alternadas (ex.:
+ir e voltar entre duas Oficinas).
+
+Os resultados são compartilhados, não copiados a cada acerto: arrays saem
+somente leitura e DataFrames/Series como cópia rasa (só a estrutura, sem
+copiar as linhas), então adicionar, trocar ou remover colunas não altera o
+que está no cache. Quem for alterar valores no lugar (.loc/.iloc/.at) faz
+.copy() antes.
+
+Limite (MB) pela variável de ambiente TC_CACHE_RESULTADOS_MB (padrão 256).
+"""
+import functools
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+LIMITE_PADRAO_MB = 256
+FRACAO_PROTEGIDA = 0.8
+
+
+def tamanho_em_bytes(valor):
+    """Estimativa do tamanho em memória de um resultado"""
+    if isinstance(valor, pd.DataFrame):
+        return int(valor.memory_usage(index=True, deep=True).sum())
+    if isinstance(valor, (pd.Series, pd.Index)):
+        return int(valor.memory_usage(deep=True))
+    if isinstance(valor, np.ndarray):
+        return int(valor.nbytes)
+    if isinstance(valor, dict):
+        return sys.getsizeof(valor) + sum(tamanho_em_bytes(k) + tamanho_em_bytes(v) for k, v in valor.items())
+    if isinstance(valor, (list, tuple, set)):
+        return sys.getsizeof(valor) + sum(tamanho_em_bytes(v) for v in valor)
+    return sys.getsizeof(valor)
+
+
+def _proteger(valor):
+    """Marca arrays como somente leitura antes de entrarem no cache"""
+    if isinstance(valor, np.ndarray):
+        valor.setflags(write=False)
+    return valor
+
+
+def _compartilhar(valor):
+    """
+    Resultado do cache para quem chamou: DataFrames/Series como cópia rasa
+    (O(colunas), os dados continuam compartilhados); o resto como está
+    """
+    if isinstance(valor, (pd.DataFrame, pd.Series)):
+        return valor.copy(deep=False)
+    return valor
+
+
+class CacheResultados:
+    """Cache SLRU limitado por bytes, seguro para várias sessões (threads)"""
+
+    def __init__(self, limite_bytes):
+        self.limite_bytes = limite_bytes
+        self._provisorio = OrderedDict()
+        self._protegido = OrderedDict()
+        self._bytes_provisorio = 0
+        self._bytes_protegido = 0
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+        self.remocoes = 0
+
+    def obter(self, chave):
+        """Retorna (encontrado, valor)"""
+        with self._lock:
+            if chave in self._protegido:
+                self._protegido.move_to_end(chave)
+                self.acertos += 1
+                return True, self._protegido[chave][0]
+            if chave in self._provisorio:
+                # Segundo acesso: promove ao segmento protegido
+                valor, tamanho = self._provisorio.pop(chave)
+                self._bytes_provisorio -= tamanho
+                self._protegido[chave] = (valor, tamanho)
+                self._bytes_protegido += tamanho
+                self._rebaixar()
+                self.acertos += 1
+                return True, valor
+            self.falhas += 1
+            return False, None
+
+    def contem(self, chave):
+        """A chave está no cache? (não conta como acerto nem promove a entrada)"""
+        with self._lock:
+            return chave in self._protegido or chave in self._provisorio
+
+    def guardar(self, chave, valor):
+        tamanho = tamanho_em_bytes(valor)
+        if tamanho > self.limite_bytes:
+            return
+        with self._lock:
+            if chave in self._provisorio or chave in self._protegido:
+                return
+            self._provisorio[chave] = (valor, tamanho)
+            self._bytes_provisorio += tamanho
+            self._remover_excesso()
+
+    def _rebaixar(self):
+        """Protegido acima da sua fração: o menos recente volta ao provisório"""
+        while self._bytes_protegido > self.limite_bytes * FRACAO_PROTEGIDA and len(self._protegido) > 1:
+            chave, (valor, tamanho) = self._protegido.popitem(last=False)
+            self._bytes_protegido -= tamanho
+            self._provisorio[chave] = (valor, tamanho)
+            self._bytes_provisorio += tamanho
+        self._remover_excesso()
+
+    def _remover_excesso(self):
+        while self._bytes_provisorio + self._bytes_protegido > self.limite_bytes:
+            if self._provisorio:
+                _, (_, tamanho) = self._provisorio.popitem(last=False)
+                self._bytes_provisorio -= tamanho
+            else:
+                _, (_, tamanho) = self._protegido.popitem(last=False)
+                self._bytes_protegido -= tamanho
+            self.remocoes += 1
+
+    def limpar(self):
+        with self._lock:
+            self._provisorio.clear()
+            self._protegido.clear()
+            self._bytes_provisorio = 0
+            self._bytes_protegido = 0
+
+    def estatisticas(self):
+        """Acertos, falhas, remoções, itens e bytes em uso"""
+        with self._lock:
+            consultas = self.acertos + self.falhas
+            return {
+                'acertos': self.acertos,
+                'falhas': self.falhas,
+                'taxa_acerto': self.acertos / consultas if consultas else 0.0,
+                'remocoes': self.remocoes,
+                'itens': len(self._provisorio) + len(self._protegido),
+                'bytes': self._bytes_provisorio + self._bytes_protegido,
+                'limite_bytes': self.limite_bytes,
+            }
+
+
+# Instância única do processo (compartilhada por todas as sessões)
+CACHE = CacheResultados(int(float(os.environ.get("TC_CACHE_RESULTADOS_MB", LIMITE_PADRAO_MB)) * 1024 * 1024))
+
+
+def cache_resultados(funcao):
+    """
+    Guarda o resultado da função no cache compartilhado.
+
+    A chave é o nome da função + argumentos (devem ser hashable: strings,
+    versão dos dados, chave do FiltroSpec...).
+    """
+    nome = f"{funcao.__module__}.{funcao.__qualname__}"
+
+    @functools.wraps(funcao)
+    def com_cache(*args):
+        chave = (nome,) + args
+        encontrado, valor = CACHE.obter(chave)
+        if not encontrado:
+            valor = _proteger(funcao(*args))
+            CACHE.guardar(chave, valor)
+        return _compartilhar(valor)
+
+    return com_cache
+
+
+def exibir_estatisticas_cache():
+    """Mostra na sidebar o uso do cache de resultados"""
+    estatisticas = CACHE.estatisticas()
+    st.sidebar.caption(
+        f"🗄️ Cache de resultados: {estatisticas['itens']} itens, "
+        f"{estatisticas['bytes'] / 1024 / 1024:,.1f} de {estatisticas['limite_bytes'] / 1024 / 1024:,.0f} MB, "
+        f"{estatisticas['taxa_acerto']:.0%} de acertos "
+        f"({estatisticas['acertos']:,} acertos / {estatisticas['falhas']:,} falhas)"
+    )
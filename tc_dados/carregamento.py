@@ -0,0 +1,173 @@
+"""
+Acesso aos dados compartilhado pelo app.py e pelas páginas.
+
+Todas as páginas carregam os parquets por aqui, então o cache do Streamlit
+guarda uma única cópia de cada conjunto (ex.: o histórico consolidado) por
+versão dos dados: ao navegar entre páginas o arquivo já carregado e otimizado
+é reaproveitado em vez de ser lido de novo.
+
+Os caches não expiram por tempo: a versão dos dados (tc_dados.versionamento)
+faz parte da chave, então as entradas valem enquanto os dados não mudam e,
+quando o ETL publica uma nova versão, a próxima execução já lê a chave nova.
+As entradas da versão antiga saem pelo limite de max_entries.
+"""
+import os
+
+import pandas as pd
+import streamlit as st
+
+from tc_dados.moeda import COLUNAS_MONETARIAS
+from tc_dados.versionamento import PASTA_DADOS, existe_na_versao, resolver_caminho, versao_dados
+
+PASTA_HISTORICO = os.path.join(PASTA_DADOS, "historico_consolidado")
+
+# Conjuntos de dados: arquivo anual (dados/{ANO}/) e arquivo do histórico consolidado
+DATASETS = {
+    "df_final": {
+        "arquivo": "df_final.parquet",
+        "historico": "df_final_historico.parquet",
+    },
+    "df_vol": {
+        "arquivo": "df_vol.parquet",
+        "historico": "df_vol_historico.parquet",
+    },
+    "df_ke5z_group": {
+        "arquivo": "df_ke5z_group.parquet",
+        "historico": "df_ke5z_historico.parquet",
+    },
+}
+
+# Colunas numéricas que não podem virar categoria na otimização de tipos
+COLUNAS_NUMERICAS = ['Valor', 'Total', 'Volume', 'CPU']
+
+# (dataset, ano, versão) já lidos neste processo (ver dados_carregados)
+_CARREGADOS = set()
+
+
+def listar_anos_disponiveis(pasta_dados=PASTA_DADOS, versionado=True):
+    """
+    Lista todos os anos disponíveis nas pastas de dados.
+
+    versionado: com uma versão publicada (ou fixada), lista os anos da árvore
+    da versão; False lista a pasta dados viva (ex.: para gerar metadados no ETL).
+    """
+    anos_disponiveis = []
+
+    pasta = resolver_caminho(pasta_dados, pasta_dados=pasta_dados) if versionado else pasta_dados
+    if pasta is not None and os.path.exists(pasta):
+        for item in os.listdir(pasta):
+            caminho_item = os.path.join(pasta, item)
+            if os.path.isdir(caminho_item) and item.isdigit():
+                anos_disponiveis.append(int(item))
+
+    return sorted(anos_disponiveis, reverse=True)  # Mais recente primeiro
+
+
+def encontrar_arquivo_parquet(dataset, ano_selecionado=None):
+    """
+    Busca o arquivo parquet do conjunto na seguinte ordem de prioridade:
+    1. Se ano_selecionado for especificado: Pasta do ano (dados/{ANO}/)
+    2. Histórico consolidado (dados/historico_consolidado/)
+    3. Pasta do ano mais recente (dados/{ANO}/)
+    4. Raiz do projeto (compatibilidade)
+
+    A existência de cada candidato é verificada na árvore da versão publicada
+    (ou fixada por TC_VERSAO_DADOS), não na pasta dados viva: um arquivo
+    removido, ou gravado pelo ETL e ainda não publicado, não muda a escolha
+    enquanto a versão não muda. Retorna o caminho na pasta dados
+    (resolver_caminho o converte).
+    """
+    arquivos = DATASETS[dataset]
+
+    # Se ano específico foi selecionado, buscar na pasta do ano
+    if ano_selecionado is not None and str(ano_selecionado) != "Todos":
+        caminho_ano = os.path.join(PASTA_DADOS, str(ano_selecionado), arquivos["arquivo"])
+        if existe_na_versao(caminho_ano):
+            return caminho_ano
+
+    # Histórico consolidado (para "Todos" ou quando o ano não tem pasta própria)
+    caminho_historico = os.path.join(PASTA_HISTORICO, arquivos["historico"])
+    if existe_na_versao(caminho_historico):
+        return caminho_historico
+
+    # Pasta do ano mais recente (anos da versão, não da pasta viva)
+    anos_disponiveis = listar_anos_disponiveis()
+    if anos_disponiveis:
+        caminho_ano = os.path.join(PASTA_DADOS, str(anos_disponiveis[0]), arquivos["arquivo"])
+        if existe_na_versao(caminho_ano):
+            return caminho_ano
+
+    # Raiz (compatibilidade)
+    if os.path.exists(arquivos["arquivo"]):
+        return arquivos["arquivo"]
+
+    return None
+
+
+def otimizar_tipos(df):
+    """Converte tipos para reduzir memória (categorias, floats e ints menores)"""
+    # Converter colunas numéricas conhecidas para numérico ANTES da otimização
+    # Isso evita que sejam convertidas para categorical
+    for col in COLUNAS_NUMERICAS:
+        if col in df.columns and df[col].dtype == 'object':
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+
+    # Colunas de texto com poucos valores distintos viram categoria
+    for col in df.columns:
+        if df[col].dtype == 'object' and len(df) > 0:
+            unique_ratio = df[col].nunique() / len(df)
+            if unique_ratio < 0.5:
+                df[col] = df[col].astype('category')
+
+    # Converter floats para tipos menores (valores em R$ continuam float64:
+    # float32 causa arredondamento visível nos totais)
+    for col in df.select_dtypes(include=['float64']).columns:
+        if col not in COLUNAS_MONETARIAS:
+            df[col] = pd.to_numeric(df[col], downcast='float')
+
+    # Converter ints para tipos menores
+    for col in df.select_dtypes(include=['int64']).columns:
+        df[col] = pd.to_numeric(df[col], downcast='integer')
+
+    return df
+
+
+@st.cache_data(
+    max_entries=12,  # Anos + histórico dos três conjuntos
+    show_spinner="Carregando dados..."
+)
+def _carregar_dados_versao(dataset, ano, versao):
+    """Lê e otimiza um conjunto de dados; 'versao' separa o cache por versão dos dados"""
+    caminho = encontrar_arquivo_parquet(dataset, ano)
+    if caminho is None:
+        return None
+
+    df = pd.read_parquet(resolver_caminho(caminho))
+
+    # Se carregou do histórico consolidado e um ano específico foi selecionado, filtrar
+    if ano != "Todos" and "Ano" in df.columns:
+        df = df[df['Ano'] == int(ano)].copy()
+
+    df = otimizar_tipos(df)
+    _CARREGADOS.add((dataset, ano, versao))
+    return df
+
+
+def carregar_dados(ano="Todos", dataset="df_final"):
+    """
+    Carrega um conjunto de dados ("df_final", "df_vol" ou "df_ke5z_group").
+
+    ano: "Todos" para o histórico consolidado ou o ano (str/int) desejado.
+    Retorna None se nenhum arquivo for encontrado.
+    """
+    return _carregar_dados_versao(dataset, str(ano), versao_dados())
+
+
+def dados_carregados(ano="Todos", dataset="df_final"):
+    """
+    A tabela completa do conjunto já foi lida (está no cache) nesta versão?
+
+    Permite usar caminhos mais baratos (ex.: metadados de dimensões) enquanto
+    ninguém pediu a tabela inteira.
+    """
+    return (dataset, str(ano), versao_dados()) in _CARREGADOS
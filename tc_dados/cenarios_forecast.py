@@ -0,0 +1,214 @@
+"""
+Armazenamento de forecasts particionado por cenário e execução.
+
+Cada geração de forecast é gravada em uma pasta própria, sem sobrescrever as
+anteriores::
+
+    dados/Forecast/cenarios/
+        <cenario>/
+            <AAAAMMDD-HHMMSS>/
+                config.json               sensibilidades, inflação, meses da média, último período real...
+                forecast_completo.parquet
+                volume_base.parquet
+                volume_por_mes.parquet
+                df_vol_historico.parquet
+            ULTIMA                        "<execucao>" mais recente do cenário (troca atômica)
+        ULTIMA                            "<cenario>/<execucao>" mais recente entre todos os cenários
+
+Forecasts antigos podem ser recarregados direto do parquet para comparação,
+sem recalcular, e ``aplicar_retencao`` remove execuções antigas.
+"""
+import json
+import os
+import re
+import shutil
+import tempfile
+import unicodedata
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from tc_dados.versionamento import escrever_atomico
+
+PASTA_CENARIOS = os.path.join("dados", "Forecast", "cenarios")
+CENARIO_PADRAO = "padrao"
+
+# Política de retenção padrão
+MAX_EXECUCOES_POR_CENARIO = 5
+MAX_DIAS_EXECUCAO = 180
+
+
+def normalizar_cenario(nome):
+    """Converte o nome digitado em um id de pasta seguro (ex.: 'Cenário Alta 5%' -> 'cenario-alta-5')"""
+    texto = unicodedata.normalize("NFKD", str(nome or "")).encode("ascii", "ignore").decode("ascii")
+    texto = re.sub(r"[^a-z0-9]+", "-", texto.lower()).strip("-")
+    return texto or CENARIO_PADRAO
+
+
+def _valor_json(valor):
+    """Converte valores do numpy/pandas em tipos serializáveis"""
+    if isinstance(valor, dict):
+        return {str(k): _valor_json(v) for k, v in valor.items()}
+    if isinstance(valor, (list, tuple, set)):
+        return [_valor_json(v) for v in valor]
+    if hasattr(valor, "item"):
+        return valor.item()
+    if valor is None or isinstance(valor, (str, int, float, bool)):
+        return valor
+    return str(valor)
+
+
+def salvar_execucao(cenario, tabelas, config, pasta_cenarios=PASTA_CENARIOS):
+    """
+    Grava uma execução do forecast e retorna o id "<cenario>/<execucao>".
+
+    tabelas: dict nome -> DataFrame (None ou vazio são ignorados)
+    config: dict com os parâmetros usados no cálculo (gravado em config.json)
+    """
+    cenario = normalizar_cenario(cenario)
+    agora = datetime.now()
+    execucao = agora.strftime("%Y%m%d-%H%M%S")
+    pasta_cenario = os.path.join(pasta_cenarios, cenario)
+    pasta_final = os.path.join(pasta_cenario, execucao)
+    # Duas execuções no mesmo segundo: sufixo incremental
+    sufixo = 1
+    while os.path.exists(pasta_final):
+        sufixo += 1
+        pasta_final = os.path.join(pasta_cenario, f"{execucao}-{sufixo}")
+    execucao = os.path.basename(pasta_final)
+
+    # Montar em pasta temporária nova (nunca reaproveitar sobra de uma gravação
+    # interrompida) e renomear: a execução só aparece completa
+    os.makedirs(pasta_cenario, exist_ok=True)
+    pasta_tmp = tempfile.mkdtemp(prefix=f".tmp_{execucao}_", dir=pasta_cenario)
+    try:
+        linhas = {}
+        for nome, df in tabelas.items():
+            if df is None or df.empty:
+                continue
+            df.to_parquet(os.path.join(pasta_tmp, f"{nome}.parquet"), index=False, engine="pyarrow")
+            linhas[nome] = len(df)
+
+        metadados = {
+            "cenario": cenario,
+            "execucao": execucao,
+            "criado_em": agora.isoformat(timespec="seconds"),
+            "tabelas": linhas,
+            "config": _valor_json(config),
+        }
+        with open(os.path.join(pasta_tmp, "config.json"), "w", encoding="utf-8") as f:
+            json.dump(metadados, f, ensure_ascii=False, indent=2)
+        os.rename(pasta_tmp, pasta_final)
+    except Exception:
+        shutil.rmtree(pasta_tmp, ignore_errors=True)
+        raise
+
+    id_execucao = f"{cenario}/{execucao}"
+    escrever_atomico(os.path.join(pasta_cenario, "ULTIMA"), execucao + "\n")
+    escrever_atomico(os.path.join(pasta_cenarios, "ULTIMA"), id_execucao + "\n")
+    return id_execucao
+
+
+def listar_execucoes(cenario=None, pasta_cenarios=PASTA_CENARIOS):
+    """Lista os metadados das execuções (mais recente primeiro), opcionalmente de um cenário"""
+    if not os.path.isdir(pasta_cenarios):
+        return []
+
+    cenarios = [normalizar_cenario(cenario)] if cenario else sorted(os.listdir(pasta_cenarios))
+    execucoes = []
+    for nome_cenario in cenarios:
+        pasta_cenario = os.path.join(pasta_cenarios, nome_cenario)
+        if nome_cenario.startswith(".") or not os.path.isdir(pasta_cenario):
+            continue
+        for execucao in os.listdir(pasta_cenario):
+            if execucao.startswith(".") or not os.path.isdir(os.path.join(pasta_cenario, execucao)):
+                continue
+            try:
+                with open(os.path.join(pasta_cenario, execucao, "config.json"), encoding="utf-8") as f:
+                    metadados = json.load(f)
+            except (OSError, ValueError):
+                continue
+            metadados["id"] = f"{nome_cenario}/{execucao}"
+            execucoes.append(metadados)
+    return sorted(execucoes, key=lambda m: m["criado_em"], reverse=True)
+
+
+def ultima_execucao(cenario=None, pasta_cenarios=PASTA_CENARIOS):
+    """
+    Id "<cenario>/<execucao>" da execução mais recente do cenário, ou de
+    todos os cenários se nenhum for informado (None se não houver)
+    """
+    if cenario:
+        cenario = normalizar_cenario(cenario)
+        ponteiro = os.path.join(pasta_cenarios, cenario, "ULTIMA")
+    else:
+        ponteiro = os.path.join(pasta_cenarios, "ULTIMA")
+    try:
+        with open(ponteiro, encoding="utf-8") as f:
+            id_execucao = f.read().strip()
+    except OSError:
+        id_execucao = ""
+    if id_execucao and cenario:
+        id_execucao = f"{cenario}/{id_execucao}"
+    if id_execucao and os.path.isdir(os.path.join(pasta_cenarios, id_execucao)):
+        return id_execucao
+
+    # Ponteiro ausente ou apontando para execução removida: usar a mais recente listada
+    execucoes = listar_execucoes(cenario, pasta_cenarios=pasta_cenarios)
+    return execucoes[0]["id"] if execucoes else None
+
+
+def caminho_tabela(tabela, id_execucao=None, cenario=None, pasta_cenarios=PASTA_CENARIOS):
+    """
+    Caminho do parquet de uma tabela na execução informada (padrão: a mais
+    recente do cenário, ou de todos os cenários se nenhum for informado)
+    """
+    id_execucao = id_execucao or ultima_execucao(cenario, pasta_cenarios)
+    if not id_execucao:
+        return None
+    caminho = os.path.join(pasta_cenarios, *id_execucao.split("/"), f"{tabela}.parquet")
+    return caminho if os.path.exists(caminho) else None
+
+
+def carregar_tabela(tabela, id_execucao=None, cenario=None, pasta_cenarios=PASTA_CENARIOS):
+    """Carrega uma tabela de uma execução salva (None se não existir)"""
+    caminho = caminho_tabela(tabela, id_execucao, cenario, pasta_cenarios)
+    if caminho is None:
+        return None
+    return pd.read_parquet(caminho)
+
+
+def aplicar_retencao(max_execucoes_por_cenario=MAX_EXECUCOES_POR_CENARIO, max_dias=MAX_DIAS_EXECUCAO,
+                     pasta_cenarios=PASTA_CENARIOS):
+    """
+    Remove execuções antigas e retorna a lista de ids removidos.
+
+    Mantém as ``max_execucoes_por_cenario`` mais recentes de cada cenário e
+    descarta as que passaram de ``max_dias``. A execução mais recente de
+    cada cenário (ponteiros ULTIMA) nunca é removida.
+    """
+    limite = datetime.now() - timedelta(days=max_dias) if max_dias else None
+
+    por_cenario = {}
+    for metadados in listar_execucoes(pasta_cenarios=pasta_cenarios):
+        por_cenario.setdefault(metadados["cenario"], []).append(metadados)
+
+    protegidas = {ultima_execucao(pasta_cenarios=pasta_cenarios)}
+    protegidas.update(ultima_execucao(cenario, pasta_cenarios) for cenario in por_cenario)
+
+    removidas = []
+    for execucoes in por_cenario.values():
+        for posicao, metadados in enumerate(execucoes):
+            if metadados["id"] in protegidas:
+                continue
+            antiga = limite is not None and datetime.fromisoformat(metadados["criado_em"]) < limite
+            if posicao >= max_execucoes_por_cenario or antiga:
+                shutil.rmtree(os.path.join(pasta_cenarios, *metadados["id"].split("/")), ignore_errors=True)
+                removidas.append(metadados["id"])
+
+    # Remover pastas de cenário que ficaram vazias
+    for cenario in por_cenario:
+        pasta_cenario = os.path.join(pasta_cenarios, cenario)
+        if os.path.isdir(pasta_cenario) and not os.listdir(pasta_cenario):
+            os.rmdir(pasta_cenario)
+    return removidas
@@ -0,0 +1,124 @@
+"""
+Estado da visão na URL (query params) para compartilhar links.
+
+Ano, tipo de visualização, filtros da sidebar, busca e filtros locais dos
+gráficos vão para a URL com os valores crus (ex.: ``?filtro_Oficina=Prensas``),
+sem os rótulos com linhas/total das facetas, que mudam com os dados. Quem abre
+o link tem os widgets iniciados com esses valores; como as visões, máscaras e
+facetas ficam no cache de resultados compartilhado (chave = spec dos filtros),
+um link já aberto por outra pessoa sai direto do cache.
+
+Uso na página::
+
+    iniciar_estado_url("app")                      # antes dos widgets
+    st.multiselect(..., default=padrao_url("filtro_Oficina", opcoes, ["Todos"]),
+                   key="filtro_Oficina")
+    st.selectbox(..., index=indice_url("filtro_Período", opcoes), key="filtro_Período")
+    sincronizar_url()                              # no fim da página
+
+Só entram na URL os valores diferentes do padrão de cada widget. Seções da
+página com widgets próprios (ex.: filtros locais de um gráfico) podem ser
+fragmentos com ``@fragmento_secao``: mexer neles reexecuta só a seção, que
+grava a URL sozinha.
+"""
+import functools
+
+import streamlit as st
+
+_CHAVE_INICIAL = "_estado_url_inicial"
+_CHAVE_PADROES = "_estado_url_padroes"
+_CHAVE_PAGINA_COMPLETA = "_estado_url_pagina_completa"
+
+
+def iniciar_estado_url(pagina):
+    """
+    Guarda os query params recebidos na primeira execução da página na sessão.
+
+    Os padrões dos widgets saem sempre dessa foto (e não da URL atual), então
+    não mudam entre execuções e as seleções do usuário não são resetadas.
+    """
+    iniciais = st.session_state.setdefault(_CHAVE_INICIAL, {})
+    if pagina not in iniciais:
+        iniciais[pagina] = {chave: st.query_params.get_all(chave) for chave in st.query_params.keys()}
+    st.session_state[_CHAVE_INICIAL + "_pagina"] = pagina
+    st.session_state[_CHAVE_PADROES] = {}
+    st.session_state[_CHAVE_PAGINA_COMPLETA] = False
+
+
+def valores_url(chave):
+    """Valores (texto) de um widget no link com que a página foi aberta"""
+    pagina = st.session_state.get(_CHAVE_INICIAL + "_pagina")
+    return st.session_state.get(_CHAVE_INICIAL, {}).get(pagina, {}).get(chave, [])
+
+
+def _registrar(chave, padrao):
+    st.session_state.setdefault(_CHAVE_PADROES, {})[chave] = padrao
+
+
+def padrao_url(chave, opcoes, padrao):
+    """default de um multiselect: valores do link que existem nas opções, senão o padrão"""
+    _registrar(chave, sorted(str(v) for v in padrao))
+    por_texto = {str(op): op for op in opcoes}
+    valores = [por_texto[v] for v in valores_url(chave) if v in por_texto]
+    return valores or padrao
+
+
+def indice_url(chave, opcoes, padrao=0):
+    """index de um selectbox/radio: posição do valor do link nas opções, senão o padrão"""
+    textos = [str(op) for op in opcoes]
+    if textos:
+        _registrar(chave, textos[padrao])
+    valores = valores_url(chave)
+    if valores and valores[-1] in textos:
+        return textos.index(valores[-1])
+    return padrao
+
+
+def texto_url(chave, padrao=""):
+    """value de um text_input: texto do link, senão o padrão"""
+    _registrar(chave, padrao)
+    valores = valores_url(chave)
+    return valores[-1] if valores else padrao
+
+
+def sincronizar_url():
+    """Grava na URL os widgets registrados nesta execução cujo valor difere do padrão"""
+    estado = {}
+    for chave, padrao in st.session_state.get(_CHAVE_PADROES, {}).items():
+        if chave not in st.session_state:
+            continue
+        valor = st.session_state[chave]
+        if isinstance(valor, (list, tuple)):
+            valor = sorted(str(v) for v in valor)  # Mesmo link em qualquer ordem de clique
+            if not valor:
+                continue  # Lista vazia não filtra, como "Todos"
+        else:
+            valor = str(valor)
+        if valor != padrao:
+            estado[chave] = valor
+
+    atual = {chave: st.query_params.get_all(chave) for chave in st.query_params.keys()}
+    novo = {chave: v if isinstance(v, list) else [v] for chave, v in estado.items()}
+    if atual != novo:
+        st.query_params.from_dict(estado)
+    st.session_state[_CHAVE_PAGINA_COMPLETA] = True
+
+
+def fragmento_secao(funcao):
+    """
+    st.fragment para uma seção da página: widgets dentro dela reexecutam só a
+    seção (com os argumentos da última execução completa), sem recarregar nem
+    refiltrar a página.
+
+    Nessas execuções a página não chega ao sincronizar_url() do fim, então a
+    seção grava a URL ao terminar; na execução completa isso fica para o fim
+    da página, quando os widgets das seções seguintes já foram registrados.
+    """
+    @st.fragment
+    @functools.wraps(funcao)
+    def executar(*args, **kwargs):
+        funcao(*args, **kwargs)
+        if st.session_state.get(_CHAVE_PAGINA_COMPLETA):
+            sincronizar_url()
+
+    return executar
@@ -0,0 +1,206 @@
+"""
+Downloads das tabelas direto para o navegador.
+
+Os botões "📥 Baixar ..." gravavam um .xlsx na pasta Downloads do servidor
+(para quem acessa de outra máquina, o arquivo nunca chegava) e a gravação
+travava a execução da página. Agora o arquivo é gerado em memória só quando
+o usuário clica (o st.download_button chama a função numa thread separada,
+sem reexecutar a página) e vai como download do navegador.
+
+Formatos:
+
+- Excel: workbook write-only do openpyxl, linha a linha (memória constante
+  no gerador, sem montar as células do pandas); limitado a 1.048.576 linhas.
+- CSV: separador ';' e vírgula decimal (abre direto no Excel em pt-BR).
+- Parquet: o mais compacto e rápido para extrações grandes.
+"""
+import functools
+import io
+import uuid
+
+import pandas as pd
+import streamlit as st
+from openpyxl import Workbook
+
+from tc_dados.fila_exportacao import FILA
+from tc_dados.versionamento import versao_dados
+
+FORMATOS = {
+    "Excel": ("xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    "CSV": ("csv", "text/csv"),
+    "Parquet": ("parquet", "application/vnd.apache.parquet"),
+}
+
+# Linhas de dados por planilha (1.048.576 menos o cabeçalho)
+LIMITE_LINHAS_EXCEL = 1_048_575
+# Linhas convertidas por vez para o Excel (a memória não cresce com a tabela)
+LINHAS_POR_BLOCO = 50_000
+
+
+def _linhas(df):
+    """Linhas da tabela como valores Python (ausentes viram célula vazia), por blocos"""
+    for inicio in range(0, len(df), LINHAS_POR_BLOCO):
+        bloco = df.iloc[inicio:inicio + LINHAS_POR_BLOCO]
+        colunas = []
+        for posicao in range(bloco.shape[1]):
+            serie = bloco.iloc[:, posicao]
+            valores = serie.tolist()
+            ausentes = serie.isna().to_numpy()
+            if ausentes.any():
+                valores = [None if ausente else valor for valor, ausente in zip(valores, ausentes)]
+            colunas.append(valores)
+        yield from zip(*colunas)
+
+
+def _para_excel(df, buffer, nome_planilha, progresso):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(nome_planilha)
+    ws.append([str(col) for col in df.columns])
+    for numero, linha in enumerate(_linhas(df), start=1):
+        ws.append(linha)
+        if numero % LINHAS_POR_BLOCO == 0:
+            progresso(numero / len(df), f"Gravando Excel: {numero:,} de {len(df):,} linhas...")
+    progresso(1.0, "Finalizando arquivo...")
+    wb.save(buffer)
+
+
+def _sem_progresso(progresso, etapa):
+    pass
+
+
+def gerar_arquivo(df, formato, nome_planilha="Dados", index=False, progresso=_sem_progresso):
+    """
+    Conteúdo (bytes) do arquivo da tabela no formato escolhido.
+
+    progresso(fração, etapa): chamado durante a gravação (ver tc_dados.fila_exportacao).
+    """
+    if index:
+        df = df.reset_index()
+    buffer = io.BytesIO()
+    if formato == "Excel":
+        _para_excel(df, buffer, nome_planilha, progresso)
+    elif formato == "CSV":
+        df.to_csv(buffer, index=False, sep=';', decimal=',', encoding='utf-8-sig')
+    else:
+        # Parquet exige nomes de coluna em texto (ex.: anos da tabela dinâmica)
+        df.set_axis([str(col) for col in df.columns], axis=1).to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
+
+def botao_download(dados, rotulo, nome_arquivo, chave, nome_planilha="Dados", index=False, linhas=None):
+    """
+    Formato + botão de download da tabela.
+
+    dados: DataFrame ou função sem argumentos que monta o DataFrame (chamada
+    só no clique, para tabelas de exportação que não aparecem na página).
+    linhas: quantidade de linhas, se conhecida, para oferecer só CSV/Parquet
+    acima do limite do Excel.
+    """
+    if linhas is None and isinstance(dados, pd.DataFrame):
+        linhas = len(dados)
+    formatos = list(FORMATOS)
+    if linhas is not None and linhas > LIMITE_LINHAS_EXCEL:
+        formatos.remove("Excel")
+
+    col_formato, col_botao = st.columns([1, 4])
+    with col_formato:
+        formato = st.selectbox("Formato:", formatos, key=f"{chave}_formato", label_visibility="collapsed")
+    extensao, mime = FORMATOS[formato]
+
+    def conteudo():
+        df = dados() if callable(dados) else dados
+        return gerar_arquivo(df, formato, nome_planilha, index)
+
+    with col_botao:
+        st.download_button(
+            f"{rotulo} ({formato})",
+            data=conteudo,
+            file_name=f"{nome_arquivo}.{extensao}",
+            mime=mime,
+            key=chave,
+            on_click="ignore",
+            use_container_width=True
+        )
+    if linhas is not None and linhas > LIMITE_LINHAS_EXCEL:
+        st.caption(f"ℹ️ {linhas:,} linhas passam do limite do Excel: baixe em CSV ou Parquet.")
+
+
+def _montar_e_gerar(dados, formato, nome_planilha, index, progresso):
+    """Geração na thread da fila: monta a tabela (se for função) e grava o arquivo"""
+    progresso(0.0, "Montando tabela...")
+    df = dados() if callable(dados) else dados
+    progresso(0.0, f"Gravando {formato}: {len(df):,} linhas...")
+    return gerar_arquivo(df, formato, nome_planilha, index, progresso)
+
+
+def _sessao():
+    """Id desta sessão do navegador (quem espera cada geração da fila)"""
+    if '_sessao_exportacao' not in st.session_state:
+        st.session_state['_sessao_exportacao'] = uuid.uuid4().hex
+    return st.session_state['_sessao_exportacao']
+
+
+def _exibir_exportacao(chave_arquivo, rotulo, nome_arquivo, mime, chave):
+    """Progresso, erro ou botão de download do arquivo da fila"""
+    situacao, valor = FILA.estado(chave_arquivo, _sessao())
+    if situacao == 'andamento':
+        st.progress(valor.progresso, text=f"⏳ {valor.etapa} ({valor.segundos:,.0f}s)")
+    elif situacao == 'erro':
+        st.error(f"❌ Erro ao gerar arquivo: {valor}")
+        FILA.descartar_erro(chave_arquivo, _sessao())
+    elif situacao == 'pronto':
+        st.download_button(
+            f"📥 Baixar {rotulo}: {nome_arquivo} ({len(valor) / 1024 / 1024:,.1f} MB)",
+            data=valor,
+            file_name=nome_arquivo,
+            mime=mime,
+            key=f"{chave}_baixar",
+            on_click="ignore",
+            use_container_width=True
+        )
+    return situacao
+
+
+def botao_exportacao(dados, rotulo, nome_arquivo, chave, identidade, nome_planilha="Dados",
+                     index=False, linhas=None):
+    """
+    Formato + botão que gera o arquivo na fila em segundo plano; o progresso
+    e, ao terminar, o botão de download aparecem logo abaixo, sem travar o
+    resto da página.
+
+    identidade: o que define o conteúdo (ex.: ano, chave do spec dos filtros
+    e tipo de visualização). Pedidos com a mesma identidade e formato, de
+    qualquer sessão, compartilham a geração e o arquivo pronto. Precisa ser
+    barata de calcular: é montada a cada execução da página, então nada de
+    hash da tabela.
+    """
+    if linhas is None and isinstance(dados, pd.DataFrame):
+        linhas = len(dados)
+    formatos = list(FORMATOS)
+    if linhas is not None and linhas > LIMITE_LINHAS_EXCEL:
+        formatos.remove("Excel")
+
+    col_formato, col_botao = st.columns([1, 4])
+    with col_formato:
+        formato = st.selectbox("Formato:", formatos, key=f"{chave}_formato", label_visibility="collapsed")
+    extensao, mime = FORMATOS[formato]
+    chave_arquivo = (chave, identidade, formato, nome_planilha, index, versao_dados())
+
+    with col_botao:
+        if st.button(f"⚙️ Gerar {rotulo} ({formato})", key=chave, use_container_width=True):
+            FILA.enviar(chave_arquivo, functools.partial(_montar_e_gerar, dados, formato, nome_planilha, index),
+                        _sessao())
+    if linhas is not None and linhas > LIMITE_LINHAS_EXCEL:
+        st.caption(f"ℹ️ {linhas:,} linhas passam do limite do Excel: gere em CSV ou Parquet.")
+
+    # Enquanto gera, só este trecho é atualizado (a cada segundo); a consulta
+    # da situação não lê o arquivo nem mexe nas estatísticas do cache
+    andamento = FILA.situacao(chave_arquivo, _sessao()) == 'andamento'
+
+    @st.fragment(run_every=1 if andamento else None)
+    def exibir():
+        if andamento and FILA.situacao(chave_arquivo, _sessao()) != 'andamento':
+            st.rerun()  # Terminou: a página inteira exibe o resultado e para de atualizar
+        _exibir_exportacao(chave_arquivo, rotulo, f"{nome_arquivo}.{extensao}", mime, chave)
+
+    exibir()
@@ -0,0 +1,152 @@
+"""
+Fila de exportações em segundo plano.
+
+Montar e gravar um arquivo grande (ex.: a tabela por Veículo e Oficina com a
+linha TOTAL de cada oficina, ou a tabela filtrada inteira em Excel) dentro da
+execução da página deixa o usuário esperando sem poder mexer no dashboard. A
+fila roda essas gerações num pool de threads do processo:
+
+- cada exportação informa o progresso (fração + etapa) para a tela;
+- pedidos iguais (mesma chave: tabela, identidade dos dados, formato e
+  versão dos dados), da mesma sessão ou de outras, compartilham a mesma
+  geração em andamento e o mesmo arquivo pronto;
+- um erro de geração é exibido uma vez para cada sessão que esperava a
+  geração (pediu ou acompanhou o progresso) e descartado quando todas viram;
+- os arquivos prontos ficam num cache limitado por bytes (o mesmo SLRU do
+  cache de resultados), para baixar de novo sem gerar outra vez.
+
+Threads pela variável de ambiente TC_EXPORTACAO_THREADS (padrão 2) e limite
+do cache de arquivos (MB) por TC_CACHE_EXPORTACOES_MB (padrão 128).
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from tc_dados.cache_resultados import CacheResultados
+
+THREADS_PADRAO = 2
+LIMITE_ARQUIVOS_PADRAO_MB = 128
+
+
+class Exportacao:
+    """Progresso de uma geração em andamento (ou o erro, se falhou)"""
+
+    def __init__(self, chave):
+        self.chave = chave
+        self.progresso = 0.0
+        self.etapa = "Na fila..."
+        self.erro = None
+        self.inicio = time.perf_counter()
+
+    def atualizar(self, progresso, etapa):
+        """Chamado pela função de geração (na thread da fila)"""
+        self.progresso = min(max(progresso, 0.0), 1.0)
+        self.etapa = etapa
+
+    @property
+    def segundos(self):
+        return time.perf_counter() - self.inicio
+
+
+class FilaExportacao:
+    """Pool de threads que gera arquivos, sem duplicar pedidos iguais"""
+
+    def __init__(self, threads, limite_bytes):
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="exportacao")
+        self._em_andamento = {}
+        self._aguardando = {}  # chave -> sessões esperando a geração em andamento
+        self._erros = {}  # chave -> (mensagem, sessões que ainda não viram o erro)
+        self._lock = threading.Lock()
+        self.arquivos = CacheResultados(limite_bytes)
+
+    def enviar(self, chave, funcao, sessao=None):
+        """
+        Agenda funcao(progresso) -> bytes, a não ser que a mesma chave já
+        esteja sendo gerada ou pronta no cache; a sessão passa a esperar a
+        geração. Retorna o estado da chave.
+        """
+        with self._lock:
+            if chave not in self._em_andamento and not self.arquivos.contem(chave):
+                self._erros.pop(chave, None)
+                exportacao = Exportacao(chave)
+                self._em_andamento[chave] = exportacao
+                self._aguardando[chave] = set()
+                self._executor.submit(self._executar, exportacao, funcao)
+            if chave in self._em_andamento and sessao is not None:
+                self._aguardando[chave].add(sessao)
+        return self.estado(chave, sessao)
+
+    def _executar(self, exportacao, funcao):
+        try:
+            conteudo = funcao(exportacao.atualizar)
+            self.arquivos.guardar(exportacao.chave, conteudo)
+        except Exception as e:
+            with self._lock:
+                self._erros[exportacao.chave] = (str(e), self._aguardando.get(exportacao.chave, set()))
+        finally:
+            with self._lock:
+                self._em_andamento.pop(exportacao.chave, None)
+                self._aguardando.pop(exportacao.chave, None)
+
+    def _situacao_local(self, chave, sessao):
+        """Andamento ou erro da chave para a sessão (chamar com o lock)"""
+        if chave in self._em_andamento:
+            if sessao is not None:
+                self._aguardando[chave].add(sessao)
+            return 'andamento', self._em_andamento[chave]
+        if chave in self._erros:
+            mensagem, sessoes = self._erros[chave]
+            if sessao is None or sessao in sessoes:
+                return 'erro', mensagem
+        return None, None
+
+    def situacao(self, chave, sessao=None):
+        """
+        Só a situação da chave ('andamento', 'pronto', 'erro' ou None), sem
+        ler o arquivo: serve para consultas frequentes (ex.: a cada segundo)
+        sem contar acertos nem promover o arquivo no cache.
+        """
+        with self._lock:
+            situacao, _ = self._situacao_local(chave, sessao)
+        if situacao is None and self.arquivos.contem(chave):
+            return 'pronto'
+        return situacao
+
+    def estado(self, chave, sessao=None):
+        """
+        ('andamento', Exportacao), ('pronto', bytes), ('erro', mensagem) ou
+        (None, None) se a chave nunca foi pedida ou saiu do cache.
+
+        sessao: quem consulta; enquanto a geração está em andamento a sessão
+        passa a esperá-la e, se falhar, vê o erro até descartá-lo. Sem sessão,
+        qualquer erro pendente da chave é retornado.
+        """
+        with self._lock:
+            situacao, valor = self._situacao_local(chave, sessao)
+        if situacao is not None:
+            return situacao, valor
+        encontrado, conteudo = self.arquivos.obter(chave)
+        if encontrado:
+            return 'pronto', conteudo
+        return None, None
+
+    def descartar_erro(self, chave, sessao=None):
+        """
+        A sessão já viu o erro da chave; quando todas as sessões que esperavam
+        viram (ou sem sessão), o erro é esquecido e o próximo pedido gera de novo
+        """
+        with self._lock:
+            if chave not in self._erros:
+                return
+            sessoes = self._erros[chave][1]
+            sessoes.discard(sessao)
+            if sessao is None or not sessoes:
+                del self._erros[chave]
+
+
+# Fila única do processo (compartilhada por todas as sessões)
+FILA = FilaExportacao(
+    int(os.environ.get("TC_EXPORTACAO_THREADS", THREADS_PADRAO)),
+    int(float(os.environ.get("TC_CACHE_EXPORTACOES_MB", LIMITE_ARQUIVOS_PADRAO_MB)) * 1024 * 1024)
+)
@@ -0,0 +1,197 @@
+"""
+Filtros da sidebar compilados numa única máscara.
+
+As páginas montam um ``FiltroSpec`` com as seleções (coluna -> valores, na
+ordem da sidebar). Em vez de recortar a tabela filtro a filtro, criando um
+DataFrame intermediário a cada passo, as condições são combinadas numa única
+máscara booleana e a tabela é recortada uma vez só no final. A ``chave`` do
+spec é estável e serve de chave de cache (ver tc_dados.metadados.carregar_visao).
+
+Colunas categóricas (a maioria, depois de otimizar_tipos) são filtradas pelos
+códigos da categoria, sem converter a coluna inteira para texto.
+"""
+import numpy as np
+import pandas as pd
+
+from tc_dados.moeda import de_inteiro, para_inteiro
+
+# Campo do FiltroSpec com os termos da busca textual (ver tc_dados.busca)
+CAMPO_BUSCA = "Busca"
+
+
+def _normalizar(selecionados):
+    """
+    Valores selecionados como tupla de texto ordenada (a ordem dos cliques não
+    muda a chave do spec); None quando não filtram
+    """
+    if isinstance(selecionados, str):
+        selecionados = [selecionados]
+    if not selecionados or "Todos" in selecionados:
+        return None
+    return tuple(sorted(str(v) for v in selecionados))
+
+
+def _mascara_categoria(serie, valores):
+    """
+    Compara códigos inteiros em vez de decodificar a coluna para texto.
+
+    Os rótulos selecionados viram códigos uma vez (só as K categorias são
+    convertidas); a máscara sai de uma tabela de consulta indexada pelos
+    códigos int8/int16 da coluna.
+    """
+    categorias = serie.cat.categories
+    selecionadas = categorias.astype(str).isin(valores)
+    if pd.api.types.is_numeric_dtype(categorias.dtype):
+        # Nºconta/Account podem chegar como número: '6101' casa com 6101 e 6101.0
+        numeros = pd.to_numeric(pd.Series(valores), errors='coerce').dropna()
+        selecionadas |= categorias.isin(numeros)
+    # Última posição = código -1 (valor ausente), nunca selecionado
+    tabela = np.append(selecionadas, False)
+    return tabela[serie.cat.codes.to_numpy()]
+
+
+def mascara_coluna(df, coluna, selecionados):
+    """
+    Máscara das linhas cujo valor (como texto) está entre os selecionados.
+
+    Retorna None quando não há o que filtrar (lista vazia, "Todos" ou coluna
+    ausente).
+    """
+    valores = _normalizar(selecionados)
+    if valores is None or coluna not in df.columns:
+        return None
+
+    serie = df[coluna]
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        return _mascara_categoria(serie, valores)
+    if pd.api.types.is_numeric_dtype(serie.dtype) and not pd.api.types.is_bool_dtype(serie.dtype):
+        numeros = pd.to_numeric(pd.Series(valores), errors='coerce').dropna()
+        return serie.isin(numeros).to_numpy()
+    return serie.astype(str).isin(valores).to_numpy()
+
+
+def valores_distintos(serie, mascara=None):
+    """Valores distintos (como texto, ordenados) da coluna, opcionalmente sob uma máscara"""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        codigos = serie.cat.codes.to_numpy()
+        if mascara is not None:
+            codigos = codigos[mascara]
+        codigos = np.unique(codigos)
+        codigos = codigos[codigos >= 0]
+        return sorted(set(serie.cat.categories[codigos].astype(str)))
+    if mascara is not None:
+        serie = serie[mascara]
+    return sorted(serie.dropna().astype(str).unique().tolist())
+
+
+def codigos_coluna(serie):
+    """Códigos inteiros (-1 = ausente) e rótulos da coluna"""
+    if isinstance(serie.dtype, pd.CategoricalDtype):
+        return serie.cat.codes.to_numpy(), serie.cat.categories
+    return pd.factorize(serie)
+
+
+def calcular_facetas(df, colunas, mascara=None, coluna_valor='Valor', coluna_linhas=None):
+    """
+    Facetas dos filtros numa passada por coluna sobre os códigos de categoria.
+
+    Retorna {coluna: DataFrame indexado pela opção (texto, ordenado) com
+    'Linhas' e 'Total' (soma exata de coluna_valor)}; a primeira linha,
+    "Todos", traz o total da visão.
+
+    coluna_linhas: quantas linhas cada linha de df representa (ex.: 'Linhas'
+    dos metadados de dimensões); sem ela, cada linha conta uma.
+    """
+    if coluna_valor in df.columns:
+        valores = para_inteiro(df[coluna_valor])
+    else:
+        valores = np.zeros(len(df), dtype='int64')
+    pesos = df[coluna_linhas].to_numpy(dtype='int64') if coluna_linhas else None
+    if mascara is not None:
+        valores = valores[mascara]
+        pesos = pesos[mascara] if pesos is not None else None
+    total_linhas = len(valores) if pesos is None else int(pesos.sum())
+    todos = pd.DataFrame({'Linhas': [total_linhas], 'Total': [de_inteiro(valores.sum())]}, index=["Todos"])
+
+    facetas = {}
+    for coluna in colunas:
+        if coluna not in df.columns:
+            continue
+        codigos, rotulos = codigos_coluna(df[coluna])
+        if mascara is not None:
+            codigos = codigos[mascara]
+        validos = codigos >= 0
+        if pesos is None:
+            linhas = np.bincount(codigos[validos], minlength=len(rotulos))
+        else:
+            linhas = np.bincount(codigos[validos], weights=pesos[validos], minlength=len(rotulos)).astype('int64')
+        totais = np.zeros(len(rotulos), dtype='int64')
+        np.add.at(totais, codigos[validos], valores[validos])
+
+        presentes = np.flatnonzero(linhas)
+        faceta = pd.DataFrame({
+            'Opção': pd.Index(rotulos[presentes]).astype(str),
+            'Linhas': linhas[presentes],
+            'Total': totais[presentes],
+        })
+        # Agrupar junta rótulos com o mesmo texto (ex.: 6101 e '6101') e ordena
+        faceta = faceta.groupby('Opção', sort=True)[['Linhas', 'Total']].sum()
+        faceta['Total'] = de_inteiro(faceta['Total'])
+        faceta.index.name = None
+        facetas[coluna] = pd.concat([todos, faceta])
+    return facetas
+
+
+class FiltroSpec:
+    """Seleções da sidebar compiladas numa única máscara booleana"""
+
+    def __init__(self, selecoes=None):
+        self._selecoes = {}
+        for coluna, selecionados in (selecoes or {}).items():
+            valores = _normalizar(selecionados)
+            if valores is not None:
+                self._selecoes[coluna] = valores
+
+    @property
+    def chave(self):
+        """Chave estável (hashable) das seleções que filtram"""
+        return tuple(self._selecoes.items())
+
+    def com(self, coluna, selecionados):
+        """Novo spec com a seleção de mais uma coluna"""
+        return FiltroSpec({**dict(self._selecoes), coluna: selecionados})
+
+    def com_busca(self, termos):
+        """Novo spec com os termos da busca textual (todos precisam aparecer na linha)"""
+        return self.com(CAMPO_BUSCA, list(termos))
+
+    def mascara(self, df):
+        """Máscara combinada de todas as seleções (uma passada por coluna filtrada)"""
+        mascara = np.ones(len(df), dtype=bool)
+        for coluna, valores in self._selecoes.items():
+            if coluna == CAMPO_BUSCA:
+                from tc_dados.busca import IndiceTextual  # import aqui: busca usa este módulo
+                mascara &= IndiceTextual(df).mascara(valores)
+                continue
+            mascara_col = mascara_coluna(df, coluna, valores)
+            if mascara_col is not None:
+                mascara &= mascara_col
+        return mascara
+
+    def aplicar(self, df):
+        """Recorta a tabela uma única vez com a máscara combinada"""
+        if not self._selecoes:
+            return df.copy()
+        return df[self.mascara(df)]
+
+    def __bool__(self):
+        return bool(self._selecoes)
+
+    def __eq__(self, outro):
+        return isinstance(outro, FiltroSpec) and self.chave == outro.chave
+
+    def __hash__(self):
+        return hash(self.chave)
+
+    def __repr__(self):
+        return f"FiltroSpec({dict(self._selecoes)!r})"
@@ -0,0 +1,557 @@
+"""
+Cálculos do Forecast compartilhados entre a página e o pré-aquecimento do cache.
+
+A configuração padrão (último período com dados reais, meses usados na média)
+é calculada aqui com as mesmas regras da tela, então o pré-aquecimento chama
+``calcular_medias_forecast`` com exatamente os argumentos que o primeiro
+analista vai usar e o resultado já está no cache quando ele aplicar a
+configuração.
+"""
+from datetime import datetime
+
+import pandas as pd
+import streamlit as st
+
+# Lista de meses do ano (necessária para a configuração)
+MESES_ANO = ['Janeiro', 'Fevereiro', 'Março', 'Abril', 'Maio', 'Junho',
+             'Julho', 'Agosto', 'Setembro', 'Outubro', 'Novembro', 'Dezembro']
+
+# Quantidade padrão de meses a prever e a usar na média
+NUM_MESES_PADRAO = 6
+
+
+def is_custo_fixo(valor_custo):
+    """Identifica se o custo é fixo baseado no valor da coluna Custo"""
+    if pd.isna(valor_custo):
+        return False
+    valor_str = str(valor_custo).strip().upper()
+    # Considerar como fixo se contém palavras-chave
+    palavras_fixo = ['FIXO', 'FIX', 'FIXED']
+    return any(palavra in valor_str for palavra in palavras_fixo)
+
+
+def marcar_tipo_custo(df):
+    """Cria a coluna Tipo_Custo ('Fixo' ou 'Variável') a partir da coluna Custo"""
+    df['Tipo_Custo'] = df['Custo'].apply(is_custo_fixo)
+    df['Tipo_Custo'] = df['Tipo_Custo'].map({True: 'Fixo', False: 'Variável'})
+    return df
+
+
+def ordenar_periodo(periodo_str):
+    """Chave de ordenação (ano, mês) para períodos como 'Novembro 2025' ou 'novembro'"""
+    periodo_str = str(periodo_str).strip()
+    # Se tiver ano (ex: "Novembro 2025")
+    if ' ' in periodo_str:
+        partes = periodo_str.split(' ', 1)
+        mes_nome = partes[0]
+        ano = int(partes[1]) if partes[1].isdigit() else 0
+        # Normalizar nome do mês (capitalizar)
+        mes_nome_capitalizado = mes_nome.capitalize()
+        mes_idx = MESES_ANO.index(mes_nome_capitalizado) if mes_nome_capitalizado in MESES_ANO else 0
+        return (ano, mes_idx)
+    else:
+        # Apenas mês - normalizar (capitalizar)
+        mes_nome_capitalizado = periodo_str.capitalize()
+        mes_idx = MESES_ANO.index(mes_nome_capitalizado) if mes_nome_capitalizado in MESES_ANO else 0
+        return (0, mes_idx)
+
+
+def anos_dos_dados(df):
+    """Retorna (tem_anos, anos_disponiveis, ano_maximo) dos dados filtrados"""
+    tem_anos = 'Ano' in df.columns and df['Ano'].nunique() > 1
+    if tem_anos:
+        return tem_anos, sorted(df['Ano'].dropna().unique()), int(df['Ano'].max())
+    return tem_anos, [datetime.now().year], datetime.now().year
+
+
+def listar_periodos_disponiveis(df, tem_anos, ano_maximo, anos_disponiveis):
+    """Lista de períodos (com ano quando há vários anos) em ordem cronológica"""
+    if 'Período' not in df.columns:
+        # Fallback: criar períodos baseado nos meses e anos disponíveis
+        return [f"{mes} {ano}" if tem_anos else mes for ano in anos_disponiveis for mes in MESES_ANO]
+
+    # Pegar períodos únicos dos dados
+    periodos_unicos = df['Período'].dropna().unique()
+
+    # Verificar se os períodos já têm ano ou não
+    periodos_com_ano = any(' ' in str(p) and str(p).split(' ', 1)[1].isdigit() for p in periodos_unicos)
+
+    # Se não tiver ano nos períodos mas temos múltiplos anos, adicionar o ano máximo (ano dos dados)
+    if not periodos_com_ano and tem_anos:
+        periodos_unicos = [f"{str(periodo).strip().capitalize()} {ano_maximo}" for periodo in periodos_unicos]
+    return sorted(periodos_unicos, key=ordenar_periodo)
+
+
+def definir_periodo_padrao(periodos_disponiveis, tem_anos, ano_maximo):
+    """Período padrão do último mês com dados reais: mês atual ou, se ausente, o último disponível"""
+    mes_atual_nome = MESES_ANO[datetime.now().month - 1]
+    periodo_padrao = f"{mes_atual_nome} {ano_maximo}" if tem_anos else mes_atual_nome
+    if periodo_padrao not in periodos_disponiveis and periodos_disponiveis:
+        periodo_padrao = periodos_disponiveis[-1]
+    return periodo_padrao
+
+
+def indice_mes(periodo):
+    """Índice (0-11) do mês de um período como 'Setembro 2025' ou 'setembro'"""
+    mes = str(periodo).split(' ', 1)[0].capitalize()
+    return MESES_ANO.index(mes) if mes in MESES_ANO else 0
+
+
+def contar_meses_com_valor(df, meses_historicos_disponiveis, ultimo_periodo_dados, ano_maximo):
+    """
+    Conta os meses até o último período que têm valores (Total != 0).
+
+    Inclui valores negativos e exclui apenas zeros; sem dados, retorna a
+    quantidade de meses históricos disponíveis.
+    """
+    meses_com_valor = len(meses_historicos_disponiveis)  # Valor padrão
+    if not meses_historicos_disponiveis or df.empty or 'Período' not in df.columns or 'Total' not in df.columns:
+        return meses_com_valor
+
+    # Extrair ano do último período
+    ano_referencia_contagem = None
+    if ' ' in str(ultimo_periodo_dados):
+        partes_periodo = str(ultimo_periodo_dados).split(' ', 1)
+        if len(partes_periodo) > 1 and partes_periodo[1].isdigit():
+            ano_referencia_contagem = partes_periodo[1]
+    if ano_referencia_contagem is None:
+        ano_referencia_contagem = str(ano_maximo)
+
+    # Períodos até o último mês selecionado (com ano e apenas o mês, para dados antigos)
+    periodos_ate_ultimo = []
+    for mes in meses_historicos_disponiveis:
+        periodos_ate_ultimo.append(f"{mes} {ano_referencia_contagem}".lower())
+        periodos_ate_ultimo.append(mes.lower())
+
+    periodos_normalizados = df['Período'].astype(str).str.strip().str.lower()
+    mask_periodos_ate_ultimo = periodos_normalizados.isin(periodos_ate_ultimo)
+    if not mask_periodos_ate_ultimo.any():
+        return meses_com_valor
+
+    # Períodos com pelo menos uma linha com Total != 0
+    tem_valor = (df['Total'] != 0)[mask_periodos_ate_ultimo]
+    meses_com_valor = int(tem_valor.groupby(periodos_normalizados[mask_periodos_ate_ultimo]).any().sum())
+
+    # Se não encontrou nenhum período com valor, usar o número de meses históricos disponíveis
+    return meses_com_valor or len(meses_historicos_disponiveis)
+
+
+def calcular_periodos_media(meses_historicos_disponiveis, meses_excluir_media, num_meses_media, tem_anos,
+                            ultimo_ano_dados):
+    """Retorna (meses_para_media, periodos_para_media): os últimos N meses após as exclusões"""
+    meses_considerados = [mes for mes in meses_historicos_disponiveis if mes not in meses_excluir_media]
+    if not meses_considerados:
+        return [], []
+
+    meses_para_media = meses_considerados[-num_meses_media:]
+    if tem_anos:
+        return meses_para_media, [f"{mes} {ultimo_ano_dados}" for mes in meses_para_media]
+    return meses_para_media, meses_para_media.copy()
+
+
+def configuracao_padrao(df_filtrado):
+    """
+    Configuração inicial da tela do Forecast para os dados filtrados.
+
+    Retorna dict com ultimo_periodo_dados, num_meses_media e periodos_para_media.
+    """
+    tem_anos, anos_disponiveis, ano_maximo = anos_dos_dados(df_filtrado)
+    periodos_disponiveis = listar_periodos_disponiveis(df_filtrado, tem_anos, ano_maximo, anos_disponiveis)
+    if not periodos_disponiveis:
+        return None
+
+    ultimo_periodo_dados = definir_periodo_padrao(periodos_disponiveis, tem_anos, ano_maximo)
+    meses_historicos_disponiveis = MESES_ANO[:indice_mes(ultimo_periodo_dados) + 1]
+    max_meses_media = max(1, contar_meses_com_valor(
+        df_filtrado, meses_historicos_disponiveis, ultimo_periodo_dados, ano_maximo
+    ))
+    num_meses_media = min(max_meses_media, NUM_MESES_PADRAO)
+
+    if ' ' in str(ultimo_periodo_dados):
+        ultimo_ano_dados = int(str(ultimo_periodo_dados).split(' ', 1)[1])
+    elif tem_anos:
+        ultimo_ano_dados = ano_maximo
+    else:
+        ultimo_ano_dados = datetime.now().year
+
+    _, periodos_para_media = calcular_periodos_media(
+        meses_historicos_disponiveis, [], num_meses_media, tem_anos, ultimo_ano_dados
+    )
+    return {
+        'ultimo_periodo_dados': ultimo_periodo_dados,
+        'num_meses_media': num_meses_media,
+        'periodos_para_media': periodos_para_media,
+    }
+
+
+# Função para calcular médias com cache
+@st.cache_data(max_entries=10, show_spinner=False)
+def calcular_medias_forecast(df_filtrado_cache, colunas_adicionais_cache, periodos_para_media_cache, ultimo_periodo_dados_cache=None):
+    """Calcula médias mensais históricas com cache, usando apenas os períodos selecionados"""
+    # 🔧 CORREÇÃO CRÍTICA: Extrair ano de referência ANTES de qualquer filtro
+    # Isso garante que o mesmo ano seja usado em todos os filtros
+    ano_referencia_filtro = None
+    if periodos_para_media_cache:
+        # Extrair ano dos períodos procurados
+        anos_nos_periodos = []
+        for periodo_procurado in periodos_para_media_cache:
+            periodo_str = str(periodo_procurado).strip()
+            if ' ' in periodo_str:
+                partes = periodo_str.split(' ', 1)
+                if len(partes) > 1 and partes[1].isdigit():
+                    anos_nos_periodos.append(int(partes[1]))
+        if anos_nos_periodos:
+            ano_referencia_filtro = max(anos_nos_periodos)
+    if ano_referencia_filtro is None and ultimo_periodo_dados_cache:
+        ultimo_periodo_str = str(ultimo_periodo_dados_cache).strip()
+        if ' ' in ultimo_periodo_str:
+            ano_str = ultimo_periodo_str.split(' ', 1)[1]
+            if ano_str.isdigit():
+                ano_referencia_filtro = int(ano_str)
+
+    # Filtrar apenas os períodos que serão usados para calcular a média
+    if periodos_para_media_cache and 'Período' in df_filtrado_cache.columns:
+        # Normalizar períodos procurados (manter mês + ano se disponível)
+        periodos_procurados_normalizados = []
+        for periodo_procurado in periodos_para_media_cache:
+            periodo_str = str(periodo_procurado).strip()
+            # Normalizar para minúsculas para comparação
+            periodos_procurados_normalizados.append(periodo_str.lower())
+
+        # Extrair último mês e ano para validação
+        ultimo_mes_limite = None
+        ultimo_ano_limite = None
+        if ultimo_periodo_dados_cache:
+            ultimo_periodo_str = str(ultimo_periodo_dados_cache).strip().lower()
+            if ' ' in ultimo_periodo_str:
+                ultimo_mes_limite = ultimo_periodo_str.split(' ', 1)[0]
+                ultimo_ano_limite = int(ultimo_periodo_str.split(' ', 1)[1]) if ultimo_periodo_str.split(' ', 1)[1].isdigit() else None
+            else:
+                ultimo_mes_limite = ultimo_periodo_str
+                ultimo_ano_limite = None
+
+        # Verificar períodos no DataFrame
+        periodos_no_df = df_filtrado_cache['Período'].astype(str).str.strip().str.lower()
+
+        # 🔧 CORREÇÃO: Usar ano_referencia_filtro já definido no início da função
+        # Se não foi definido, usar ultimo_ano_limite como fallback
+        if ano_referencia_filtro is None:
+            ano_referencia_filtro = ultimo_ano_limite
+
+        # Criar máscara: comparar período completo (mês + ano) quando disponível
+        # 🔧 CORREÇÃO CRÍTICA: Garantir que apenas períodos do ano de referência sejam incluídos
+        def periodo_corresponde(periodo_df):
+            periodo_df_lower = str(periodo_df).strip().lower()
+
+            # 🔧 CORREÇÃO CRÍTICA: Se há ano de referência definido, filtrar APENAS esse ano
+            if ano_referencia_filtro:
+                periodo_df_tem_ano = ' ' in periodo_df_lower and len(periodo_df_lower.split(' ', 1)) > 1
+                if periodo_df_tem_ano:
+                    periodo_df_ano = int(periodo_df_lower.split(' ', 1)[1]) if periodo_df_lower.split(' ', 1)[1].isdigit() else None
+                    # Se o período tem ano diferente do ano de referência, NÃO incluir
+                    if periodo_df_ano != ano_referencia_filtro:
+                        return False
+                else:
+                    # Se o período não tem ano mas há ano de referência, NÃO incluir
+                    # (evita incluir períodos sem ano quando há períodos com ano)
+                    return False
+
+            # Verificar se o período está antes ou no último mês selecionado
+            if ultimo_mes_limite and ultimo_ano_limite:
+                periodo_df_tem_ano = ' ' in periodo_df_lower and len(periodo_df_lower.split(' ', 1)) > 1
+                if periodo_df_tem_ano:
+                    periodo_df_ano = int(periodo_df_lower.split(' ', 1)[1]) if periodo_df_lower.split(' ', 1)[1].isdigit() else None
+                    periodo_df_mes = periodo_df_lower.split(' ', 1)[0]
+
+                    # Verificar se está antes do último mês
+                    if periodo_df_ano and periodo_df_ano > ultimo_ano_limite:
+                        return False
+                    if periodo_df_ano == ultimo_ano_limite:
+                        # Comparar meses usando índice
+                        meses_ano_lower = [m.lower() for m in MESES_ANO]
+                        if periodo_df_mes in meses_ano_lower and ultimo_mes_limite in meses_ano_lower:
+                            idx_periodo = meses_ano_lower.index(periodo_df_mes)
+                            idx_limite = meses_ano_lower.index(ultimo_mes_limite)
+                            if idx_periodo > idx_limite:
+                                return False
+                else:
+                    # Se o período do DataFrame não tem ano, verificar apenas pelo mês
+                    periodo_df_mes = periodo_df_lower
+                    meses_ano_lower = [m.lower() for m in MESES_ANO]
+                    if periodo_df_mes in meses_ano_lower and ultimo_mes_limite in meses_ano_lower:
+                        idx_periodo = meses_ano_lower.index(periodo_df_mes)
+                        idx_limite = meses_ano_lower.index(ultimo_mes_limite)
+                        if idx_periodo > idx_limite:
+                            return False
+
+            # Comparação exata primeiro (período completo)
+            if periodo_df_lower in periodos_procurados_normalizados:
+                return True
+
+            # Se não houver correspondência exata, verificar se ambos têm ano
+            periodo_df_tem_ano = ' ' in periodo_df_lower and len(periodo_df_lower.split(' ', 1)) > 1
+
+            for periodo_procurado in periodos_procurados_normalizados:
+                periodo_procurado_tem_ano = ' ' in periodo_procurado and len(periodo_procurado.split(' ', 1)) > 1
+
+                # Se ambos têm ano, comparar período completo (já verificamos exato acima)
+                if periodo_df_tem_ano and periodo_procurado_tem_ano:
+                    # Se ambos têm ano mas não são iguais, não corresponde
+                    continue
+
+                # Se nenhum tem ano ou apenas um tem, comparar apenas o mês
+                # MAS APENAS se não houver ano de referência definido
+                if not ano_referencia_filtro:
+                    mes_df = periodo_df_lower.split(' ', 1)[0] if ' ' in periodo_df_lower else periodo_df_lower
+                    mes_procurado = periodo_procurado.split(' ', 1)[0] if ' ' in periodo_procurado else periodo_procurado
+
+                    if mes_df == mes_procurado:
+                        # Se o período procurado tem ano mas o do DF não tem, não incluir
+                        if periodo_procurado_tem_ano and not periodo_df_tem_ano:
+                            continue
+                        return True
+
+            return False
+
+        df_filtrado_media = df_filtrado_cache[
+            periodos_no_df.apply(periodo_corresponde)
+        ].copy()
+
+        # Se não encontrou correspondências, tentar encontrar períodos alternativos pelos meses
+        # MAS APENAS se estiverem antes do último mês selecionado
+        if df_filtrado_media.empty:
+            # Tentar encontrar períodos disponíveis nos dados que correspondem aos meses solicitados
+            periodos_disponiveis_df = df_filtrado_cache['Período'].dropna().unique()
+            periodos_encontrados_alternativos = []
+
+            # Extrair apenas os meses dos períodos procurados
+            meses_procurados = []
+            for periodo_procurado in periodos_para_media_cache:
+                periodo_str = str(periodo_procurado).strip().lower()
+                mes_procurado = periodo_str.split(' ', 1)[0] if ' ' in periodo_str else periodo_str
+                meses_procurados.append(mes_procurado)
+
+            # Procurar períodos no DataFrame que correspondem aos meses procurados
+            # MAS APENAS se estiverem antes ou no último mês selecionado
+            for periodo_df in periodos_disponiveis_df:
+                periodo_df_str = str(periodo_df).strip().lower()
+                periodo_df_mes = periodo_df_str.split(' ', 1)[0] if ' ' in periodo_df_str else periodo_df_str
+                periodo_df_ano = int(periodo_df_str.split(' ', 1)[1]) if ' ' in periodo_df_str and periodo_df_str.split(' ', 1)[1].isdigit() else None
+
+                # Verificar se o mês corresponde
+                if periodo_df_mes in meses_procurados:
+                    # Verificar se está antes ou no último mês selecionado
+                    if ultimo_mes_limite and ultimo_ano_limite:
+                        if periodo_df_ano:
+                            if periodo_df_ano > ultimo_ano_limite:
+                                continue
+                            if periodo_df_ano == ultimo_ano_limite:
+                                # Comparar meses usando índice
+                                meses_ano_lower = [m.lower() for m in MESES_ANO]
+                                if periodo_df_mes in meses_ano_lower and ultimo_mes_limite in meses_ano_lower:
+                                    idx_periodo = meses_ano_lower.index(periodo_df_mes)
+                                    idx_limite = meses_ano_lower.index(ultimo_mes_limite)
+                                    if idx_periodo > idx_limite:
+                                        continue
+                        elif not periodo_df_ano:
+                            # Se não tem ano, verificar pelo mês
+                            meses_ano_lower = [m.lower() for m in MESES_ANO]
+                            if periodo_df_mes in meses_ano_lower and ultimo_mes_limite in meses_ano_lower:
+                                idx_periodo = meses_ano_lower.index(periodo_df_mes)
+                                idx_limite = meses_ano_lower.index(ultimo_mes_limite)
+                                if idx_periodo > idx_limite:
+                                    continue
+
+                    periodos_encontrados_alternativos.append(str(periodo_df))
+
+            # Se encontrou períodos alternativos, usar eles
+            if periodos_encontrados_alternativos:
+                periodos_alternativos_normalizados = [p.strip().lower() for p in periodos_encontrados_alternativos]
+                df_filtrado_media = df_filtrado_cache[
+                    periodos_no_df.isin(periodos_alternativos_normalizados)
+                ].copy()
+    else:
+        # Se não houver períodos selecionados, usar todos os dados (comportamento original)
+        df_filtrado_media = df_filtrado_cache.copy()
+
+    if df_filtrado_media.empty:
+        # Retornar DataFrames vazios se não houver dados
+        colunas_base = ['Oficina', 'Veículo', 'Período', 'Tipo_Custo'] + colunas_adicionais_cache
+        df_medias = pd.DataFrame(columns=colunas_base + ['Total'])
+        colunas_media = ['Oficina', 'Veículo', 'Tipo_Custo'] + colunas_adicionais_cache
+        df_media_mensal = pd.DataFrame(columns=colunas_media + ['Total'])
+        return df_medias, df_media_mensal
+
+    # 🔧 CORREÇÃO CRÍTICA: Normalizar Período para SEMPRE incluir o ano antes do groupby
+    # Isso evita somar meses de anos diferentes (ex: "Novembro 2024" + "Novembro 2025")
+    # 🔧 CORREÇÃO: Usar o mesmo ano_referencia_filtro que foi usado no filtro inicial
+    ano_referencia = ano_referencia_filtro
+    if ano_referencia is None:
+        if ultimo_periodo_dados_cache:
+            ultimo_periodo_str = str(ultimo_periodo_dados_cache).strip()
+            if ' ' in ultimo_periodo_str:
+                ano_str = ultimo_periodo_str.split(' ', 1)[1]
+                if ano_str.isdigit():
+                    ano_referencia = int(ano_str)
+        elif periodos_para_media_cache:
+            # Tentar extrair ano dos períodos selecionados
+            for p in periodos_para_media_cache:
+                p_str = str(p).strip()
+                if ' ' in p_str:
+                    ano_str = p_str.split(' ', 1)[1]
+                    if ano_str.isdigit():
+                        ano_referencia = int(ano_str)
+                        break
+
+    # 🔧 CORREÇÃO CRÍTICA: Normalizar Período usando coluna Ano ORIGINAL (não ano_referencia)
+    # Estratégia: Se Período não tem ano, usar coluna Ano original dos dados
+    # Isso garante que Período e Ano sejam sempre consistentes
+    if 'Período' in df_filtrado_media.columns:
+        df_filtrado_media = df_filtrado_media.copy()
+        # 🔧 CORREÇÃO: Converter Período para string ANTES de qualquer operação (pode ser Categorical)
+        df_filtrado_media['Período'] = df_filtrado_media['Período'].astype(str).str.lower().str.strip()
+
+        def extrair_ano_do_periodo(periodo_str):
+            periodo_str = str(periodo_str).strip()
+            if ' ' in periodo_str:
+                partes = periodo_str.split(' ', 1)
+                if len(partes) > 1 and partes[1].isdigit():
+                    return int(partes[1])
+            return None
+
+        # Verificar quais períodos não têm ano
+        df_filtrado_media['Ano_Do_Periodo'] = df_filtrado_media['Período'].apply(extrair_ano_do_periodo)
+        mask_sem_ano_periodo = df_filtrado_media['Ano_Do_Periodo'].isna()
+
+        # 🔧 CORREÇÃO: Usar coluna Ano ORIGINAL dos dados para normalizar Período
+        if 'Ano' in df_filtrado_media.columns:
+            # Converter Ano para int (remover .0 se for float)
+            df_filtrado_media['Ano'] = pd.to_numeric(df_filtrado_media['Ano'], errors='coerce')
+
+            # Se Período não tem ano, adicionar ano da coluna Ano ORIGINAL
+            mask_ano_valido = df_filtrado_media.loc[mask_sem_ano_periodo, 'Ano'].notna()
+            # 🔧 CORREÇÃO: Converter Período para string antes de concatenar (pode ser Categorical)
+            df_filtrado_media.loc[mask_sem_ano_periodo & mask_ano_valido, 'Período'] = (
+                df_filtrado_media.loc[mask_sem_ano_periodo & mask_ano_valido, 'Período'].astype(str) + ' ' +
+                df_filtrado_media.loc[mask_sem_ano_periodo & mask_ano_valido, 'Ano'].astype(int).astype(str)
+            )
+            # Re-extrair ano após adicionar
+            df_filtrado_media.loc[mask_sem_ano_periodo & mask_ano_valido, 'Ano_Do_Periodo'] = (
+                df_filtrado_media.loc[mask_sem_ano_periodo & mask_ano_valido, 'Período'].apply(extrair_ano_do_periodo)
+            )
+
+            # Se Período já tem ano, sincronizar coluna Ano com o ano do Período
+            # Mas manter a coluna Ano original se não houver conflito
+            mask_ano_periodo_valido = df_filtrado_media['Ano_Do_Periodo'].notna()
+            # Sincronizar: usar ano do Período na coluna Ano (já está normalizado)
+            # Ano_Do_Periodo é float (tem vazios): converter para o tipo da coluna Ano (ex.: int16)
+            df_filtrado_media.loc[mask_ano_periodo_valido, 'Ano'] = (
+                df_filtrado_media.loc[mask_ano_periodo_valido, 'Ano_Do_Periodo'].astype(df_filtrado_media['Ano'].dtype)
+            )
+
+        df_filtrado_media = df_filtrado_media.drop(columns=['Ano_Do_Periodo'], errors='ignore')
+
+    # 🔧 CORREÇÃO CRÍTICA: Filtrar por ano ANTES do groupby para evitar incluir dados de ambos os anos
+    # Isso garante que apenas períodos do ano de referência sejam agrupados
+    if ano_referencia:
+        if 'Ano' in df_filtrado_media.columns:
+            # Filtrar diretamente pela coluna Ano ANTES do groupby
+            df_filtrado_media = df_filtrado_media[df_filtrado_media['Ano'] == ano_referencia].copy()
+        elif 'Período' in df_filtrado_media.columns:
+            # Filtrar pelo ano no Período se não houver coluna Ano
+            def periodo_tem_ano_correto_pre_groupby(periodo_val):
+                periodo_str = str(periodo_val).strip()
+                if ' ' in periodo_str:
+                    ano_val = periodo_str.split(' ', 1)[1]
+                    if ano_val.isdigit():
+                        return int(ano_val) == ano_referencia
+                return False
+            df_filtrado_media = df_filtrado_media[
+                df_filtrado_media['Período'].apply(periodo_tem_ano_correto_pre_groupby)
+            ].copy()
+
+    # Agrupar por Oficina, Veículo, Período (com ano) e Tipo_Custo para obter totais
+    # 🔧 CORREÇÃO: Se houver coluna Ano, incluí-la no groupby (mesma lógica da TC_Ext)
+    # Isso garante que "Julho 2024" e "Julho 2025" sejam tratados separadamente
+    # MAS agora df_filtrado_media já contém APENAS o ano de referência
+    colunas_groupby = ['Oficina', 'Veículo', 'Período', 'Tipo_Custo'] + colunas_adicionais_cache
+    # Se houver coluna Ano, incluí-la no groupby para evitar somar meses de anos diferentes
+    if 'Ano' in df_filtrado_media.columns:
+        colunas_groupby = ['Ano'] + colunas_groupby
+    colunas_groupby = [col for col in colunas_groupby if col in df_filtrado_media.columns]
+    agg_dict = {'Total': 'sum'}  # Usar 'sum' para ter valores totais reais
+    df_medias = df_filtrado_media.groupby(colunas_groupby, observed=True).agg(agg_dict).reset_index()
+
+    # 🔧 CORREÇÃO: df_medias já contém apenas o ano de referência (foi filtrado antes do groupby)
+    # Mas vamos garantir novamente para segurança
+    df_medias_ano_recente = df_medias.copy()
+    if ano_referencia:
+        if 'Ano' in df_medias_ano_recente.columns:
+            # Filtrar diretamente pela coluna Ano (mais eficiente e correto)
+            df_medias_ano_recente = df_medias_ano_recente[df_medias_ano_recente['Ano'] == ano_referencia].copy()
+        elif 'Período' in df_medias.columns:
+            # Fallback: filtrar pelo ano no Período
+            def periodo_tem_ano_correto(periodo_val):
+                periodo_str = str(periodo_val).strip()
+                if ' ' in periodo_str:
+                    ano_val = periodo_str.split(' ', 1)[1]
+                    if ano_val.isdigit():
+                        return int(ano_val) == ano_referencia
+                # Se não tem ano após normalização, excluir
+                return False
+            df_medias_ano_recente = df_medias[
+                df_medias['Período'].apply(periodo_tem_ano_correto)
+            ].copy()
+        else:
+            # Se não temos coluna Ano nem Período, usar todos (compatibilidade)
+            df_medias_ano_recente = df_medias.copy()
+    else:
+        # Se não temos ano de referência, usar todos (compatibilidade)
+        df_medias_ano_recente = df_medias.copy()
+
+    # Calcular média geral mensal por linha (média das médias dos meses selecionados)
+    # 🔧 CORREÇÃO CRÍTICA: Garantir que df_medias_ano_recente contém APENAS o ano de referência
+    # Se ainda houver dados de outros anos após o filtro, filtrar novamente
+    if ano_referencia and 'Ano' in df_medias_ano_recente.columns:
+        anos_ainda_presentes = df_medias_ano_recente['Ano'].dropna().unique()
+        if len(anos_ainda_presentes) > 1 or (len(anos_ainda_presentes) == 1 and anos_ainda_presentes[0] != ano_referencia):
+            # Forçar filtro novamente
+            df_medias_ano_recente = df_medias_ano_recente[df_medias_ano_recente['Ano'] == ano_referencia].copy()
+    elif ano_referencia and 'Período' in df_medias_ano_recente.columns:
+        # Filtrar pelo ano no Período se não houver coluna Ano
+        def periodo_tem_ano_correto_final(periodo_val):
+            periodo_str = str(periodo_val).strip()
+            if ' ' in periodo_str:
+                ano_val = periodo_str.split(' ', 1)[1]
+                if ano_val.isdigit():
+                    return int(ano_val) == ano_referencia
+            return False
+        df_medias_ano_recente = df_medias_ano_recente[
+            df_medias_ano_recente['Período'].apply(periodo_tem_ano_correto_final)
+        ].copy()
+
+    # Calcular média geral mensal por linha (média das médias dos meses selecionados)
+    # 🔧 CORREÇÃO: Incluir 'Ano' no groupby se existir (preservar ano para forecast)
+    # IMPORTANTE: df_medias_ano_recente já deve conter APENAS o ano de referência
+    colunas_groupby_media = ['Oficina', 'Veículo', 'Tipo_Custo'] + colunas_adicionais_cache
+    if 'Ano' in df_medias_ano_recente.columns:
+        colunas_groupby_media.insert(2, 'Ano')  # Inserir Ano após Veículo
+    colunas_groupby_media = [col for col in colunas_groupby_media if col in df_medias_ano_recente.columns]
+    agg_dict_media = {'Total': 'mean'}
+    # Média mensal = soma dos meses / quantidade de meses da base: mês sem
+    # lançamento de um grupo conta como 0 (sem montar todas as combinações de categorias)
+    df_media_mensal = df_medias_ano_recente.groupby(colunas_groupby_media, observed=True).agg({'Total': 'sum'}).reset_index()
+    if 'Período' in df_medias_ano_recente.columns and df_medias_ano_recente['Período'].nunique() > 0:
+        df_media_mensal['Total'] = df_media_mensal['Total'] / df_medias_ano_recente['Período'].nunique()
+
+    # 🔧 VERIFICAÇÃO FINAL: Garantir que não há duplicatas após o agrupamento
+    # Se ainda houver duplicatas, significa que o agrupamento não está funcionando corretamente
+    if len(colunas_groupby_media) > 0:
+        duplicatas_final = df_media_mensal.duplicated(subset=colunas_groupby_media, keep=False)
+        if duplicatas_final.any():
+            # Se ainda houver duplicatas, forçar agrupamento novamente
+            df_media_mensal = df_media_mensal.groupby(
+                colunas_groupby_media, as_index=False
+            ).agg(agg_dict_media)
+
+    return df_medias, df_media_mensal
@@ -0,0 +1,166 @@
+"""
+Motor único dos gráficos de barras.
+
+Cada página agrega os dados uma vez num cubo (somas das medidas por Ano,
+Período e pelas dimensões dos gráficos, como Oficina e Veículo) e todos os
+gráficos da página saem desse cubo, descritos só pelo que desenham:
+
+    criar_grafico(cubo, 'CPU', "CPU por Veículo", "CPU (R$/Unidade)",
+                  dimensao='Veículo', ponderado=True, formato=',.4f')
+
+O cubo tem no máximo algumas centenas de linhas, então cada gráfico reagrupa
+o cubo em vez da visão filtrada inteira. O período vira uma chave inteira
+(Ano * 100 + mês) para agrupar e ordenar cronologicamente.
+
+Somas sobre as visões da sidebar saem prontas de ``carregar_agregado``
+(tc_dados.metadados, memoizado pelo spec dos filtros) e já servem de cubo;
+tabelas que já estão na memória passam por ``montar_cubo``.
+"""
+import altair as alt
+import pandas as pd
+import streamlit as st
+
+from tc_dados.agregacao import GRUPOS_PERIODO, agregar, calcular_cpu
+from tc_dados.metadados import ORDEM_MESES
+
+# Granularidade do eixo de período
+GRAO_AUTO = "auto"        # "mês ano" só quando o cubo tiver mais de um ano
+GRAO_ANO_MES = "ano_mes"  # "mês ano" sempre que o cubo tiver Ano
+GRAO_MES = "mes"          # anos somados no mesmo mês
+
+CHAVE_PERIODO = '_periodo'
+MES_FORA_CALENDARIO = 99  # Período que não é nome de mês: depois de dezembro
+
+_NUMERO_MES = {mes: numero for numero, mes in enumerate(ORDEM_MESES, start=1)}
+
+
+def chave_periodo(df):
+    """Chave inteira do período: Ano * 100 + mês (só o mês, sem coluna Ano)"""
+    mes = (df['Período'].astype(str).str.lower().map(_NUMERO_MES)
+           .fillna(MES_FORA_CALENDARIO).astype('int64'))
+    if 'Ano' not in df.columns:
+        return mes
+    ano = pd.to_numeric(df['Ano'].astype(str), errors='coerce').fillna(0).astype('int64')
+    return ano * 100 + mes
+
+
+def montar_cubo(df, dimensoes, medidas):
+    """
+    Cubo de uma tabela em memória: soma das medidas por Ano, Período e dimensões.
+
+    Colunas ausentes são ignoradas; linhas com grupo vazio ficam no cubo (cada
+    gráfico descarta só as da própria dimensão).
+    """
+    if df is None:
+        return None
+    medidas = [m for m in dict.fromkeys(medidas) if m in df.columns]
+    return agregar(df, GRUPOS_PERIODO + tuple(dimensoes), medidas, manter_ausentes=True)
+
+
+def _periodos(cubo, colunas, com_ano):
+    """Soma das colunas por período, em ordem cronológica, com o rótulo em 'Período'"""
+    chave = chave_periodo(cubo)
+    dados = cubo.assign(**{CHAVE_PERIODO: chave if com_ano else chave % 100})
+    pontos = agregar(dados, [CHAVE_PERIODO, 'Período'] + (['Ano'] if com_ano else []), colunas)
+    rotulo = pontos['Período'].astype(str)
+    if com_ano:
+        rotulo = rotulo + ' ' + pontos['Ano'].astype(str)
+    pontos['Período'] = rotulo
+    return pontos.drop(columns=[CHAVE_PERIODO, 'Ano'], errors='ignore')
+
+
+def pontos_grafico(cubo, medida, dimensao=None, grao=GRAO_AUTO, ponderado=False):
+    """
+    Pontos de um gráfico: a medida por período (dimensao=None) ou por uma ou
+    mais dimensões (ex.: ('Oficina', 'Veículo')). None se o cubo não tiver
+    as colunas necessárias.
+
+    ponderado: CPU = soma do Total / soma do Volume de cada ponto (quando o
+    cubo tiver as duas colunas), em vez da soma dos CPUs.
+    """
+    ponderado = ponderado and {'Total', 'Volume'} <= set(cubo.columns)
+    colunas = ['Total', 'Volume'] if ponderado else [medida]
+    dimensoes = [] if dimensao is None else [dimensao] if isinstance(dimensao, str) else list(dimensao)
+    necessarias = colunas + (dimensoes or ['Período'])
+    if any(col not in cubo.columns for col in necessarias):
+        return None
+
+    if dimensoes:
+        pontos = agregar(cubo, dimensoes, colunas)
+    else:
+        com_ano = 'Ano' in cubo.columns and (
+            grao == GRAO_ANO_MES or (grao == GRAO_AUTO and cubo['Ano'].nunique() > 1)
+        )
+        pontos = _periodos(cubo, colunas, com_ano)
+
+    if ponderado:
+        pontos[medida] = calcular_cpu(pontos['Total'], pontos['Volume'])
+        pontos = pontos.drop(columns=[c for c in colunas if c != medida])
+    if dimensoes:
+        pontos = pontos.sort_values(medida, ascending=False)
+    return pontos
+
+
+def grafico_barras(pontos, medida, eixo, titulo, titulo_y, formato=',.2f',
+                   esquema='blues', inverter=False, cor=None):
+    """
+    Barras com rótulo do valor. eixo: 'Período' (ordem cronológica dos pontos)
+    ou uma dimensão (maior valor primeiro); cor: dimensão das barras agrupadas.
+    """
+    escala = alt.Scale(scheme=esquema, reverse=True) if inverter else alt.Scale(scheme=esquema)
+    if cor:
+        cores = alt.Color(f'{cor}:N', title=cor, scale=escala)
+        dicas = [alt.Tooltip(f'{eixo}:N', title=eixo), alt.Tooltip(f'{cor}:N', title=cor)]
+    else:
+        cores = alt.Color(f'{medida}:Q', title=medida, scale=escala)
+        dicas = [alt.Tooltip(f'{eixo}:N', title=eixo)]
+
+    grafico = alt.Chart(pontos).mark_bar().encode(
+        x=alt.X(f'{eixo}:N', title=eixo,
+                sort=pontos['Período'].tolist() if eixo == 'Período' else '-y'),
+        y=alt.Y(f'{medida}:Q', title=titulo_y),
+        color=cores,
+        tooltip=dicas + [alt.Tooltip(f'{medida}:Q', title=medida, format=formato)]
+    ).properties(
+        title=titulo,
+        height=400
+    )
+
+    rotulos = grafico.mark_text(
+        align='center',
+        baseline='middle',
+        dy=-10,
+        color='black',
+        fontSize=10 if cor else 12
+    ).encode(
+        text=alt.Text(f'{medida}:Q', format=formato)
+    )
+
+    return grafico + rotulos
+
+
+@st.cache_data(max_entries=16)
+def criar_grafico(cubo, medida, titulo, titulo_y, dimensao=None, grao=GRAO_AUTO,
+                  ponderado=False, formato=',.2f', esquema='blues', inverter=False):
+    """
+    Gráfico de barras da medida por período ou dimensão, a partir do cubo da
+    página. Com duas dimensões, a segunda colore as barras agrupadas.
+    Retorna None se não houver pontos.
+    """
+    try:
+        if cubo is None:
+            return None
+        pontos = pontos_grafico(cubo, medida, dimensao, grao, ponderado)
+        if pontos is None or len(pontos) == 0:
+            return None
+
+        if dimensao is None:
+            eixo, cor = 'Período', None
+        elif isinstance(dimensao, str):
+            eixo, cor = dimensao, None
+        else:
+            eixo, cor = dimensao[0], dimensao[1]
+        return grafico_barras(pontos, medida, eixo, titulo, titulo_y, formato, esquema, inverter, cor)
+    except Exception as e:
+        st.error(f"Erro ao criar gráfico: {e}")
+        return None
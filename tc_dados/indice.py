@@ -0,0 +1,115 @@
+"""
+Índice de bitmaps por valor de dimensão para filtros cruzados instantâneos.
+
+Para cada conjunto (e versão dos dados) o índice guarda, por (coluna, valor),
+as linhas em que o valor aparece, comprimidas como no Roaring: valores raros
+ficam como lista ordenada de linhas (uint32) e os demais como bitset
+empacotado (1 bit por linha). Combinar filtros vira OR entre os valores de
+uma coluna e AND entre colunas, sem tocar na tabela; a máscara resultante
+alimenta as visões e as facetas da sidebar (contagens e totais por opção em
+tc_dados.filtros.calcular_facetas).
+
+O índice é montado uma vez por versão dos dados (st.cache_resource: um único
+objeto compartilhado por todas as sessões, sem cópia a cada acesso).
+"""
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from tc_dados.carregamento import carregar_dados
+from tc_dados.versionamento import versao_dados
+
+# Colunas indexadas: as da cascata da sidebar
+COLUNAS_INDICE = [
+    'Oficina', 'Veículo', 'USI', 'Período', 'Ano', 'Type 05', 'Type 06', 'Fornecedor',
+    'Account', 'Centrocst', 'Nºconta', 'Fornec.', 'Tipo', 'Custo'
+]
+
+def _comprimir(linhas, n_linhas):
+    """Lista de linhas (uint32) se for menor que o bitset; senão bitset empacotado (uint8)"""
+    if len(linhas) * 32 < n_linhas:
+        return linhas.astype(np.uint32)
+    mascara = np.zeros(n_linhas, dtype=bool)
+    mascara[linhas] = True
+    return np.packbits(mascara)
+
+
+def _como_bitset(item, n_linhas):
+    if item.dtype == np.uint8:
+        return item
+    mascara = np.zeros(n_linhas, dtype=bool)
+    mascara[item] = True
+    return np.packbits(mascara)
+
+
+def _indexar_coluna(serie, n_linhas):
+    """Valor (como texto) -> linhas comprimidas, numa única ordenação da coluna"""
+    codigos, rotulos = pd.factorize(serie)
+    ordem = np.argsort(codigos, kind='stable')
+    limites = np.searchsorted(codigos[ordem], np.arange(len(rotulos) + 1))
+
+    indice_coluna = {}
+    for k, rotulo in enumerate(rotulos):
+        linhas = np.sort(ordem[limites[k]:limites[k + 1]])
+        chave = str(rotulo)
+        if chave in indice_coluna:
+            # Mesmo texto vindo de tipos diferentes (ex.: 6101 e '6101')
+            linhas = np.union1d(linhas, np.flatnonzero(np.unpackbits(
+                _como_bitset(indice_coluna[chave], n_linhas), count=n_linhas)))
+        indice_coluna[chave] = _comprimir(linhas, n_linhas)
+    return indice_coluna
+
+
+class IndiceBitmap:
+    """Bitsets (coluna, valor) -> linhas de um conjunto de dados"""
+
+    def __init__(self, df, colunas=COLUNAS_INDICE):
+        self.n_linhas = len(df)
+        self.bitsets = {
+            coluna: _indexar_coluna(df[coluna], self.n_linhas)
+            for coluna in colunas if coluna in df.columns
+        }
+
+    def bits(self, coluna, valores):
+        """OR dos bitsets dos valores selecionados de uma coluna"""
+        resultado = np.zeros((self.n_linhas + 7) // 8, dtype=np.uint8)
+        for valor in valores:
+            item = self.bitsets[coluna].get(str(valor))
+            if item is not None:
+                resultado |= _como_bitset(item, self.n_linhas)
+        return resultado
+
+    def filtrar(self, chave):
+        """
+        AND das colunas indexadas de uma chave de FiltroSpec.
+
+        Retorna (bitset ou None se nenhuma coluna indexada filtra, dict das
+        seleções em colunas fora do índice).
+        """
+        bits = None
+        restantes = {}
+        for coluna, valores in chave:
+            if coluna not in self.bitsets:
+                restantes[coluna] = valores
+                continue
+            bits_coluna = self.bits(coluna, valores)
+            bits = bits_coluna if bits is None else bits & bits_coluna
+        return bits, restantes
+
+    def mascara(self, bits):
+        """Bitset -> máscara booleana por linha"""
+        return np.unpackbits(bits, count=self.n_linhas).astype(bool)
+
+
+@st.cache_resource(max_entries=12, show_spinner=False)
+def carregar_indice_versao(dataset, ano, versao):
+    """Índice de um conjunto; 'versao' faz o índice ser remontado a cada nova versão dos dados"""
+    df = carregar_dados(ano, dataset)
+    if df is None:
+        return None
+    return IndiceBitmap(df)
+
+
+def carregar_indice(ano="Todos", dataset="df_final"):
+    """Índice de bitmaps do conjunto (None se o conjunto não for encontrado)"""
+    return carregar_indice_versao(dataset, str(ano), versao_dados())
@@ -0,0 +1,426 @@
+"""
+Metadados de dimensões para montar a sidebar sem carregar a tabela completa.
+
+Para cada parquet de dados o ETL grava ao lado um arquivo
+``<nome>_dimensoes.parquet`` com as combinações distintas das colunas de
+filtro de baixa cardinalidade (Ano, Oficina, USI, Período, Centrocst,
+Nºconta, Type 05/06, Fornecedor, Fornec., Tipo, Veículo, Account, Custo), a
+quantidade de linhas e a soma de Valor de cada combinação. São poucos KB: as
+opções dos filtros em cascata, com linhas e total, saem desse arquivo e a
+tabela pesada só é lida quando a visualização precisa dela.
+
+Regerar manualmente (todos os parquets da pasta dados)::
+
+    python -m tc_dados.metadados
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import streamlit as st
+
+from tc_dados.carregamento import (
+    DATASETS, PASTA_HISTORICO, carregar_dados, dados_carregados, encontrar_arquivo_parquet,
+    listar_anos_disponiveis
+)
+from tc_dados.agregacao import GRAO_CPU, LINHAS_CUSTO, agregar
+from tc_dados.busca import carregar_indice_textual_versao
+from tc_dados.cache_resultados import cache_resultados
+from tc_dados.filtros import CAMPO_BUSCA, FiltroSpec, calcular_facetas, mascara_coluna, valores_distintos
+from tc_dados.indice import carregar_indice_versao
+from tc_dados.moeda import de_inteiro, para_inteiro
+from tc_dados.versionamento import PASTA_DADOS, resolver_caminho, versao_dados
+
+# Colunas de filtro com poucos valores distintos (as demais ficam na tabela completa)
+COLUNAS_DIMENSAO = [
+    'Ano', 'Oficina', 'USI', 'Período', 'Centrocst', 'Nºconta', 'Type 05', 'Type 06',
+    'Fornecedor', 'Fornec.', 'Tipo', 'Veículo', 'Account', 'Custo'
+]
+
+# Medida somada por combinação (total em R$ das facetas)
+COLUNA_VALOR_DIMENSOES = 'Valor'
+
+SUFIXO_DIMENSOES = "_dimensoes.parquet"
+
+# Ordem dos meses para ordenação cronológica
+ORDEM_MESES = [
+    'janeiro', 'fevereiro', 'março', 'abril', 'maio', 'junho',
+    'julho', 'agosto', 'setembro', 'outubro', 'novembro', 'dezembro'
+]
+
+
+def caminho_dimensoes(caminho_dados):
+    """Caminho do arquivo de dimensões correspondente a um parquet de dados"""
+    return os.path.splitext(caminho_dados)[0] + SUFIXO_DIMENSOES
+
+
+def gerar_dimensoes(df):
+    """
+    Combinações distintas das colunas de dimensão com a contagem de linhas
+    ('Linhas') e, se a tabela tiver Valor, a soma exata de Valor
+    """
+    colunas = [col for col in COLUNAS_DIMENSAO if col in df.columns]
+    tem_valor = COLUNA_VALOR_DIMENSOES in df.columns
+    if not colunas:
+        df_dim = pd.DataFrame({'Linhas': [len(df)]})
+        if tem_valor:
+            df_dim[COLUNA_VALOR_DIMENSOES] = de_inteiro([para_inteiro(df[COLUNA_VALOR_DIMENSOES]).sum()])
+        return df_dim
+
+    df_dim = df[colunas].copy()
+    for col in colunas:
+        if col != 'Ano':
+            # Texto uniforme: Nºconta/Account chegam como número em alguns anos
+            df_dim[col] = df_dim[col].astype(str).where(df_dim[col].notna())
+    df_dim['Linhas'] = 1
+    medidas = ['Linhas']
+    if tem_valor:
+        df_dim[COLUNA_VALOR_DIMENSOES] = para_inteiro(df[COLUNA_VALOR_DIMENSOES])
+        medidas.append(COLUNA_VALOR_DIMENSOES)
+    df_dim = df_dim.groupby(colunas, observed=True, dropna=False)[medidas].sum().reset_index()
+    if tem_valor:
+        df_dim[COLUNA_VALOR_DIMENSOES] = de_inteiro(df_dim[COLUNA_VALOR_DIMENSOES])
+    return df_dim
+
+
+def _ler_colunas_dimensao(caminho_dados):
+    """Lê do parquet apenas as colunas de dimensão e Valor (formato colunar: o resto nem é lido)"""
+    colunas = pq.read_schema(caminho_dados).names
+    return pd.read_parquet(
+        caminho_dados,
+        columns=[col for col in COLUNAS_DIMENSAO + [COLUNA_VALOR_DIMENSOES] if col in colunas]
+    )
+
+
+def salvar_dimensoes(caminho_dados):
+    """Gera e grava o arquivo de dimensões de um parquet de dados"""
+    caminho = caminho_dimensoes(caminho_dados)
+    gerar_dimensoes(_ler_colunas_dimensao(caminho_dados)).to_parquet(caminho, index=False, engine="pyarrow")
+    return caminho
+
+
+def gerar_todas_dimensoes(pasta_dados=PASTA_DADOS):
+    """Regera os arquivos de dimensões de todos os conjuntos (anos e histórico)"""
+    gerados = []
+    anos = listar_anos_disponiveis(pasta_dados, versionado=False)
+    pastas = [os.path.join(pasta_dados, str(ano)) for ano in anos]
+    pastas.append(os.path.join(pasta_dados, os.path.basename(PASTA_HISTORICO)))
+    for pasta in pastas:
+        for arquivos in DATASETS.values():
+            for nome in (arquivos["arquivo"], arquivos["historico"]):
+                caminho = os.path.join(pasta, nome)
+                if os.path.exists(caminho):
+                    gerados.append(salvar_dimensoes(caminho))
+    return gerados
+
+
+@st.cache_data(max_entries=12, show_spinner=False)
+def _carregar_dimensoes_versao(dataset, ano, versao):
+    """Lê o arquivo de dimensões; se ausente ou desatualizado, calcula só com as colunas de filtro"""
+    caminho = encontrar_arquivo_parquet(dataset, ano)
+    if caminho is None:
+        return None
+
+    caminho_dados = resolver_caminho(caminho)
+    caminho_dim = resolver_caminho(caminho_dimensoes(caminho))
+    df_dim = None
+    if (caminho_dim is not None and os.path.exists(caminho_dim)
+            and os.path.getmtime(caminho_dim) >= os.path.getmtime(caminho_dados)):
+        df_dim = pd.read_parquet(caminho_dim)
+        if (COLUNA_VALOR_DIMENSOES not in df_dim.columns
+                and COLUNA_VALOR_DIMENSOES in pq.read_schema(caminho_dados).names):
+            df_dim = None  # Gerado antes da soma de Valor existir
+    if df_dim is None:
+        # Sem metadados (ex.: parquet gerado antes deste arquivo existir)
+        df_dim = gerar_dimensoes(_ler_colunas_dimensao(caminho_dados))
+
+    if ano != "Todos" and 'Ano' in df_dim.columns:
+        df_dim = df_dim[df_dim['Ano'] == int(ano)].reset_index(drop=True)
+    return df_dim
+
+
+def carregar_dimensoes(ano="Todos", dataset="df_final"):
+    """
+    Carrega os metadados de dimensões do conjunto (poucos KB).
+
+    Retorna None se o conjunto de dados não for encontrado.
+    """
+    return _carregar_dimensoes_versao(dataset, str(ano), versao_dados())
+
+
+def opcoes_filtro(df_dim, coluna):
+    """Opções de um filtro: "Todos" + valores distintos ordenados (Período em ordem cronológica)"""
+    if df_dim is None or coluna not in df_dim.columns:
+        return ["Todos"]
+
+    return ["Todos"] + ordenar_opcoes(df_dim[coluna].dropna().astype(str).unique().tolist(), coluna)
+
+
+def ordenar_opcoes(opcoes, coluna):
+    """Ordena as opções de um filtro (Período em ordem cronológica)"""
+    opcoes = sorted(opcoes)
+    if coluna == 'Período':
+        meses = sorted((p for p in opcoes if p.lower() in ORDEM_MESES),
+                       key=lambda p: ORDEM_MESES.index(p.lower()))
+        opcoes = meses + [p for p in opcoes if p.lower() not in ORDEM_MESES]
+    return opcoes
+
+
+def contar_linhas(df_dim):
+    """Quantidade de linhas da tabela completa representada pelos metadados"""
+    if df_dim is None or 'Linhas' not in df_dim.columns:
+        return 0
+    return int(df_dim['Linhas'].sum())
+
+
+def filtrar(df, coluna, selecionados):
+    """
+    Mantém as linhas cujo valor (como texto) está entre os selecionados.
+
+    Lista vazia ou contendo "Todos" não filtra. Usado na cascata sobre os
+    metadados; a tabela completa é filtrada de uma vez com um FiltroSpec.
+    """
+    mascara = mascara_coluna(df, coluna, selecionados)
+    if mascara is None:
+        return df
+    return df[mascara]
+
+
+def _como_spec(selecoes):
+    return selecoes if isinstance(selecoes, FiltroSpec) else FiltroSpec(selecoes)
+
+
+@cache_resultados
+def _mascara_versao(dataset, ano, versao, chave):
+    """
+    Máscara combinada das seleções sobre a tabela completa (indexada pela chave do spec).
+
+    Colunas do índice de bitmaps entram por AND/OR de bitsets e a busca textual
+    pelo índice invertido; só as demais (ex.: filtros avançados) leem a tabela.
+    """
+    indice = carregar_indice_versao(dataset, ano, versao)
+    if indice is None:
+        return None
+    bits, restantes = indice.filtrar(chave)
+    mascara = indice.mascara(bits) if bits is not None else np.ones(indice.n_linhas, dtype=bool)
+    termos = restantes.pop(CAMPO_BUSCA, None)
+    if termos:
+        mascara &= carregar_indice_textual_versao(dataset, ano, versao).mascara(termos)
+    if restantes:
+        mascara &= FiltroSpec(restantes).mascara(carregar_dados(ano, dataset))
+    return mascara
+
+
+@cache_resultados
+def _carregar_visao_versao(dataset, ano, versao, chave):
+    """Tabela completa recortada uma única vez pela máscara do spec"""
+    df = carregar_dados(ano, dataset)
+    if df is None:
+        return None
+    return df[_mascara_versao(dataset, ano, versao, chave)]
+
+
+def carregar_visao(ano="Todos", dataset="df_final", selecoes=None):
+    """
+    Carrega o conjunto já filtrado pelas seleções da sidebar (cache de resultados compartilhado, limitado por bytes).
+
+    selecoes: FiltroSpec ou dict coluna -> valores selecionados.
+    As visões padrão são calculadas pelo pré-aquecimento (tc_dados.preaquecimento).
+    Sem seleções, é a própria tabela de carregar_dados (não ocupa o cache de
+    resultados com uma segunda cópia). Retorna None se o conjunto de dados não
+    for encontrado.
+    """
+    chave = _como_spec(selecoes).chave
+    if not chave:
+        return carregar_dados(ano, dataset)
+    return _carregar_visao_versao(dataset, str(ano), versao_dados(), chave)
+
+
+@cache_resultados
+def _opcoes_visao_versao(dataset, ano, versao, chave, coluna):
+    df = carregar_dados(ano, dataset)
+    if df is None or coluna not in df.columns:
+        return ["Todos"]
+    mascara = _mascara_versao(dataset, ano, versao, chave) if chave else None
+    return ["Todos"] + valores_distintos(df[coluna], mascara)
+
+
+def opcoes_visao(ano, dataset, selecoes, coluna):
+    """
+    Opções de um filtro ("Todos" + valores ordenados) dentro da visão filtrada.
+
+    Para colunas fora dos metadados (Usuário, Material, ...): usa a máscara em
+    cache do spec em vez de recortar e hashear a tabela filtrada.
+    """
+    return _opcoes_visao_versao(dataset, str(ano), versao_dados(), _como_spec(selecoes).chave, coluna)
+
+
+@cache_resultados
+def _facetas_versao(dataset, ano, versao, chave):
+    """Todas as facetas de um spec de uma vez, pela máscara sobre a tabela completa"""
+    df = carregar_dados(ano, dataset)
+    if df is None:
+        return {}
+    mascara = _mascara_versao(dataset, ano, versao, chave) if chave else None
+    return calcular_facetas(df, COLUNAS_DIMENSAO, mascara)
+
+
+@cache_resultados
+def _facetas_dimensoes_versao(dataset, ano, versao, chave):
+    """Todas as facetas de um spec de uma vez, somando Linhas e Valor dos metadados"""
+    df_dim = _carregar_dimensoes_versao(dataset, ano, versao)
+    if df_dim is None:
+        return {}
+    mascara = FiltroSpec(dict(chave)).mascara(df_dim) if chave else None
+    return calcular_facetas(df_dim, COLUNAS_DIMENSAO, mascara,
+                            coluna_valor=COLUNA_VALOR_DIMENSOES, coluna_linhas='Linhas')
+
+
+def carregar_facetas(ano, dataset, selecoes):
+    """
+    Opções disponíveis de cada filtro, com linhas e total (R$), dadas as seleções.
+
+    Na cascata da sidebar cada filtro usa as facetas das seleções anteriores a
+    ele; seleções que não mudam reaproveitam o resultado em cache. Enquanto a
+    tabela completa não foi carregada, as facetas saem dos metadados de
+    dimensões (a sidebar aparece sem ler os lançamentos); depois, da máscara
+    do spec sobre a tabela. Seleções fora dos metadados (ex.: busca textual)
+    sempre usam a tabela.
+    """
+    ano = str(ano)
+    versao = versao_dados()
+    chave = _como_spec(selecoes).chave
+    if not dados_carregados(ano, dataset):
+        df_dim = _carregar_dimensoes_versao(dataset, ano, versao)
+        if df_dim is not None and all(coluna in df_dim.columns for coluna, _ in chave):
+            return _facetas_dimensoes_versao(dataset, ano, versao, chave)
+    return _facetas_versao(dataset, ano, versao, chave)
+
+
+@cache_resultados
+def _agregado_versao(dataset, ano, versao, chave, grupos, colunas):
+    """Soma das colunas por grupos sobre a visão (só as colunas usadas são recortadas)"""
+    df = carregar_dados(ano, dataset)
+    if df is None:
+        return None
+    colunas = [c for c in colunas if c in df.columns]
+    if not colunas:
+        return None
+    recorte = [g for g in grupos if g in df.columns] + colunas
+    if chave:
+        df = df.loc[_mascara_versao(dataset, ano, versao, chave), recorte]
+    else:
+        df = df[recorte]
+    return agregar(df, grupos, colunas, manter_ausentes=True)
+
+
+def carregar_agregado(ano, dataset, selecoes, grupos, colunas):
+    """
+    Soma das colunas por grupos dentro da visão filtrada (poucas linhas, para
+    gráficos; serve de cubo para tc_dados.graficos).
+
+    Linhas com grupo vazio formam um grupo próprio, para que somas por outras
+    dimensões não percam essas linhas. Memoizado pela chave do spec: mesmos
+    filtros reaproveitam o resultado sem recortar nem hashear a tabela.
+    Retorna None se o conjunto ou as colunas não existirem.
+    """
+    colunas = (colunas,) if isinstance(colunas, str) else tuple(colunas)
+    return _agregado_versao(dataset, str(ano), versao_dados(), _como_spec(selecoes).chave, tuple(grupos), colunas)
+
+
+@cache_resultados
+def _cubo_cpu_versao(dataset, ano, versao, chave, coluna_custo):
+    """Custo da visão e Volume de df_vol somados no grão do cubo de CPU"""
+    df = carregar_dados(ano, dataset)
+    try:
+        df_vol = carregar_dados(ano, "df_vol")
+    except Exception:
+        df_vol = None
+    if df is None or df_vol is None or coluna_custo not in df.columns or 'Volume' not in df_vol.columns:
+        return None
+    grao = [g for g in GRAO_CPU if g in df.columns and g in df_vol.columns]
+    if chave:
+        df = df.loc[_mascara_versao(dataset, ano, versao, chave), grao + [coluna_custo]]
+    else:
+        df = df[grao + [coluna_custo]]
+    custo = agregar(df.assign(**{LINHAS_CUSTO: 1}), grao, [coluna_custo, LINHAS_CUSTO])
+    volume = agregar(df_vol, grao, 'Volume')
+    # Outer: grupos só com custo ficam com Volume 0 e grupos só com volume com custo 0
+    cubo = custo.merge(volume, on=grao, how='outer')
+    cubo[coluna_custo] = cubo[coluna_custo].fillna(0.0)
+    cubo[LINHAS_CUSTO] = cubo[LINHAS_CUSTO].fillna(0).astype('int64')
+    cubo['Volume'] = cubo['Volume'].fillna(0.0)
+    return cubo
+
+
+def carregar_cubo_cpu(ano, dataset, selecoes, coluna_custo='Total'):
+    """
+    Cubo de CPU: custo (da visão filtrada) e Volume (de df_vol, sem os filtros
+    da sidebar) somados por Ano, Período, Oficina e Veículo (as colunas que
+    existirem nas duas tabelas), mais a quantidade de linhas de custo.
+
+    Calculado uma vez por versão dos dados e spec dos filtros; os CPUs por
+    qualquer agrupamento saem de tc_dados.agregacao.cpu_por, sem reler os
+    lançamentos. Retorna None sem volumes ou sem a coluna de custo.
+    """
+    return _cubo_cpu_versao(dataset, str(ano), versao_dados(), _como_spec(selecoes).chave, coluna_custo)
+
+
+# Colunas da visão que não restringem os volumes (medidas e o mês: o gráfico
+# de volume mostra sempre todos os períodos)
+COLUNAS_FORA_VOLUME = ('Volume', 'Total', 'Valor', 'CPU', 'Período')
+
+
+@cache_resultados
+def _volume_visao_versao(dataset, ano, versao, chave):
+    """Linhas de df_vol com os valores das dimensões presentes na visão"""
+    try:
+        df_vol = carregar_dados(ano, "df_vol")
+    except Exception:
+        return None
+    df = carregar_dados(ano, dataset)
+    if df_vol is None or df is None:
+        return df_vol
+    selecoes = {
+        col: _opcoes_visao_versao(dataset, ano, versao, chave, col)[1:]
+        for col in df_vol.columns if col in df.columns and col not in COLUNAS_FORA_VOLUME
+    }
+    return FiltroSpec(selecoes).aplicar(df_vol)
+
+
+def carregar_volume_visao(ano, dataset, selecoes):
+    """
+    Volumes (df_vol) que acompanham os filtros da sidebar: cada dimensão em
+    comum com o conjunto (Ano, Oficina, Veículo) fica restrita aos valores
+    presentes na visão filtrada, e o spec resultante é aplicado pelos códigos
+    de categoria de df_vol. Os valores vêm das opções da visão em cache (pela
+    máscara do spec), sem recortar a tabela de lançamentos.
+
+    Memoizado pela versão dos dados e chave do spec. Retorna None sem df_vol.
+    """
+    return _volume_visao_versao(dataset, str(ano), versao_dados(), _como_spec(selecoes).chave)
+
+
+def opcoes_faceta(facetas, coluna):
+    """Opções de um filtro: "Todos" + valores presentes (Período em ordem cronológica)"""
+    if coluna not in facetas:
+        return ["Todos"]
+    return ["Todos"] + ordenar_opcoes([op for op in facetas[coluna].index if op != "Todos"], coluna)
+
+
+def rotulo_faceta(facetas, coluna):
+    """format_func dos filtros: mostra 'opção (linhas · R$ total)'"""
+    faceta = facetas.get(coluna)
+
+    def formatar(opcao):
+        if faceta is None or opcao not in faceta.index:
+            return opcao
+        return f"{opcao} ({faceta.at[opcao, 'Linhas']:,} · R$ {faceta.at[opcao, 'Total']:,.0f})"
+    return formatar
+
+
+if __name__ == "__main__":
+    for caminho_gerado in gerar_todas_dimensoes(sys.argv[1] if len(sys.argv) > 1 else PASTA_DADOS):
+        print(f"✅ {caminho_gerado}")
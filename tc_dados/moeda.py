@@ -0,0 +1,69 @@
+"""
+Soma exata de valores monetários (Valor, Total).
+
+Os valores em R$ são convertidos para inteiros escalados (int64 em milionésimos
+de real) antes de somar: a soma de inteiros é exata e independe da ordem das
+linhas, então totais de dezenas de milhares de lançamentos batem até o
+centavo em pivots, gráficos e no waterfall. A escala de 10^6 preserva as casas
+decimais do rateio (Total = Valor x percentual), que o dados.py propositalmente
+não arredonda.
+"""
+import numpy as np
+import pandas as pd
+
+# Colunas em R$ (nunca reduzir para float32 na otimização de tipos)
+COLUNAS_MONETARIAS = ['Valor', 'Total']
+
+ESCALA = 1_000_000
+
+
+def para_inteiro(valores):
+    """Converte valores em R$ para int64 escalado (NaN vira 0)"""
+    array = pd.to_numeric(pd.Series(valores), errors='coerce').to_numpy(dtype='float64', na_value=0.0)
+    return np.rint(array * ESCALA).astype('int64')
+
+
+def de_inteiro(valores):
+    """Converte inteiros escalados de volta para R$ (float64)"""
+    return np.asarray(valores, dtype='int64') / ESCALA
+
+
+def somar(valores):
+    """Soma exata de uma série de valores em R$"""
+    return int(para_inteiro(valores).sum()) / ESCALA
+
+
+def somar_por(df, por, coluna):
+    """
+    Equivalente exato a ``df.groupby(por)[coluna].sum().reset_index()``.
+
+    Agrupa apenas as combinações presentes nos dados (observed=True).
+    """
+    chaves = [por] if isinstance(por, str) else list(por)
+    df_soma = df[chaves].copy()
+    df_soma[coluna] = para_inteiro(df[coluna])
+    resultado = df_soma.groupby(chaves, observed=True, sort=True)[coluna].sum().reset_index()
+    resultado[coluna] = de_inteiro(resultado[coluna])
+    return resultado
+
+
+def tabela_soma(df, index, columns, values):
+    """Equivalente exato a ``df.pivot_table(..., aggfunc='sum', fill_value=0)``"""
+    chaves = ([index] if isinstance(index, str) else list(index)) + [columns]
+    df_soma = df[chaves].copy()
+    df_soma[values] = para_inteiro(df[values])
+    tabela = df_soma.groupby(chaves, observed=True)[values].sum().unstack(columns, fill_value=0)
+    tabela.columns = tabela.columns.astype(object)
+    return pd.DataFrame(de_inteiro(tabela.to_numpy()), index=tabela.index, columns=tabela.columns)
+
+
+def somar_linhas(df):
+    """Total exato por linha de uma tabela de valores em R$"""
+    inteiros = np.rint(df.to_numpy(dtype='float64', na_value=0.0) * ESCALA).astype('int64')
+    return pd.Series(de_inteiro(inteiros.sum(axis=1)), index=df.index)
+
+
+def somar_grupos(df, por, coluna):
+    """Equivalente exato a ``df.groupby(por)[coluna].sum()`` (Series indexada pelos grupos)"""
+    soma = pd.Series(para_inteiro(df[coluna]), index=df.index).groupby(df[por], observed=True).sum()
+    return pd.Series(de_inteiro(soma.to_numpy()), index=soma.index, name=coluna)
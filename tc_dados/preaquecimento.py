@@ -0,0 +1,152 @@
+"""
+Pré-aquecimento do cache compartilhado do Streamlit.
+
+Depois de um deploy, de um restart ou de uma nova publicação do ETL, o primeiro
+analista a abrir cada página pagaria a leitura de todos os parquets e o
+primeiro cálculo de médias do Forecast. ``iniciar_preaquecimento`` (chamado no
+topo do app e das páginas) dispara uma única vez por processo e por versão dos
+dados uma thread em segundo plano que:
+
+- carrega todos os anos e o histórico consolidado de df_final, df_vol e
+  df_ke5z_group, com os respectivos metadados de dimensões;
+- monta os índices de bitmaps dos filtros (tc_dados.indice) e os de busca
+  dos filtros avançados e da busca textual (tc_dados.busca);
+- monta as visões padrão (USI 'TC Ext', todas as Oficinas) e as facetas da
+  cascata de filtros;
+- calcula as médias do Forecast para a configuração padrão da tela.
+
+Como o cache do Streamlit é do processo, tudo isso fica disponível para todas
+as sessões. Quando o ETL publica uma nova versão, o próximo acesso detecta a
+versão nova e aquece de novo.
+
+Medir o tempo de aquecimento fora do servidor::
+
+    python -m tc_dados.preaquecimento
+"""
+import logging
+import threading
+import time
+
+import streamlit as st
+
+from tc_dados.busca import COLUNAS_BUSCA, buscar_valores, carregar_indice_textual
+from tc_dados.carregamento import DATASETS, carregar_dados, listar_anos_disponiveis
+from tc_dados.forecast import calcular_medias_forecast, configuracao_padrao, marcar_tipo_custo
+from tc_dados.indice import carregar_indice
+from tc_dados.metadados import carregar_dimensoes, carregar_facetas, carregar_visao
+from tc_dados.versionamento import versao_dados
+
+logger = logging.getLogger(__name__)
+
+# Visão padrão das páginas (default dos filtros da sidebar)
+SELECOES_PADRAO = {'USI': ['TC Ext']}
+
+
+def _aquecer_forecast():
+    """Primeiro cálculo de médias do Forecast com a configuração padrão da tela"""
+    df_filtrado = carregar_visao("Todos", "df_final", SELECOES_PADRAO)
+    if df_filtrado is None:
+        return
+    df_filtrado = marcar_tipo_custo(df_filtrado)
+    config = configuracao_padrao(df_filtrado)
+    if config is None or not config['periodos_para_media']:
+        return
+    colunas_adicionais = [col for col in ['Type 05', 'Type 06', 'Account'] if col in df_filtrado.columns]
+    calcular_medias_forecast(
+        df_filtrado, colunas_adicionais, config['periodos_para_media'], config['ultimo_periodo_dados']
+    )
+
+
+def _aquecer_facetas(ano, dataset):
+    """Facetas da cascata padrão da sidebar (sem seleção e com a USI padrão)"""
+    carregar_facetas(ano, dataset, {})
+    carregar_facetas(ano, dataset, SELECOES_PADRAO)
+
+
+def _aquecer_busca(ano, dataset):
+    """Índices de busca dos filtros avançados e da busca textual"""
+    for coluna in COLUNAS_BUSCA:
+        buscar_valores(ano, dataset, coluna, "")
+    carregar_indice_textual(ano, dataset)
+
+
+def preaquecer():
+    """
+    Carrega todos os conjuntos no cache e calcula as visões padrão.
+
+    Retorna dict etapa -> segundos (inclui 'total'); etapas com erro são
+    registradas como 'erro: <mensagem>' sem interromper as demais.
+    """
+    tempos = {}
+    inicio = time.perf_counter()
+
+    def etapa(nome, funcao, *args):
+        t0 = time.perf_counter()
+        try:
+            resultado = funcao(*args)
+            tempos[nome] = round(time.perf_counter() - t0, 2)
+            return resultado
+        except Exception as e:
+            tempos[nome] = f"erro: {e}"
+            logger.warning("Pré-aquecimento: etapa '%s' falhou: %s", nome, e)
+            return None
+
+    anos = ["Todos"] + [str(ano) for ano in listar_anos_disponiveis()]
+    for dataset in DATASETS:
+        for ano in anos:
+            etapa(f"dimensões {dataset} {ano}", carregar_dimensoes, ano, dataset)
+            df = etapa(f"{dataset} {ano}", carregar_dados, ano, dataset)
+            if df is not None and dataset != "df_vol":
+                etapa(f"índice {dataset} {ano}", carregar_indice, ano, dataset)
+                etapa(f"visão padrão {dataset} {ano}", carregar_visao, ano, dataset, SELECOES_PADRAO)
+                etapa(f"facetas {dataset} {ano}", _aquecer_facetas, ano, dataset)
+                etapa(f"busca {dataset} {ano}", _aquecer_busca, ano, dataset)
+
+    etapa("médias do forecast", _aquecer_forecast)
+
+    tempos['total'] = round(time.perf_counter() - inicio, 2)
+    return tempos
+
+
+class _Preaquecimento:
+    """Estado da thread de pré-aquecimento de uma versão dos dados"""
+
+    def __init__(self, versao):
+        self.versao = versao
+        self.tempos = None
+        self.thread = threading.Thread(target=self._executar, name=f"preaquecimento-{versao}", daemon=True)
+        self.thread.start()
+
+    def _executar(self):
+        self.tempos = preaquecer()
+        logger.info("🔥 Cache pré-aquecido (versão %s) em %.1fs", self.versao, self.tempos['total'])
+
+    @property
+    def concluido(self):
+        return self.tempos is not None
+
+
+# Só a versão atual interessa: uma versão nova descarta o estado da anterior
+@st.cache_resource(show_spinner=False, max_entries=1)
+def _iniciar_versao(versao):
+    return _Preaquecimento(versao)
+
+
+def iniciar_preaquecimento():
+    """Dispara o pré-aquecimento da versão atual dos dados (uma vez por processo e versão)"""
+    return _iniciar_versao(versao_dados())
+
+
+def exibir_status_preaquecimento(preaquecimento):
+    """Mostra na sidebar o tempo do pré-aquecimento (ou que ele ainda está em andamento)"""
+    if preaquecimento.concluido:
+        st.sidebar.caption(f"🔥 Cache pré-aquecido em {preaquecimento.tempos['total']:.1f}s")
+    else:
+        st.sidebar.caption("🔥 Pré-aquecendo cache em segundo plano...")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    resultado = preaquecer()
+    for nome_etapa, segundos in resultado.items():
+        logger.info("%-40s %s", nome_etapa, segundos)
@@ -0,0 +1,74 @@
+"""
+Linhas de subtotal (e total geral) de tabelas agrupadas.
+
+As tabelas por Veículo e Oficina mostram, depois dos veículos de cada
+oficina, uma linha TOTAL. Montar essa linha filtrando a tabela oficina por
+oficina e somando coluna a coluna custa (linhas x oficinas); aqui os
+subtotais de todos os grupos saem de um único groupby sobre a tabela larga
+(estilo ROLLUP) e são intercalados com uma ordenação estável, em tempo
+linear. A mesma tabela serve a exibição e o download.
+
+Para CPU o subtotal não é a soma dos CPUs: cada coluna recebe a soma do
+numerador (Total) dividida pela soma do denominador (Volume) do grupo.
+"""
+import numpy as np
+import pandas as pd
+
+from tc_dados.agregacao import calcular_cpu
+
+# Coluna com o nível de cada linha (as telas separam itens e subtotais por ela)
+NIVEL = '_nivel'
+NIVEL_ITEM, NIVEL_SUBTOTAL, NIVEL_TOTAL_GERAL = 0, 1, 2
+
+
+def _razao(numerador, denominador):
+    """numerador / denominador célula a célula (0 onde não há denominador)"""
+    valores = calcular_cpu(numerador.to_numpy(dtype='float64', na_value=np.nan),
+                           denominador.to_numpy(dtype='float64', na_value=np.nan))
+    return pd.DataFrame(valores, index=numerador.index, columns=numerador.columns)
+
+
+def com_subtotais(tabela, grupo, rotulo, colunas, razao=None, rotulo_total="TOTAL", total_geral=False):
+    """
+    Linhas da tabela com o subtotal de cada grupo logo depois das suas linhas
+    (grupos em ordem) e, opcionalmente, o total geral no fim.
+
+    tabela: uma linha por item (ex.: Oficina, Veículo) com as colunas de valor.
+    grupo: coluna dos subtotais (ex.: 'Oficina'), repetida na linha de subtotal.
+    rotulo: coluna (ou lista de colunas) que recebe rotulo_total nos subtotais.
+    colunas: colunas somadas; as demais ficam vazias nas linhas de subtotal.
+    razao: (numerador, denominador) — tabelas com as colunas de valor e o
+    grupo como nível do índice; o subtotal vira soma(numerador) / soma(denominador).
+
+    A coluna NIVEL marca itens, subtotais e o total geral.
+    """
+    rotulos = [rotulo] if isinstance(rotulo, str) else list(rotulo)
+    colunas = [col for col in colunas if col in tabela.columns]
+
+    if razao is None:
+        somas = tabela[colunas].groupby(tabela[grupo], observed=True, sort=True).sum()
+        subtotais = somas
+        geral = somas.sum().to_frame().T
+    else:
+        numerador, denominador = (df[colunas].groupby(level=grupo, observed=True, sort=True).sum() for df in razao)
+        subtotais = _razao(numerador, denominador)
+        geral = _razao(numerador.sum().to_frame().T, denominador.sum().to_frame().T)
+
+    subtotais = subtotais.reset_index()
+    subtotais[NIVEL] = NIVEL_SUBTOTAL
+    partes = [tabela.assign(**{NIVEL: NIVEL_ITEM}), subtotais]
+    if total_geral:
+        geral[grupo] = rotulo_total
+        geral[NIVEL] = NIVEL_TOTAL_GERAL
+        partes.append(geral)
+    for parte in partes[1:]:
+        for col in rotulos:
+            parte[col] = rotulo_total
+
+    resultado = pd.concat(partes, ignore_index=True)[list(tabela.columns) + [NIVEL]]
+    # Cada grupo com seus itens (na ordem da tabela) e o subtotal em seguida; total geral por último
+    ordem_grupo = resultado[grupo].where(resultado[NIVEL] != NIVEL_TOTAL_GERAL)
+    posicao = pd.Series(np.arange(len(resultado)), index=resultado.index)
+    chaves = pd.DataFrame({'g': ordem_grupo, 'n': resultado[NIVEL], 'p': posicao})
+    ordem = chaves.sort_values(['g', 'n', 'p'], kind='stable', na_position='last').index
+    return resultado.loc[ordem].reset_index(drop=True)
@@ -0,0 +1,122 @@
+"""
+Tabela paginada no servidor para visões com muitas linhas.
+
+Mandar a tabela filtrada inteira (ou as primeiras 1.000 linhas) para o
+navegador deixa a página lenta e a ordenação do st.dataframe só enxerga as
+linhas enviadas. Aqui a busca, a ordenação e a paginação rodam sobre a visão
+completa no servidor e só a página visível vira um DataFrame e é enviada.
+
+A busca normaliza só as categorias de cada coluna (poucas, depois de
+otimizar_tipos) e vira máscara pelos códigos; a ordenação é uma única
+ordenação da coluna escolhida sobre as linhas que passaram na busca.
+
+As tabelas de valores (dinâmicas, por veículo/oficina) ficam numéricas: o
+R$ / CPU com 4 casas é aplicado na exibição pelo column_config, sem criar
+uma cópia em texto de cada célula, e a ordenação no navegador continua
+numérica.
+"""
+import math
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from tc_dados.busca import normalizar_texto
+from tc_dados.filtros import codigos_coluna
+
+TAMANHOS_PAGINA = [50, 100, 250, 500]
+SEM_ORDENACAO = "(ordem original)"
+
+TIPO_CPU = "CPU (Custo por Unidade)"
+FORMATO_CPU = "%,.4f"
+FORMATO_REAL = "R$ %,.2f"
+
+
+def formatar_valor(valor, tipo_visualizacao):
+    """Um valor como texto (R$ ou CPU com 4 casas), para títulos e mensagens"""
+    if tipo_visualizacao == TIPO_CPU:
+        return f"{valor:,.4f}"
+    return f"R$ {valor:,.2f}"
+
+
+def config_colunas_valor(colunas, tipo_visualizacao):
+    """column_config do st.dataframe: colunas de valor formatadas na exibição"""
+    formato = FORMATO_CPU if tipo_visualizacao == TIPO_CPU else FORMATO_REAL
+    return {col: st.column_config.NumberColumn(format=formato) for col in colunas}
+
+
+def _mascara_texto(df, termo):
+    """Linhas em que alguma coluna de texto contém o termo (sem acentos/maiúsculas)"""
+    termo = normalizar_texto(termo).strip()
+    mascara = np.zeros(len(df), dtype=bool)
+    for coluna in df.columns:
+        serie = df[coluna]
+        if pd.api.types.is_numeric_dtype(serie.dtype) or pd.api.types.is_datetime64_any_dtype(serie.dtype):
+            continue
+        codigos, rotulos = codigos_coluna(serie)
+        # Última posição = código -1 (valor ausente)
+        tabela = np.append([termo in normalizar_texto(r) for r in rotulos], False).astype(bool)
+        mascara |= tabela[codigos]
+    return mascara
+
+
+def _ordenar(serie, crescente):
+    """Posições (0..n-1) que ordenam a série, ausentes no fim"""
+    serie = serie.reset_index(drop=True)
+    try:
+        ordenada = serie.sort_values(ascending=crescente, na_position='last', kind='stable')
+    except TypeError:
+        # Tipos misturados (ex.: 6101 e '6101'): ordena como texto
+        ordenada = serie.astype(str).sort_values(ascending=crescente, kind='stable')
+    return ordenada.index.to_numpy()
+
+
+def linhas_busca(df, busca=""):
+    """Posições das linhas que contêm o texto buscado (todas, sem busca)"""
+    if not busca or not busca.strip():
+        return np.arange(len(df))
+    return np.flatnonzero(_mascara_texto(df, busca))
+
+
+def paginar(df, posicoes, pagina=1, tamanho=TAMANHOS_PAGINA[1], ordenar_por=None, crescente=True):
+    """Página das linhas selecionadas, ordenadas por uma coluna sobre todas elas"""
+    if ordenar_por in df.columns:
+        posicoes = posicoes[_ordenar(df[ordenar_por].iloc[posicoes], crescente)]
+    inicio = (pagina - 1) * tamanho
+    return df.iloc[posicoes[inicio:inicio + tamanho]]
+
+
+def exibir_tabela_paginada(df, chave):
+    """
+    Desenha os controles (busca, ordenação, linhas por página, página) e a
+    página atual da tabela. chave: prefixo das keys dos widgets.
+    """
+    col_busca, col_ordem, col_direcao, col_tamanho = st.columns([3, 2, 1, 1])
+    with col_busca:
+        busca = st.text_input("🔎 Buscar na tabela:", key=f"{chave}_busca",
+                              placeholder="Texto em qualquer coluna...")
+    with col_ordem:
+        ordenar_por = st.selectbox("Ordenar por:", [SEM_ORDENACAO] + list(df.columns),
+                                   key=f"{chave}_ordenar")
+    with col_direcao:
+        direcao = st.radio("Ordem:", ["Crescente", "Decrescente"], key=f"{chave}_direcao",
+                           disabled=ordenar_por == SEM_ORDENACAO)
+    with col_tamanho:
+        tamanho = st.selectbox("Linhas por página:", TAMANHOS_PAGINA, index=1, key=f"{chave}_tamanho")
+
+    posicoes = linhas_busca(df, busca)
+    total = len(posicoes)
+    n_paginas = max(1, math.ceil(total / tamanho))
+    pagina = st.number_input(f"Página (de {n_paginas:,}):", min_value=1, max_value=n_paginas,
+                             value=1, step=1, key=f"{chave}_pagina")
+    pagina = min(int(pagina), n_paginas)
+
+    df_pagina = paginar(df, posicoes, pagina, tamanho, ordenar_por, direcao == "Crescente")
+    st.dataframe(df_pagina, use_container_width=True)
+
+    if total:
+        inicio = (pagina - 1) * tamanho
+        st.caption(f"📊 Linhas {inicio + 1:,}–{inicio + len(df_pagina):,} de {total:,}"
+                   + (f" (busca em {len(df):,} registros)" if total < len(df) else ""))
+    else:
+        st.caption(f"📊 Nenhuma linha contém \"{busca}\"")
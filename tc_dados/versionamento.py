@@ -0,0 +1,456 @@
+"""
+Versionamento da pasta ``dados`` com snapshots endereçados por conteúdo.
+
+Estrutura criada em ``dados/.versoes``::
+
+    objetos/ab/abcdef...        conteúdo de cada arquivo, uma única cópia por hash SHA-256
+    versoes/<id>/manifesto.json lista de arquivos da versão (caminho -> hash)
+    versoes/<id>/arquivos/...   hard links para os objetos (mesma árvore da pasta dados)
+    ATUAL                       id da versão publicada (trocado de forma atômica)
+    publicacoes.log             histórico de publicações (usado no rollback)
+
+Arquivos que não mudaram entre duas versões apontam para o mesmo objeto, então
+cada versão nova só ocupa espaço com o que realmente mudou. Publicar ou voltar
+para a versão anterior apenas reescreve o ponteiro ``ATUAL``: os dashboards leem
+sempre da versão publicada e não enxergam a pasta ``dados`` sendo reescrita pelo
+notebook até a próxima publicação.
+
+Uso pela linha de comando::
+
+    python -m tc_dados.versionamento listar
+    python -m tc_dados.versionamento criar --publicar --descricao "ETL 2025"
+    python -m tc_dados.versionamento publicar <id>
+    python -m tc_dados.versionamento rollback
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+PASTA_DADOS = "dados"
+NOME_PASTA_VERSOES = ".versoes"
+
+# Variável de ambiente para fixar os dashboards em uma versão específica
+VARIAVEL_VERSAO_FIXA = "TC_VERSAO_DADOS"
+
+TAMANHO_BLOCO_HASH = 1024 * 1024
+
+# Sem versão publicada, a assinatura da pasta viva vale por este intervalo (s):
+# versao_dados é chamada várias vezes por execução da página (chave de cache)
+VALIDADE_ASSINATURA_LOCAL = 2.0
+
+_assinaturas_locais = {}  # pasta -> (instante, assinatura)
+_lock_assinaturas = threading.Lock()
+
+
+def _pasta_versoes(pasta_dados=PASTA_DADOS):
+    return os.path.join(pasta_dados, NOME_PASTA_VERSOES)
+
+
+def _pasta_versao(versao_id, pasta_dados=PASTA_DADOS):
+    return os.path.join(_pasta_versoes(pasta_dados), "versoes", versao_id)
+
+
+def _caminho_objeto(sha256, pasta_dados=PASTA_DADOS):
+    return os.path.join(_pasta_versoes(pasta_dados), "objetos", sha256[:2], sha256)
+
+
+def escrever_atomico(caminho, conteudo):
+    """Escreve um arquivo texto via arquivo temporário + os.replace (troca atômica)"""
+    pasta = os.path.dirname(caminho) or "."
+    os.makedirs(pasta, exist_ok=True)
+    fd, caminho_tmp = tempfile.mkstemp(dir=pasta, prefix=".tmp_")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(conteudo)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(caminho_tmp, caminho)
+    except Exception:
+        if os.path.exists(caminho_tmp):
+            os.remove(caminho_tmp)
+        raise
+
+
+def calcular_hash_arquivo(caminho):
+    """Calcula o SHA-256 do conteúdo de um arquivo"""
+    sha = hashlib.sha256()
+    with open(caminho, "rb") as f:
+        for bloco in iter(lambda: f.read(TAMANHO_BLOCO_HASH), b""):
+            sha.update(bloco)
+    return sha.hexdigest()
+
+
+def _listar_arquivos(pasta_dados=PASTA_DADOS):
+    """Lista os arquivos versionáveis (caminhos relativos com '/'), ignorando itens ocultos"""
+    arquivos = []
+    for raiz, pastas, nomes in os.walk(pasta_dados):
+        # Não descer em pastas ocultas (inclui a própria .versoes)
+        pastas[:] = sorted(p for p in pastas if not p.startswith("."))
+        for nome in sorted(nomes):
+            if nome.startswith(".") or nome.startswith("~$"):
+                continue
+            caminho = os.path.join(raiz, nome)
+            arquivos.append(os.path.relpath(caminho, pasta_dados).replace(os.sep, "/"))
+    return arquivos
+
+
+def _carregar_indice_hash(pasta_dados=PASTA_DADOS):
+    """Cache (tamanho, mtime) -> hash para não recalcular arquivos que não mudaram"""
+    caminho_indice = os.path.join(_pasta_versoes(pasta_dados), "indice_hash.json")
+    try:
+        with open(caminho_indice, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _salvar_indice_hash(indice, pasta_dados=PASTA_DADOS):
+    caminho_indice = os.path.join(_pasta_versoes(pasta_dados), "indice_hash.json")
+    escrever_atomico(caminho_indice, json.dumps(indice, ensure_ascii=False))
+
+
+def _armazenar_objeto(caminho_origem, sha256, pasta_dados=PASTA_DADOS):
+    """Copia o arquivo para o repositório de objetos (se o hash ainda não existir)"""
+    destino = _caminho_objeto(sha256, pasta_dados)
+    if os.path.exists(destino):
+        return destino
+
+    # Copiar (nunca criar hard link com o arquivo vivo: o notebook sobrescreve
+    # os parquets no mesmo inode e isso corromperia o snapshot)
+    pasta_destino = os.path.dirname(destino)
+    os.makedirs(pasta_destino, exist_ok=True)
+    fd, caminho_tmp = tempfile.mkstemp(dir=pasta_destino, prefix=".tmp_")
+    os.close(fd)
+    try:
+        shutil.copyfile(caminho_origem, caminho_tmp)
+        os.replace(caminho_tmp, destino)
+    except Exception:
+        if os.path.exists(caminho_tmp):
+            os.remove(caminho_tmp)
+        raise
+    return destino
+
+
+def _vincular(caminho_objeto, destino):
+    """Cria hard link para o objeto (cópia como fallback em sistemas sem suporte)"""
+    os.makedirs(os.path.dirname(destino), exist_ok=True)
+    try:
+        os.link(caminho_objeto, destino)
+    except OSError:
+        shutil.copyfile(caminho_objeto, destino)
+
+
+def _hash_conteudo(arquivos):
+    """Hash da versão: combina caminho e hash de todos os arquivos"""
+    sha = hashlib.sha256()
+    for caminho in sorted(arquivos):
+        sha.update(f"{caminho}\0{arquivos[caminho]['sha256']}\n".encode("utf-8"))
+    return sha.hexdigest()
+
+
+def carregar_manifesto(versao_id, pasta_dados=PASTA_DADOS):
+    """Retorna o manifesto de uma versão (ou None se ela não existir)"""
+    caminho = os.path.join(_pasta_versao(versao_id, pasta_dados), "manifesto.json")
+    try:
+        with open(caminho, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def listar_versoes(pasta_dados=PASTA_DADOS):
+    """Lista os manifestos de todas as versões, da mais antiga para a mais recente"""
+    pasta = os.path.join(_pasta_versoes(pasta_dados), "versoes")
+    if not os.path.isdir(pasta):
+        return []
+
+    manifestos = []
+    for versao_id in os.listdir(pasta):
+        if versao_id.startswith("."):
+            continue
+        manifesto = carregar_manifesto(versao_id, pasta_dados)
+        if manifesto is not None:
+            manifestos.append(manifesto)
+    return sorted(manifestos, key=lambda m: (m["criado_em"], m["versao"]))
+
+
+def criar_versao(descricao="", pasta_dados=PASTA_DADOS):
+    """
+    Cria um snapshot do estado atual da pasta dados e retorna o id da versão.
+
+    Se o conteúdo for idêntico a uma versão já existente, nenhuma versão nova é
+    criada e o id existente é retornado.
+    """
+    indice = _carregar_indice_hash(pasta_dados)
+    arquivos = {}
+    for caminho_relativo in _listar_arquivos(pasta_dados):
+        caminho = os.path.join(pasta_dados, caminho_relativo)
+        info = os.stat(caminho)
+        assinatura = [info.st_size, info.st_mtime_ns]
+        registro = indice.get(caminho_relativo)
+        if registro and registro[:2] == assinatura:
+            sha256 = registro[2]
+        else:
+            sha256 = calcular_hash_arquivo(caminho)
+            indice[caminho_relativo] = assinatura + [sha256]
+        _armazenar_objeto(caminho, sha256, pasta_dados)
+        arquivos[caminho_relativo] = {"sha256": sha256, "tamanho": info.st_size}
+    _salvar_indice_hash(indice, pasta_dados)
+
+    hash_versao = _hash_conteudo(arquivos)
+
+    # Deduplicar versões inteiras: mesmo conteúdo = mesma versão
+    for manifesto in listar_versoes(pasta_dados):
+        if manifesto["hash"] == hash_versao:
+            return manifesto["versao"]
+
+    agora = datetime.now()
+    versao_id = f"{agora:%Y%m%d-%H%M%S}-{hash_versao[:10]}"
+    manifesto = {
+        "versao": versao_id,
+        "criado_em": agora.isoformat(timespec="seconds"),
+        "descricao": descricao,
+        "hash": hash_versao,
+        "arquivos": arquivos,
+    }
+
+    # Montar a árvore em uma pasta temporária e renomear no final, para que
+    # uma versão incompleta nunca fique visível
+    pasta_final = _pasta_versao(versao_id, pasta_dados)
+    pasta_tmp = _pasta_versao(f".tmp_{versao_id}", pasta_dados)
+    if os.path.exists(pasta_tmp):
+        shutil.rmtree(pasta_tmp)
+    for caminho_relativo, info in arquivos.items():
+        _vincular(
+            _caminho_objeto(info["sha256"], pasta_dados),
+            os.path.join(pasta_tmp, "arquivos", *caminho_relativo.split("/")),
+        )
+    escrever_atomico(
+        os.path.join(pasta_tmp, "manifesto.json"),
+        json.dumps(manifesto, ensure_ascii=False, indent=2),
+    )
+    os.rename(pasta_tmp, pasta_final)
+    return versao_id
+
+
+def _versao_ponteiro(pasta_dados=PASTA_DADOS):
+    """Id gravado no ponteiro ATUAL (ignora a versão fixada pelo ambiente)"""
+    try:
+        with open(os.path.join(_pasta_versoes(pasta_dados), "ATUAL"), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def versao_publicada(pasta_dados=PASTA_DADOS):
+    """Id da versão que os dashboards devem ler (None se nada foi publicado)"""
+    versao_fixa = os.environ.get(VARIAVEL_VERSAO_FIXA)
+    if versao_fixa:
+        return versao_fixa
+    return _versao_ponteiro(pasta_dados)
+
+
+def versao_dados(pasta_dados=PASTA_DADOS):
+    """
+    Identificador da versão dos dados que os dashboards estão lendo.
+
+    Usa a versão publicada (ou fixada); sem publicação, gera uma assinatura a
+    partir do tamanho e da data de modificação dos parquets da pasta dados. A
+    assinatura é reaproveitada por VALIDADE_ASSINATURA_LOCAL segundos, para
+    que as várias chamadas de uma mesma execução da página percorram a pasta
+    uma vez só.
+    """
+    versao = versao_publicada(pasta_dados)
+    if versao:
+        return versao
+
+    agora = time.monotonic()
+    with _lock_assinaturas:
+        memo = _assinaturas_locais.get(pasta_dados)
+        if memo is not None and agora - memo[0] < VALIDADE_ASSINATURA_LOCAL:
+            return memo[1]
+
+    sha = hashlib.sha256()
+    for caminho_relativo in _listar_arquivos(pasta_dados):
+        if not caminho_relativo.endswith(".parquet"):
+            continue
+        info = os.stat(os.path.join(pasta_dados, caminho_relativo))
+        sha.update(f"{caminho_relativo}\0{info.st_size}\0{info.st_mtime_ns}\n".encode("utf-8"))
+    assinatura = f"local-{sha.hexdigest()[:12]}"
+    with _lock_assinaturas:
+        _assinaturas_locais[pasta_dados] = (agora, assinatura)
+    return assinatura
+
+
+def _registrar_publicacao(acao, versao_id, anterior, pasta_dados=PASTA_DADOS):
+    caminho_log = os.path.join(_pasta_versoes(pasta_dados), "publicacoes.log")
+    registro = {
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "acao": acao,
+        "versao": versao_id,
+        "anterior": anterior,
+    }
+    with open(caminho_log, "a", encoding="utf-8") as f:
+        f.write(json.dumps(registro, ensure_ascii=False) + "\n")
+
+
+def _trocar_ponteiro(versao_id, pasta_dados=PASTA_DADOS):
+    if carregar_manifesto(versao_id, pasta_dados) is None:
+        raise ValueError(f"Versão não encontrada: {versao_id}")
+    escrever_atomico(os.path.join(_pasta_versoes(pasta_dados), "ATUAL"), versao_id + "\n")
+
+
+def publicar_versao(versao_id, pasta_dados=PASTA_DADOS):
+    """Publica uma versão para os dashboards (troca atômica do ponteiro ATUAL)"""
+    anterior = versao_publicada(pasta_dados)
+    if anterior == versao_id:
+        return versao_id
+    _trocar_ponteiro(versao_id, pasta_dados)
+    _registrar_publicacao("publicar", versao_id, anterior, pasta_dados)
+    return versao_id
+
+
+def voltar_versao(pasta_dados=PASTA_DADOS):
+    """
+    Volta para a versão que estava publicada antes da atual (O(1): só troca o ponteiro).
+
+    Chamadas repetidas continuam voltando pela cadeia de publicações.
+    """
+    atual = versao_publicada(pasta_dados)
+    caminho_log = os.path.join(_pasta_versoes(pasta_dados), "publicacoes.log")
+    anterior = None
+    try:
+        with open(caminho_log, encoding="utf-8") as f:
+            for linha in f:
+                registro = json.loads(linha)
+                if registro["acao"] == "publicar" and registro["versao"] == atual:
+                    anterior = registro["anterior"]
+    except OSError:
+        pass
+
+    if not anterior:
+        raise ValueError("Não há versão anterior para voltar")
+
+    _trocar_ponteiro(anterior, pasta_dados)
+    _registrar_publicacao("rollback", anterior, atual, pasta_dados)
+    return anterior
+
+
+def resolver_caminho(caminho, versao_id=None, pasta_dados=PASTA_DADOS):
+    """
+    Converte um caminho da pasta dados para o arquivo correspondente na versão publicada.
+
+    Retorna o próprio caminho quando não há versão publicada (ou fixada) e para
+    caminhos fora da pasta dados. Com uma versão ativa, um arquivo que não faz
+    parte dela retorna None: os dashboards nunca leem a pasta viva, que o ETL
+    pode estar reescrevendo, até a próxima publicação.
+    """
+    if caminho is None:
+        return None
+    versao_id = versao_id or versao_publicada(pasta_dados)
+    if not versao_id:
+        return caminho
+
+    pasta_abs = os.path.abspath(pasta_dados)
+    caminho_abs = os.path.abspath(caminho)
+    if os.path.commonpath([pasta_abs, caminho_abs]) != pasta_abs:
+        return caminho
+
+    relativo = os.path.relpath(caminho_abs, pasta_abs)
+    caminho_versao = os.path.join(_pasta_versao(versao_id, pasta_dados), "arquivos", relativo)
+    if os.path.exists(caminho_versao):
+        return caminho_versao
+    return None
+
+
+def existe_na_versao(caminho, versao_id=None, pasta_dados=PASTA_DADOS):
+    """O arquivo existe na versão lida pelos dashboards (ou na pasta dados, sem versão ativa)?"""
+    caminho_versao = resolver_caminho(caminho, versao_id, pasta_dados)
+    return caminho_versao is not None and os.path.exists(caminho_versao)
+
+
+def remover_versoes_antigas(manter=10, pasta_dados=PASTA_DADOS):
+    """
+    Remove versões antigas e os objetos que ficaram sem referência.
+
+    Nunca remove a versão do ponteiro ATUAL nem a fixada por TC_VERSAO_DADOS
+    (com a fixação, as duas podem ser diferentes).
+    """
+    versoes = listar_versoes(pasta_dados)
+    manter_ids = {m["versao"] for m in versoes[-manter:]} if manter > 0 else set()
+    for protegida in (_versao_ponteiro(pasta_dados), os.environ.get(VARIAVEL_VERSAO_FIXA)):
+        if protegida:
+            manter_ids.add(protegida)
+
+    removidas = []
+    for manifesto in versoes:
+        if manifesto["versao"] not in manter_ids:
+            shutil.rmtree(_pasta_versao(manifesto["versao"], pasta_dados), ignore_errors=True)
+            removidas.append(manifesto["versao"])
+
+    # Coletar objetos sem referência
+    referenciados = set()
+    for manifesto in listar_versoes(pasta_dados):
+        referenciados.update(info["sha256"] for info in manifesto["arquivos"].values())
+    pasta_objetos = os.path.join(_pasta_versoes(pasta_dados), "objetos")
+    if os.path.isdir(pasta_objetos):
+        for prefixo in os.listdir(pasta_objetos):
+            pasta_prefixo = os.path.join(pasta_objetos, prefixo)
+            for nome in os.listdir(pasta_prefixo):
+                if nome not in referenciados:
+                    os.remove(os.path.join(pasta_prefixo, nome))
+    return removidas
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Snapshots versionados da pasta dados")
+    parser.add_argument("--pasta-dados", default=PASTA_DADOS)
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    sub.add_parser("listar", help="Lista as versões existentes")
+
+    p_criar = sub.add_parser("criar", help="Cria um snapshot do estado atual")
+    p_criar.add_argument("--descricao", default="")
+    p_criar.add_argument("--publicar", action="store_true")
+
+    p_publicar = sub.add_parser("publicar", help="Publica uma versão existente")
+    p_publicar.add_argument("versao")
+
+    sub.add_parser("rollback", help="Volta para a versão publicada anteriormente")
+
+    p_limpar = sub.add_parser("limpar", help="Remove versões antigas")
+    p_limpar.add_argument("--manter", type=int, default=10)
+
+    args = parser.parse_args(argv)
+    pasta = args.pasta_dados
+
+    if args.comando == "listar":
+        publicada = versao_publicada(pasta)
+        for manifesto in listar_versoes(pasta):
+            marcador = "*" if manifesto["versao"] == publicada else " "
+            print(f"{marcador} {manifesto['versao']}  {len(manifesto['arquivos'])} arquivos  {manifesto['descricao']}")
+    elif args.comando == "criar":
+        versao_id = criar_versao(args.descricao, pasta)
+        print(f"✅ Versão criada: {versao_id}")
+        if args.publicar:
+            publicar_versao(versao_id, pasta)
+            print(f"🚀 Versão publicada: {versao_id}")
+    elif args.comando == "publicar":
+        publicar_versao(args.versao, pasta)
+        print(f"🚀 Versão publicada: {args.versao}")
+    elif args.comando == "rollback":
+        versao_id = voltar_versao(pasta)
+        print(f"⏪ Versão publicada: {versao_id}")
+    elif args.comando == "limpar":
+        removidas = remover_versoes_antigas(args.manter, pasta)
+        print(f"🧹 {len(removidas)} versões removidas")
+
+
+if __name__ == "__main__":
+    main()